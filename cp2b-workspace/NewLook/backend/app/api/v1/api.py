@@ -3,7 +3,7 @@ Main API router for CP2B Maps V3
 """
 from fastapi import APIRouter
 
-from app.api.v1.endpoints import municipalities, analysis, auth, maps, geospatial, mock_geospatial, infrastructure, mapbiomas, proximity, residuos
+from app.api.v1.endpoints import municipalities, analysis, auth, maps, geospatial, mock_geospatial, infrastructure, mapbiomas, proximity, residuos, tiles
 
 api_router = APIRouter()
 
@@ -58,6 +58,13 @@ api_router.include_router(
     tags=["mapbiomas", "raster", "environmental"]
 )
 
+# Vector tiles for municipalities and infrastructure layers
+api_router.include_router(
+    tiles.router,
+    prefix="/tiles",
+    tags=["tiles", "geospatial"]
+)
+
 # Proximity analysis endpoints
 api_router.include_router(
     proximity.router,
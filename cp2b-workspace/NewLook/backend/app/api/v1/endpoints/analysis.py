@@ -4,7 +4,11 @@ Analysis API endpoints for biogas potential calculations
 from fastapi import APIRouter, HTTPException, Query
 from typing import List, Optional, Dict, Any
 from enum import Enum
-from app.services.supabase_client import get_supabase_client
+import numpy as np
+
+from app.services.cache_service import get_analytics_cache_key, municipality_cache
+from app.services.municipality_table import load_municipality_table
+from app.utils.analytics import HISTOGRAM_SCALES, histogram, summary_statistics
 
 router = APIRouter()
 
@@ -137,98 +141,69 @@ async def get_analysis_by_residue(
     - **limit**: number of results (max 100)
     - **min_value**: minimum biogas value to include
     """
-    try:
-        supabase = get_supabase_client()
-
-        # Determine which columns to query
-        category_columns = RESIDUE_COLUMNS.get(category.value, {})
-
-        if residue_types:
-            # Sum specific residue types
-            columns_to_sum = [
-                category_columns.get(rt)
-                for rt in residue_types
-                if rt in category_columns and rt != "_total"
-            ]
-            if not columns_to_sum:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"No valid residue types provided for category {category.value}"
-                )
-        else:
-            # Use the category total column
-            columns_to_sum = [category_columns.get("_total")]
-
-        # Build the select query
-        select_fields = [
-            "id",
-            "municipality_name",
-            "ibge_code",
-            "administrative_region",
-            "population",
-            "area_km2"
+    # Determine which columns to sum
+    category_columns = RESIDUE_COLUMNS.get(category.value, {})
+
+    if residue_types:
+        # Sum specific residue types
+        columns_to_sum = [
+            category_columns.get(rt)
+            for rt in residue_types
+            if rt in category_columns and rt != "_total"
         ]
+        if not columns_to_sum:
+            raise HTTPException(
+                status_code=400,
+                detail=f"No valid residue types provided for category {category.value}"
+            )
+    else:
+        # Use the category total column
+        columns_to_sum = [category_columns.get("_total")]
 
-        # Add residue columns
-        for col in columns_to_sum:
-            if col:
-                select_fields.append(col)
-
-        # Query Supabase
-        query = supabase.table("municipalities").select(",".join(select_fields))
-
-        # Execute query
-        response = query.execute()
-
-        if not response.data:
-            return {
-                "data": [],
-                "total": 0,
-                "category": category.value,
-                "residue_types": residue_types or ["_total"]
-            }
-
-        # Process results - calculate sum if multiple columns
-        results = []
-        for row in response.data:
-            total_biogas = 0
-            for col in columns_to_sum:
-                if col and row.get(col):
-                    total_biogas += float(row.get(col, 0))
-
-            if total_biogas >= min_value:
-                results.append({
-                    "id": row.get("id"),
-                    "municipality_name": row.get("municipality_name"),
-                    "ibge_code": row.get("ibge_code"),
-                    "administrative_region": row.get("administrative_region"),
-                    "population": row.get("population"),
-                    "area_km2": row.get("area_km2"),
-                    "biogas_m3_year": round(total_biogas, 2)
-                })
-
-        # Sort by biogas potential descending
-        results.sort(key=lambda x: x["biogas_m3_year"], reverse=True)
-
-        # Apply limit
-        results = results[:limit]
-
-        return {
-            "data": results,
-            "total": len(results),
-            "category": category.value,
-            "residue_types": residue_types or ["_total"],
-            "columns_used": columns_to_sum
-        }
-
-    except HTTPException:
-        raise
+    try:
+        table = await load_municipality_table()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error fetching residue analysis: {str(e)}"
         )
 
+    # Dashboard filters repeat often: cache per table version and parameters
+    cache_key = get_analytics_cache_key(
+        "by_residue", table.version,
+        category=category.value, columns=sorted(columns_to_sum), limit=limit, min_value=float(min_value)
+    )
+    cached = municipality_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "residue_types": residue_types or ["_total"]}
+
+    # Top municipalities by the summed columns (ties keep table order)
+    totals = table.sum_columns(columns_to_sum)
+    top = table.top(totals, limit, min_value=min_value)
+
+    results = [
+        {
+            "id": int(table.ids[i]),
+            "municipality_name": table.names[i],
+            "ibge_code": table.ibge_codes[i] or None,
+            "administrative_region": table.regions[i],
+            "population": None if np.isnan(table.population[i]) else int(table.population[i]),
+            "area_km2": None if np.isnan(table.area_km2[i]) else float(table.area_km2[i]),
+            "biogas_m3_year": round(float(totals[i]), 2)
+        }
+        for i in top
+    ]
+
+    result = {
+        "data": results,
+        "total": len(results),
+        "category": category.value,
+        "residue_types": residue_types or ["_total"],
+        "columns_used": columns_to_sum
+    }
+    municipality_cache.set(cache_key, result)
+    return result
+
 @router.get("/statistics/by-category")
 async def get_statistics_by_category():
     """
@@ -236,65 +211,50 @@ async def get_statistics_by_category():
     Returns total, average, min, max for agricultural, livestock, and urban sectors.
     """
     try:
-        supabase = get_supabase_client()
-
-        # Get all category totals
-        response = supabase.table("municipalities").select(
-            "agricultural_biogas_m3_year,livestock_biogas_m3_year,urban_biogas_m3_year,total_biogas_m3_year"
-        ).execute()
-
-        if not response.data:
-            return {"categories": {}, "total_municipalities": 0}
-
-        # Calculate statistics for each category
-        categories = {
-            "agricultural": [],
-            "livestock": [],
-            "urban": [],
-            "total": []
-        }
-
-        for row in response.data:
-            if row.get("agricultural_biogas_m3_year"):
-                categories["agricultural"].append(float(row["agricultural_biogas_m3_year"]))
-            if row.get("livestock_biogas_m3_year"):
-                categories["livestock"].append(float(row["livestock_biogas_m3_year"]))
-            if row.get("urban_biogas_m3_year"):
-                categories["urban"].append(float(row["urban_biogas_m3_year"]))
-            if row.get("total_biogas_m3_year"):
-                categories["total"].append(float(row["total_biogas_m3_year"]))
-
-        # Calculate stats
-        stats = {}
-        for cat_name, values in categories.items():
-            if values:
-                stats[cat_name] = {
-                    "total": round(sum(values), 2),
-                    "average": round(sum(values) / len(values), 2),
-                    "min": round(min(values), 2),
-                    "max": round(max(values), 2),
-                    "count": len([v for v in values if v > 0])
-                }
-            else:
-                stats[cat_name] = {
-                    "total": 0,
-                    "average": 0,
-                    "min": 0,
-                    "max": 0,
-                    "count": 0
-                }
-
-        return {
-            "categories": stats,
-            "total_municipalities": len(response.data)
-        }
-
+        table = await load_municipality_table()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error fetching category statistics: {str(e)}"
         )
 
+    if len(table) == 0:
+        return {"categories": {}, "total_municipalities": 0}
+
+    columns = {
+        "agricultural": "agricultural_biogas_m3_year",
+        "livestock": "livestock_biogas_m3_year",
+        "urban": "urban_biogas_m3_year",
+        "total": "total_biogas_m3_year"
+    }
+
+    # Statistics over municipalities with a non-zero value
+    stats = {}
+    for cat_name, column in columns.items():
+        values = table.column(column)
+        values = values[values != 0]
+        if values.size:
+            stats[cat_name] = {
+                "total": round(float(values.sum()), 2),
+                "average": round(float(values.mean()), 2),
+                "min": round(float(values.min()), 2),
+                "max": round(float(values.max()), 2),
+                "count": int((values > 0).sum())
+            }
+        else:
+            stats[cat_name] = {
+                "total": 0,
+                "average": 0,
+                "min": 0,
+                "max": 0,
+                "count": 0
+            }
+
+    return {
+        "categories": stats,
+        "total_municipalities": len(table)
+    }
+
 @router.get("/statistics/by-region")
 async def get_statistics_by_region(
     category: Optional[ResidueCategory] = Query(default=None, description="Filter by residue category")
@@ -303,137 +263,100 @@ async def get_statistics_by_region(
     Get biogas potential aggregated by administrative region.
     Used for pie charts showing regional distribution.
     """
-    try:
-        supabase = get_supabase_client()
-
-        # Determine which column to use
-        if category:
-            column = RESIDUE_COLUMNS[category.value]["_total"]
-        else:
-            column = "total_biogas_m3_year"
-
-        # Get data grouped by region
-        response = supabase.table("municipalities").select(
-            f"administrative_region,{column}"
-        ).execute()
-
-        if not response.data:
-            return {"regions": [], "total": 0}
-
-        # Aggregate by region
-        region_totals: Dict[str, float] = {}
-        for row in response.data:
-            region = row.get("administrative_region") or "Não definido"
-            value = float(row.get(column, 0) or 0)
-            region_totals[region] = region_totals.get(region, 0) + value
-
-        # Convert to list and sort
-        regions = [
-            {"region": k, "biogas_m3_year": round(v, 2)}
-            for k, v in region_totals.items()
-        ]
-        regions.sort(key=lambda x: x["biogas_m3_year"], reverse=True)
-
-        total = sum(r["biogas_m3_year"] for r in regions)
-
-        # Calculate percentages
-        for r in regions:
-            r["percentage"] = round((r["biogas_m3_year"] / total * 100) if total > 0 else 0, 2)
-
-        return {
-            "regions": regions,
-            "total": round(total, 2),
-            "category": category.value if category else "total"
-        }
+    # Determine which column to use
+    if category:
+        column = RESIDUE_COLUMNS[category.value]["_total"]
+    else:
+        column = "total_biogas_m3_year"
 
+    try:
+        table = await load_municipality_table()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error fetching regional statistics: {str(e)}"
         )
 
+    if len(table) == 0:
+        return {"regions": [], "total": 0}
+
+    # Aggregate by region
+    regions = [
+        {"region": region, "biogas_m3_year": round(value, 2)}
+        for region, value in table.group_sum(table.column(column)).items()
+    ]
+    regions.sort(key=lambda x: x["biogas_m3_year"], reverse=True)
+
+    total = sum(r["biogas_m3_year"] for r in regions)
+
+    # Calculate percentages
+    for r in regions:
+        r["percentage"] = round((r["biogas_m3_year"] / total * 100) if total > 0 else 0, 2)
+
+    return {
+        "regions": regions,
+        "total": round(total, 2),
+        "category": category.value if category else "total"
+    }
+
 @router.get("/distribution")
 async def get_distribution(
     category: Optional[ResidueCategory] = Query(default=None, description="Filter by residue category"),
-    bins: int = Query(default=10, ge=5, le=50, description="Number of histogram bins")
+    bins: int = Query(default=10, ge=5, le=50, description="Number of histogram bins"),
+    scale: str = Query(default="linear", enum=list(HISTOGRAM_SCALES), description="Bin scale (log suits skewed potentials)")
 ):
     """
     Get distribution data for histogram visualization.
-    Returns bin ranges and counts for biogas potential values.
+    Returns bin ranges and counts for biogas potential values,
+    plus summary statistics and percentiles.
     """
-    try:
-        supabase = get_supabase_client()
+    # Determine which column to use
+    if category:
+        column = RESIDUE_COLUMNS[category.value]["_total"]
+    else:
+        column = "total_biogas_m3_year"
 
-        # Determine which column to use
-        if category:
-            column = RESIDUE_COLUMNS[category.value]["_total"]
-        else:
-            column = "total_biogas_m3_year"
+    try:
+        table = await load_municipality_table()
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error calculating distribution: {str(e)}"
+        )
 
-        # Get all values
-        response = supabase.table("municipalities").select(
-            f"municipality_name,{column}"
-        ).execute()
+    cache_key = get_analytics_cache_key("distribution", table.version, column=column, bins=bins, scale=scale)
+    cached = municipality_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-        if not response.data:
-            return {"histogram": [], "statistics": {}}
+    # Non-zero values only
+    values = table.column(column)
+    values = values[values > 0]
 
-        # Extract non-zero values
-        values = [
-            float(row.get(column, 0) or 0)
-            for row in response.data
-            if float(row.get(column, 0) or 0) > 0
-        ]
+    if not values.size:
+        return {"histogram": [], "statistics": {}}
 
-        if not values:
-            return {"histogram": [], "statistics": {}}
-
-        # Calculate histogram bins
-        min_val = min(values)
-        max_val = max(values)
-        bin_width = (max_val - min_val) / bins
-
-        histogram = []
-        for i in range(bins):
-            bin_start = min_val + (i * bin_width)
-            bin_end = min_val + ((i + 1) * bin_width)
-            count = len([v for v in values if bin_start <= v < bin_end])
-
-            # Include max value in last bin
-            if i == bins - 1:
-                count = len([v for v in values if bin_start <= v <= bin_end])
-
-            histogram.append({
-                "bin_start": round(bin_start, 2),
-                "bin_end": round(bin_end, 2),
-                "count": count,
-                "label": f"{round(bin_start/1000000, 2)}-{round(bin_end/1000000, 2)}M"
-            })
-
-        # Calculate basic statistics
-        sorted_values = sorted(values)
-        n = len(values)
-
-        statistics = {
-            "count": n,
-            "min": round(min_val, 2),
-            "max": round(max_val, 2),
-            "mean": round(sum(values) / n, 2),
-            "median": round(sorted_values[n // 2], 2),
-            "std": round((sum((v - sum(values)/n)**2 for v in values) / n) ** 0.5, 2)
-        }
+    # Bins over [min, max]; the last bin includes the max value
+    counts, edges = histogram(values, bins, scale=scale)
 
-        return {
-            "histogram": histogram,
-            "statistics": statistics,
-            "category": category.value if category else "total"
+    bins_out = [
+        {
+            "bin_start": round(float(bin_start), 2),
+            "bin_end": round(float(bin_end), 2),
+            "count": int(count),
+            "label": f"{round(bin_start/1000000, 2)}-{round(bin_end/1000000, 2)}M"
         }
+        for bin_start, bin_end, count in zip(edges[:-1], edges[1:], counts)
+    ]
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error calculating distribution: {str(e)}"
-        )
+    result = {
+        "histogram": bins_out,
+        "statistics": summary_statistics(values),
+        "category": category.value if category else "total",
+        "scale": scale
+    }
+    municipality_cache.set(cache_key, result)
+    return result
 
 @router.get("/residue-config")
 async def get_residue_config():
@@ -3,16 +3,34 @@ Geospatial API Endpoints
 Serve PostGIS data for interactive maps and spatial analysis
 """
 
-from fastapi import APIRouter, HTTPException, Query, Depends
-from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Header, Query, Depends, Response
+from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel, Field
+import asyncio
+import hashlib
+import json
 import logging
+import numpy as np
 import psycopg2
 
+from app.api.v1.endpoints.analysis import RESIDUE_COLUMNS, ResidueCategory
 from app.core.database import get_db
+from app.core.executors import get_thread_pool
 from app.middleware.auth import optional_auth
 from app.models.auth import UserProfile
-from app.utils.shapefile_loader import get_shapefile_loader
+from app.utils.shapefile_loader import Viewport, get_shapefile_loader, map_simplify_level, map_viewport
+from app.utils.geojson_stream import (
+    COORDINATE_PRECISION,
+    GEOJSON_MEDIA_TYPE,
+    feature_to_bytes,
+    geometries_to_json,
+    stream_feature_collection,
+    stream_features,
+)
+from app.services.cache_maintenance import get_dataset_version
+from app.services.cache_service import geometry_cache, get_analytics_cache_key, municipality_cache
+from app.services.geometry_store import get_geometry_store
+from app.services.municipality_table import BIOGAS_SUM_COLUMNS, get_municipality_table, load_municipality_table
 
 # Initialize shapefile loader
 shapefile_loader = get_shapefile_loader()
@@ -143,6 +161,9 @@ class MapBounds(BaseModel):
 # GEOJSON ENDPOINTS
 # ============================================================================
 
+# Features are built by PostGIS and streamed as text (see utils/geojson_stream);
+# response_model only documents the FeatureCollection shape and is not validated.
+
 @router.get(
     "/municipalities/geojson",
     response_model=GeoJSONFeatureCollection,
@@ -161,101 +182,83 @@ async def get_municipalities_geojson(
     Returns polygon geometries with biogas potential data as properties.
     Suitable for rendering choropleth maps.
     """
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        try:
-            # Build query
-            query = """
+    try:
+        # Build query
+        query = """
             SELECT jsonb_build_object(
-                'type', 'FeatureCollection',
-                'features', jsonb_agg(feature)
-            ) as geojson
-            FROM (
-                SELECT jsonb_build_object(
-                    'type', 'Feature',
+                'type', 'Feature',
+                'id', id,
+                'geometry', ST_AsGeoJSON(
+                    COALESCE(geometry, ST_Buffer(centroid::geography, 5000)::geometry)
+                )::jsonb,
+                'properties', jsonb_build_object(
                     'id', id,
-                    'geometry', ST_AsGeoJSON(
-                        COALESCE(geometry, ST_Buffer(centroid::geography, 5000)::geometry)
-                    )::jsonb,
-                    'properties', jsonb_build_object(
-                        'id', id,
-                        'name', municipality_name,
-                        'ibge_code', ibge_code,
-                        'area_km2', ROUND(area_km2::numeric, 2),
-                        'population', population,
-                        'population_density', ROUND((population / NULLIF(area_km2, 0))::numeric, 2),
-                        'immediate_region', immediate_region,
-                        'intermediate_region', intermediate_region,
-                        'immediate_region_code', immediate_region_code,
-                        'intermediate_region_code', intermediate_region_code,
-                        'total_biogas_m3_year', ROUND(total_biogas_m3_year::numeric, 2),
-                        'urban_biogas_m3_year', ROUND(urban_biogas_m3_year::numeric, 2),
-                        'agricultural_biogas_m3_year', ROUND(agricultural_biogas_m3_year::numeric, 2),
-                        'livestock_biogas_m3_year', ROUND(livestock_biogas_m3_year::numeric, 2),
-                        'sugarcane_biogas_m3_year', ROUND(sugarcane_biogas_m3_year::numeric, 2),
-                        'soybean_biogas_m3_year', ROUND(soybean_biogas_m3_year::numeric, 2),
-                        'corn_biogas_m3_year', ROUND(corn_biogas_m3_year::numeric, 2),
-                        'coffee_biogas_m3_year', ROUND(coffee_biogas_m3_year::numeric, 2),
-                        'citrus_biogas_m3_year', ROUND(citrus_biogas_m3_year::numeric, 2),
-                        'cattle_biogas_m3_year', ROUND(cattle_biogas_m3_year::numeric, 2),
-                        'swine_biogas_m3_year', ROUND(swine_biogas_m3_year::numeric, 2),
-                        'poultry_biogas_m3_year', ROUND(poultry_biogas_m3_year::numeric, 2),
-                        'aquaculture_biogas_m3_year', ROUND(aquaculture_biogas_m3_year::numeric, 2),
-                        'forestry_biogas_m3_year', ROUND(COALESCE(forestry_biogas_m3_year, 0)::numeric, 2),
-                        'rsu_biogas_m3_year', ROUND(rsu_biogas_m3_year::numeric, 2),
-                        'rpo_biogas_m3_year', ROUND(rpo_biogas_m3_year::numeric, 2),
-                        'sugarcane_residues_tons_year', ROUND(COALESCE(sugarcane_residues_tons_year, 0)::numeric, 2),
-                        'soybean_residues_tons_year', ROUND(COALESCE(soybean_residues_tons_year, 0)::numeric, 2),
-                        'corn_residues_tons_year', ROUND(COALESCE(corn_residues_tons_year, 0)::numeric, 2),
-                        'potential_category', potential_category,
-                        'energy_potential_mwh_year', ROUND(energy_potential_mwh_year::numeric, 2),
-                        'co2_reduction_tons_year', ROUND(co2_reduction_tons_year::numeric, 2),
-                        'administrative_region', administrative_region
-                    )
-                ) as feature
-                FROM municipalities
-                WHERE 1=1
+                    'name', municipality_name,
+                    'ibge_code', ibge_code,
+                    'area_km2', ROUND(area_km2::numeric, 2),
+                    'population', population,
+                    'population_density', ROUND((population / NULLIF(area_km2, 0))::numeric, 2),
+                    'immediate_region', immediate_region,
+                    'intermediate_region', intermediate_region,
+                    'immediate_region_code', immediate_region_code,
+                    'intermediate_region_code', intermediate_region_code,
+                    'total_biogas_m3_year', ROUND(total_biogas_m3_year::numeric, 2),
+                    'urban_biogas_m3_year', ROUND(urban_biogas_m3_year::numeric, 2),
+                    'agricultural_biogas_m3_year', ROUND(agricultural_biogas_m3_year::numeric, 2),
+                    'livestock_biogas_m3_year', ROUND(livestock_biogas_m3_year::numeric, 2),
+                    'sugarcane_biogas_m3_year', ROUND(sugarcane_biogas_m3_year::numeric, 2),
+                    'soybean_biogas_m3_year', ROUND(soybean_biogas_m3_year::numeric, 2),
+                    'corn_biogas_m3_year', ROUND(corn_biogas_m3_year::numeric, 2),
+                    'coffee_biogas_m3_year', ROUND(coffee_biogas_m3_year::numeric, 2),
+                    'citrus_biogas_m3_year', ROUND(citrus_biogas_m3_year::numeric, 2),
+                    'cattle_biogas_m3_year', ROUND(cattle_biogas_m3_year::numeric, 2),
+                    'swine_biogas_m3_year', ROUND(swine_biogas_m3_year::numeric, 2),
+                    'poultry_biogas_m3_year', ROUND(poultry_biogas_m3_year::numeric, 2),
+                    'aquaculture_biogas_m3_year', ROUND(aquaculture_biogas_m3_year::numeric, 2),
+                    'forestry_biogas_m3_year', ROUND(COALESCE(forestry_biogas_m3_year, 0)::numeric, 2),
+                    'rsu_biogas_m3_year', ROUND(rsu_biogas_m3_year::numeric, 2),
+                    'rpo_biogas_m3_year', ROUND(rpo_biogas_m3_year::numeric, 2),
+                    'sugarcane_residues_tons_year', ROUND(COALESCE(sugarcane_residues_tons_year, 0)::numeric, 2),
+                    'soybean_residues_tons_year', ROUND(COALESCE(soybean_residues_tons_year, 0)::numeric, 2),
+                    'corn_residues_tons_year', ROUND(COALESCE(corn_residues_tons_year, 0)::numeric, 2),
+                    'potential_category', potential_category,
+                    'energy_potential_mwh_year', ROUND(energy_potential_mwh_year::numeric, 2),
+                    'co2_reduction_tons_year', ROUND(co2_reduction_tons_year::numeric, 2),
+                    'administrative_region', administrative_region
+                )
+            )::text as feature
+            FROM municipalities
+            WHERE 1=1
         """
 
-            params = []
-
-            if min_biogas is not None:
-                query += " AND total_biogas_m3_year >= %s"
-                params.append(min_biogas)
-
-            if region:
-                # SECURITY: Validate region against whitelist
-                if region not in VALID_REGIONS:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Invalid region. Must be one of: {', '.join(sorted(VALID_REGIONS))}"
-                    )
-                query += " AND administrative_region = %s"
-                params.append(region)
+        params = []
 
-            query += " ORDER BY total_biogas_m3_year DESC"
+        if min_biogas is not None:
+            query += " AND total_biogas_m3_year >= %s"
+            params.append(min_biogas)
 
-            # SECURITY: Use parameterized query for LIMIT instead of f-string
-            if limit:
-                query += " LIMIT %s"
-                params.append(limit)
-
-            query += " ) as features"
+        if region:
+            # SECURITY: Validate region against whitelist
+            if region not in VALID_REGIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid region. Must be one of: {', '.join(sorted(VALID_REGIONS))}"
+                )
+            query += " AND administrative_region = %s"
+            params.append(region)
 
-            cursor.execute(query, params)
-            result = cursor.fetchone()
+        query += " ORDER BY total_biogas_m3_year DESC"
 
-            if not result or not result.get('geojson'):
-                return GeoJSONFeatureCollection(type="FeatureCollection", features=[])
+        # SECURITY: Use parameterized query for LIMIT instead of f-string
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
 
-            return result['geojson']
+        return await stream_feature_collection(query, params)
 
-        except psycopg2.Error as e:
-            logger.error(f"Database error in get_municipalities_geojson: {e}")
-            raise HTTPException(status_code=500, detail="Database query failed")
-        finally:
-            cursor.close()
+    except psycopg2.Error as e:
+        logger.error(f"Database error in get_municipalities_geojson: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
 
 
 @router.get(
@@ -273,55 +276,179 @@ async def get_municipality_centroids(
 
     Faster alternative to full polygons for initial map rendering.
     """
-    with get_db() as conn:
-        cursor = conn.cursor()
+    try:
+        query = """
+            SELECT jsonb_build_object(
+                'type', 'Feature',
+                'id', id,
+                'geometry', ST_AsGeoJSON(centroid)::jsonb,
+                'properties', jsonb_build_object(
+                    'id', id,
+                    'name', municipality_name,
+                    'biogas', ROUND(total_biogas_m3_year::numeric, 2)
+                )
+            )::text as feature
+            FROM municipalities
+            WHERE centroid IS NOT NULL
+        """
 
-        try:
-            query = """
-                SELECT jsonb_build_object(
-                    'type', 'FeatureCollection',
-                    'features', jsonb_agg(feature)
-                ) as geojson
-                FROM (
-                    SELECT jsonb_build_object(
-                        'type', 'Feature',
-                        'id', id,
-                        'geometry', ST_AsGeoJSON(centroid)::jsonb,
-                        'properties', jsonb_build_object(
-                            'id', id,
-                            'name', municipality_name,
-                            'biogas', ROUND(total_biogas_m3_year::numeric, 2)
-                        )
-                    ) as feature
-                    FROM municipalities
-                    WHERE centroid IS NOT NULL
-            """
+        params = []
 
-            params = []
+        if min_biogas is not None:
+            query += " AND total_biogas_m3_year >= %s"
+            params.append(min_biogas)
 
-            if min_biogas is not None:
-                query += " AND total_biogas_m3_year >= %s"
-                params.append(min_biogas)
+        query += " ORDER BY total_biogas_m3_year DESC"
 
-            query += " ORDER BY total_biogas_m3_year DESC"
+        # SECURITY: Use parameterized query for LIMIT
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
 
-            # SECURITY: Use parameterized query for LIMIT
-            if limit:
-                query += " LIMIT %s"
-                params.append(limit)
+        return await stream_feature_collection(query, params)
 
-            query += " ) as features"
+    except psycopg2.Error as e:
+        logger.error(f"Database error in get_municipality_centroids: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
 
-            cursor.execute(query, params)
-            result = cursor.fetchone()
 
-            return result['geojson'] if result and result.get('geojson') else {"type": "FeatureCollection", "features": []}
+def _municipality_polygon_properties(table, position: Optional[int], ibge_code: str, name: str) -> Dict[str, Any]:
+    """Properties of one /municipalities/polygons feature (zeros when the table has no row for it)"""
+    properties = {
+        'id': ibge_code or name.strip().upper(),
+        'name': name or 'Unknown',
+        'ibge_code': ibge_code,
+    }
 
-        except psycopg2.Error as e:
-            logger.error(f"Database error in get_municipality_centroids: {e}")
-            raise HTTPException(status_code=500, detail="Database query failed")
-        finally:
-            cursor.close()
+    if position is None:
+        # No biogas data found - set defaults
+        properties.update({
+            'total_biogas': 0,
+            'total_biogas_m3_year': 0,
+            'urban_biogas': 0,
+            'urban_biogas_m3_year': 0,
+            'agricultural_biogas': 0,
+            'agricultural_biogas_m3_year': 0,
+            'livestock_biogas': 0,
+            'livestock_biogas_m3_year': 0,
+            'energy_mwh_year': 0,
+            'energy_potential_mwh_year': 0,
+            'co2_reduction': 0,
+            'co2_reduction_tons_year': 0,
+            'population': 0,
+            'region': '',
+            'intermediate_region': '',
+            'area_km2': 0,
+            'population_density': 0
+        })
+        return properties
+
+    def value(column: str) -> float:
+        return round(float(table.column(column)[position]), 2)
+
+    population = table.population[position]
+    population = 0 if np.isnan(population) else int(population)
+    area = table.area_km2[position]
+    area = 0.0 if np.isnan(area) else float(area)
+    region = table.regions[position]
+    properties.update({
+        'total_biogas': value('total_biogas_m3_year'),
+        'total_biogas_m3_year': value('total_biogas_m3_year'),
+        'urban_biogas': value('urban_biogas_m3_year'),
+        'urban_biogas_m3_year': value('urban_biogas_m3_year'),
+        'agricultural_biogas': value('agricultural_biogas_m3_year'),
+        'agricultural_biogas_m3_year': value('agricultural_biogas_m3_year'),
+        'livestock_biogas': value('livestock_biogas_m3_year'),
+        'livestock_biogas_m3_year': value('livestock_biogas_m3_year'),
+        'energy_mwh_year': value('energy_potential_mwh_year'),
+        'energy_potential_mwh_year': value('energy_potential_mwh_year'),
+        'co2_reduction': value('co2_reduction_tons_year'),
+        'co2_reduction_tons_year': value('co2_reduction_tons_year'),
+        'population': population,
+        'region': region,
+        'intermediate_region': region,
+        'area_km2': round(area, 2),
+        'population_density': round(population / area, 2) if area > 0 else 0
+    })
+    return properties
+
+
+def _municipality_polygon_features(layer, level: float, table) -> Tuple[List[bytes], np.ndarray]:
+    """
+    Serialized /municipalities/polygons features for every layer row
+
+    Built once per (layer file, simplification level, table version) and
+    kept in geometry_cache; requests only pick their viewport's rows.
+
+    Returns:
+        Tuple of (features aligned with the layer rows, mask of rows
+        matched with a municipalities table row)
+    """
+    key = f"municipality_polygons:{layer.path}@{layer.mtime}:{level}:{table.version}@{table.loaded_at}"
+    cached = geometry_cache.get(key)
+    if cached is not None:
+        return cached
+
+    codes, names = _municipality_codes_and_names(layer, np.arange(len(layer.gdf_wgs84)))
+    geometries = geometries_to_json(layer.simplified(level))
+
+    features = []
+    matched = np.zeros(len(codes), dtype=bool)
+    for i, (ibge_code, name, geometry) in enumerate(zip(codes, names, geometries)):
+        # Match by CD_MUN (IBGE code), then by NM_MUN (municipality name)
+        code = ibge_code if ibge_code in table.index_by_ibge else table.ibge_by_name.get(name.strip().upper())
+        position = table.index_by_ibge.get(code) if code else None
+        matched[i] = position is not None
+
+        properties = _municipality_polygon_properties(table, position, ibge_code, name)
+        # Geometry JSON is spliced in as text (no dict round trip)
+        features.append(feature_to_bytes(properties['id'], geometry, properties))
+
+    entry = (features, matched)
+    geometry_cache.set(key, entry)
+    return entry
+
+
+def _municipality_polygons_page(level: float, viewport: Viewport) -> Tuple[List[bytes], Dict[str, Any]]:
+    """Features and metadata of a /municipalities/polygons response (blocking; run in the thread pool)"""
+    # Load municipality boundaries from the resident shapefile layer
+    try:
+        layer = get_geometry_store().get_layer(MUNICIPALITY_LAYER)
+        if layer is None:
+            logger.warning(f"Municipality shapefile {MUNICIPALITY_LAYER}.shp not available")
+            selected, matched = np.array([], dtype=int), 0
+        else:
+            (selected,), matched = viewport.select_layers([layer])
+    except Exception as e:
+        logger.error(f"Error loading municipality shapefile: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load municipality boundaries")
+
+    features: List[bytes] = []
+    matched_count = 0
+    if len(selected):
+        try:
+            table = get_municipality_table()
+        except Exception as e:
+            logger.error(f"Error fetching biogas data: {e}")
+            raise HTTPException(status_code=500, detail="Failed to load biogas data")
+
+        layer_features, matched_rows = _municipality_polygon_features(layer, level, table)
+        features = [layer_features[i] for i in selected]
+        matched_count = int(matched_rows[selected].sum())
+
+    logger.info(f"Matched {matched_count}/{len(features)} municipalities with biogas data")
+
+    metadata = {
+        'total_features': len(features),
+        'matched_with_biogas': matched_count,
+        'simplify_tolerance': level,
+        'coordinate_precision': COORDINATE_PRECISION,
+        'source': f'{MUNICIPALITY_LAYER}.shp + Supabase municipalities table',
+        'note': f'{len(features)} municípios de São Paulo com dados de biogás'
+    }
+    if viewport.bbox is not None or viewport.limit is not None:
+        metadata.update(viewport.metadata(matched))
+    return features, metadata
 
 
 @router.get(
@@ -329,165 +456,243 @@ async def get_municipality_centroids(
     summary="Get municipalities with polygon boundaries from shapefile",
     description="Returns municipality polygon boundaries from shapefile with biogas data from database"
 )
-async def get_municipalities_polygons():
+async def get_municipalities_polygons(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+):
     """
     Get municipality boundaries from shapefile joined with biogas data from database.
 
     This endpoint loads actual polygon boundaries from SP_Municipios_2024.shp
-    and joins them with biogas potential data from the database.
+    and joins them with biogas potential data from the municipalities table.
+    Geometry detail follows ?zoom= or ?tolerance= (precomputed simplification
+    levels); ?bbox= and ?limit=/?cursor= restrict it to the map viewport.
+    Layer loading, the table join and serialization run in the thread pool.
     """
-    # Load municipality boundaries from shapefile
-    try:
-        shapefile_geojson = shapefile_loader.load_shapefile_as_geojson(
-            "SP_Municipios_2024",
-            simplify_tolerance=0.001  # Simplify to reduce size
-        )
-    except Exception as e:
-        logger.error(f"Error loading municipality shapefile: {e}")
-        raise HTTPException(status_code=500, detail="Failed to load municipality boundaries")
+    loop = asyncio.get_running_loop()
+    features, metadata = await loop.run_in_executor(get_thread_pool(), _municipality_polygons_page, level, viewport)
+    return stream_features(features, metadata)
 
-    # Get biogas data from database
-    with get_db() as conn:
-        cursor = conn.cursor()
 
-        try:
-            # Get all biogas data keyed by IBGE code or name
-            cursor.execute("""
-                SELECT
-                    ibge_code,
-                    municipality_name,
-                    total_biogas_m3_year,
-                    urban_biogas_m3_year,
-                    agricultural_biogas_m3_year,
-                    livestock_biogas_m3_year,
-                    energy_potential_mwh_year,
-                    co2_reduction_tons_year,
-                    population,
-                    administrative_region,
-                    area_km2
-                FROM municipalities
-            """)
-            rows = cursor.fetchall()
+# ============================================================================
+# MAP PAYLOADS: IMMUTABLE GEOMETRY + SCENARIO ATTRIBUTES
+# ============================================================================
 
-            # Create lookup dictionaries by IBGE code and name
-            biogas_by_ibge = {}
-            biogas_by_name = {}
-            for row in rows:
-                ibge_code = str(row.get('ibge_code', '')).strip()
-                name = str(row.get('municipality_name', '')).strip().upper()
-
-                data = {
-                    'total_biogas_m3_year': row.get('total_biogas_m3_year', 0) or 0,
-                    'urban_biogas_m3_year': row.get('urban_biogas_m3_year', 0) or 0,
-                    'agricultural_biogas_m3_year': row.get('agricultural_biogas_m3_year', 0) or 0,
-                    'livestock_biogas_m3_year': row.get('livestock_biogas_m3_year', 0) or 0,
-                    'energy_potential_mwh_year': row.get('energy_potential_mwh_year', 0) or 0,
-                    'co2_reduction_tons_year': row.get('co2_reduction_tons_year', 0) or 0,
-                    'population': row.get('population', 0) or 0,
-                    'administrative_region': row.get('administrative_region', ''),
-                    'area_km2': row.get('area_km2', 0) or 0
-                }
-
-                if ibge_code:
-                    biogas_by_ibge[ibge_code] = data
-                if name:
-                    biogas_by_name[name] = data
+# Municipality boundaries served by /municipalities/geometry
+MUNICIPALITY_LAYER = "SP_Municipios_2024"
 
-            cursor.close()
+# Geometry changes only with the dataset: cache for a year when the URL
+# carries the current version (?v=), otherwise revalidate every time
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, max-age=0, must-revalidate"
 
-        except Exception as e:
-            logger.error(f"Error fetching biogas data: {e}")
-            raise HTTPException(status_code=500, detail="Failed to load biogas data")
+# Attributes follow the municipality table; short browser cache plus ETag
+ATTRIBUTES_CACHE_CONTROL = "public, max-age=300"
 
-    # Join shapefile features with biogas data
-    enriched_features = []
-    matched_count = 0
+# Columns selectable with ?fields= on /municipalities/attributes
+ATTRIBUTE_FIELDS = ["municipality_name", "administrative_region", "population", "area_km2", *BIOGAS_SUM_COLUMNS]
 
-    for feature in shapefile_geojson.get('features', []):
-        props = feature.get('properties', {})
-
-        # Try to match by CD_MUN (IBGE code) or NM_MUN (municipality name)
-        ibge_code = str(props.get('CD_MUN', props.get('cod_ibge', props.get('IBGE', '')))).strip()
-        name = str(props.get('NM_MUN', props.get('nome', props.get('NAME', '')))).strip().upper()
-
-        # Find biogas data
-        biogas_data = None
-        if ibge_code and ibge_code in biogas_by_ibge:
-            biogas_data = biogas_by_ibge[ibge_code]
-        elif name and name in biogas_by_name:
-            biogas_data = biogas_by_name[name]
-
-        # Create enriched properties
-        enriched_props = {
-            'id': ibge_code or name,
-            'name': props.get('NM_MUN', props.get('nome', props.get('NAME', 'Unknown'))),
-            'ibge_code': ibge_code,
-        }
-
-        if biogas_data:
-            matched_count += 1
-            area = biogas_data['area_km2'] or 0
-            pop = biogas_data['population'] or 0
-            enriched_props.update({
-                'total_biogas': round(biogas_data['total_biogas_m3_year'], 2),
-                'total_biogas_m3_year': round(biogas_data['total_biogas_m3_year'], 2),
-                'urban_biogas': round(biogas_data['urban_biogas_m3_year'], 2),
-                'urban_biogas_m3_year': round(biogas_data['urban_biogas_m3_year'], 2),
-                'agricultural_biogas': round(biogas_data['agricultural_biogas_m3_year'], 2),
-                'agricultural_biogas_m3_year': round(biogas_data['agricultural_biogas_m3_year'], 2),
-                'livestock_biogas': round(biogas_data['livestock_biogas_m3_year'], 2),
-                'livestock_biogas_m3_year': round(biogas_data['livestock_biogas_m3_year'], 2),
-                'energy_mwh_year': round(biogas_data['energy_potential_mwh_year'], 2),
-                'energy_potential_mwh_year': round(biogas_data['energy_potential_mwh_year'], 2),
-                'co2_reduction': round(biogas_data['co2_reduction_tons_year'], 2),
-                'co2_reduction_tons_year': round(biogas_data['co2_reduction_tons_year'], 2),
-                'population': pop,
-                'region': biogas_data['administrative_region'],
-                'intermediate_region': biogas_data['administrative_region'],
-                'area_km2': round(area, 2),
-                'population_density': round(pop / area, 2) if area > 0 else 0
-            })
-        else:
-            # No biogas data found - set defaults
-            enriched_props.update({
-                'total_biogas': 0,
-                'total_biogas_m3_year': 0,
-                'urban_biogas': 0,
-                'urban_biogas_m3_year': 0,
-                'agricultural_biogas': 0,
-                'agricultural_biogas_m3_year': 0,
-                'livestock_biogas': 0,
-                'livestock_biogas_m3_year': 0,
-                'energy_mwh_year': 0,
-                'energy_potential_mwh_year': 0,
-                'co2_reduction': 0,
-                'co2_reduction_tons_year': 0,
-                'population': 0,
-                'region': '',
-                'intermediate_region': '',
-                'area_km2': 0,
-                'population_density': 0
-            })
-
-        enriched_features.append({
-            'type': 'Feature',
-            'id': enriched_props['id'],
-            'geometry': feature.get('geometry'),
-            'properties': enriched_props
-        })
+# Fields returned when neither fields nor a residue selection is given
+DEFAULT_ATTRIBUTE_FIELDS = [
+    "total_biogas_m3_year",
+    "urban_biogas_m3_year",
+    "agricultural_biogas_m3_year",
+    "livestock_biogas_m3_year",
+    "energy_potential_mwh_year",
+    "co2_reduction_tons_year"
+]
 
-    logger.info(f"Matched {matched_count}/{len(enriched_features)} municipalities with biogas data")
 
-    return {
-        'type': 'FeatureCollection',
-        'features': enriched_features,
-        'metadata': {
-            'total_features': len(enriched_features),
-            'matched_with_biogas': matched_count,
-            'source': 'SP_Municipios_2024.shp + Supabase municipalities table',
-            'note': f'{len(enriched_features)} municípios de São Paulo com dados de biogás'
-        }
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    return bool(if_none_match) and etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def _municipality_codes_and_names(layer, indices: np.ndarray) -> Tuple[List[str], List[str]]:
+    """IBGE codes and names of municipality features ("" when the shapefile lacks the column)"""
+    gdf = layer.gdf_wgs84
+    codes = next((gdf[c] for c in ("CD_MUN", "cod_ibge", "IBGE") if c in gdf.columns), None)
+    names = next((gdf[c] for c in ("NM_MUN", "nome", "NAME") if c in gdf.columns), None)
+    codes = codes.iloc[indices].astype(str).str.strip().tolist() if codes is not None else [""] * len(indices)
+    names = names.iloc[indices].astype(str).tolist() if names is not None else [""] * len(indices)
+    return codes, names
+
+
+def _municipality_geometry_body(level: float, version: str, viewport: Viewport) -> Tuple[bytes, str]:
+    """
+    FeatureCollection bytes of municipality boundaries (id = IBGE code)
+
+    Built once per (dataset version, layer file, simplification level,
+    viewport page) and kept in geometry_cache with its ETag.
+
+    Raises:
+        LookupError: If the municipality shapefile is not available
+    """
+    layer = get_geometry_store().get_layer(MUNICIPALITY_LAYER)
+    if layer is None:
+        raise LookupError(f"{MUNICIPALITY_LAYER}.shp not available")
+
+    key = (
+        f"municipality_geometry:{version}:{layer.path}@{layer.mtime}:{level}"
+        f":{viewport.bbox}:{viewport.limit}:{viewport.offset}"
+    )
+    cached = geometry_cache.get(key)
+    if cached is not None:
+        return cached
+
+    (selected,), matched = viewport.select_layers([layer])
+    codes, names = _municipality_codes_and_names(layer, selected)
+
+    features = [
+        feature_to_bytes(code, geometry, {"ibge_code": code, "name": name})
+        for code, name, geometry in zip(codes, names, geometries_to_json(layer.simplified(level)[selected]))
+    ]
+    metadata = {
+        "total_features": len(features),
+        "dataset_version": version,
+        "simplify_tolerance": level,
+        "coordinate_precision": COORDINATE_PRECISION,
+        "source": f"{MUNICIPALITY_LAYER}.shp"
+    }
+    if viewport.bbox is not None or viewport.limit is not None:
+        metadata.update(viewport.metadata(matched))
+    metadata = json.dumps(metadata)
+    body = b'{"type": "FeatureCollection", "features": [%s], "metadata": %s}' % (b",".join(features), metadata.encode())
+
+    entry = (body, f'"{hashlib.md5(key.encode()).hexdigest()}"')
+    geometry_cache.set(key, entry)
+    return entry
+
+
+@router.get(
+    "/municipalities/geometry",
+    summary="Municipality boundaries (geometry only)",
+    description="Immutable municipality polygons keyed by IBGE code; join attributes from /municipalities/attributes"
+)
+async def get_municipalities_geometry(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport),
+    v: Optional[str] = Query(None, description="Dataset version (from /municipalities/attributes) for long caching"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get municipality boundaries without attributes
+
+    Features carry only ibge_code and name (feature id = IBGE code), so the
+    response only changes with the dataset. Requests whose ?v= matches the
+    current dataset version are cacheable for a year (immutable).
+    ?bbox= and ?limit=/?cursor= restrict the features to the map viewport.
+    """
+    version = get_dataset_version()
+
+    try:
+        loop = asyncio.get_running_loop()
+        body, etag = await loop.run_in_executor(
+            get_thread_pool(), _municipality_geometry_body, level, version, viewport
+        )
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Municipality boundaries not available on the server")
+
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if v == version else REVALIDATE_CACHE_CONTROL,
+        "ETag": etag,
+        "X-Dataset-Version": version
+    }
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=GEOJSON_MEDIA_TYPE, headers=headers)
+
+
+@router.get(
+    "/municipalities/attributes",
+    summary="Municipality attributes (columnar)",
+    description="Columnar biogas attributes keyed by IBGE code for joining onto /municipalities/geometry"
+)
+async def get_municipalities_attributes(
+    response: Response,
+    fields: Optional[str] = Query(None, description="Comma-separated fields (sparse fieldset)"),
+    category: Optional[ResidueCategory] = Query(None, description="Residue category for biogas_m3_year"),
+    residue_types: Optional[List[str]] = Query(None, description="Residue types summed into biogas_m3_year"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get municipality attributes as arrays aligned with ibge_codes
+
+    With a category (and optionally residue_types) a biogas_m3_year array
+    holds the selected residues' potential, as in /analysis/by-residue.
+    Without fields or a category a small default set is returned.
+    """
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else []
+    unknown = [f for f in selected if f not in ATTRIBUTE_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Must be among: {', '.join(ATTRIBUTE_FIELDS)}"
+        )
+    if not selected and category is None:
+        selected = DEFAULT_ATTRIBUTE_FIELDS
+
+    residue_columns = []
+    if category is not None:
+        category_columns = RESIDUE_COLUMNS[category.value]
+        if residue_types:
+            residue_columns = [category_columns[rt] for rt in residue_types if rt in category_columns and rt != "_total"]
+            if not residue_columns:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"No valid residue types provided for category {category.value}"
+                )
+        else:
+            residue_columns = [category_columns["_total"]]
+
+    try:
+        table = await load_municipality_table()
+    except psycopg2.Error as e:
+        logger.error(f"Database error in get_municipalities_attributes: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
+
+    # The result carries the dataset version clients put in /municipalities/geometry?v=
+    dataset_version = get_dataset_version()
+    cache_key = get_analytics_cache_key(
+        "attributes", table.version, fields=selected, residue_columns=sorted(residue_columns),
+        dataset_version=dataset_version
+    )
+    etag = f'"{cache_key.split(":")[-1]}"'
+    response.headers["Cache-Control"] = ATTRIBUTES_CACHE_CONTROL
+    response.headers["ETag"] = etag
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"Cache-Control": ATTRIBUTES_CACHE_CONTROL, "ETag": etag})
+
+    cached = municipality_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    rows = np.flatnonzero(table.ibge_codes != "")
+    columns: Dict[str, list] = {}
+    for field in selected:
+        if field == "municipality_name":
+            columns[field] = table.names[rows].tolist()
+        elif field == "administrative_region":
+            columns[field] = table.regions[rows].tolist()
+        elif field == "population":
+            columns[field] = [None if np.isnan(p) else int(p) for p in table.population[rows]]
+        elif field == "area_km2":
+            columns[field] = [None if np.isnan(a) else round(float(a), 2) for a in table.area_km2[rows]]
+        else:
+            columns[field] = np.round(table.column(field)[rows], 2).tolist()
+    if residue_columns:
+        columns["biogas_m3_year"] = np.round(table.sum_columns(residue_columns)[rows], 2).tolist()
+
+    result = {
+        "ibge_codes": table.ibge_codes[rows].tolist(),
+        "fields": columns,
+        "count": int(len(rows)),
+        "category": category.value if category else None,
+        "residue_columns": residue_columns,
+        "table_version": table.version,
+        "dataset_version": dataset_version
     }
+    municipality_cache.set(cache_key, result)
+    return result
 
 
 # ============================================================================
@@ -705,55 +910,38 @@ async def get_rankings(
     """
     Get top municipalities ranked by biogas potential
     """
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        try:
-            # SECURITY: Validate criteria against whitelist
-            column_map = {
-                "total": "total_biogas_m3_year",
-                "urban": "urban_biogas_m3_year",
-                "agricultural": "agricultural_biogas_m3_year",
-                "livestock": "livestock_biogas_m3_year"
-            }
+    # SECURITY: Validate criteria against whitelist
+    column_map = {
+        "total": "total_biogas_m3_year",
+        "urban": "urban_biogas_m3_year",
+        "agricultural": "agricultural_biogas_m3_year",
+        "livestock": "livestock_biogas_m3_year"
+    }
+    column = column_map.get(criteria, "total_biogas_m3_year")
 
-            # Get validated column (safe since from whitelist)
-            column = column_map.get(criteria, "total_biogas_m3_year")
+    try:
+        table = await load_municipality_table()
+    except psycopg2.Error as e:
+        logger.error(f"Database error in get_rankings: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
 
-            # SECURITY: Use validated column name in SQL (safe since from whitelist)
-            query = f"""
-                SELECT
-                    municipality_name,
-                    {column} as biogas_potential,
-                    energy_potential_mwh_year,
-                    ROW_NUMBER() OVER (ORDER BY {column} DESC) as ranking
-                FROM municipalities
-                WHERE {column} > 0
-                ORDER BY {column} DESC
-                LIMIT %s
-            """
+    values = table.column(column)
+    energy = table.column("energy_potential_mwh_year")
+    top = table.top(values, limit)
+    top = top[values[top] > 0]
 
-            cursor.execute(query, (limit,))
-            rows = cursor.fetchall()
-
-            return {
-                "criteria": criteria,
-                "rankings": [
-                    {
-                        "rank": row['ranking'],
-                        "municipality": row['municipality_name'],
-                        "biogas_m3_year": float(row['biogas_potential']),
-                        "energy_mwh_year": float(row['energy_potential_mwh_year'])
-                    }
-                    for row in rows
-                ]
+    return {
+        "criteria": criteria,
+        "rankings": [
+            {
+                "rank": rank,
+                "municipality": table.names[i],
+                "biogas_m3_year": float(values[i]),
+                "energy_mwh_year": float(energy[i])
             }
-
-        except psycopg2.Error as e:
-            logger.error(f"Database error in get_rankings: {e}")
-            raise HTTPException(status_code=500, detail="Database query failed")
-        finally:
-            cursor.close()
+            for rank, i in enumerate(top, start=1)
+        ]
+    }
 
 
 @router.get(
@@ -765,81 +953,51 @@ async def get_summary_statistics():
     """
     Get overall statistics for the platform
     """
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        try:
-            # Get overall statistics
-            query_stats = """
-                SELECT
-                    COUNT(*) as total_municipalities,
-                    SUM(total_biogas_m3_year) as total_biogas_potential,
-                    AVG(total_biogas_m3_year) as avg_biogas_potential,
-                    SUM(energy_potential_mwh_year) as total_energy_potential,
-                    SUM(co2_reduction_tons_year) as total_co2_reduction,
-                    SUM(population) as total_population,
-                    SUM(agricultural_biogas_m3_year) as total_agricultural,
-                    SUM(livestock_biogas_m3_year) as total_livestock,
-                    SUM(urban_biogas_m3_year) as total_urban
-                FROM municipalities
-            """
-
-            cursor.execute(query_stats)
-            row = cursor.fetchone()
-
-            total_biogas = float(row['total_biogas_potential'] or 0)
-            total_agricultural = float(row['total_agricultural'] or 0)
-            total_livestock = float(row['total_livestock'] or 0)
-            total_urban = float(row['total_urban'] or 0)
-
-            # Get top 5 municipalities
-            query_top = """
-                SELECT municipality_name, total_biogas_m3_year
-                FROM municipalities
-                WHERE total_biogas_m3_year > 0
-                ORDER BY total_biogas_m3_year DESC
-                LIMIT 5
-            """
-            cursor.execute(query_top)
-            top_municipalities = cursor.fetchall()
-
-            return {
-                "total_municipalities": row['total_municipalities'],
-                "total_biogas_m3_year": total_biogas,
-                "average_biogas_m3_year": float(row['avg_biogas_potential'] or 0),
-                "total_energy_mwh_year": float(row['total_energy_potential'] or 0),
-                "total_co2_reduction_tons_year": float(row['total_co2_reduction'] or 0),
-                "total_population": row['total_population'] or 0,
-                "top_municipality": {
-                    "name": top_municipalities[0]['municipality_name'] if top_municipalities else "N/A",
-                    "biogas_m3_year": float(top_municipalities[0]['total_biogas_m3_year']) if top_municipalities else 0
-                },
-                "top_5_municipalities": [
-                    {
-                        "name": m['municipality_name'],
-                        "biogas_m3_year": float(m['total_biogas_m3_year'])
-                    }
-                    for m in top_municipalities
-                ],
-                "categories": {},  # Can be expanded later
-                "sector_breakdown": {
-                    "agricultural": total_agricultural,
-                    "livestock": total_livestock,
-                    "urban": total_urban
-                },
-                "sector_percentages": {
-                    "agricultural": round((total_agricultural / total_biogas * 100) if total_biogas > 0 else 0, 2),
-                    "livestock": round((total_livestock / total_biogas * 100) if total_biogas > 0 else 0, 2),
-                    "urban": round((total_urban / total_biogas * 100) if total_biogas > 0 else 0, 2)
-                },
-                "note": f"Dados de {row['total_municipalities']} municípios do estado de São Paulo"
-            }
+    try:
+        table = await load_municipality_table()
+    except psycopg2.Error as e:
+        logger.error(f"Database error in get_summary_statistics: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
+
+    total_municipalities = len(table)
+    biogas = table.column("total_biogas_m3_year")
+    total_biogas = float(biogas.sum())
+    total_agricultural = float(table.column("agricultural_biogas_m3_year").sum())
+    total_livestock = float(table.column("livestock_biogas_m3_year").sum())
+    total_urban = float(table.column("urban_biogas_m3_year").sum())
+
+    # Top 5 municipalities
+    top = table.top(biogas, 5)
+    top_municipalities = [
+        {"name": table.names[i], "biogas_m3_year": float(biogas[i])}
+        for i in top if biogas[i] > 0
+    ]
 
-        except psycopg2.Error as e:
-            logger.error(f"Database error in get_summary_statistics: {e}")
-            raise HTTPException(status_code=500, detail="Database query failed")
-        finally:
-            cursor.close()
+    return {
+        "total_municipalities": total_municipalities,
+        "total_biogas_m3_year": total_biogas,
+        "average_biogas_m3_year": total_biogas / total_municipalities if total_municipalities else 0.0,
+        "total_energy_mwh_year": float(table.column("energy_potential_mwh_year").sum()),
+        "total_co2_reduction_tons_year": float(table.column("co2_reduction_tons_year").sum()),
+        "total_population": int(np.nansum(table.population)),
+        "top_municipality": {
+            "name": top_municipalities[0]["name"] if top_municipalities else "N/A",
+            "biogas_m3_year": top_municipalities[0]["biogas_m3_year"] if top_municipalities else 0
+        },
+        "top_5_municipalities": top_municipalities,
+        "categories": {},  # Can be expanded later
+        "sector_breakdown": {
+            "agricultural": total_agricultural,
+            "livestock": total_livestock,
+            "urban": total_urban
+        },
+        "sector_percentages": {
+            "agricultural": round((total_agricultural / total_biogas * 100) if total_biogas > 0 else 0, 2),
+            "livestock": round((total_livestock / total_biogas * 100) if total_biogas > 0 else 0, 2),
+            "urban": round((total_urban / total_biogas * 100) if total_biogas > 0 else 0, 2)
+        },
+        "note": f"Dados de {total_municipalities} municípios do estado de São Paulo"
+    }
 
 
 # ============================================================================
@@ -854,38 +1012,24 @@ async def get_summary_statistics():
 )
 async def get_biogas_plants():
     """Get existing biogas plants"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        try:
-            query = """
-                SELECT jsonb_build_object(
-                    'type', 'FeatureCollection',
-                    'features', jsonb_agg(feature)
-                ) as geojson
-                FROM (
-                    SELECT jsonb_build_object(
-                        'type', 'Feature',
-                        'geometry', ST_AsGeoJSON(location)::jsonb,
-                        'properties', jsonb_build_object(
-                            'name', plant_name,
-                            'type', plant_type,
-                            'status', status,
-                            'capacity', installed_capacity_m3_day
-                        )
-                    ) as feature
-                    FROM biogas_plants
-                    WHERE location IS NOT NULL
-                ) as features
-            """
-
-            cursor.execute(query)
-            result = cursor.fetchone()
+    try:
+        query = """
+            SELECT jsonb_build_object(
+                'type', 'Feature',
+                'geometry', ST_AsGeoJSON(location)::jsonb,
+                'properties', jsonb_build_object(
+                    'name', plant_name,
+                    'type', plant_type,
+                    'status', status,
+                    'capacity', installed_capacity_m3_day
+                )
+            )::text as feature
+            FROM biogas_plants
+            WHERE location IS NOT NULL
+        """
 
-            return result['geojson'] if result and result.get('geojson') else {"type": "FeatureCollection", "features": []}
+        return await stream_feature_collection(query)
 
-        except psycopg2.Error as e:
-            logger.error(f"Database error in get_biogas_plants: {e}")
-            raise HTTPException(status_code=500, detail="Database query failed")
-        finally:
-            cursor.close()
+    except psycopg2.Error as e:
+        logger.error(f"Database error in get_biogas_plants: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
@@ -1,12 +1,18 @@
 """
 CP2B Maps V3 - Infrastructure Endpoints
 Provides GeoJSON data for infrastructure layers from real shapefiles
+
+Every layer accepts ?bbox=minx,miny,maxx,maxy and ?limit=/?cursor= so a
+zoomed-in map fetches only the features in view.
 """
 
-from fastapi import APIRouter
-from typing import Dict, Any
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional
+import asyncio
 import logging
-from app.utils.shapefile_loader import get_shapefile_loader
+from app.core.executors import get_thread_pool
+from app.utils.shapefile_loader import Viewport, get_shapefile_loader, map_simplify_level, map_viewport
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -14,8 +20,26 @@ logger = logging.getLogger(__name__)
 shapefile_loader = get_shapefile_loader()
 
 
+async def _stream_layers(
+    filenames: List[str],
+    layer_type: str,
+    viewport: Viewport,
+    level: Optional[float] = None
+) -> StreamingResponse:
+    """Select and serialize the layer features in the thread pool, off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_thread_pool(),
+        shapefile_loader.stream_shapefiles,
+        filenames, level, viewport, {"layer_type": layer_type}
+    )
+
+
 @router.get("/railways/geojson")
-async def get_railways_geojson() -> Dict[str, Any]:
+async def get_railways_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get railway network GeoJSON for São Paulo state
 
@@ -23,165 +47,126 @@ async def get_railways_geojson() -> Dict[str, Any]:
         GeoJSON FeatureCollection with railway lines from Rodovias_Estaduais_SP.shp
     """
     # Use highways shapefile (Rodovias) as proxy for railways
-    # Simplify to reduce file size (tolerance in degrees, ~0.001 = ~100m)
-    geojson = shapefile_loader.load_shapefile_as_geojson(
-        "Rodovias_Estaduais_SP",
-        simplify_tolerance=0.001
-    )
-    geojson["metadata"]["layer_type"] = "railways"
-    return geojson
+    # Simplification level follows the client zoom (default 0.001 degrees = ~100m)
+    return await _stream_layers(["Rodovias_Estaduais_SP"], "railways", viewport, level)
 
 
 @router.get("/pipelines/geojson")
-async def get_pipelines_geojson() -> Dict[str, Any]:
+async def get_pipelines_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get pipeline network GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with gas pipeline lines from Gasodutos shapefiles
     """
-    # Load both distribution and transport pipelines
-    dist_geojson = shapefile_loader.load_shapefile_as_geojson(
-        "Gasodutos_Distribuicao_SP",
-        simplify_tolerance=0.001
-    )
-    transp_geojson = shapefile_loader.load_shapefile_as_geojson(
-        "Gasodutos_Transporte_SP",
-        simplify_tolerance=0.001
-    )
-
-    # Combine both into one FeatureCollection
-    combined_features = dist_geojson["features"] + transp_geojson["features"]
-
-    return {
-        "type": "FeatureCollection",
-        "features": combined_features,
-        "metadata": {
-            "source": "Gasodutos_Distribuicao_SP.shp + Gasodutos_Transporte_SP.shp",
-            "total_features": len(combined_features),
-            "layer_type": "pipelines",
-            "note": f"Dados de gasodutos - {len(combined_features)} segmentos"
-        }
-    }
+    # Load both distribution and transport pipelines as one layer (shared viewport page)
+    return await _stream_layers(["Gasodutos_Distribuicao_SP", "Gasodutos_Transporte_SP"], "pipelines", viewport, level)
 
 
 @router.get("/substations/geojson")
-async def get_substations_geojson() -> Dict[str, Any]:
+async def get_substations_geojson(viewport: Viewport = Depends(map_viewport)) -> StreamingResponse:
     """
     Get electrical substations GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with substation points from Subestacoes_Energia.shp
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson("Subestacoes_Energia")
-    geojson["metadata"]["layer_type"] = "substations"
-    return geojson
+    return await _stream_layers(["Subestacoes_Energia"], "substations", viewport)
 
 
 @router.get("/biogas-plants/geojson")
-async def get_biogas_plants_geojson() -> Dict[str, Any]:
+async def get_biogas_plants_geojson(viewport: Viewport = Depends(map_viewport)) -> StreamingResponse:
     """
     Get existing biogas plants GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with biogas plant points from Plantas_Biogas_SP.shp
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson("Plantas_Biogas_SP")
-    geojson["metadata"]["layer_type"] = "biogas_plants"
-    return geojson
+    return await _stream_layers(["Plantas_Biogas_SP"], "biogas_plants", viewport)
 
 
 @router.get("/transmission-lines/geojson")
-async def get_transmission_lines_geojson() -> Dict[str, Any]:
+async def get_transmission_lines_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get electrical transmission lines GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with transmission line polylines
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson(
-        "Linhas_De_Transmissao_Energia",
-        simplify_tolerance=0.001
-    )
-    geojson["metadata"]["layer_type"] = "transmission_lines"
-    return geojson
+    return await _stream_layers(["Linhas_De_Transmissao_Energia"], "transmission_lines", viewport, level)
 
 
 @router.get("/etes/geojson")
-async def get_etes_geojson() -> Dict[str, Any]:
+async def get_etes_geojson(viewport: Viewport = Depends(map_viewport)) -> StreamingResponse:
     """
     Get wastewater treatment plants (ETEs) GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with ETE points
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson("ETEs_2019_SP")
-    geojson["metadata"]["layer_type"] = "etes"
-    return geojson
+    return await _stream_layers(["ETEs_2019_SP"], "etes", viewport)
 
 
 @router.get("/administrative-regions/geojson")
-async def get_admin_regions_geojson() -> Dict[str, Any]:
+async def get_admin_regions_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get administrative regions GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with admin region polygons
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson(
-        "Regiao_Adm_SP",
-        simplify_tolerance=0.001
-    )
-    geojson["metadata"]["layer_type"] = "administrative_regions"
-    return geojson
+    return await _stream_layers(["Regiao_Adm_SP"], "administrative_regions", viewport, level)
 
 
 @router.get("/intermediate-regions/geojson")
-async def get_intermediate_regions_geojson() -> Dict[str, Any]:
+async def get_intermediate_regions_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get intermediate geographic regions GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with intermediate region polygons
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson(
-        "SP_RG_Intermediarias_2024",
-        simplify_tolerance=0.001
-    )
-    geojson["metadata"]["layer_type"] = "intermediate_regions"
-    return geojson
+    return await _stream_layers(["SP_RG_Intermediarias_2024"], "intermediate_regions", viewport, level)
 
 
 @router.get("/immediate-regions/geojson")
-async def get_immediate_regions_geojson() -> Dict[str, Any]:
+async def get_immediate_regions_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get immediate geographic regions GeoJSON for São Paulo state
 
     Returns:
         GeoJSON FeatureCollection with immediate region polygons
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson(
-        "SP_RG_Imediatas_2024",
-        simplify_tolerance=0.001
-    )
-    geojson["metadata"]["layer_type"] = "immediate_regions"
-    return geojson
+    return await _stream_layers(["SP_RG_Imediatas_2024"], "immediate_regions", viewport, level)
 
 
 @router.get("/sp-boundary/geojson")
-async def get_sp_boundary_geojson() -> Dict[str, Any]:
+async def get_sp_boundary_geojson(
+    level: float = Depends(map_simplify_level),
+    viewport: Viewport = Depends(map_viewport)
+) -> StreamingResponse:
     """
     Get São Paulo state boundary GeoJSON
 
     Returns:
         GeoJSON FeatureCollection with state boundary polygon
     """
-    geojson = shapefile_loader.load_shapefile_as_geojson(
-        "Limite_SP",
-        simplify_tolerance=0.002
-    )
-    geojson["metadata"]["layer_type"] = "state_boundary"
-    return geojson
+    return await _stream_layers(["Limite_SP"], "state_boundary", viewport, level)
 
 
 @router.get("/health")
@@ -4,50 +4,32 @@ Provides dynamic tile generation from MapBiomas agricultural land use data
 """
 from __future__ import annotations
 
+import asyncio
 import json
-import math
 import logging
-from pathlib import Path
-from io import BytesIO
-from typing import Dict, Any
-
-from fastapi import APIRouter, HTTPException, Response
-
-try:
-    import rasterio
-    from rasterio.windows import Window
-    from PIL import Image
-    import numpy as np
-    HAS_RASTER_DEPS = True
-except ImportError:
-    HAS_RASTER_DEPS = False
-    np = None  # type: ignore
+from typing import Dict, Any, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Response
+
+from app.core.executors import get_thread_pool
+from app.services.mapbiomas_service import MAPBIOMAS_DIR, RASTER_PATH, get_mapbiomas_service
+from app.services.mapbiomas_tiles import (
+    HAS_RASTER_DEPS,
+    get_tile_service,
+    rasterio,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# MapBiomas data directory
-MAPBIOMAS_DIR = Path(__file__).parent.parent.parent.parent.parent / "data" / "mapbiomas"
-RASTER_PATH = MAPBIOMAS_DIR / "mapbiomas_agropecuaria_sp_2024.tif"
+# MapBiomas metadata (raster path lives in app.services.mapbiomas_service)
 METADATA_PATH = MAPBIOMAS_DIR / "mapbiomas_metadata.json"
 
-# Tile size
-TILE_SIZE = 256
-
-# MapBiomas color mapping (class code -> RGB tuple)
-MAPBIOMAS_COLORS = {
-    15: (255, 217, 102),   # Pastagem - Yellow
-    9: (109, 76, 65),      # Silvicultura - Brown
-    39: (225, 190, 231),   # Soja - Light purple
-    20: (197, 225, 165),   # Cana-de-açúcar - Light green
-    40: (255, 205, 210),   # Arroz - Light pink
-    62: (248, 187, 217),   # Algodão - Pink
-    41: (220, 237, 200),   # Outras Temporárias - Very light green
-    46: (141, 110, 99),    # Café - Light brown
-    47: (255, 167, 38),    # Citros - Orange
-    35: (102, 187, 106),   # Dendê - Green
-    48: (161, 136, 127),   # Outras Perenes - Grayish brown
+# Browser/CDN caching for tiles (1 day) - revalidated by ETag afterwards
+TILE_CACHE_HEADERS = {
+    "Cache-Control": "public, max-age=86400",
+    "Access-Control-Allow-Origin": "*"
 }
 
 
@@ -75,83 +57,6 @@ def load_metadata() -> Dict[str, Any]:
     }
 
 
-def tile_to_bbox(z: int, x: int, y: int) -> tuple:
-    """
-    Convert tile coordinates to bounding box in WGS84
-
-    Uses Web Mercator tile scheme (TMS/XYZ)
-
-    Args:
-        z: Zoom level
-        x: Tile X coordinate
-        y: Tile Y coordinate
-
-    Returns:
-        Tuple of (west, south, east, north) in degrees
-    """
-    n = 2.0 ** z
-
-    # Calculate longitude bounds
-    west = x / n * 360.0 - 180.0
-    east = (x + 1) / n * 360.0 - 180.0
-
-    # Calculate latitude bounds (using Mercator projection formula)
-    lat_rad_north = math.atan(math.sinh(math.pi * (1 - 2 * y / n)))
-    lat_rad_south = math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n)))
-
-    north = math.degrees(lat_rad_north)
-    south = math.degrees(lat_rad_south)
-
-    return (west, south, east, north)
-
-
-def create_tile_image(data: np.ndarray) -> bytes:
-    """
-    Convert raster data to colored PNG tile
-
-    Args:
-        data: 2D numpy array with MapBiomas class codes
-
-    Returns:
-        PNG image bytes
-    """
-    height, width = data.shape
-
-    # Create RGBA image (4 channels)
-    rgba = np.zeros((height, width, 4), dtype=np.uint8)
-
-    # Apply colors for each class
-    for class_code, rgb in MAPBIOMAS_COLORS.items():
-        mask = data == class_code
-        rgba[mask, 0] = rgb[0]  # R
-        rgba[mask, 1] = rgb[1]  # G
-        rgba[mask, 2] = rgb[2]  # B
-        rgba[mask, 3] = 200     # Alpha (semi-transparent)
-
-    # Create PIL Image
-    img = Image.fromarray(rgba, 'RGBA')
-
-    # Resize to tile size if needed
-    if img.size != (TILE_SIZE, TILE_SIZE):
-        img = img.resize((TILE_SIZE, TILE_SIZE), Image.Resampling.NEAREST)
-
-    # Save to bytes
-    buffer = BytesIO()
-    img.save(buffer, format='PNG', optimize=True)
-    buffer.seek(0)
-
-    return buffer.getvalue()
-
-
-def create_transparent_tile() -> bytes:
-    """Create a fully transparent tile for areas outside raster bounds"""
-    img = Image.new('RGBA', (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    return buffer.getvalue()
-
-
 @router.get(
     "/metadata",
     summary="Get MapBiomas metadata",
@@ -179,12 +84,19 @@ async def get_metadata():
     summary="Get MapBiomas tile",
     description="Returns a 256x256 PNG tile with colored MapBiomas agricultural classes"
 )
-async def get_tile(z: int, x: int, y: int):
+async def get_tile(
+    z: int,
+    x: int,
+    y: int,
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Get MapBiomas raster tile
 
-    Converts raster data to colored PNG using MapBiomas color scheme.
-    Returns transparent tile if outside raster bounds.
+    Served from the in-process tile cache or the pre-rendered MBTiles
+    pyramid; tiles missing from both are rendered from the GeoTIFF and
+    written back. Returns transparent tile if outside raster bounds.
+    Supports conditional requests (ETag / If-None-Match -> 304).
 
     Args:
         z: Zoom level (7-15 recommended)
@@ -200,7 +112,8 @@ async def get_tile(z: int, x: int, y: int):
             detail="Raster processing dependencies not available (rasterio, PIL, numpy)"
         )
 
-    if not RASTER_PATH.exists():
+    tile_service = get_tile_service()
+    if not RASTER_PATH.exists() and not tile_service.store.exists():
         raise HTTPException(
             status_code=404,
             detail="MapBiomas raster file not found"
@@ -214,82 +127,17 @@ async def get_tile(z: int, x: int, y: int):
         )
 
     try:
-        # Get tile bounding box
-        tile_bbox = tile_to_bbox(z, x, y)
-        west, south, east, north = tile_bbox
-
-        # Open raster and check bounds
-        with rasterio.open(RASTER_PATH) as src:
-            raster_bounds = src.bounds
-
-            # Check if tile is completely outside raster bounds
-            if (east < raster_bounds.left or
-                west > raster_bounds.right or
-                north < raster_bounds.bottom or
-                south > raster_bounds.top):
-                # Return transparent tile
-                png_bytes = create_transparent_tile()
-                return Response(
-                    content=png_bytes,
-                    media_type="image/png",
-                    headers={
-                        "Cache-Control": "public, max-age=86400",  # 1 day cache
-                        "Access-Control-Allow-Origin": "*"
-                    }
-                )
-
-            # Calculate pixel coordinates for the tile bbox
-            # Convert geographic coordinates to pixel coordinates
-            inv_transform = ~src.transform
-
-            # Get pixel coordinates for corners
-            col_west, row_north = inv_transform * (west, north)
-            col_east, row_south = inv_transform * (east, south)
-
-            # Clamp to raster bounds
-            col_start = max(0, int(col_west))
-            row_start = max(0, int(row_north))
-            col_end = min(src.width, int(col_east) + 1)
-            row_end = min(src.height, int(row_south) + 1)
-
-            # Calculate window
-            width = col_end - col_start
-            height = row_end - row_start
-
-            if width <= 0 or height <= 0:
-                png_bytes = create_transparent_tile()
-                return Response(
-                    content=png_bytes,
-                    media_type="image/png",
-                    headers={
-                        "Cache-Control": "public, max-age=86400",
-                        "Access-Control-Allow-Origin": "*"
-                    }
-                )
-
-            # Read raster window with resampling to tile size
-            window = Window(col_start, row_start, width, height)
-
-            # Read data and resample to tile size
-            data = src.read(
-                1,  # First band
-                window=window,
-                out_shape=(TILE_SIZE, TILE_SIZE),
-                resampling=rasterio.enums.Resampling.nearest
-            )
-
-            # Create colored tile
-            png_bytes = create_tile_image(data)
-
-            return Response(
-                content=png_bytes,
-                media_type="image/png",
-                headers={
-                    "Cache-Control": "public, max-age=86400",  # 1 day cache
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
-
+        # Store lookups and rendering block - run them off the event loop
+        loop = asyncio.get_running_loop()
+        png_bytes, etag = await loop.run_in_executor(
+            get_thread_pool(), tile_service.get_tile, z, x, y
+        )
+    except FileNotFoundError:
+        # Store-only deployment and the tile was never pre-rendered
+        raise HTTPException(
+            status_code=404,
+            detail=f"MapBiomas tile {z}/{x}/{y} not found"
+        )
     except Exception as e:
         logger.error(f"Error generating tile {z}/{x}/{y}: {e}")
         raise HTTPException(
@@ -297,6 +145,41 @@ async def get_tile(z: int, x: int, y: int):
             detail=f"Error generating tile: {str(e)}"
         )
 
+    headers = {**TILE_CACHE_HEADERS, "ETag": etag}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=png_bytes, media_type="image/png", headers=headers)
+
+
+@router.get(
+    "/municipalities/{ibge_code}/land-use",
+    summary="Get MapBiomas land use for a municipality",
+    description="Returns class areas for a whole municipality from precomputed zonal histograms"
+)
+async def get_municipality_land_use(ibge_code: str):
+    """
+    Get MapBiomas land use for a municipality
+
+    Answered from the zonal histogram index built by
+    scripts/build_mapbiomas_histograms.py (no raster reads).
+
+    Args:
+        ibge_code: Municipality IBGE code
+
+    Returns:
+        Land use by class, same structure as the proximity land_use result
+    """
+    result = get_mapbiomas_service().analyze_municipality(ibge_code)
+    if result is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No MapBiomas histogram for municipality {ibge_code}"
+        )
+
+    return {"ibge_code": ibge_code, **result}
+
 
 @router.get(
     "/classes",
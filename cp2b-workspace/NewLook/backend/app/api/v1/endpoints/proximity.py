@@ -5,19 +5,30 @@ Comprehensive spatial analysis for biogas potential assessment
 
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Tuple
 from datetime import datetime
+from functools import partial
+import asyncio
 import uuid
 import logging
 import time
 
-from app.services.proximity_service import ProximityService
-from app.services.mapbiomas_service import MapBiomasService
+from app.core.config import settings
+from app.core.executors import get_thread_pool, get_process_pool
+from app.services.proximity_service import ProximityService, INFRASTRUCTURE_CONFIGS
+from app.services.mapbiomas_service import run_buffer_analysis
 from app.services.cache_service import (
     proximity_cache,
-    get_proximity_cache_key
+    mapbiomas_cache,
+    proximity_flight,
+    mapbiomas_flight,
+    get_proximity_cache_key,
+    get_mapbiomas_cache_key,
+    record_proximity_radius,
+    find_covering_proximity_result
 )
 from app.services.validation_service import ValidationService, ValidationError
+from app.utils import geohash
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -32,6 +43,11 @@ class AnalysisOptions(BaseModel):
     include_mapbiomas: bool = Field(default=True, description="Include MapBiomas land use analysis")
     include_biogas_potential: bool = Field(default=True, description="Include biogas potential aggregation")
     include_infrastructure: bool = Field(default=True, description="Include infrastructure proximity")
+    snap_to_grid: Optional[bool] = Field(
+        default=None,
+        description="Snap the point to a geohash cell center and the radius to a standard step "
+                    "so nearby requests share results (default: server setting)"
+    )
 
 
 class ProximityAnalysisRequest(BaseModel):
@@ -124,8 +140,11 @@ class AnalysisMetadata(BaseModel):
     """Metadata about the analysis execution"""
     analysis_timestamp: str
     processing_time_ms: int
+    stage_timings_ms: Dict[str, int] = Field(default_factory=dict)
     coordinate_system: str = "WGS84 (EPSG:4326)"
     buffer_projection: str = "SIRGAS 2000 / UTM 23S (EPSG:31983)"
+    snapped_to: Optional[Dict[str, Any]] = None  # {geohash, latitude, longitude, radius_km} when snapped
+    derived_from_radius_km: Optional[float] = None  # Larger cached analysis reused at the same center
 
 
 class ProximityAnalysisResponse(BaseModel):
@@ -137,6 +156,85 @@ class ProximityAnalysisResponse(BaseModel):
     metadata: AnalysisMetadata
 
 
+# =============================================================================
+# PIPELINE HELPERS
+# =============================================================================
+
+async def _run_stage(
+    name: str,
+    timings: Dict[str, int],
+    func: Callable,
+    *args,
+    executor=None,
+    **kwargs
+) -> Any:
+    """
+    Run a blocking analysis stage in a worker pool and record its duration.
+
+    Args:
+        name: Stage name used as key in timings
+        timings: Dict collecting stage durations in milliseconds
+        func: Blocking callable (GDAL/shapely/psycopg2 work)
+        executor: Pool to use (defaults to the shared thread pool)
+    """
+    loop = asyncio.get_running_loop()
+    stage_start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(
+            executor or get_thread_pool(),
+            partial(func, *args, **kwargs)
+        )
+    finally:
+        timings[name] = int((time.perf_counter() - stage_start) * 1000)
+
+
+def _snap_request(request: ProximityAnalysisRequest) -> Tuple[ProximityAnalysisRequest, Optional[Dict[str, Any]]]:
+    """
+    Quantize the analysis center to its geohash cell and the radius to the
+    nearest standard step, if snapping is enabled for this request.
+
+    Returns:
+        Tuple of (request to analyze, snapping info or None)
+    """
+    snap_to_grid = request.options.snap_to_grid
+    if snap_to_grid is None:
+        snap_to_grid = settings.PROXIMITY_SNAP_ENABLED
+    if not snap_to_grid:
+        return request, None
+
+    lat, lng, cell = geohash.snap(
+        request.latitude, request.longitude, settings.PROXIMITY_SNAP_GEOHASH_PRECISION
+    )
+    radius_km = min(settings.PROXIMITY_RADIUS_STEPS_KM, key=lambda step: abs(step - request.radius_km))
+    snapped = request.model_copy(update={"latitude": lat, "longitude": lng, "radius_km": radius_km})
+    return snapped, {"geohash": cell, "latitude": lat, "longitude": lng, "radius_km": radius_km}
+
+
+def _cache_key(request: ProximityAnalysisRequest) -> str:
+    """Cache and single-flight key of the analysis a request asks for"""
+    return get_proximity_cache_key(
+        request.latitude, request.longitude, request.radius_km, **_include_options(request)
+    )
+
+
+def _include_options(request: ProximityAnalysisRequest) -> Dict[str, bool]:
+    """The include_* options, which select the parts of a result"""
+    return request.options.model_dump(
+        include={"include_mapbiomas", "include_biogas_potential", "include_infrastructure"}
+    )
+
+
+def _land_use_error(error: Exception) -> Dict[str, Any]:
+    """Land use result returned when the MapBiomas stage fails"""
+    return {
+        "error": str(error),
+        "total_area_km2": 0,
+        "by_class": {},
+        "dominant_class": "unknown",
+        "agricultural_percent": 0
+    }
+
+
 # =============================================================================
 # API ENDPOINTS
 # =============================================================================
@@ -193,91 +291,174 @@ async def analyze_proximity(request: ProximityAnalysisRequest):
             }
         )
 
+    # Optionally snap to the grid so nearby requests share one analysis
+    analysis_request, snapped_to = _snap_request(request)
     # Check cache first (Sprint 4: Performance Optimization)
-    cache_key = get_proximity_cache_key(request.latitude, request.longitude, request.radius_km)
+    cache_key = _cache_key(analysis_request)
     cached_result = proximity_cache.get(cache_key)
     
     if cached_result is not None:
         logger.info(f"✅ Cache hit for proximity analysis {analysis_id}")
-        # Add cache indicator to response
-        cached_result["from_cache"] = True
-        cached_result["analysis_id"] = analysis_id
-        # Add validation warnings to cached result
-        if validation_result.get("warnings"):
-            cached_result["warnings"] = validation_result["warnings"]
-        return cached_result
+        return _mark_from_cache(cached_result, request, analysis_id, validation_result)
 
+    # Identical requests arriving while this one runs wait for its result
+    response, coalesced = await proximity_flight.do_async(
+        cache_key, _run_proximity_analysis,
+        analysis_request, analysis_id, start_time, cache_key, snapped_to
+    )
+    if coalesced:
+        logger.info(f"✅ Coalesced proximity analysis {analysis_id} with a concurrent request")
+        return _mark_from_cache(response.dict(), request, analysis_id, validation_result)
+
+    response.request = request
+    return response
+
+
+def _mark_from_cache(
+    result: Dict[str, Any],
+    request: ProximityAnalysisRequest,
+    analysis_id: str,
+    validation_result: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Flag a cached or shared result as such for this request"""
+    # Add cache indicator to response
+    result["from_cache"] = True
+    result["analysis_id"] = analysis_id
+    # Snapped results are shared by nearby requests; echo this one
+    result["request"] = request.dict()
+    # Add validation warnings to cached result
+    if validation_result.get("warnings"):
+        result["warnings"] = validation_result["warnings"]
+    return result
+
+
+async def _run_proximity_analysis(
+    request: ProximityAnalysisRequest,
+    analysis_id: str,
+    start_time: float,
+    cache_key: str,
+    snapped_to: Optional[Dict[str, Any]] = None
+) -> ProximityAnalysisResponse:
+    """Run the full analysis pipeline and cache the result"""
     try:
-        # Initialize services
-        proximity_service = ProximityService()
+        options = request.options
+        lat, lng, radius_km = request.latitude, request.longitude, request.radius_km
+        stage_timings: Dict[str, int] = {}
+
+        # Radius-independent parts can come from a larger cached analysis at this center
+        covering = find_covering_proximity_result(lat, lng, radius_km, **_include_options(request))
+        derived_from_radius_km, reusable = None, {}
+        if covering is not None:
+            derived_from_radius_km, covering_result = covering
+            reusable = covering_result.get("results", {})
+            logger.info(f"Reusing {derived_from_radius_km}km analysis at the same center for {radius_km}km")
 
         # Determine radius recommendation
-        if request.radius_km <= 20:
+        if radius_km <= 20:
             radius_recommendation = "optimal"
-        elif request.radius_km <= 30:
+        elif radius_km <= 30:
             radius_recommendation = "acceptable"
         else:
             radius_recommendation = "excessive"
 
-        # 1. Create buffer and get municipalities
-        buffer_geojson, municipalities = proximity_service.get_municipalities_in_radius(
-            lat=request.latitude,
-            lng=request.longitude,
-            radius_km=request.radius_km
-        )
+        # Initialize services off the event loop (builds pyproj transformers)
+        proximity_service = await _run_stage("setup", stage_timings, ProximityService)
+
+        async def municipalities_branch():
+            # 1. Create buffer and get municipalities
+            buffer_geojson, municipalities = await _run_stage(
+                "municipalities", stage_timings,
+                proximity_service.get_municipalities_in_radius,
+                lat=lat, lng=lng, radius_km=radius_km
+            )
+            logger.info(f"Found {len(municipalities)} municipalities within {radius_km}km")
 
-        logger.info(f"Found {len(municipalities)} municipalities within {request.radius_km}km")
+            if not (options.include_biogas_potential and municipalities):
+                return buffer_geojson, municipalities, None, None
 
-        # 2. Calculate biogas potential aggregation
-        biogas_result = None
-        if request.options.include_biogas_potential and municipalities:
-            biogas_result = proximity_service.aggregate_biogas_potential(
-                lat=request.latitude,
-                lng=request.longitude,
-                radius_km=request.radius_km
+            # 2. Biogas potential aggregation and 6. residuos context (independent)
+            biogas_task = _run_stage(
+                "biogas_potential", stage_timings,
+                proximity_service.aggregate_biogas_potential, municipalities
             )
+            # Residuos parameters are the same for any non-empty municipality set
+            if reusable.get("residuos_data"):
+                return buffer_geojson, municipalities, await biogas_task, reusable["residuos_data"]
+
+            biogas_result, residuos_data = await asyncio.gather(
+                biogas_task,
+                _run_stage(
+                    "residuos_data", stage_timings,
+                    proximity_service.get_residuos_for_municipalities
+                )
+            )
+            return buffer_geojson, municipalities, biogas_result, residuos_data
+
+        async def land_use_branch():
+            if not options.include_mapbiomas:
+                return None, None
 
-        # 3. MapBiomas land use analysis
-        land_use_result = None
-        if request.options.include_mapbiomas:
+            # 3. MapBiomas land use analysis (optionally in a separate process)
+            executor = get_process_pool() if settings.MAPBIOMAS_USE_PROCESS_POOL else None
+            mapbiomas_key = get_mapbiomas_cache_key(lat, lng, radius_km)
             try:
-                mapbiomas_service = MapBiomasService()
-                land_use_result = mapbiomas_service.analyze_buffer(
-                    lat=request.latitude,
-                    lng=request.longitude,
-                    radius_km=request.radius_km
-                )
+                land_use_result = mapbiomas_cache.get(mapbiomas_key)
+                if land_use_result is None:
+                    land_use_result, _ = await mapbiomas_flight.do_async(
+                        mapbiomas_key, _run_stage,
+                        "mapbiomas", stage_timings,
+                        run_buffer_analysis, lat, lng, radius_km,
+                        executor=executor
+                    )
+                    if "error" not in land_use_result:
+                        mapbiomas_cache.set(mapbiomas_key, land_use_result)
             except Exception as e:
                 logger.warning(f"MapBiomas analysis failed: {e}")
-                land_use_result = {
-                    "error": str(e),
-                    "total_area_km2": 0,
-                    "by_class": {},
-                    "dominant_class": "unknown",
-                    "agricultural_percent": 0
-                }
+                land_use_result = _land_use_error(e)
+
+            # 5. Correlate MapBiomas land use with residuos database
+            residuos_correlation = None
+            if land_use_result and options.include_biogas_potential:
+                residuos_correlation = await _run_stage(
+                    "residuos_correlation", stage_timings,
+                    proximity_service.correlate_mapbiomas_residuos,
+                    land_use_data=land_use_result
+                )
+                logger.info(f"Found {residuos_correlation.get('total_potential_sources', 0)} land use to residuos correlations")
 
-        # 4. Infrastructure proximity analysis
-        infrastructure_result = None
-        if request.options.include_infrastructure:
-            infrastructure_result = proximity_service.find_nearest_infrastructure(
-                lat=request.latitude,
-                lng=request.longitude
-            )
+            return land_use_result, residuos_correlation
 
-        # 5. Correlate MapBiomas land use with residuos database
-        residuos_correlation = None
-        if land_use_result and request.options.include_biogas_potential:
-            residuos_correlation = proximity_service.correlate_mapbiomas_residuos(
-                land_use_data=land_use_result
-            )
-            logger.info(f"Found {residuos_correlation.get('total_potential_sources', 0)} land use to residuos correlations")
+        async def infrastructure_branch():
+            if not options.include_infrastructure:
+                return None
 
-        # 6. Get detailed residuos data for analysis context
-        residuos_data = None
-        if municipalities and request.options.include_biogas_potential:
-            muni_names = [m["name"] for m in municipalities]
-            residuos_data = proximity_service.get_residuos_for_municipalities(muni_names)
+            # Nearest infrastructure does not depend on the analysis radius
+            if reusable.get("infrastructure"):
+                return reusable["infrastructure"]
+
+            # 4. Infrastructure proximity analysis (one lookup per type)
+            branch_start = time.perf_counter()
+            results = await asyncio.gather(*[
+                _run_stage(
+                    f"infrastructure.{config['type']}", stage_timings,
+                    proximity_service.find_nearest_infrastructure_of_type,
+                    lat, lng, config
+                )
+                for config in INFRASTRUCTURE_CONFIGS
+            ])
+            stage_timings["infrastructure"] = int((time.perf_counter() - branch_start) * 1000)
+            return list(results)
+
+        # Independent branches run concurrently
+        (
+            (buffer_geojson, municipalities, biogas_result, residuos_data),
+            (land_use_result, residuos_correlation),
+            infrastructure_result
+        ) = await asyncio.gather(
+            municipalities_branch(),
+            land_use_branch(),
+            infrastructure_branch()
+        )
 
         # Calculate summary statistics
         total_population = sum(
@@ -287,7 +468,7 @@ async def analyze_proximity(request: ProximityAnalysisRequest):
         total_energy = biogas_result["energy_potential_mwh_year"] if biogas_result else 0
 
         # Calculate buffer area
-        buffer_area_km2 = 3.14159 * (request.radius_km ** 2)
+        buffer_area_km2 = 3.14159 * (radius_km ** 2)
 
         # Build response
         results = {
@@ -326,7 +507,10 @@ async def analyze_proximity(request: ProximityAnalysisRequest):
             ),
             metadata=AnalysisMetadata(
                 analysis_timestamp=datetime.utcnow().isoformat() + "Z",
-                processing_time_ms=processing_time
+                processing_time_ms=processing_time,
+                stage_timings_ms=stage_timings,
+                snapped_to=snapped_to,
+                derived_from_radius_km=derived_from_radius_km
             )
         )
 
@@ -335,7 +519,11 @@ async def analyze_proximity(request: ProximityAnalysisRequest):
         # Store in cache (Sprint 4: Performance Optimization - 5 min TTL)
         response_dict = response.dict()
         response_dict["from_cache"] = False
-        proximity_cache.set(cache_key, response_dict, ttl=300)
+        proximity_cache.set(
+            cache_key, response_dict, ttl=300,
+            refresh=partial(_refresh_proximity_analysis, request, cache_key, snapped_to)
+        )
+        record_proximity_radius(lat, lng, radius_km)
         
         return response
 
@@ -347,6 +535,67 @@ async def analyze_proximity(request: ProximityAnalysisRequest):
         )
 
 
+async def _refresh_proximity_analysis(
+    request: ProximityAnalysisRequest,
+    cache_key: str,
+    snapped_to: Optional[Dict[str, Any]]
+):
+    """Recompute a hot cached analysis in the background (stale-while-revalidate)"""
+    await proximity_flight.do_async(
+        cache_key, _run_proximity_analysis,
+        request, str(uuid.uuid4()), time.time(), cache_key, snapped_to
+    )
+
+
+async def prewarm_proximity_cache(top_n: int, radii_km: List[float], concurrency: int = 2) -> int:
+    """
+    Compute analyses around the top-N municipalities at standard radii.
+
+    Run as a background task at startup so the first users after a deploy
+    hit a warm cache. Radii run largest first per point, so smaller ones
+    reuse the larger analysis; already cached analyses are skipped.
+
+    Args:
+        top_n: Municipalities to warm (by biogas potential)
+        radii_km: Radii to analyze around each municipality centroid
+        concurrency: Points analyzed at the same time
+
+    Returns:
+        Number of analyses computed
+    """
+    loop = asyncio.get_running_loop()
+    proximity_service = await loop.run_in_executor(get_thread_pool(), ProximityService)
+    centroids = await loop.run_in_executor(
+        get_thread_pool(), proximity_service.get_top_municipality_centroids, top_n
+    )
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def warm_point(point: Dict[str, Any]) -> int:
+        computed = 0
+        async with semaphore:
+            for radius_km in sorted(radii_km, reverse=True):
+                try:
+                    request = ProximityAnalysisRequest(
+                        latitude=point["latitude"], longitude=point["longitude"], radius_km=radius_km
+                    )
+                    analysis_request, snapped_to = _snap_request(request)
+                    cache_key = _cache_key(analysis_request)
+                    if proximity_cache.get(cache_key) is not None:
+                        continue
+                    await proximity_flight.do_async(
+                        cache_key, _run_proximity_analysis,
+                        analysis_request, str(uuid.uuid4()), time.time(), cache_key, snapped_to
+                    )
+                    computed += 1
+                except Exception as e:
+                    logger.warning(f"Prewarm of {point['name']} at {radius_km}km failed: {e}")
+        return computed
+
+    counts = await asyncio.gather(*[warm_point(point) for point in centroids])
+    logger.info(f"Prewarmed {sum(counts)} proximity analyses around {len(centroids)} municipalities")
+    return sum(counts)
+
+
 @router.get(
     "/validate-point",
     summary="Validate Analysis Point",
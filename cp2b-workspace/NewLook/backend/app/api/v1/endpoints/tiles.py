@@ -0,0 +1,125 @@
+"""
+Vector Tile Endpoints
+Mapbox Vector Tiles for municipalities and infrastructure layers
+
+Clients draw what is in view and fetch more as they pan and zoom, instead of
+downloading whole FeatureCollections from the */geojson endpoints first.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+
+from app.api.v1.endpoints.mapbiomas import TILE_CACHE_HEADERS
+from app.core.executors import get_thread_pool
+from app.services.vector_tiles import (
+    MAX_ZOOM,
+    MIN_ZOOM,
+    VECTOR_TILE_LAYERS,
+    get_vector_tile_service,
+)
+from app.utils.mvt import MVT_MEDIA_TYPE
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get(
+    "/layers",
+    summary="List vector tile layers",
+    description="Returns the vector tile layers and the properties each can include"
+)
+async def list_vector_tile_layers():
+    """
+    List vector tile layers
+
+    Layers whose shapefiles are not on the server are reported as unavailable.
+    """
+    service = get_vector_tile_service()
+    loop = asyncio.get_running_loop()
+
+    layers = {}
+    for name in VECTOR_TILE_LAYERS:
+        info = await loop.run_in_executor(get_thread_pool(), service.describe_layer, name)
+        layers[name] = {**info, "url": f"/api/v1/tiles/{name}/{{z}}/{{x}}/{{y}}.mvt"}
+
+    return {"layers": layers, "min_zoom": MIN_ZOOM, "max_zoom": MAX_ZOOM}
+
+
+@router.get(
+    "/{layer}/{z}/{x}/{y}.mvt",
+    summary="Get vector tile",
+    description="Returns a Mapbox Vector Tile with the features of a layer inside the tile"
+)
+async def get_vector_tile(
+    layer: str,
+    z: int,
+    x: int,
+    y: int,
+    properties: Optional[str] = Query(
+        None, description="Comma-separated properties to include (default: all; empty: none)"
+    ),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get a vector tile
+
+    Geometry detail follows the zoom (precomputed simplification levels).
+    The tile layer is named like the URL layer. Empty tiles have no body.
+    Supports conditional requests (ETag / If-None-Match -> 304).
+
+    Args:
+        layer: Tile layer (see /tiles/layers)
+        z: Zoom level (0-18)
+        x: Tile X coordinate
+        y: Tile Y coordinate
+        properties: Properties to include in each feature
+
+    Returns:
+        application/vnd.mapbox-vector-tile response
+    """
+    if layer not in VECTOR_TILE_LAYERS:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown layer. Must be one of: {', '.join(VECTOR_TILE_LAYERS)}"
+        )
+
+    if z < MIN_ZOOM or z > MAX_ZOOM:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Zoom level {z} not supported. Use {MIN_ZOOM}-{MAX_ZOOM}."
+        )
+
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail=f"Tile {z}/{x}/{y} is outside the tile grid")
+
+    selected = None
+    if properties is not None:
+        selected = [p.strip() for p in properties.split(",") if p.strip()]
+
+    try:
+        # Layer loading and tile building block - run them off the event loop
+        loop = asyncio.get_running_loop()
+        data, etag = await loop.run_in_executor(
+            get_thread_pool(), get_vector_tile_service().get_tile, layer, z, x, y, selected
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError:
+        raise HTTPException(status_code=404, detail=f"Layer {layer} data not available on the server")
+    except Exception as e:
+        logger.error(f"Error generating vector tile {layer}/{z}/{x}/{y}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating tile: {str(e)}"
+        )
+
+    headers = {**TILE_CACHE_HEADERS, "ETag": etag}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=data, media_type=MVT_MEDIA_TYPE, headers=headers)
@@ -74,6 +74,48 @@ class Settings(BaseSettings):
     # Rate limiting
     RATE_LIMIT_PER_MINUTE: int = 60
 
+    # Geometry store - load all shapefiles into memory at startup
+    GEOMETRY_PRELOAD: bool = True
+    # Simplification levels (degrees) served to map clients, computed once per layer
+    GEOMETRY_SIMPLIFY_LEVELS_DEG: List[float] = [0.01, 0.003, 0.001, 0.0003]
+    # Decimal places of coordinates in shapefile GeoJSON responses (6 = ~0.1 m)
+    GEOJSON_COORDINATE_PRECISION: int = 6
+
+    # Analysis worker pools
+    ANALYSIS_THREAD_WORKERS: int = 8
+    ANALYSIS_PROCESS_WORKERS: int = 2
+    MAPBIOMAS_USE_PROCESS_POOL: bool = False  # Run raster masking in a separate process
+
+    # Proximity snapping: quantize analysis center/radius so nearby clicks share results
+    PROXIMITY_SNAP_ENABLED: bool = False  # Default when a request does not set options.snap_to_grid
+    PROXIMITY_SNAP_GEOHASH_PRECISION: int = 6  # ~1.2 km x 0.6 km cells
+    PROXIMITY_RADIUS_STEPS_KM: List[float] = [1, 2, 3, 5, 7.5, 10, 15, 20, 25, 30, 40, 50, 75, 100]
+
+    # In-process caches: total memory budget split across the caches
+    CACHE_MEMORY_BUDGET_MB: int = 160
+
+    # Shared (L2) cache behind the per-process LRU caches
+    CACHE_BACKEND: str = "memory"  # memory (per-process only), sqlite (one host), redis
+    CACHE_SQLITE_PATH: Path = Path("/dev/shm/cp2b_cache.sqlite3")
+    REDIS_URL: Optional[str] = None
+
+    # Background cache maintenance (sweep expired entries, refresh hot ones)
+    CACHE_MAINTENANCE_INTERVAL_SECONDS: int = 15
+    CACHE_SOFT_TTL_FRACTION: float = 0.8  # Refresh hot entries after this share of their TTL
+    CACHE_REFRESH_MIN_HITS: int = 2  # Hits before an entry counts as hot
+    CACHE_REFRESH_MAX_PER_RUN: int = 8
+
+    # Warm start: snapshot hot cache entries on shutdown, reload on startup
+    CACHE_SNAPSHOT_ENABLED: bool = True
+    CACHE_SNAPSHOT_PATH: Path = Path(__file__).parent.parent.parent / "data" / "cache_snapshot.bin"
+    CACHE_SNAPSHOT_MAX_ENTRIES: int = 200  # Hottest entries kept per cache
+    DATASET_VERSION: str = "2024.1"  # Bump after reloading database tables to drop snapshots
+
+    # Startup prewarm: analyses around the top-N municipalities (by biogas potential)
+    CACHE_PREWARM_TOP_N: int = 20  # 0 disables
+    CACHE_PREWARM_RADII_KM: List[float] = [10, 20, 30, 50]
+    CACHE_PREWARM_CONCURRENCY: int = 2
+
     # Logging
     LOG_LEVEL: str = "INFO"
 
@@ -0,0 +1,73 @@
+"""
+Worker Pools for Blocking Work
+Shared thread/process pools so GDAL, shapely and psycopg2 calls run off the event loop
+"""
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional
+import logging
+import threading
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Global pools (thread-safe lazy singletons)
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """
+    Get or create the shared thread pool for blocking I/O and GEOS/GDAL work.
+
+    Returns:
+        ThreadPoolExecutor sized by ANALYSIS_THREAD_WORKERS
+    """
+    global _thread_pool
+
+    if _thread_pool is None:
+        with _pool_lock:
+            # Double-check locking pattern
+            if _thread_pool is None:
+                _thread_pool = ThreadPoolExecutor(
+                    max_workers=settings.ANALYSIS_THREAD_WORKERS,
+                    thread_name_prefix="analysis"
+                )
+                logger.info(f"Analysis thread pool started ({settings.ANALYSIS_THREAD_WORKERS} workers)")
+
+    return _thread_pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Get or create the shared process pool for CPU-bound raster work.
+
+    Returns:
+        ProcessPoolExecutor sized by ANALYSIS_PROCESS_WORKERS
+    """
+    global _process_pool
+
+    if _process_pool is None:
+        with _pool_lock:
+            if _process_pool is None:
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=settings.ANALYSIS_PROCESS_WORKERS
+                )
+                logger.info(f"Analysis process pool started ({settings.ANALYSIS_PROCESS_WORKERS} workers)")
+
+    return _process_pool
+
+
+def shutdown_pools():
+    """Shut down worker pools (called on application shutdown)"""
+    global _thread_pool, _process_pool
+
+    with _pool_lock:
+        if _thread_pool is not None:
+            _thread_pool.shutdown(wait=False, cancel_futures=True)
+            _thread_pool = None
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
@@ -3,10 +3,13 @@ CP2B Maps V3 Backend API
 FastAPI application for geospatial biogas potential analysis
 Sprint 4: Performance optimizations, error handling, and production deployment
 """
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import uvicorn
+import asyncio
+import threading
 from datetime import datetime, timezone
 from slowapi.errors import RateLimitExceeded
 
@@ -14,9 +17,53 @@ from app.core.config import settings
 from app.core.database import test_db_connection
 from app.api.v1.api import api_router
 from app.middleware.rate_limiter import rate_limit_middleware
-from app.middleware.response_compression import gzip_middleware
+from app.middleware.response_compression import CompressionMiddleware
 from app.middleware.rate_limit import limiter, rate_limit_exceeded_handler
 from app.services.cache_service import get_all_cache_stats
+from app.services.cache_maintenance import (
+    cache_maintenance,
+    restore_cache_snapshot,
+    persist_cache_snapshot
+)
+from app.api.v1.endpoints.proximity import prewarm_proximity_cache
+from app.services.geometry_store import get_geometry_store
+from app.services.municipality_table import get_municipality_table_store
+from app.core.executors import shutdown_pools
+from app.services.mapbiomas_tiles import close_tile_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks"""
+    # Load shapefile layers in the background so startup is not delayed;
+    # requests arriving earlier load the layers they need on demand
+    if settings.GEOMETRY_PRELOAD:
+        threading.Thread(
+            target=get_geometry_store().preload,
+            name="geometry-preload",
+            daemon=True
+        ).start()
+    # Warm start: reload hot cache entries saved by the previous process
+    restore_cache_snapshot()
+    # Sweep expired cache entries and refresh hot ones in the background
+    cache_maintenance.start()
+    prewarm_task = None
+    if settings.CACHE_PREWARM_TOP_N > 0:
+        prewarm_task = asyncio.create_task(prewarm_proximity_cache(
+            settings.CACHE_PREWARM_TOP_N,
+            settings.CACHE_PREWARM_RADII_KM,
+            settings.CACHE_PREWARM_CONCURRENCY
+        ))
+    yield
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await prewarm_task
+    await cache_maintenance.stop()
+    persist_cache_snapshot()
+    shutdown_pools()
+    close_tile_service()
+
 
 # Create FastAPI app
 app = FastAPI(
@@ -25,6 +72,7 @@ app = FastAPI(
     version="3.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # Register slowapi limiter with FastAPI app
@@ -48,8 +96,8 @@ app.add_middleware(
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
-# 3. Response compression (reduces bandwidth)
-app.middleware("http")(gzip_middleware)
+# 3. Response compression (reduces bandwidth; zstd/br/gzip, streaming-aware)
+app.add_middleware(CompressionMiddleware)
 
 # Trusted host middleware - DISABLED for Railway deployment
 # Railway uses dynamic host headers that don't work well with TrustedHostMiddleware
@@ -139,12 +187,14 @@ async def liveness_check():
 async def cache_statistics():
     """
     Cache performance statistics (Sprint 4)
-    Shows hit rates and cache efficiency
+    Shows hit rates, cache efficiency and background refresh counts
     """
     stats = get_all_cache_stats()
     return {
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "caches": stats
+        "caches": stats,
+        "maintenance": cache_maintenance.get_stats(),
+        "municipality_table": get_municipality_table_store().get_stats()
     }
 
 if __name__ == "__main__":
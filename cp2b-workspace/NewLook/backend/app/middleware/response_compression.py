@@ -1,65 +1,387 @@
 """
 Response Compression Middleware for CP2B Maps V3
-Compress API responses with gzip for faster transmission
+Stream-compress API responses with zstd, brotli or gzip
 Sprint 4: Task 4.1 - Performance Optimization
+
+Pure ASGI middleware, so streamed responses (GeoJSON) are compressed chunk
+by chunk instead of being buffered. The codec is negotiated from the
+Accept-Encoding q-values; large bodies are compressed in the shared thread
+pool, and bodies carrying an ETag are compressed once and then served from
+cache_service.compressed_response_cache.
+
+A strong ETag must differ per content-coding, so compressed responses
+carry the endpoint's ETag with a coding suffix ("abc" -> "abc-gzip").
+If-None-Match tags with a suffix are also passed to the endpoint in their
+plain form, so endpoints keep comparing against their own ETag.
 """
 
-from fastapi import Request
-from fastapi.responses import Response
-import gzip
+import asyncio
 import logging
+import zlib
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.executors import get_thread_pool
+from app.services.cache_service import compressed_response_cache
+
+# Optional codecs - gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
+# Compression levels tuned for on-the-fly compression
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Content-codings this middleware can produce (ETag suffixes)
+ENCODINGS = ("zstd", "br", "gzip")
+
+# Server preference when the client weights several codecs equally
+ENCODING_PREFERENCE = [
+    name for name, available in (("zstd", zstandard is not None), ("br", brotli is not None), ("gzip", True))
+    if available
+]
+
+# Responses smaller than this are sent as-is (>1KB)
+MINIMUM_SIZE = 1024
+
+# Bodies (or streamed chunks) larger than this are compressed off the event loop
+OFFLOAD_SIZE = 256 * 1024
+
+# Largest compressed body kept in the ETag-keyed cache
+MAX_CACHED_SIZE = 16 * 1024 * 1024
+
+# Media that is already compressed (PNG tiles, archives) or must not be delayed
+UNCOMPRESSIBLE_TYPES = (
+    "image/png",
+    "image/jpeg",
+    "image/webp",
+    "image/gif",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+    "application/octet-stream",
+    "text/event-stream",
+)
+
+
+class _StreamCompressor:
+    """Incremental compressor with a common compress/finish interface"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """Compress a complete body with the given content-coding"""
+    compressor = _StreamCompressor(encoding)
+    return compressor.compress(body) + compressor.finish()
 
-async def gzip_middleware(request: Request, call_next):
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """ETag of the encoded representation ("abc" -> "abc-gzip", W/"abc" -> W/"abc-gzip")"""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def identity_etags(if_none_match: str) -> str:
+    """If-None-Match with every encoded tag also listed in its plain form"""
+    tags = [tag.strip() for tag in if_none_match.split(",") if tag.strip()]
+    plain = []
+    for tag in tags:
+        for encoding in ENCODINGS:
+            suffix = f'-{encoding}"'
+            if tag.endswith(suffix):
+                plain.append(f'{tag[:-len(suffix)]}"')
+                break
+    return ", ".join(tags + [tag for tag in plain if tag not in tags])
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
     """
-    Compress responses if client supports gzip encoding
-    
-    Compresses responses > 1KB to reduce bandwidth usage
+    Parse an Accept-Encoding header into {coding: q-value}
+
+    Malformed q-values are treated as q=0 (not acceptable).
     """
-    response = await call_next(request)
-    
-    # Check if client accepts gzip
-    accept_encoding = request.headers.get("accept-encoding", "")
-    
-    if "gzip" not in accept_encoding:
-        return response
-    
-    # Only compress if response is large enough (>1KB) and not already compressed
-    if (
-        hasattr(response, "body") 
-        and len(response.body) > 1024 
-        and "content-encoding" not in response.headers
+    weights = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    return weights
+
+
+def select_encoding(header: str, available=None) -> Optional[str]:
+    """
+    Pick the content-coding to use for a request
+
+    Args:
+        header: Accept-Encoding request header
+        available: Codecs in server preference order (defaults to installed ones)
+
+    Returns:
+        Content-coding name, or None to send the body uncompressed
+    """
+    if not header:
+        return None
+
+    available = ENCODING_PREFERENCE if available is None else available
+    weights = parse_accept_encoding(header)
+    wildcard = weights.get("*", 0.0)
+
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, wildcard)
+        # Strictly greater keeps the server preference on ties
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compress HTTP responses with the best codec the client accepts
+
+    Responses are passed through untouched when they are small, already
+    encoded, of an uncompressible media type, or marked no-transform.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = MINIMUM_SIZE,
+        offload_size: int = OFFLOAD_SIZE
     ):
-        try:
-            # Compress response body
-            compressed_body = gzip.compress(response.body, compresslevel=6)
-            
-            # Calculate compression ratio
-            original_size = len(response.body)
-            compressed_size = len(compressed_body)
-            ratio = (1 - compressed_size / original_size) * 100
-            
-            logger.debug(
-                f"Compressed response: {original_size}B → {compressed_size}B "
-                f"({ratio:.1f}% reduction)"
-            )
-            
-            # Update response
-            response.headers["Content-Encoding"] = "gzip"
-            response.headers["Content-Length"] = str(compressed_size)
-            
-            # Create new response with compressed body
-            return Response(
-                content=compressed_body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.media_type
-            )
-        except Exception as e:
-            logger.error(f"Compression failed: {e}")
-            return response
-    
-    return response
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match:
+            scope = _with_header(scope, b"if-none-match", identity_etags(if_none_match).encode("latin-1"))
+
+        encoding = select_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(
+            send, encoding, self.minimum_size, self.offload_size, scope["path"], if_none_match
+        )
+        await self.app(scope, receive, responder.send)
+
+
+def _with_header(scope: Scope, name: bytes, value: bytes) -> Scope:
+    """Copy of scope with one request header replaced"""
+    headers = [(key, val) for key, val in scope["headers"] if key.lower() != name]
+    return {**scope, "headers": headers + [(name, value)]}
+
+
+class _CompressionResponder:
+    """Per-response state: waits for the first body chunk, then picks a mode"""
+
+    def __init__(
+        self,
+        send: Send,
+        encoding: str,
+        minimum_size: int,
+        offload_size: int,
+        path: str = "",
+        if_none_match: Optional[str] = None
+    ):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.path = path
+        self.if_none_match = if_none_match or ""
+
+        self.start_message: Optional[Message] = None
+        self.mode: Optional[str] = None  # "identity", "stream" or "cached"
+        self.compressor: Optional[_StreamCompressor] = None
+        self.cache_key: Optional[str] = None
+        self.cache_parts: Optional[list] = None
+        self.cache_size = 0
+
+    async def send(self, message: Message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # Hold the headers until we know whether the body gets compressed
+            self.start_message = message
+            return
+
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.mode is None:
+            await self._start(message)
+        elif self.mode == "identity":
+            await self._send(message)
+        elif self.mode == "stream":
+            await self._stream(message)
+        # "cached": the body was already sent from cache; drain the rest
+
+    async def _start(self, message: Message):
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+
+        if not self._should_compress(headers, body, more_body):
+            if self.start_message["status"] == 304:
+                self._revalidated_etag(headers)
+            self.mode = "identity"
+            await self._send(self.start_message)
+            await self._send(message)
+            return
+
+        etag = headers.get("etag")
+        if etag:
+            # Scoped by path: two endpoints may use the same ETag string
+            self.cache_key = f"{self.encoding}:{self.path}:{etag}"
+            cached = compressed_response_cache.get(self.cache_key)
+            if cached is not None:
+                self.mode = "cached"
+                self._set_encoding_headers(headers, len(cached))
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": cached, "more_body": False})
+                return
+            self.cache_parts = []
+
+        self.compressor = _StreamCompressor(self.encoding)
+
+        if not more_body:
+            # Complete body: compress in one go and keep Content-Length
+            compressed = await self._compress(body, finish=True)
+            self._remember(compressed, finished=True)
+            self.mode = "identity"
+            self._set_encoding_headers(headers, len(compressed))
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": compressed, "more_body": False})
+            return
+
+        self.mode = "stream"
+        self._set_encoding_headers(headers, None)
+        await self._send(self.start_message)
+        await self._stream(message)
+
+    async def _stream(self, message: Message):
+        more_body = message.get("more_body", False)
+        compressed = await self._compress(message.get("body", b""), finish=not more_body)
+        self._remember(compressed, finished=not more_body)
+
+        # Brotli/zstd buffer internally; skip empty intermediate chunks
+        if compressed or not more_body:
+            await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    def _should_compress(self, headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        status = self.start_message["status"]
+        if status < 200 or status in (204, 304):
+            return False
+        if "content-encoding" in headers:
+            return False
+        if "no-transform" in headers.get("cache-control", "").lower():
+            return False
+
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type.startswith(("video/", "audio/")) or content_type in UNCOMPRESSIBLE_TYPES:
+            return False
+
+        return more_body or len(body) >= self.minimum_size
+
+    async def _compress(self, data: bytes, finish: bool) -> bytes:
+        if len(data) < self.offload_size:
+            return self._compress_sync(data, finish)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_thread_pool(), self._compress_sync, data, finish)
+
+    def _compress_sync(self, data: bytes, finish: bool) -> bytes:
+        compressed = self.compressor.compress(data) if data else b""
+        if finish:
+            compressed += self.compressor.finish()
+        return compressed
+
+    def _remember(self, compressed: bytes, finished: bool):
+        """Collect compressed output for the ETag cache (bounded by MAX_CACHED_SIZE)"""
+        if self.cache_parts is None:
+            return
+
+        self.cache_size += len(compressed)
+        if self.cache_size > MAX_CACHED_SIZE:
+            self.cache_parts = None
+            return
+
+        self.cache_parts.append(compressed)
+        if finished:
+            compressed_response_cache.set(self.cache_key, b"".join(self.cache_parts))
+            self.cache_parts = None
+
+    def _revalidated_etag(self, headers: MutableHeaders):
+        """On 304, echo the encoded ETag if that is the one the client revalidated"""
+        etag = headers.get("etag")
+        if etag:
+            encoded = encoded_etag(etag, self.encoding)
+            if encoded in [tag.strip() for tag in self.if_none_match.split(",")]:
+                headers["ETag"] = encoded
 
+    def _set_encoding_headers(self, headers: MutableHeaders, content_length: Optional[int]):
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag:
+            headers["ETag"] = encoded_etag(etag, self.encoding)
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
@@ -0,0 +1,395 @@
+"""
+Shared Cache Backends for CP2B Maps V3
+Second-tier (L2) stores behind the in-process LRUCache
+
+With several uvicorn/gunicorn workers each process keeps its own LRUCache
+(L1). An L2 backend is shared by all workers so a result computed by one
+worker is a hit for the others:
+
+- MemoryBackend: in-process dict (single worker, tests)
+- SQLiteBackend: SQLite file on tmpfs (/dev/shm), shared by workers on one host
+- RedisBackend: any Redis-protocol server, shared across hosts
+
+Values cross process boundaries as bytes: raw bytes are stored as-is and
+everything else as JSON. No pickle, so a poisoned shared store cannot run
+code in the API process.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+from app.core.config import settings
+
+# Optional Redis client
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Prefix for every key written to a shared store
+L2_KEY_PREFIX = "cp2b:"
+
+# Payload header: absolute expiry (unix time)
+_HEADER = struct.Struct(">d")
+
+# Format tag leading every serialized value
+_FORMAT_BYTES = b"b"
+_FORMAT_JSON = b"j"
+
+
+def _json_default(value: Any):
+    """JSON fallback for numpy scalars/arrays and dates"""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def serialize_value(value: Any) -> bytes:
+    """
+    Serialize a cache value to bytes (raw bytes as-is, everything else as JSON)
+
+    Raises:
+        TypeError: If the value is neither bytes nor JSON-serializable
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return _FORMAT_BYTES + bytes(value)
+    return _FORMAT_JSON + json.dumps(value, default=_json_default, separators=(",", ":")).encode()
+
+
+def deserialize_value(data: bytes) -> Any:
+    """Inverse of serialize_value"""
+    if data[:1] == _FORMAT_BYTES:
+        return bytes(data[1:])
+    return json.loads(data[1:])
+
+
+def encode_entry(value: Any, expires_at: float) -> bytes:
+    """
+    Serialize a cache value and its expiry for a shared store
+
+    Raises:
+        TypeError: If the value is neither bytes nor JSON-serializable
+    """
+    return pack_entry(serialize_value(value), expires_at)
+
+
+def pack_entry(serialized: bytes, expires_at: float) -> bytes:
+    """Prefix an already serialized value with its expiry"""
+    return _HEADER.pack(expires_at) + serialized
+
+
+def decode_entry(payload: bytes) -> Tuple[Any, float]:
+    """Deserialize a payload written by encode_entry into (value, expires_at)"""
+    (expires_at,) = _HEADER.unpack_from(payload)
+    return deserialize_value(payload[_HEADER.size:]), expires_at
+
+
+class CacheBackend(ABC):
+    """
+    Interface for L2 stores
+
+    Keys are strings, values are encoded payloads. Implementations expire
+    entries themselves; LRUCache also checks the expiry in the payload.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a payload, or None if missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, payload: bytes, ttl: int):
+        """Store a payload for ttl seconds"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Delete one key"""
+
+    @abstractmethod
+    def clear(self, prefix: str):
+        """Delete every key starting with prefix"""
+
+    def update(self, key: str, apply: Callable[[Optional[bytes]], bytes], ttl: int) -> bytes:
+        """
+        Replace a payload with apply(current payload or None) and return it
+
+        This default is a plain get then set; backends override it to make
+        the read-modify-write atomic across workers. apply may be called
+        more than once and must not have side effects.
+        """
+        payload = apply(self.get(key))
+        self.set(key, payload, ttl)
+        return payload
+
+    def get_stats(self) -> dict:
+        return {"type": self.name}
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """In-process store (stand-in for a shared backend in one process)"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, payload: bytes, ttl: int):
+        with self._lock:
+            self._put(key, payload, ttl)
+
+    def _put(self, key: str, payload: bytes, ttl: int):
+        """Store a payload (caller holds the lock)"""
+        self._data.pop(key, None)
+        while len(self._data) >= self.max_entries:
+            self._data.popitem(last=False)
+        self._data[key] = (payload, time.time() + ttl)
+
+    def update(self, key: str, apply: Callable[[Optional[bytes]], bytes], ttl: int) -> bytes:
+        with self._lock:
+            item = self._data.get(key)
+            current = item[0] if item is not None and item[1] > time.time() else None
+            payload = apply(current)
+            self._put(key, payload, ttl)
+        return payload
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"type": self.name, "size": len(self._data)}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    SQLite store shared by worker processes on one host
+
+    Put the file on tmpfs (/dev/shm) so it lives in memory. Each process
+    opens its own connection (reopened after fork); threads share it
+    behind a lock, as MBTilesStore does.
+    """
+
+    name = "sqlite"
+
+    # Purge expired rows / trim to max_entries every N writes
+    PURGE_EVERY = 200
+
+    def __init__(self, path: Path, max_entries: int = 20000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # timeout waits on other workers' write locks
+            conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB,
+                    expires_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at)")
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, payload: bytes, ttl: int):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(payload), time.time() + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(conn)
+            conn.commit()
+
+    def update(self, key: str, apply: Callable[[Optional[bytes]], bytes], ttl: int) -> bytes:
+        with self._lock:
+            conn = self._connect()
+            # Take the write lock before reading so other workers' updates wait
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time())
+                ).fetchone()
+                payload = apply(bytes(row[0]) if row else None)
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, sqlite3.Binary(payload), time.time() + ttl)
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return payload
+
+    def _purge(self, conn: sqlite3.Connection):
+        """Drop expired rows, then the soonest-expiring rows above max_entries"""
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)",
+                (excess,)
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            conn.commit()
+
+    def clear(self, prefix: str):
+        with self._lock:
+            conn = self._connect()
+            # substr comparison avoids LIKE wildcards in the prefix
+            conn.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            conn.commit()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            size = self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {"type": self.name, "size": size, "path": str(self.path)}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisBackend(CacheBackend):
+    """
+    Store on a Redis-protocol server (Redis, Valkey, KeyDB, ...)
+
+    Accepts any client with the redis-py get/set/delete/scan_iter methods,
+    so tests can pass a local fake.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("redis package is not installed")
+            # Short timeouts: a slow L2 must not be slower than recomputing
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, payload: bytes, ttl: int):
+        self.client.set(key, payload, ex=max(1, int(ttl)))
+
+    def update(self, key: str, apply: Callable[[Optional[bytes]], bytes], ttl: int) -> bytes:
+        if not hasattr(self.client, "transaction"):
+            return super().update(key, apply, ttl)
+
+        def write(pipe) -> bytes:
+            # WATCHed read; the transaction is retried if another worker wrote key meanwhile
+            payload = apply(pipe.get(key))
+            pipe.multi()
+            pipe.set(key, payload, ex=max(1, int(ttl)))
+            return payload
+
+        return self.client.transaction(write, key, value_from_callable=True)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def clear(self, prefix: str):
+        keys = []
+        for key in self.client.scan_iter(match=f"{prefix}*", count=500):
+            keys.append(key)
+            if len(keys) >= 500:
+                self.client.delete(*keys)
+                keys = []
+        if keys:
+            self.client.delete(*keys)
+
+
+def get_shared_backend() -> Optional[CacheBackend]:
+    """
+    Create the L2 backend selected by settings.CACHE_BACKEND
+
+    Returns:
+        Backend instance, or None for "memory" (per-process L1 only)
+    """
+    backend = settings.CACHE_BACKEND.lower()
+
+    if backend == "memory":
+        return None
+
+    if backend == "sqlite":
+        return SQLiteBackend(settings.CACHE_SQLITE_PATH)
+
+    if backend == "redis":
+        if not settings.REDIS_URL:
+            logger.warning("CACHE_BACKEND=redis but REDIS_URL is not set - using per-process cache")
+            return None
+        try:
+            return RedisBackend(settings.REDIS_URL)
+        except RuntimeError as e:
+            logger.warning(f"Redis cache backend unavailable ({e}) - using per-process cache")
+            return None
+
+    logger.warning(f"Unknown CACHE_BACKEND '{settings.CACHE_BACKEND}' - using per-process cache")
+    return None
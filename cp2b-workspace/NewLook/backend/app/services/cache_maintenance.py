@@ -0,0 +1,210 @@
+"""
+Background Cache Maintenance for CP2B Maps V3
+Periodic sweep of expired entries and stale-while-revalidate refreshes
+
+Started and stopped by the application lifespan (app/main.py). Every
+CACHE_MAINTENANCE_INTERVAL_SECONDS it:
+1. Removes expired entries from every cache (frees memory without waiting
+   for the key to be requested again)
+2. Refreshes hot entries past their soft TTL, so busy analysis points are
+   recomputed in the background instead of on the request path
+3. Runs the periodic hooks (e.g. reloading the municipality table when the
+   database table changed)
+
+Across restarts, restore_cache_snapshot/persist_cache_snapshot carry the
+hottest entries over, stamped with get_dataset_version().
+"""
+
+import asyncio
+import hashlib
+import inspect
+import logging
+import time
+from typing import Any, Callable, List, Optional
+
+from app.core.config import settings
+from app.core.executors import get_thread_pool
+from app.services.cache_service import (
+    LRUCache,
+    proximity_cache,
+    mapbiomas_cache,
+    municipality_cache,
+    tile_cache,
+    compressed_response_cache,
+    geometry_cache,
+    save_cache_snapshot,
+    load_cache_snapshot
+)
+from app.services.geometry_store import SHAPEFILE_DIR
+from app.services.mapbiomas_service import RASTER_PATH, ZONAL_INDEX_PATH
+from app.services.municipality_table import get_municipality_table_store
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMaintenance:
+    """Periodic asyncio task sweeping and refreshing a set of caches"""
+
+    def __init__(
+        self,
+        caches: List[LRUCache],
+        interval_seconds: int = 15,
+        min_hits: int = 2,
+        max_refreshes_per_run: int = 8,
+        periodic: Optional[List[Callable[[], Any]]] = None
+    ):
+        self.caches = caches
+        self.periodic = periodic or []
+        self.interval_seconds = interval_seconds
+        self.min_hits = min_hits
+        self.max_refreshes_per_run = max_refreshes_per_run
+        self._task: Optional[asyncio.Task] = None
+
+        # Statistics
+        self.runs = 0
+        self.expired_removed = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.last_run_at: Optional[float] = None
+        self.last_run_ms: Optional[int] = None
+
+    async def run_once(self) -> dict:
+        """
+        Sweep expired entries, then refresh stale hot entries
+
+        Returns:
+            Dict with expired_removed, refreshed and failed counts for this run
+        """
+        run_start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        removed = 0
+        for cache in self.caches:
+            removed += await loop.run_in_executor(get_thread_pool(), cache.cleanup_expired)
+
+        jobs = []
+        for cache in self.caches:
+            budget = self.max_refreshes_per_run - len(jobs)
+            if budget <= 0:
+                break
+            for key, refresh in cache.claim_refreshes(self.min_hits, limit=budget):
+                jobs.append(self._refresh(cache, key, refresh))
+
+        outcomes = await asyncio.gather(*jobs)
+
+        for hook in self.periodic:
+            try:
+                await loop.run_in_executor(get_thread_pool(), hook)
+            except Exception as e:
+                logger.warning(f"Periodic maintenance hook {getattr(hook, '__name__', hook)} failed: {e}")
+        refreshed = sum(1 for ok in outcomes if ok)
+        failed = len(outcomes) - refreshed
+
+        self.runs += 1
+        self.expired_removed += removed
+        self.refreshes += refreshed
+        self.refresh_failures += failed
+        self.last_run_at = time.time()
+        self.last_run_ms = int((time.perf_counter() - run_start) * 1000)
+
+        if removed or outcomes:
+            logger.info(f"Cache maintenance: {removed} expired removed, {refreshed} refreshed, {failed} failed")
+
+        return {"expired_removed": removed, "refreshed": refreshed, "failed": failed}
+
+    async def _refresh(self, cache: LRUCache, key: str, refresh: Callable[[], Any]) -> bool:
+        """Run one refresh callable (async inline, blocking in the thread pool)"""
+        try:
+            if inspect.iscoroutinefunction(refresh):
+                await refresh()
+            else:
+                await asyncio.get_running_loop().run_in_executor(get_thread_pool(), refresh)
+        except Exception as e:
+            logger.warning(f"Background refresh of {key} failed: {e}")
+            cache.record_refresh(False)
+            return False
+        cache.record_refresh(True)
+        return True
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Cache maintenance run failed: {e}")
+
+    def start(self):
+        """Start the periodic task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+            logger.info(f"Cache maintenance started (every {self.interval_seconds}s)")
+
+    async def stop(self):
+        """Cancel the periodic task and wait for it to finish"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "expired_removed": self.expired_removed,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "last_run_at": self.last_run_at,
+            "last_run_ms": self.last_run_ms
+        }
+
+
+# Global maintenance task over all in-process caches
+cache_maintenance = CacheMaintenance(
+    [proximity_cache, mapbiomas_cache, municipality_cache, tile_cache, compressed_response_cache, geometry_cache],
+    interval_seconds=settings.CACHE_MAINTENANCE_INTERVAL_SECONDS,
+    min_hits=settings.CACHE_REFRESH_MIN_HITS,
+    max_refreshes_per_run=settings.CACHE_REFRESH_MAX_PER_RUN,
+    periodic=[get_municipality_table_store().refresh_if_changed]
+)
+
+
+def get_dataset_version() -> str:
+    """
+    Stamp of the data cached results are computed from
+
+    Combines DATASET_VERSION (bumped by hand after database reloads), the
+    API version and the size/mtime of the shapefiles and MapBiomas files,
+    so replacing any of them invalidates older snapshots.
+    """
+    parts = [settings.DATASET_VERSION, settings.VERSION]
+    files = sorted(SHAPEFILE_DIR.glob("*.shp")) if SHAPEFILE_DIR.exists() else []
+    for path in [*files, RASTER_PATH, ZONAL_INDEX_PATH]:
+        if path.exists():
+            stat = path.stat()
+            parts.append(f"{path.name}:{stat.st_size}:{int(stat.st_mtime)}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+def restore_cache_snapshot() -> int:
+    """Reload the warm-start snapshot if enabled (startup)"""
+    if not settings.CACHE_SNAPSHOT_ENABLED:
+        return 0
+    return load_cache_snapshot(settings.CACHE_SNAPSHOT_PATH, get_dataset_version())
+
+
+def persist_cache_snapshot() -> int:
+    """Write the warm-start snapshot if enabled (shutdown)"""
+    if not settings.CACHE_SNAPSHOT_ENABLED:
+        return 0
+    try:
+        return save_cache_snapshot(
+            settings.CACHE_SNAPSHOT_PATH, get_dataset_version(), settings.CACHE_SNAPSHOT_MAX_ENTRIES
+        )
+    except OSError as e:
+        logger.warning(f"Could not write cache snapshot to {settings.CACHE_SNAPSHOT_PATH}: {e}")
+        return 0
@@ -5,76 +5,263 @@ Sprint 4: Task 4.1 - Performance Optimization
 
 Thread-safe implementation using locks for concurrent access.
 
-Production note: Replace with Redis for multi-server deployments
+Memory: every cache is bounded by entry count and by estimated bytes
+(CACHE_MEMORY_BUDGET_MB split across the caches), so bursts of large
+proximity responses cannot grow the process without limit.
+
+Multi-worker deployments: set CACHE_BACKEND=sqlite (one host) or redis so
+the proximity/MapBiomas/municipality caches share an L2 store across
+workers (see cache_backends).
+
+Stale-while-revalidate: entries stored with a refresh callable get a soft
+TTL (CACHE_SOFT_TTL_FRACTION of the TTL). Once a hot entry passes it, the
+background maintenance task (cache_maintenance) recomputes it while
+requests keep getting the current value until the hard TTL.
+
+Warm start: save_cache_snapshot/load_cache_snapshot write the hottest
+entries to a local file on shutdown and reload them on startup, stamped
+with a dataset version so results computed from older data are dropped.
 """
 
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from collections import OrderedDict
+from pathlib import Path
+import asyncio
 import hashlib
 import json
 import logging
+import os
+import sys
 import threading
+import time
+import zlib
+
+from app.core.config import settings
+from app.services.cache_backends import (
+    L2_KEY_PREFIX,
+    CacheBackend,
+    decode_entry,
+    deserialize_value,
+    encode_entry,
+    pack_entry,
+    serialize_value,
+    get_shared_backend,
+)
+
+# Optional zstd codec for compressed entries (falls back to zlib)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
+# Seconds to stop using an L2 backend after it fails (e.g. Redis down)
+L2_RETRY_AFTER = 30
+
+# Lock stripes per cache; small caches use fewer so each shard keeps >= 16 entries
+DEFAULT_SHARDS = 8
+MIN_SHARD_SIZE = 16
+
+# Values serializing to less than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+MB = 1024 * 1024
+
+_CODEC_ZSTD = b"z"
+_CODEC_ZLIB = b"d"
+
+
+def compress_value(data: bytes) -> bytes:
+    """Compress serialized bytes with zstd (level 3) or zlib (level 1)"""
+    if zstandard is not None:
+        return _CODEC_ZSTD + zstandard.compress(data, 3)
+    return _CODEC_ZLIB + zlib.compress(data, 1)
+
+
+def decompress_value(blob: bytes) -> bytes:
+    """Inverse of compress_value"""
+    if blob[:1] == _CODEC_ZSTD:
+        return zstandard.decompress(blob[1:])
+    return zlib.decompress(blob[1:])
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Estimate the memory held by a cached value in bytes
+
+    Walks dicts, lists, tuples and sets; numpy arrays count their buffer.
+    Shared/interned objects are counted every time they appear, so this
+    errs on the high side.
+    """
+    size = sys.getsizeof(value)
+    if _depth > 32:
+        return size
+
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _depth + 1) for v in value)
+    elif hasattr(value, "nbytes"):
+        size += int(value.nbytes)
+
+    return size
+
 
 class CacheEntry:
-    """Single cache entry with expiration"""
-    
-    def __init__(self, value: Any, ttl_seconds: int):
+    """Single cache entry with expiration (hard TTL) and optional refresh (soft TTL)"""
+
+    def __init__(
+        self,
+        value: Any,
+        ttl_seconds: float,
+        size: int = 0,
+        compressed: bool = False,
+        refresh: Optional[Callable[[], Any]] = None
+    ):
         self.value = value
+        self.size = size
+        self.compressed = compressed
         self.created_at = datetime.now()
         self.expires_at = self.created_at + timedelta(seconds=ttl_seconds)
-    
+        self.refresh = refresh
+        self.refresh_at = self.created_at + timedelta(seconds=ttl_seconds * settings.CACHE_SOFT_TTL_FRACTION)
+        self.refreshing = False
+        self.hits = 0
+
     def is_expired(self) -> bool:
         return datetime.now() > self.expires_at
-    
+
+    def is_stale(self) -> bool:
+        """Past the soft TTL - still served, due for revalidation"""
+        return datetime.now() >= self.refresh_at
+
     def get_age_seconds(self) -> int:
         return int((datetime.now() - self.created_at).total_seconds())
 
 
+class _Shard:
+    """One lock-protected LRU slice of an LRUCache"""
+
+    def __init__(self, max_size: int, max_bytes: Optional[int]):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.cache: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.lock = threading.Lock()
+        # Serializes update() read-modify-writes; get/set take lock themselves
+        self.update_lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def remove(self, key: str):
+        """Drop an entry (caller holds the lock)"""
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def insert(self, key: str, entry: CacheEntry):
+        """Insert and evict least recently used entries over budget (caller holds the lock)"""
+        self.remove(key)
+        self.cache[key] = entry
+        self.bytes += entry.size
+
+        while len(self.cache) > self.max_size or (
+            self.max_bytes is not None and self.bytes > self.max_bytes and len(self.cache) > 1
+        ):
+            oldest_key = next(iter(self.cache))
+            self.remove(oldest_key)
+            self.evictions += 1
+            logger.debug(f"Cache eviction: {oldest_key}")
+
+
 class LRUCache:
     """
     Thread-safe LRU (Least Recently Used) Cache with TTL
 
     Features:
     - Automatic expiration (TTL)
-    - Max size limit (evicts oldest)
-    - Cache hit/miss tracking
-    - Thread-safe operations via lock
+    - Max size limit by entry count and by estimated bytes (evicts oldest)
+    - Cache hit/miss tracking and memory reporting
+    - Thread-safe operations via striped locks
+    - Optional compression of stored values (zstd, zlib fallback)
+    - Optional shared L2 backend (two-tier lookup: local L1, shared L2)
 
     Thread Safety:
-    All cache operations are protected by a threading.Lock() to ensure
-    safe concurrent access in multi-threaded FastAPI environment.
+    Keys are hashed onto independent shards, each with its own
+    threading.Lock(), so concurrent requests for different keys do not
+    serialize on one lock. LRU order and budgets are kept per shard.
+    L2 calls and (de)compression run outside the locks; L2 failures
+    count as misses.
     """
 
-    def __init__(self, max_size: int = 1000, default_ttl: int = 300):
+    def __init__(
+        self,
+        max_size: int = 1000,
+        default_ttl: int = 300,
+        name: Optional[str] = None,
+        backend: Optional[CacheBackend] = None,
+        max_bytes: Optional[int] = None,
+        shards: int = DEFAULT_SHARDS,
+        compress: bool = False
+    ):
         """
         Args:
             max_size: Maximum number of entries
             default_ttl: Time-to-live in seconds (default: 5 minutes)
+            name: Namespace for keys in the shared backend (required with backend)
+            backend: Shared L2 store; None keeps the cache per-process
+            max_bytes: Memory budget in estimated bytes (None = count limit only)
+            shards: Number of lock stripes
+            compress: Store JSON/bytes values compressed (>= COMPRESS_MIN_BYTES)
         """
         self.max_size = max_size
         self.default_ttl = default_ttl
-        self.cache: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.name = name
+        self.backend = backend if name else None
+
+        # Thread safety: per-shard locks, never more entries than max_size in total
+        shard_count = max(1, min(shards, max_size // MIN_SHARD_SIZE))
+        shard_bytes = max_bytes // shard_count if max_bytes is not None else None
+        self._shards = [_Shard(max_size // shard_count, shard_bytes) for _ in range(shard_count)]
+        self._stats_lock = threading.Lock()
+
+        # Statistics (hits/misses/evictions are kept per shard)
+        self.l2_hits = 0
+        self.l2_errors = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self._l2_retry_at = 0.0
+
+    @property
+    def hits(self) -> int:
+        return sum(shard.hits for shard in self._shards)
+
+    @property
+    def misses(self) -> int:
+        return sum(shard.misses for shard in self._shards)
+
+    @property
+    def evictions(self) -> int:
+        return sum(shard.evictions for shard in self._shards)
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
 
-        # Thread safety
-        self._lock = threading.Lock()
-
-        # Statistics
-        self.hits = 0
-        self.misses = 0
-        self.evictions = 0
-    
     def _generate_key(self, prefix: str, **kwargs) -> str:
         """
         Generate cache key from parameters
-        
+
         Args:
             prefix: Cache key prefix (e.g., "proximity", "mapbiomas")
             **kwargs: Parameters to include in key
-            
+
         Returns:
             Hash-based cache key
         """
@@ -82,36 +269,62 @@ class LRUCache:
         params = json.dumps(kwargs, sort_keys=True)
         hash_value = hashlib.sha256(f"{prefix}:{params}".encode()).hexdigest()[:16]
         return f"{prefix}:{hash_value}"
-    
+
     def get(self, key: str) -> Optional[Any]:
         """
         Get value from cache (thread-safe)
 
+        Looks in the local LRU first, then in the shared backend; L2 hits
+        are copied into the local LRU for their remaining TTL.
+
         Returns:
             Cached value if exists and not expired, None otherwise
         """
-        with self._lock:
-            if key not in self.cache:
-                self.misses += 1
-                return None
-
-            entry = self.cache[key]
-
-            # Check expiration
-            if entry.is_expired():
-                del self.cache[key]
-                self.misses += 1
-                logger.debug(f"Cache expired: {key}")
-                return None
-
-            # Move to end (mark as recently used)
-            self.cache.move_to_end(key)
-            self.hits += 1
-
+        shard = self._shard(key)
+
+        with shard.lock:
+            entry = shard.cache.get(key)
+            if entry is not None:
+                if entry.is_expired():
+                    shard.remove(key)
+                    logger.debug(f"Cache expired: {key}")
+                    entry = None
+                else:
+                    # Move to end (mark as recently used)
+                    shard.cache.move_to_end(key)
+                    shard.hits += 1
+                    entry.hits += 1
+
+        if entry is not None:
             logger.debug(f"Cache hit: {key} (age: {entry.get_age_seconds()}s)")
+            if entry.compressed:
+                return deserialize_value(decompress_value(entry.value))
             return entry.value
-    
-    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+
+        payload = self._l2_call("get", self._l2_key(key)) if self._l2_available() else None
+        if payload is not None:
+            value, expires_at = decode_entry(payload)
+            remaining = expires_at - time.time()
+            if remaining > 0:
+                self._set_local(key, value, remaining)
+                with shard.lock:
+                    shard.hits += 1
+                with self._stats_lock:
+                    self.l2_hits += 1
+                logger.debug(f"Cache L2 hit: {key}")
+                return value
+
+        with shard.lock:
+            shard.misses += 1
+        return None
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int] = None,
+        refresh: Optional[Callable[[], Any]] = None
+    ):
         """
         Store value in cache (thread-safe)
 
@@ -119,104 +332,621 @@ class LRUCache:
             key: Cache key
             value: Value to store
             ttl: Time-to-live in seconds (overrides default)
+            refresh: Zero-argument callable (plain or async) that recomputes
+                the value and stores it again; enables background refresh
+                of this entry once it is hot and past its soft TTL
         """
-        with self._lock:
-            # Remove existing entry if present
-            if key in self.cache:
-                del self.cache[key]
-
-            # Evict oldest if at capacity
-            if len(self.cache) >= self.max_size:
-                oldest_key = next(iter(self.cache))
-                del self.cache[oldest_key]
-                self.evictions += 1
-                logger.debug(f"Cache eviction: {oldest_key}")
-
-            # Add new entry
-            ttl_seconds = ttl if ttl is not None else self.default_ttl
-            self.cache[key] = CacheEntry(value, ttl_seconds)
-
-            logger.debug(f"Cache set: {key} (TTL: {ttl_seconds}s)")
-    
+        ttl_seconds = ttl if ttl is not None else self.default_ttl
+        serialized = self._set_local(key, value, ttl_seconds, refresh)
+
+        logger.debug(f"Cache set: {key} (TTL: {ttl_seconds}s)")
+
+        if self._l2_available():
+            try:
+                if serialized is None:
+                    serialized = serialize_value(value)
+            except TypeError as e:
+                logger.debug(f"Cache value for {key} not shareable, kept local: {e}")
+                return
+            self._l2_call("set", self._l2_key(key), pack_entry(serialized, time.time() + ttl_seconds), ttl_seconds)
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[int] = None) -> Any:
+        """
+        Replace a value with fn(current value or None), atomically (thread-safe)
+
+        Updates of one key do not lose each other's writes, within this
+        process and, through the backend's update(), across workers sharing
+        the L2. fn may be called more than once and must not have side effects.
+
+        Returns:
+            The new value
+        """
+        ttl_seconds = ttl if ttl is not None else self.default_ttl
+        l2_key = self._l2_key(key)
+
+        def apply(payload: Optional[bytes]) -> bytes:
+            current = None
+            if payload is not None:
+                value, expires_at = decode_entry(payload)
+                if expires_at > time.time():
+                    current = value
+            return encode_entry(fn(current), time.time() + ttl_seconds)
+
+        with self._shard(key).update_lock:
+            payload = self._l2_call("update", l2_key, apply, ttl_seconds) if self._l2_available() else None
+            if payload is not None:
+                value = decode_entry(payload)[0]
+                self._set_local(key, value, ttl_seconds)
+            else:
+                value = fn(self.get(key))
+                self.set(key, value, ttl_seconds)
+
+        logger.debug(f"Cache update: {key} (TTL: {ttl_seconds}s)")
+        return value
+
+    def _set_local(
+        self,
+        key: str,
+        value: Any,
+        ttl_seconds: float,
+        refresh: Optional[Callable[[], Any]] = None
+    ) -> Optional[bytes]:
+        """
+        Insert into the local LRU
+
+        Returns:
+            The serialized value if it was serialized for compression, else None
+        """
+        serialized = None
+        entry = None
+
+        if self.compress:
+            try:
+                serialized = serialize_value(value)
+            except TypeError:
+                serialized = None
+            if serialized is not None and len(serialized) >= COMPRESS_MIN_BYTES:
+                blob = compress_value(serialized)
+                entry = CacheEntry(blob, ttl_seconds, size=sys.getsizeof(blob), compressed=True, refresh=refresh)
+
+        if entry is None:
+            entry = CacheEntry(value, ttl_seconds, size=estimate_size(value), refresh=refresh)
+
+        shard = self._shard(key)
+        with shard.lock:
+            if shard.max_bytes is not None and entry.size > shard.max_bytes:
+                # Larger than the whole shard budget: caching it would flush everything else
+                shard.remove(key)
+                logger.debug(f"Cache skip: {key} ({entry.size}B exceeds shard budget)")
+            else:
+                shard.insert(key, entry)
+
+        return serialized
+
+    def _l2_key(self, key: str) -> str:
+        return f"{L2_KEY_PREFIX}{self.name}:{key}"
+
+    def _l2_available(self) -> bool:
+        return self.backend is not None and time.monotonic() >= self._l2_retry_at
+
+    def _l2_call(self, method: str, *args):
+        """Call the shared backend; on failure back off for L2_RETRY_AFTER seconds"""
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            with self._stats_lock:
+                self.l2_errors += 1
+                self._l2_retry_at = time.monotonic() + L2_RETRY_AFTER
+            logger.warning(f"Shared cache ({self.backend.name}) {method} failed: {e}")
+            return None
+
     def delete(self, key: str):
         """Delete specific cache entry (thread-safe)"""
-        with self._lock:
-            if key in self.cache:
-                del self.cache[key]
+        shard = self._shard(key)
+        with shard.lock:
+            shard.remove(key)
+        if self._l2_available():
+            self._l2_call("delete", self._l2_key(key))
 
     def clear(self):
-        """Clear all cache entries (thread-safe)"""
-        with self._lock:
-            self.cache.clear()
-            self.hits = 0
-            self.misses = 0
-            self.evictions = 0
-            logger.info("Cache cleared")
-    
+        """Clear all cache entries, including this cache's shared entries (thread-safe)"""
+        for shard in self._shards:
+            with shard.lock:
+                shard.cache.clear()
+                shard.bytes = 0
+                shard.hits = 0
+                shard.misses = 0
+                shard.evictions = 0
+                shard.expired = 0
+        with self._stats_lock:
+            self.l2_hits = 0
+            self.l2_errors = 0
+            self.refreshes = 0
+            self.refresh_failures = 0
+        logger.info("Cache cleared")
+        if self._l2_available():
+            self._l2_call("clear", self._l2_key(""))
+
     def get_stats(self) -> dict:
         """Get cache statistics (thread-safe)"""
-        with self._lock:
-            total_requests = self.hits + self.misses
-            hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+        size = memory_bytes = compressed_entries = hits = misses = evictions = expired = 0
+        for shard in self._shards:
+            with shard.lock:
+                size += len(shard.cache)
+                memory_bytes += shard.bytes
+                compressed_entries += sum(1 for entry in shard.cache.values() if entry.compressed)
+                hits += shard.hits
+                misses += shard.misses
+                evictions += shard.evictions
+                expired += shard.expired
+
+        total_requests = hits + misses
+        hit_rate = (hits / total_requests * 100) if total_requests > 0 else 0
+
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "expired_removed": expired,
+            "hit_rate_percent": round(hit_rate, 2),
+            "total_requests": total_requests,
+            "memory_bytes": memory_bytes,
+            "max_bytes": self.max_bytes,
+            "compressed_entries": compressed_entries,
+            "shards": len(self._shards),
+            "l2_backend": self.backend.name if self.backend else None,
+            "l2_hits": self.l2_hits,
+            "l2_errors": self.l2_errors,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures
+        }
 
-            return {
-                "size": len(self.cache),
-                "max_size": self.max_size,
-                "hits": self.hits,
-                "misses": self.misses,
-                "evictions": self.evictions,
-                "hit_rate_percent": round(hit_rate, 2),
-                "total_requests": total_requests
-            }
-    
     def cleanup_expired(self) -> int:
         """Remove all expired entries (periodic maintenance, thread-safe)"""
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                expired_keys = [
+                    key for key, entry in shard.cache.items()
+                    if entry.is_expired()
+                ]
+
+                for key in expired_keys:
+                    shard.remove(key)
+                shard.expired += len(expired_keys)
+                removed += len(expired_keys)
+
+        if removed:
+            logger.info(f"Cleaned up {removed} expired cache entries")
+
+        return removed
+
+    def claim_refreshes(self, min_hits: int = 1, limit: Optional[int] = None) -> List[Tuple[str, Callable[[], Any]]]:
+        """
+        Claim stale, hot entries for background refresh (thread-safe)
+
+        Selects unexpired entries past their soft TTL that have a refresh
+        callable and at least min_hits hits, hottest first, and marks them
+        so they are not claimed twice. Each refresh stores a new entry.
+
+        Returns:
+            List of (key, refresh callable)
+        """
+        due = []
+        for shard in self._shards:
+            with shard.lock:
+                for key, entry in shard.cache.items():
+                    if (
+                        entry.refresh is not None
+                        and not entry.refreshing
+                        and entry.hits >= min_hits
+                        and entry.is_stale()
+                        and not entry.is_expired()
+                    ):
+                        due.append((entry.hits, key, entry))
+
+        due.sort(key=lambda item: item[0], reverse=True)
+        if limit is not None:
+            due = due[:limit]
+
+        claimed = []
+        for _, key, entry in due:
+            with self._shard(key).lock:
+                if entry.refreshing:
+                    continue
+                entry.refreshing = True
+            claimed.append((key, entry.refresh))
+        return claimed
+
+    def record_refresh(self, success: bool):
+        """Count a finished background refresh"""
+        with self._stats_lock:
+            if success:
+                self.refreshes += 1
+            else:
+                self.refresh_failures += 1
+
+    def export_entries(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Export the hottest unexpired entries (by hit count) for a snapshot
+
+        Returns:
+            List of {key, value, expires_at (unix time), hits}, hottest first
+        """
+        candidates = []
+        for shard in self._shards:
+            with shard.lock:
+                candidates.extend(
+                    (key, entry) for key, entry in shard.cache.items() if not entry.is_expired()
+                )
+
+        candidates.sort(key=lambda item: item[1].hits, reverse=True)
+        exported = []
+        for key, entry in candidates[:limit]:
+            value = entry.value
+            if entry.compressed:
+                value = deserialize_value(decompress_value(value))
+            exported.append({
+                "key": key,
+                "value": value,
+                "expires_at": entry.expires_at.timestamp(),
+                "hits": entry.hits
+            })
+        return exported
+
+    def import_entries(self, entries: List[Dict[str, Any]]) -> int:
+        """
+        Load entries written by export_entries into the local LRU
+
+        Entries keep their original expiry; already expired ones are skipped.
+
+        Returns:
+            Number of entries loaded
+        """
+        now = time.time()
+        loaded = 0
+        for item in entries:
+            remaining = item["expires_at"] - now
+            if remaining <= 0:
+                continue
+            self._set_local(item["key"], item["value"], remaining)
+            loaded += 1
+        return loaded
+
+
+class _LeaderCancelled(Exception):
+    """The caller computing a single-flight value was cancelled"""
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent computations of the same key
+
+    The first caller for a key (the leader) runs the computation; callers
+    arriving while it runs wait for and share its result or exception.
+    Works across threads (do) and event loops (do_async), so an async
+    endpoint and a threaded service can share one instance.
+
+    Nothing is kept after the leader finishes - pair with an LRUCache
+    for that.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _claim(self, key: str) -> Tuple[Future, bool]:
+        """Return (future, is_leader) for key"""
         with self._lock:
-            expired_keys = [
-                key for key, entry in self.cache.items()
-                if entry.is_expired()
-            ]
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+
+            future = Future()
+            # Running futures cannot be cancelled, so a waiter giving up never affects the others
+            future.set_running_or_notify_cancel()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        Run fn(*args, **kwargs) once for concurrent callers (blocking)
 
-            for key in expired_keys:
-                del self.cache[key]
+        Returns:
+            (result, coalesced) - coalesced is True for callers that reused
+            another caller's result
+        """
+        future, leader = self._claim(key)
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result, False
+
+    async def do_async(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Tuple[Any, bool]:
+        """
+        Await fn(*args, **kwargs) once for concurrent callers
 
-            if expired_keys:
-                logger.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+        If the leader is cancelled (client disconnected), a waiting caller
+        takes over instead of failing. A cancelled waiter only stops
+        waiting; the leader and the other waiters are unaffected.
 
-            return len(expired_keys)
+        Returns:
+            (result, coalesced) as in do()
+        """
+        while True:
+            future, leader = self._claim(key)
+            if not leader:
+                try:
+                    return await asyncio.shield(asyncio.wrap_future(future)), True
+                except _LeaderCancelled:
+                    continue
+
+            try:
+                result = await fn(*args, **kwargs)
+            except asyncio.CancelledError:
+                self._finish(key, future, error=_LeaderCancelled())
+                raise
+            except BaseException as e:
+                self._finish(key, future, error=e)
+                raise
+            self._finish(key, future, result=result)
+            return result, False
 
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced
+            }
 
-# Global cache instances
-proximity_cache = LRUCache(max_size=500, default_ttl=300)  # 5 minutes
-mapbiomas_cache = LRUCache(max_size=200, default_ttl=600)  # 10 minutes (stable data)
-municipality_cache = LRUCache(max_size=1000, default_ttl=3600)  # 1 hour (rarely changes)
 
+# Shared L2 store selected by settings.CACHE_BACKEND (None = per-process only)
+shared_backend = get_shared_backend()
 
-def get_proximity_cache_key(lat: float, lng: float, radius_km: float) -> str:
-    """Generate cache key for proximity analysis"""
+# Memory budget split across the caches (fractions of CACHE_MEMORY_BUDGET_MB)
+_budget = settings.CACHE_MEMORY_BUDGET_MB * MB
+
+# Global cache instances
+proximity_cache = LRUCache(
+    max_size=500, default_ttl=300, name="proximity", backend=shared_backend,
+    max_bytes=int(_budget * 0.25), compress=True
+)  # 5 minutes
+mapbiomas_cache = LRUCache(
+    max_size=200, default_ttl=600, name="mapbiomas", backend=shared_backend,
+    max_bytes=int(_budget * 0.10), compress=True
+)  # 10 minutes (stable data)
+municipality_cache = LRUCache(
+    max_size=1000, default_ttl=3600, name="municipality", backend=shared_backend,
+    max_bytes=int(_budget * 0.15)
+)  # 1 hour (rarely changes; read on every proximity request, kept uncompressed)
+# Per-process only: tiles are already shared through the MBTiles store
+tile_cache = LRUCache(max_size=2000, default_ttl=86400, max_bytes=int(_budget * 0.15))  # 1 day (hot MapBiomas tiles)
+compressed_response_cache = LRUCache(max_size=64, default_ttl=3600, max_bytes=int(_budget * 0.15))  # 1 hour (ETag-keyed bodies)
+# Serialized layer features and geometry payloads: few entries of several MB,
+# so one shard (an entry may use the whole budget) and no eviction by tile traffic
+geometry_cache = LRUCache(max_size=64, default_ttl=86400, max_bytes=int(_budget * 0.20), shards=1)  # 1 day
+
+# Concurrent identical analyses run once (keyed like the caches above)
+proximity_flight = SingleFlight("proximity")
+mapbiomas_flight = SingleFlight("mapbiomas")
+municipality_flight = SingleFlight("municipality")
+
+
+def get_proximity_cache_key(
+    lat: float,
+    lng: float,
+    radius_km: float,
+    include_mapbiomas: bool = True,
+    include_biogas_potential: bool = True,
+    include_infrastructure: bool = True
+) -> str:
+    """
+    Generate cache key for proximity analysis
+
+    The include_* request options select which parts a result holds, so
+    they are part of the key (defaults: the full analysis).
+    """
     return proximity_cache._generate_key(
         "proximity",
-        lat=round(lat, 4),  # Round to ~11m precision
-        lng=round(lng, 4),
-        radius=round(radius_km, 1)
+        lat=round(float(lat), 4),  # Round to ~11m precision (float so 20 and 20.0 share a key)
+        lng=round(float(lng), 4),
+        radius=round(float(radius_km), 1),
+        include=[include_mapbiomas, include_biogas_potential, include_infrastructure]
+    )
+
+
+def get_proximity_radii_key(lat: float, lng: float) -> str:
+    """Generate key of the index of cached radii for one analysis center"""
+    return proximity_cache._generate_key(
+        "proximity_radii",
+        lat=round(float(lat), 4),
+        lng=round(float(lng), 4)
     )
 
 
+def record_proximity_radius(lat: float, lng: float, radius_km: float):
+    """Remember that an analysis at this center and radius is in proximity_cache"""
+    radius = round(float(radius_km), 1)
+    proximity_cache.update(
+        get_proximity_radii_key(lat, lng),
+        lambda radii: sorted(set(radii or []) | {radius})
+    )
+
+
+def find_covering_proximity_result(
+    lat: float, lng: float, radius_km: float, **options: bool
+) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """
+    Find a cached analysis at the same center with a larger radius
+
+    Parts of an analysis that do not depend on the radius (nearest
+    infrastructure, residuos parameters) can be reused from it. options
+    are the include_* flags, as in get_proximity_cache_key.
+
+    Returns:
+        Tuple of (radius_km, cached result) for the smallest larger radius,
+        or None if there is none
+    """
+    radius_km = round(radius_km, 1)
+    for radius in proximity_cache.get(get_proximity_radii_key(lat, lng)) or []:
+        if radius <= radius_km:
+            continue
+        result = proximity_cache.get(get_proximity_cache_key(lat, lng, radius, **options))
+        if result is not None:
+            return radius, result
+    return None
+
+
 def get_mapbiomas_cache_key(lat: float, lng: float, radius_km: float) -> str:
     """Generate cache key for MapBiomas analysis"""
     return mapbiomas_cache._generate_key(
         "mapbiomas",
-        lat=round(lat, 4),
-        lng=round(lng, 4),
-        radius=round(radius_km, 1)
+        lat=round(float(lat), 4),
+        lng=round(float(lng), 4),
+        radius=round(float(radius_km), 1)
     )
 
 
+def get_analytics_cache_key(name: str, table_version: str, **params) -> str:
+    """Generate cache key for a dashboard analytics result (per municipality table version)"""
+    return municipality_cache._generate_key(f"analytics:{name}", version=table_version, **params)
+
+
+# Caches written to the warm-start snapshot (results that are costly to recompute)
+SNAPSHOT_CACHES = {
+    "proximity": proximity_cache,
+    "mapbiomas": mapbiomas_cache,
+    "municipality": municipality_cache
+}
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def save_cache_snapshot(path: Path, dataset_version: str, max_entries_per_cache: int = 200) -> int:
+    """
+    Write the hottest entries of SNAPSHOT_CACHES to a compressed file
+
+    The file is replaced atomically, so concurrent workers shutting down
+    never leave a partial snapshot. Raw bytes and values that are not
+    JSON-serializable are left out.
+
+    Args:
+        path: Snapshot file
+        dataset_version: Stamp of the data the cached results were computed from
+        max_entries_per_cache: Hottest entries kept per cache
+
+    Returns:
+        Number of entries written
+    """
+    caches = {}
+    written = 0
+    for name, cache in SNAPSHOT_CACHES.items():
+        entries = []
+        for item in cache.export_entries(max_entries_per_cache):
+            # The snapshot is one JSON document: raw bytes and other values do not fit
+            if isinstance(item["value"], (bytes, bytearray)):
+                continue
+            try:
+                serialize_value(item["value"])
+            except TypeError:
+                continue
+            entries.append(item)
+        caches[name] = entries
+        written += len(entries)
+
+    document = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "dataset_version": dataset_version,
+        "created_at": time.time(),
+        "caches": caches
+    }
+    data = compress_value(serialize_value(document))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+    logger.info(f"Cache snapshot saved: {written} entries to {path}")
+    return written
+
+
+def load_cache_snapshot(path: Path, dataset_version: str) -> int:
+    """
+    Reload a snapshot written by save_cache_snapshot
+
+    Snapshots from another dataset version (or format) are discarded, as
+    are entries whose TTL ran out while the process was down.
+
+    Returns:
+        Number of entries loaded (0 if missing, stale or unreadable)
+    """
+    path = Path(path)
+    if not path.exists():
+        return 0
+
+    try:
+        document = deserialize_value(decompress_value(path.read_bytes()))
+    except Exception as e:
+        logger.warning(f"Cache snapshot {path} unreadable, ignoring: {e}")
+        return 0
+
+    if document.get("format") != SNAPSHOT_FORMAT_VERSION or document.get("dataset_version") != dataset_version:
+        logger.info(f"Cache snapshot {path} is from another dataset version, discarding")
+        return 0
+
+    loaded = 0
+    for name, entries in document.get("caches", {}).items():
+        cache = SNAPSHOT_CACHES.get(name)
+        if cache is not None:
+            loaded += cache.import_entries(entries)
+
+    logger.info(f"Cache snapshot loaded: {loaded} entries from {path}")
+    return loaded
+
+
 def get_all_cache_stats() -> dict:
     """Get statistics for all caches"""
-    return {
+    caches = {
         "proximity": proximity_cache.get_stats(),
         "mapbiomas": mapbiomas_cache.get_stats(),
-        "municipality": municipality_cache.get_stats()
+        "municipality": municipality_cache.get_stats(),
+        "tiles": tile_cache.get_stats(),
+        "compressed_responses": compressed_response_cache.get_stats(),
+        "geometry": geometry_cache.get_stats()
+    }
+    return {
+        **caches,
+        "total_memory_bytes": sum(stats["memory_bytes"] for stats in caches.values()),
+        "memory_budget_bytes": _budget,
+        "shared_backend": shared_backend.get_stats() if shared_backend else None,
+        "single_flight": {
+            flight.name: flight.get_stats()
+            for flight in (proximity_flight, mapbiomas_flight, municipality_flight)
+        }
     }
-
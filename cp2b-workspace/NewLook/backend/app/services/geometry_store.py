@@ -0,0 +1,328 @@
+"""
+CP2B Maps V3 - Geometry Store
+Process-wide registry of shapefile layers kept resident in memory
+
+Each layer is read once (at startup or lazily on first use) and kept in both
+WGS84 and SIRGAS 2000 / UTM 23S, so request handlers never pay for shapefile
+I/O or reprojection. A layer is reloaded only when its source file changes.
+Layers are read from GeoParquet/FlatGeobuf copies when present and up to
+date (scripts/convert_shapefiles.py), otherwise from the shapefile.
+
+Map endpoints serve WGS84 geometries at a fixed set of simplification levels
+(GEOMETRY_SIMPLIFY_LEVELS_DEG), each computed once per layer and chosen from
+the client's zoom or tolerance with simplify_level().
+"""
+
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from app.core.config import settings
+from app.utils.vector_formats import layer_names, layer_source, read_layer
+
+logger = logging.getLogger(__name__)
+
+# Coordinate Reference Systems
+WGS84 = "EPSG:4326"  # Input/output
+UTM_23S = "EPSG:31983"  # SIRGAS 2000 / UTM zone 23S - for accurate distances in meters
+
+# Shapefile directory paths - check Railway deployment first, then local development
+# Railway downloads to: backend/data/shapefiles/
+# Local development uses: project_map/data/shapefile/
+_RAILWAY_SHAPEFILE_DIR = Path(__file__).parent.parent.parent / "data" / "shapefiles"
+_LOCAL_SHAPEFILE_DIR = Path(__file__).parent.parent.parent.parent.parent / "project_map" / "data" / "shapefile"
+
+# Use Railway path if it exists, otherwise fall back to local
+SHAPEFILE_DIR = _RAILWAY_SHAPEFILE_DIR if _RAILWAY_SHAPEFILE_DIR.exists() else _LOCAL_SHAPEFILE_DIR
+
+# Simplification tolerance (meters) for area-overlay geometries; changes area
+# fractions by well under 0.01% while roughly halving overlay cost
+OVERLAY_SIMPLIFY_TOLERANCE_M = 25
+
+# Simplification levels for map clients (degrees, finest last)
+SIMPLIFY_LEVELS_DEG = sorted(settings.GEOMETRY_SIMPLIFY_LEVELS_DEG, reverse=True)
+
+# Simplification level used when a client sends neither zoom nor tolerance
+DEFAULT_SIMPLIFY_TOLERANCE_DEG = 0.001
+
+# Web Mercator tiles are 256 px wide; at zoom z one pixel spans ~360 / (256 * 2^z) degrees
+TILE_SIZE_PX = 256
+
+
+def simplify_level(
+    zoom: Optional[float] = None,
+    tolerance: Optional[float] = None,
+    default: float = DEFAULT_SIMPLIFY_TOLERANCE_DEG
+) -> float:
+    """
+    Pick the stored simplification level for a request
+
+    A tolerance (degrees) takes precedence over a zoom; a zoom asks for
+    about one pixel of error. The coarsest level not exceeding the target
+    is returned, or the finest level if the target is below all of them.
+
+    Args:
+        zoom: Web map zoom level
+        tolerance: Maximum simplification error in degrees
+        default: Target when neither zoom nor tolerance is given
+
+    Returns:
+        One of SIMPLIFY_LEVELS_DEG
+    """
+    if tolerance is not None:
+        target = tolerance
+    elif zoom is not None:
+        target = 360.0 / (TILE_SIZE_PX * math.pow(2, zoom))
+    else:
+        target = default
+
+    for level in SIMPLIFY_LEVELS_DEG:
+        if level <= target:
+            return level
+    return SIMPLIFY_LEVELS_DEG[-1]
+
+
+class GeometryLayer:
+    """
+    A loaded shapefile layer in WGS84 and UTM 23S
+
+    Geometry arrays, the STRtree spatial index and UTM centroids are built
+    once at load time. Index results are positional (use with .iloc).
+    """
+
+    def __init__(self, name: str, path: Path, mtime: float, gdf_wgs84: gpd.GeoDataFrame):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.gdf_wgs84 = gdf_wgs84
+        self.gdf_utm = gdf_wgs84.to_crs(UTM_23S)
+
+        # Bulk-query structures in UTM (meters)
+        self.geometries_utm: np.ndarray = self.gdf_utm.geometry.to_numpy()
+        self.tree_utm = STRtree(self.geometries_utm)
+        self.centroids_utm: np.ndarray = shapely.centroid(self.geometries_utm)
+
+        # Lighter copies for area overlays (areas taken from the same copies
+        # so fractions stay consistent); prepared for repeated predicates
+        self.overlay_geometries_utm: np.ndarray = shapely.simplify(
+            self.geometries_utm, OVERLAY_SIMPLIFY_TOLERANCE_M
+        )
+        self.overlay_areas_utm: np.ndarray = shapely.area(self.overlay_geometries_utm)
+        shapely.prepare(self.overlay_geometries_utm)
+
+        # WGS84 map geometries (bounding-box index; simplification levels built on first use)
+        self.geometries_wgs84: np.ndarray = self.gdf_wgs84.geometry.to_numpy()
+        self.tree_wgs84 = STRtree(self.geometries_wgs84)
+        self._simplified: Dict[float, np.ndarray] = {}
+        self._simplify_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.gdf_wgs84)
+
+    def simplified(self, tolerance: float) -> np.ndarray:
+        """
+        WGS84 geometries simplified with preserve_topology at a tolerance
+
+        Each tolerance is computed once and kept; callers should pass one
+        of SIMPLIFY_LEVELS_DEG (see simplify_level).
+
+        Args:
+            tolerance: Simplification tolerance in degrees
+
+        Returns:
+            Geometry array aligned with gdf_wgs84 (do not modify)
+        """
+        geometries = self._simplified.get(tolerance)
+        if geometries is not None:
+            return geometries
+
+        with self._simplify_lock:
+            geometries = self._simplified.get(tolerance)
+            if geometries is None:
+                geometries = shapely.simplify(self.geometries_wgs84, tolerance, preserve_topology=True)
+                self._simplified[tolerance] = geometries
+            return geometries
+
+    def warm_simplified(self):
+        """Compute every simplification level ahead of the first request"""
+        for level in SIMPLIFY_LEVELS_DEG:
+            self.simplified(level)
+
+    def query_intersecting(self, geometry_utm) -> np.ndarray:
+        """Positional indices of features intersecting a UTM geometry (sorted)"""
+        return np.sort(self.tree_utm.query(geometry_utm, predicate="intersects"))
+
+    def query_bbox(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+        """Positional indices of features whose WGS84 bounding box meets a lon/lat box (sorted)"""
+        return np.sort(self.tree_wgs84.query(shapely.box(min_x, min_y, max_x, max_y)))
+
+    def intersection_fractions(self, geometry_utm, indices: np.ndarray) -> np.ndarray:
+        """
+        Fraction of each feature's area covered by a UTM geometry.
+
+        Features lying entirely inside the geometry short-circuit to 1.0;
+        only boundary features pay for a polygon overlay.
+
+        Args:
+            geometry_utm: Query geometry in UTM (e.g. analysis buffer)
+            indices: Positional indices of features (from query_intersecting)
+
+        Returns:
+            Array of fractions in [0, 1], aligned with indices
+        """
+        fractions = np.ones(len(indices), dtype=float)
+        if len(indices) == 0:
+            return fractions
+
+        shapely.prepare(geometry_utm)
+        geometries = self.overlay_geometries_utm[indices]
+        areas = self.overlay_areas_utm[indices]
+
+        partial = ~shapely.contains(geometry_utm, geometries) & (areas > 0)
+        if partial.any():
+            overlap = shapely.area(shapely.intersection(geometries[partial], geometry_utm))
+            fractions[partial] = np.clip(overlap / areas[partial], 0.0, 1.0)
+
+        return fractions
+
+    def nearest(self, point_utm) -> Tuple[Optional[int], float]:
+        """
+        Find the feature nearest to a UTM point.
+
+        Returns:
+            Tuple of (positional index, distance in meters), or (None, inf) if empty
+        """
+        indices, distances = self.tree_utm.query_nearest(
+            point_utm, return_distance=True, all_matches=False
+        )
+        if len(indices) == 0:
+            return None, float("inf")
+        return int(indices[0]), float(distances[0])
+
+
+class GeometryStore:
+    """
+    Thread-safe registry of resident shapefile layers
+
+    Layers are keyed by shapefile name (without the .shp extension).
+    Concurrent first requests for the same layer load it only once.
+    """
+
+    def __init__(self, shapefile_dir: Path = SHAPEFILE_DIR):
+        self.shapefile_dir = Path(shapefile_dir)
+        self._layers: Dict[str, GeometryLayer] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.loads = 0
+        self.reloads = 0
+
+    def _path_for(self, name: str) -> Optional[Path]:
+        """Preferred source file of a layer (see vector_formats.layer_source)"""
+        return layer_source(self.shapefile_dir, name)
+
+    def _load_lock_for(self, name: str) -> threading.Lock:
+        with self._lock:
+            if name not in self._load_locks:
+                self._load_locks[name] = threading.Lock()
+            return self._load_locks[name]
+
+    def get_layer(self, name: str) -> Optional[GeometryLayer]:
+        """
+        Get a resident layer, loading or reloading it if needed.
+
+        Args:
+            name: Shapefile name (without .shp extension)
+
+        Returns:
+            GeometryLayer, or None if the layer does not exist in any format
+        """
+        path = self._path_for(name)
+        try:
+            mtime = path.stat().st_mtime if path is not None else None
+        except FileNotFoundError:
+            mtime = None
+        if mtime is None:
+            with self._lock:
+                self._layers.pop(name, None)
+            return None
+
+        layer = self._layers.get(name)
+        if layer is not None and layer.path == path and layer.mtime == mtime:
+            return layer
+
+        with self._load_lock_for(name):
+            # Double-check after acquiring lock (another thread might have loaded it)
+            layer = self._layers.get(name)
+            if layer is not None and layer.path == path and layer.mtime == mtime:
+                return layer
+
+            logger.info(f"Loading geometry layer: {name} ({path.name})")
+            gdf = read_layer(path)
+
+            # Ensure WGS84
+            if gdf.crs != WGS84:
+                gdf = gdf.to_crs(WGS84)
+
+            new_layer = GeometryLayer(name, path, mtime, gdf)
+
+            with self._lock:
+                if layer is not None:
+                    self.reloads += 1
+                    logger.info(f"Reloaded geometry layer {name} (file changed)")
+                self.loads += 1
+                self._layers[name] = new_layer
+
+            return new_layer
+
+    def available_layers(self) -> List[str]:
+        """List layer names available under the store directory (any format)"""
+        return layer_names(self.shapefile_dir)
+
+    def preload(self) -> int:
+        """
+        Load every shapefile under the store directory and its simplification levels.
+
+        Returns:
+            Number of layers loaded
+        """
+        loaded = 0
+        for name in self.available_layers():
+            try:
+                layer = self.get_layer(name)
+                if layer is not None:
+                    layer.warm_simplified()
+                    loaded += 1
+            except Exception as e:
+                logger.error(f"Error preloading geometry layer {name}: {e}")
+
+        logger.info(f"Geometry store preloaded {loaded} layers from {self.shapefile_dir}")
+        return loaded
+
+    def get_stats(self) -> dict:
+        """Get store statistics"""
+        with self._lock:
+            return {
+                "layers": {name: len(layer) for name, layer in self._layers.items()},
+                "sources": {name: layer.path.suffix for name, layer in self._layers.items()},
+                "loads": self.loads,
+                "reloads": self.reloads,
+                "shapefile_dir": str(self.shapefile_dir)
+            }
+
+
+# Global store instance
+_geometry_store = GeometryStore()
+
+
+def get_geometry_store() -> GeometryStore:
+    """Get the process-wide geometry store"""
+    return _geometry_store
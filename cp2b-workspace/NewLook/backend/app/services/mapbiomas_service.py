@@ -4,10 +4,11 @@ Land use analysis from MapBiomas raster data within analysis buffers
 """
 
 import logging
-from typing import Dict, Any, Optional
+import math
+import threading
+from typing import Dict, Any, List, Optional
 from pathlib import Path
 import numpy as np
-from collections import Counter
 
 # Optional rasterio import - requires GDAL system dependencies
 try:
@@ -23,6 +24,8 @@ from shapely.geometry import Point, mapping
 from shapely.ops import transform
 import pyproj
 
+from app.services.mapbiomas_zonal import get_zonal_index
+
 logger = logging.getLogger(__name__)
 
 # MapBiomas land use classes for São Paulo agricultural areas
@@ -134,11 +137,33 @@ MAPBIOMAS_CLASSES = {
 # Path to MapBiomas raster
 MAPBIOMAS_DIR = Path(__file__).parent.parent.parent / "data" / "mapbiomas"
 RASTER_PATH = MAPBIOMAS_DIR / "mapbiomas_agropecuaria_sp_2024.tif"
+ZONAL_INDEX_PATH = MAPBIOMAS_DIR / "mapbiomas_zonal_2024.npz"
 
 # Coordinate reference systems
 WGS84 = "EPSG:4326"
 UTM_23S = "EPSG:31983"
 
+# Pixel budget for a buffer analysis; larger buffers read a raster overview
+MAX_ANALYSIS_PIXELS = 4_000_000
+
+
+def select_overview_level(overview_factors: List[int], decimation: float) -> Optional[int]:
+    """
+    Pick the coarsest raster overview that is still at least as fine as needed.
+
+    Args:
+        overview_factors: Overview decimation factors (src.overviews(band))
+        decimation: Source pixels per output pixel the reader can afford
+
+    Returns:
+        Overview index for rasterio.open(..., overview_level=), or None for full resolution
+    """
+    level = None
+    for index, factor in enumerate(overview_factors):
+        if factor <= decimation:
+            level = index
+    return level
+
 
 class MapBiomasService:
     """Service for MapBiomas raster analysis"""
@@ -146,7 +171,8 @@ class MapBiomasService:
     def __init__(self):
         """Initialize service and check raster availability"""
         self.raster_path = RASTER_PATH
-        self._raster_info = None
+        self.zonal_index_path = ZONAL_INDEX_PATH
+        self._raster_info = None  # ((path, mtime), info) of the last raster read
         self._rasterio_available = RASTERIO_AVAILABLE
 
         # Coordinate transformers
@@ -163,20 +189,31 @@ class MapBiomasService:
             logger.warning(f"MapBiomas raster not found at {self.raster_path}")
 
     def _get_raster_info(self) -> Optional[Dict[str, Any]]:
-        """Get cached raster metadata"""
+        """Get cached raster metadata (re-read when the GeoTIFF changes)"""
         if not self._rasterio_available:
             return None
-        if self._raster_info is None and self.raster_path.exists():
-            with rasterio.open(self.raster_path) as src:
-                self._raster_info = {
-                    "crs": str(src.crs),
-                    "bounds": src.bounds,
-                    "resolution": src.res,
-                    "nodata": src.nodata,
-                    "width": src.width,
-                    "height": src.height
-                }
-        return self._raster_info
+        try:
+            key = (str(self.raster_path), self.raster_path.stat().st_mtime)
+        except FileNotFoundError:
+            return None
+
+        cached = self._raster_info
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with rasterio.open(self.raster_path) as src:
+            info = {
+                "crs": str(src.crs),
+                "bounds": src.bounds,
+                "resolution": src.res,
+                "nodata": src.nodata,
+                "width": src.width,
+                "height": src.height,
+                "geographic": src.crs is None or src.crs.is_geographic,
+                "overviews": src.overviews(1)
+            }
+        self._raster_info = (key, info)
+        return info
 
     def analyze_buffer(
         self, lat: float, lng: float, radius_km: float
@@ -220,19 +257,24 @@ class MapBiomasService:
             buffer_utm = point_utm.buffer(radius_km * 1000)
             buffer_wgs84 = transform(self.utm_to_wgs84, buffer_utm)
 
+            # Fast path: precomputed grid histograms plus rim pixels only
+            zonal_index = get_zonal_index(self.zonal_index_path)
+            if zonal_index is not None:
+                with rasterio.open(self.raster_path) as src:
+                    if zonal_index.matches(src):
+                        pixel_counts = zonal_index.buffer_pixel_counts(
+                            src, self._to_raster_crs(src, buffer_wgs84)
+                        )
+                        return self._build_result(pixel_counts, src.nodata, src.res, lat)
+                    logger.warning("MapBiomas zonal index does not match raster - rebuild it")
+
+            # Large buffers read an overview instead of full resolution
+            overview_level = self._overview_level_for_buffer(radius_km)
+            open_kwargs = {} if overview_level is None else {"overview_level": overview_level}
+
             # Open raster and extract pixels in buffer
-            with rasterio.open(self.raster_path) as src:
-                # Get raster CRS to ensure buffer is in correct projection
-                if src.crs != WGS84:
-                    # Transform buffer to raster CRS
-                    raster_crs = pyproj.CRS(src.crs)
-                    wgs84_crs = pyproj.CRS(WGS84)
-                    transformer = pyproj.Transformer.from_crs(
-                        wgs84_crs, raster_crs, always_xy=True
-                    ).transform
-                    buffer_for_mask = transform(transformer, buffer_wgs84)
-                else:
-                    buffer_for_mask = buffer_wgs84
+            with rasterio.open(self.raster_path, **open_kwargs) as src:
+                buffer_for_mask = self._to_raster_crs(src, buffer_wgs84)
 
                 # Mask raster with buffer geometry
                 try:
@@ -247,81 +289,11 @@ class MapBiomasService:
                     logger.warning(f"Mask operation failed: {e}")
                     return self._empty_result()
 
-                # Flatten to 1D array and remove nodata
-                data = out_image[0].flatten()
-                nodata_value = src.nodata if src.nodata is not None else 0
-
-                # Filter out nodata
-                valid_data = data[data != nodata_value]
-
-                if len(valid_data) == 0:
-                    return self._empty_result()
-
                 # Count pixels by class
-                pixel_counts = Counter(valid_data)
-                total_pixels = len(valid_data)
-
-                # Calculate pixel area in km²
-                # Resolution is in degrees, convert to approximate km²
-                res_x, res_y = src.res
-
-                # Approximate conversion at São Paulo latitude (~22°S)
-                # 1 degree latitude ≈ 111 km
-                # 1 degree longitude ≈ 111 * cos(22°) ≈ 103 km
-                km_per_deg_lat = 111.0
-                km_per_deg_lng = 111.0 * np.cos(np.radians(abs(lat)))
-
-                pixel_area_km2 = abs(res_x * km_per_deg_lng * res_y * km_per_deg_lat)
-
-                # Build results by class
-                by_class = {}
-                agricultural_pixels = 0
-
-                for class_id, count in pixel_counts.items():
-                    class_id = int(class_id)
-                    class_info = MAPBIOMAS_CLASSES.get(class_id, {
-                        "name": f"Classe {class_id}",
-                        "color": "#808080",
-                        "category": "unknown"
-                    })
-
-                    area_km2 = count * pixel_area_km2
-                    percent = (count / total_pixels) * 100
-
-                    by_class[str(class_id)] = {
-                        "class_id": class_id,
-                        "name": class_info["name"],
-                        "color": class_info["color"],
-                        "category": class_info["category"],
-                        "pixel_count": int(count),
-                        "area_km2": round(area_km2, 4),
-                        "percent": round(percent, 2)
-                    }
-
-                    # Sum agricultural pixels
-                    if class_info["category"] == "agricultural":
-                        agricultural_pixels += count
-
-                # Find dominant class
-                if pixel_counts:
-                    dominant_class_id = pixel_counts.most_common(1)[0][0]
-                    dominant_info = MAPBIOMAS_CLASSES.get(int(dominant_class_id), {})
-                    dominant_class = dominant_info.get("name", f"Classe {dominant_class_id}")
-                else:
-                    dominant_class = "unknown"
-
-                # Calculate total area and agricultural percentage
-                total_area_km2 = total_pixels * pixel_area_km2
-                agricultural_percent = (agricultural_pixels / total_pixels * 100) if total_pixels > 0 else 0
-
-                return {
-                    "total_area_km2": round(total_area_km2, 2),
-                    "by_class": by_class,
-                    "dominant_class": dominant_class,
-                    "agricultural_percent": round(agricultural_percent, 2),
-                    "total_pixels": total_pixels,
-                    "pixel_resolution_m": round(np.sqrt(pixel_area_km2) * 1000, 2)
-                }
+                values, counts = np.unique(out_image[0], return_counts=True)
+                pixel_counts = {int(v): int(c) for v, c in zip(values, counts)}
+
+                return self._build_result(pixel_counts, src.nodata, src.res, lat)
 
         except Exception as e:
             logger.error(f"MapBiomas analysis failed: {e}")
@@ -333,6 +305,146 @@ class MapBiomasService:
                 "agricultural_percent": 0
             }
 
+    def analyze_municipality(self, ibge_code: str) -> Optional[Dict[str, Any]]:
+        """
+        Land use for a whole municipality from the precomputed zonal index.
+
+        Args:
+            ibge_code: Municipality IBGE code
+
+        Returns:
+            Same structure as analyze_buffer, or None if the municipality
+            (or the zonal index) is not available
+        """
+        zonal_index = get_zonal_index(self.zonal_index_path)
+        if zonal_index is None:
+            return None
+
+        pixel_counts = zonal_index.municipality_pixel_counts(ibge_code)
+        if pixel_counts is None:
+            return None
+
+        info = self._get_raster_info()
+        if info is None:
+            return None
+
+        # Pixel area evaluated at the state's mid-latitude
+        bounds = info["bounds"]
+        mid_lat = (bounds.bottom + bounds.top) / 2
+        return self._build_result(pixel_counts, info["nodata"], info["resolution"], mid_lat)
+
+    def _to_raster_crs(self, src, geometry_wgs84):
+        """Transform a WGS84 geometry to the raster CRS"""
+        if src.crs == WGS84:
+            return geometry_wgs84
+
+        transformer = pyproj.Transformer.from_crs(
+            pyproj.CRS(WGS84), pyproj.CRS(src.crs), always_xy=True
+        ).transform
+        return transform(transformer, geometry_wgs84)
+
+    def _build_result(
+        self,
+        pixel_counts: Dict[int, int],
+        nodata: Optional[float],
+        resolution: tuple,
+        lat: float
+    ) -> Dict[str, Any]:
+        """
+        Build the land use result from class pixel counts.
+
+        Args:
+            pixel_counts: Class code -> pixel count (may include nodata)
+            nodata: Raster nodata value (0 if None)
+            resolution: Raster (res_x, res_y) in degrees
+            lat: Latitude used for the degree -> km conversion
+        """
+        # Filter out nodata
+        nodata_value = nodata if nodata is not None else 0
+        pixel_counts = {
+            class_id: count for class_id, count in pixel_counts.items()
+            if class_id != nodata_value and count > 0
+        }
+        total_pixels = sum(pixel_counts.values())
+
+        if total_pixels == 0:
+            return self._empty_result()
+
+        # Calculate pixel area in km²
+        # Resolution is in degrees, convert to approximate km²
+        res_x, res_y = resolution
+
+        # Approximate conversion at São Paulo latitude (~22°S)
+        # 1 degree latitude ≈ 111 km
+        # 1 degree longitude ≈ 111 * cos(22°) ≈ 103 km
+        km_per_deg_lat = 111.0
+        km_per_deg_lng = 111.0 * np.cos(np.radians(abs(lat)))
+
+        pixel_area_km2 = abs(res_x * km_per_deg_lng * res_y * km_per_deg_lat)
+
+        # Build results by class
+        by_class = {}
+        agricultural_pixels = 0
+
+        for class_id, count in pixel_counts.items():
+            class_id = int(class_id)
+            class_info = MAPBIOMAS_CLASSES.get(class_id, {
+                "name": f"Classe {class_id}",
+                "color": "#808080",
+                "category": "unknown"
+            })
+
+            area_km2 = count * pixel_area_km2
+            percent = (count / total_pixels) * 100
+
+            by_class[str(class_id)] = {
+                "class_id": class_id,
+                "name": class_info["name"],
+                "color": class_info["color"],
+                "category": class_info["category"],
+                "pixel_count": int(count),
+                "area_km2": round(area_km2, 4),
+                "percent": round(percent, 2)
+            }
+
+            # Sum agricultural pixels
+            if class_info["category"] == "agricultural":
+                agricultural_pixels += count
+
+        # Find dominant class
+        dominant_class_id = max(pixel_counts, key=pixel_counts.get)
+        dominant_info = MAPBIOMAS_CLASSES.get(int(dominant_class_id), {})
+        dominant_class = dominant_info.get("name", f"Classe {dominant_class_id}")
+
+        # Calculate total area and agricultural percentage
+        total_area_km2 = total_pixels * pixel_area_km2
+        agricultural_percent = agricultural_pixels / total_pixels * 100
+
+        return {
+            "total_area_km2": round(total_area_km2, 2),
+            "by_class": by_class,
+            "dominant_class": dominant_class,
+            "agricultural_percent": round(agricultural_percent, 2),
+            "total_pixels": total_pixels,
+            "pixel_resolution_m": round(np.sqrt(pixel_area_km2) * 1000, 2)
+        }
+
+    def _overview_level_for_buffer(self, radius_km: float) -> Optional[int]:
+        """Overview level keeping the buffer window within MAX_ANALYSIS_PIXELS"""
+        info = self._get_raster_info()
+        if not info or not info["overviews"]:
+            return None
+
+        # Approximate pixel size in meters (degrees at ~22°S if geographic)
+        res_x, res_y = info["resolution"]
+        pixel_m = math.sqrt(abs(res_x * res_y))
+        if info["geographic"]:
+            pixel_m *= 111_000 * math.cos(math.radians(22))
+
+        window_pixels = (2 * radius_km * 1000 / pixel_m) ** 2
+        decimation = math.sqrt(window_pixels / MAX_ANALYSIS_PIXELS)
+        return select_overview_level(info["overviews"], decimation)
+
     def _empty_result(self) -> Dict[str, Any]:
         """Return empty result structure"""
         return {
@@ -355,3 +467,35 @@ class MapBiomasService:
             "year": 2024,
             "region": "São Paulo - Áreas Agropecuárias"
         }
+
+
+# Global service (thread-safe lazy singleton, one per worker process)
+_mapbiomas_service: Optional[MapBiomasService] = None
+_mapbiomas_service_lock = threading.Lock()
+
+
+def get_mapbiomas_service() -> MapBiomasService:
+    """
+    Get the process-wide MapBiomas service
+
+    Shared so its raster metadata (used to pick overview levels) is read
+    once per GeoTIFF version rather than on every analysis.
+    """
+    global _mapbiomas_service
+
+    if _mapbiomas_service is None:
+        with _mapbiomas_service_lock:
+            if _mapbiomas_service is None:
+                _mapbiomas_service = MapBiomasService()
+
+    return _mapbiomas_service
+
+
+def run_buffer_analysis(lat: float, lng: float, radius_km: float) -> Dict[str, Any]:
+    """
+    Analyze MapBiomas land use within a buffer.
+
+    Module-level entry point so the analysis can be dispatched to a
+    thread or process pool (must be picklable).
+    """
+    return get_mapbiomas_service().analyze_buffer(lat=lat, lng=lng, radius_km=radius_km)
@@ -0,0 +1,616 @@
+"""
+CP2B Maps V3 - MapBiomas Tile Service
+Rendering and caching of MapBiomas raster tiles
+
+Tiles are looked up in three tiers:
+1. In-process LRU (cache_service.tile_cache) for hot tiles
+2. MBTiles (SQLite) store, pre-rendered for zoom 5-12 by
+   scripts/prerender_mapbiomas_tiles.py
+3. On-demand render from the GeoTIFF, written back to the MBTiles store
+"""
+
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Optional raster imports - require GDAL system dependencies
+try:
+    import rasterio
+    from rasterio.windows import Window
+    from rasterio.enums import Resampling
+    from PIL import Image
+    HAS_RASTER_DEPS = True
+except ImportError:
+    HAS_RASTER_DEPS = False
+    rasterio = None
+    Window = None
+    Resampling = None
+    Image = None
+
+from app.services.cache_service import tile_cache
+from app.services.mapbiomas_service import MAPBIOMAS_DIR, RASTER_PATH, select_overview_level
+
+logger = logging.getLogger(__name__)
+
+# Pre-rendered pyramid next to the raster
+TILES_PATH = MAPBIOMAS_DIR / "mapbiomas_agropecuaria_sp_2024.mbtiles"
+
+# Tile size
+TILE_SIZE = 256
+
+# Zoom range covered by the offline pyramid (deeper zooms render on demand)
+PRERENDER_MIN_ZOOM = 5
+PRERENDER_MAX_ZOOM = 12
+
+# MapBiomas color mapping (class code -> RGB tuple)
+MAPBIOMAS_COLORS = {
+    15: (255, 217, 102),   # Pastagem - Yellow
+    9: (109, 76, 65),      # Silvicultura - Brown
+    39: (225, 190, 231),   # Soja - Light purple
+    20: (197, 225, 165),   # Cana-de-açúcar - Light green
+    40: (255, 205, 210),   # Arroz - Light pink
+    62: (248, 187, 217),   # Algodão - Pink
+    41: (220, 237, 200),   # Outras Temporárias - Very light green
+    46: (141, 110, 99),    # Café - Light brown
+    47: (255, 167, 38),    # Citros - Orange
+    35: (102, 187, 106),   # Dendê - Green
+    48: (161, 136, 127),   # Outras Perenes - Grayish brown
+}
+
+
+# Tile opacity for colored classes
+CLASS_ALPHA = 200
+
+
+def _build_palette() -> Tuple[bytes, bytes]:
+    """
+    Build the 256-entry PNG palette indexed directly by MapBiomas class code
+
+    Returns:
+        Tuple of (RGB palette, 768 bytes; alpha table, 256 bytes).
+        Unlisted classes (and nodata 0) are fully transparent.
+    """
+    rgb = np.zeros((256, 3), dtype=np.uint8)
+    alpha = np.zeros(256, dtype=np.uint8)
+    for class_code, color in MAPBIOMAS_COLORS.items():
+        rgb[class_code] = color
+        alpha[class_code] = CLASS_ALPHA
+    return rgb.tobytes(), alpha.tobytes()
+
+
+PNG_PALETTE, PNG_ALPHA = _build_palette()
+
+
+def tile_to_bbox(z: int, x: int, y: int) -> tuple:
+    """
+    Convert tile coordinates to bounding box in WGS84
+
+    Uses Web Mercator tile scheme (TMS/XYZ)
+
+    Args:
+        z: Zoom level
+        x: Tile X coordinate
+        y: Tile Y coordinate
+
+    Returns:
+        Tuple of (west, south, east, north) in degrees
+    """
+    n = 2.0 ** z
+
+    # Calculate longitude bounds
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+
+    # Calculate latitude bounds (using Mercator projection formula)
+    lat_rad_north = math.atan(math.sinh(math.pi * (1 - 2 * y / n)))
+    lat_rad_south = math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n)))
+
+    north = math.degrees(lat_rad_north)
+    south = math.degrees(lat_rad_south)
+
+    return (west, south, east, north)
+
+
+def lnglat_to_tile(lng: float, lat: float, z: int) -> Tuple[int, int]:
+    """
+    Convert a WGS84 coordinate to the XYZ tile containing it
+
+    Args:
+        lng: Longitude in degrees
+        lat: Latitude in degrees
+        z: Zoom level
+
+    Returns:
+        Tuple of (x, y) tile coordinates
+    """
+    n = 2 ** z
+    lat_rad = math.radians(lat)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def create_tile_image(data: np.ndarray) -> bytes:
+    """
+    Convert raster data to a paletted PNG tile
+
+    Class codes are used directly as palette indices, so colorization is
+    a single pass inside the PNG encoder rather than one mask per class.
+
+    Args:
+        data: 2D numpy array with MapBiomas class codes
+
+    Returns:
+        PNG image bytes
+    """
+    if data.dtype != np.uint8:
+        # Codes outside the palette range render transparent
+        data = np.where((data >= 0) & (data < 256), data, 0).astype(np.uint8)
+
+    img = Image.fromarray(data, 'P')
+    img.putpalette(PNG_PALETTE)
+
+    # Resize to tile size if needed
+    if img.size != (TILE_SIZE, TILE_SIZE):
+        img = img.resize((TILE_SIZE, TILE_SIZE), Image.Resampling.NEAREST)
+
+    # Save to bytes (alpha per palette entry goes into the tRNS chunk)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', transparency=PNG_ALPHA)
+    buffer.seek(0)
+
+    return buffer.getvalue()
+
+
+def create_transparent_tile() -> bytes:
+    """Create a fully transparent tile for areas outside raster bounds"""
+    img = Image.new('RGBA', (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def read_tile_data(src, z: int, x: int, y: int) -> Optional[np.ndarray]:
+    """
+    Read the class codes covering a tile from an open raster dataset
+
+    Args:
+        src: Open rasterio dataset (WGS84)
+        z: Zoom level
+        x: Tile X coordinate
+        y: Tile Y coordinate
+
+    Returns:
+        TILE_SIZE x TILE_SIZE array, or None if the tile is outside raster bounds
+    """
+    west, south, east, north = tile_to_bbox(z, x, y)
+    raster_bounds = src.bounds
+
+    # Check if tile is completely outside raster bounds
+    if (east < raster_bounds.left or
+            west > raster_bounds.right or
+            north < raster_bounds.bottom or
+            south > raster_bounds.top):
+        return None
+
+    # Convert geographic coordinates to pixel coordinates
+    inv_transform = ~src.transform
+    col_west, row_north = inv_transform * (west, north)
+    col_east, row_south = inv_transform * (east, south)
+
+    # Clamp to raster bounds
+    col_start = max(0, int(col_west))
+    row_start = max(0, int(row_north))
+    col_end = min(src.width, int(col_east) + 1)
+    row_end = min(src.height, int(row_south) + 1)
+
+    width = col_end - col_start
+    height = row_end - row_start
+
+    if width <= 0 or height <= 0:
+        return None
+
+    # Read raster window resampled to tile size
+    return src.read(
+        1,  # First band
+        window=Window(col_start, row_start, width, height),
+        out_shape=(TILE_SIZE, TILE_SIZE),
+        resampling=Resampling.nearest
+    )
+
+
+def render_tile(src, z: int, x: int, y: int) -> bytes:
+    """
+    Render a tile from an open raster dataset
+
+    Args:
+        src: Open rasterio dataset (WGS84)
+        z: Zoom level
+        x: Tile X coordinate
+        y: Tile Y coordinate
+
+    Returns:
+        PNG image bytes (transparent if outside raster bounds)
+    """
+    data = read_tile_data(src, z, x, y)
+    if data is None:
+        return create_transparent_tile()
+    return create_tile_image(data)
+
+
+def tile_etag(data: bytes, raster_version: Optional[str] = None) -> str:
+    """Strong ETag for tile bytes rendered from a given raster version"""
+    digest = hashlib.md5(data)
+    if raster_version is not None:
+        digest.update(raster_version.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def raster_version(path: Path) -> Optional[str]:
+    """
+    Version of a raster file (modification time), None if it is missing
+
+    Stored in the MBTiles metadata and mixed into tile cache keys and
+    ETags, so replacing the GeoTIFF invalidates every cached tile.
+    """
+    try:
+        return str(Path(path).stat().st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+# MBTiles metadata entry holding the raster version the tiles were rendered from
+RASTER_VERSION_KEY = "raster_version"
+
+
+class MBTilesStore:
+    """
+    Tile store in the MBTiles 1.3 layout (SQLite)
+
+    Rows are stored in TMS order as the spec requires; callers use XYZ.
+    Each thread reads through its own connection (WAL lets readers run
+    alongside the writer). put() buffers write-backs and commits them in
+    batches, so concurrent renders do not each wait on a commit.
+    """
+
+    # Buffered tiles are committed once there are this many, or the oldest is this old
+    WRITE_BATCH = 64
+    WRITE_DELAY = 5.0
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()  # Guards _connections and _pending
+        self._write_lock = threading.Lock()  # One writer per process
+        self._pending: Dict[Tuple[int, int, int], bytes] = {}
+        self._pending_since = 0.0
+        self._generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection for the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # timeout waits on other writers (prerender script, other workers)
+        conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                zoom_level INTEGER,
+                tile_column INTEGER,
+                tile_row INTEGER,
+                tile_data BLOB,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            )
+        """)
+        conn.commit()
+
+        with self._lock:
+            self._connections.append(conn)
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
+
+    @staticmethod
+    def _tms_row(z: int, y: int) -> int:
+        return (2 ** z) - 1 - y
+
+    def exists(self) -> bool:
+        """Whether the store has tiles to serve (file on disk or buffered writes)"""
+        return bool(self._pending) or self.path.exists()
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """Get tile bytes (including buffered writes), or None if the tile is not stored"""
+        with self._lock:
+            data = self._pending.get((z, x, y))
+        if data is not None:
+            return data
+
+        row = self._connect().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, self._tms_row(z, y))
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def put(self, z: int, x: int, y: int, data: bytes):
+        """Buffer a single tile (committed with the next batch)"""
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending[(z, x, y)] = data
+            due = (
+                len(self._pending) >= self.WRITE_BATCH
+                or time.monotonic() - self._pending_since >= self.WRITE_DELAY
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Commit buffered tiles"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self.put_many((z, x, y, data) for (z, x, y), data in pending.items())
+
+    def put_many(self, tiles):
+        """
+        Store tiles in one transaction
+
+        Args:
+            tiles: Iterable of (z, x, y, png_bytes)
+        """
+        rows = [(z, x, self._tms_row(z, y), sqlite3.Binary(data)) for z, x, y, data in tiles]
+        with self._write_lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+
+    def clear_tiles(self):
+        """Delete every stored and buffered tile (metadata is kept)"""
+        with self._lock:
+            self._pending = {}
+        with self._write_lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM tiles")
+            conn.commit()
+
+    def get_metadata(self, name: str) -> Optional[str]:
+        """Read one MBTiles metadata value"""
+        row = self._connect().execute("SELECT value FROM metadata WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_metadata(self, metadata: Dict[str, str]):
+        """Write MBTiles metadata (name, format, bounds, minzoom, maxzoom, ...)"""
+        with self._write_lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                [(key, str(value)) for key, value in metadata.items()]
+            )
+            conn.commit()
+
+    def count(self) -> int:
+        """Number of stored tiles (buffered tiles are committed first)"""
+        self.flush()
+        return self._connect().execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self):
+        """Commit buffered tiles and close every thread's connection"""
+        self.flush()
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+
+
+class MapBiomasTileService:
+    """
+    Tiered MapBiomas tile lookup (LRU -> MBTiles -> render with write-back)
+
+    Thread-safe; render work is blocking and should run off the event loop.
+    Each worker thread keeps its own open raster handle (GDAL datasets must
+    not be shared between threads), reopened if the GeoTIFF changes.
+
+    Cache keys and ETags carry the raster version, and a store rendered
+    from another version of the GeoTIFF is emptied on first use, so a
+    replaced raster never serves old tiles. Without the GeoTIFF the store
+    is served as-is.
+    """
+
+    def __init__(self, raster_path: Path = RASTER_PATH, tiles_path: Path = TILES_PATH):
+        self.raster_path = Path(raster_path)
+        self.store = MBTilesStore(tiles_path)
+        self._store_version: Optional[str] = None
+        self._store_lock = threading.Lock()
+
+        # Per-thread raster handles, tracked so they can be closed on shutdown
+        self._local = threading.local()
+        self._datasets = []
+        self._datasets_lock = threading.Lock()
+
+        # Statistics
+        self.store_hits = 0
+        self.renders = 0
+
+    @staticmethod
+    def _cache_key(version: Optional[str], z: int, x: int, y: int) -> str:
+        return f"mapbiomas:{version}:{z}/{x}/{y}"
+
+    def _check_store_version(self, version: str):
+        """Empty the store if its tiles were rendered from another raster version"""
+        if version == self._store_version:
+            return
+
+        with self._store_lock:
+            if version == self._store_version:
+                return
+            stored = self.store.get_metadata(RASTER_VERSION_KEY)
+            if stored is not None and stored != version:
+                logger.warning(
+                    f"{self.raster_path.name} changed since {self.store.path.name} was rendered - "
+                    "dropping stored tiles (re-run prerender_mapbiomas_tiles.py)"
+                )
+                self.store.clear_tiles()
+            if stored != version:
+                # Stamp the store so write-backs are tied to this raster version
+                self.store.set_metadata({RASTER_VERSION_KEY: version})
+            self._store_version = version
+
+    def get_tile(self, z: int, x: int, y: int) -> Tuple[bytes, str]:
+        """
+        Get a tile and its ETag
+
+        Args:
+            z: Zoom level
+            x: Tile X coordinate
+            y: Tile Y coordinate
+
+        Returns:
+            Tuple of (png_bytes, etag)
+
+        Raises:
+            FileNotFoundError: If the tile is not stored and the GeoTIFF is missing
+        """
+        version = raster_version(self.raster_path)
+        key = self._cache_key(version, z, x, y)
+        cached = tile_cache.get(key)
+        if cached is not None:
+            return cached
+
+        if version is not None:
+            self._check_store_version(version)
+
+        data = self.store.get(z, x, y) if self.store.exists() else None
+        if data is not None:
+            self.store_hits += 1
+        else:
+            if version is None:
+                raise FileNotFoundError(f"Tile {z}/{x}/{y} is not pre-rendered and {self.raster_path} is missing")
+            data = self.render(z, x, y)
+            self.renders += 1
+            try:
+                self.store.put(z, x, y, data)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write tile {z}/{x}/{y} back to store: {e}")
+
+        entry = (data, tile_etag(data, version))
+        tile_cache.set(key, entry)
+        return entry
+
+    def _dataset(self, overview_level: Optional[int] = None):
+        """
+        Open raster handle for the calling thread
+
+        Args:
+            overview_level: Overview index (None for full resolution)
+        """
+        mtime = self.raster_path.stat().st_mtime
+        handles = getattr(self._local, "handles", None)
+        if handles is None or self._local.mtime != mtime:
+            # First use on this thread, or the GeoTIFF changed on disk
+            for src in (handles or {}).values():
+                self._close_dataset(src)
+            handles = self._local.handles = {}
+            self._local.mtime = mtime
+
+        src = handles.get(overview_level)
+        if src is not None and not src.closed:
+            return src
+
+        if overview_level is None:
+            src = rasterio.open(self.raster_path)
+        else:
+            src = rasterio.open(self.raster_path, overview_level=overview_level)
+        handles[overview_level] = src
+        with self._datasets_lock:
+            self._datasets.append(src)
+        return src
+
+    def _close_dataset(self, src):
+        with self._datasets_lock:
+            if src in self._datasets:
+                self._datasets.remove(src)
+        src.close()
+
+    def dataset_for_zoom(self, z: int):
+        """
+        Raster handle at the coarsest overview still finer than the tile
+
+        Low zooms read a few overview blocks instead of decompressing the
+        full-resolution window.
+        """
+        src = self._dataset()
+        west, _, east, _ = tile_to_bbox(z, 0, 0)
+        decimation = (east - west) / TILE_SIZE / src.res[0]
+
+        level = select_overview_level(src.overviews(1), decimation)
+        if level is None:
+            return src
+        return self._dataset(level)
+
+    def render(self, z: int, x: int, y: int) -> bytes:
+        """Render a tile from the GeoTIFF"""
+        return render_tile(self.dataset_for_zoom(z), z, x, y)
+
+    def close(self):
+        """Close all raster handles and the tile store"""
+        with self._datasets_lock:
+            datasets, self._datasets = self._datasets, []
+        for src in datasets:
+            src.close()
+        self.store.close()
+
+    def get_stats(self) -> dict:
+        """Get tile service statistics"""
+        return {
+            "store_path": str(self.store.path),
+            "store_available": self.store.exists(),
+            "store_hits": self.store_hits,
+            "renders": self.renders,
+            "open_raster_handles": len(self._datasets)
+        }
+
+
+# Global tile service (thread-safe lazy singleton)
+_tile_service: Optional[MapBiomasTileService] = None
+_tile_service_lock = threading.Lock()
+
+
+def get_tile_service() -> MapBiomasTileService:
+    """Get the process-wide MapBiomas tile service"""
+    global _tile_service
+
+    if _tile_service is None:
+        with _tile_service_lock:
+            if _tile_service is None:
+                _tile_service = MapBiomasTileService()
+
+    return _tile_service
+
+
+def close_tile_service():
+    """Release raster handles and the tile store (called on application shutdown)"""
+    global _tile_service
+
+    with _tile_service_lock:
+        if _tile_service is not None:
+            _tile_service.close()
+            _tile_service = None
@@ -0,0 +1,341 @@
+"""
+CP2B Maps V3 - MapBiomas Zonal Histograms
+Precomputed MapBiomas class pixel counts per grid cell and per municipality
+
+The offline job (scripts/build_mapbiomas_histograms.py) stores, in one .npz:
+- grid_counts: (grid_rows, grid_cols, n_classes) pixel counts for square
+  blocks of cell_px x cell_px raster pixels (~1 km), anchored at the raster origin
+- municipality_counts: (n_municipalities, n_classes) counts keyed by IBGE code
+
+A buffer analysis then sums the cells lying fully inside the buffer and only
+masks raster pixels in the cells crossing the buffer rim. Pixels are counted
+when their center falls inside the buffer, as rasterio.mask does.
+"""
+
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+
+# Optional rasterio import - requires GDAL system dependencies
+try:
+    import rasterio
+    from rasterio.features import rasterize
+    from rasterio.windows import Window
+    RASTERIO_AVAILABLE = True
+except ImportError:
+    RASTERIO_AVAILABLE = False
+    rasterio = None
+    rasterize = None
+    Window = None
+
+logger = logging.getLogger(__name__)
+
+# Raster values are counted over the full uint8 range while building
+VALUE_RANGE = 256
+
+# Grid rows read together for rim pixels (fewer, larger raster reads)
+RIM_BAND_ROWS = 8
+
+
+def _convex_row_spans(polygon, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Where horizontal lines cross a convex polygon
+
+    Args:
+        polygon: Convex shapely polygon
+        ys: Line y coordinates
+
+    Returns:
+        Tuple of (x_left, x_right) arrays, NaN where a line misses the polygon
+    """
+    coords = shapely.get_coordinates(polygon.exterior)
+    x1, y1 = coords[:-1, 0], coords[:-1, 1]
+    x2, y2 = coords[1:, 0], coords[1:, 1]
+
+    # Crossing x of every (line, edge) pair; NaN where the edge does not span y
+    y = ys[:, None]
+    spans = (np.minimum(y1, y2) <= y) & (y <= np.maximum(y1, y2)) & (y1 != y2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = np.where(spans, x1 + (y - y1) * (x2 - x1) / (y2 - y1), np.nan)
+
+    crossed = spans.any(axis=1)
+    x_left = np.full(len(ys), np.nan)
+    x_right = np.full(len(ys), np.nan)
+    x_left[crossed] = np.nanmin(xs[crossed], axis=1)
+    x_right[crossed] = np.nanmax(xs[crossed], axis=1)
+    return x_left, x_right
+
+
+class ZonalHistogramIndex:
+    """Precomputed class histograms for a MapBiomas raster"""
+
+    def __init__(
+        self,
+        class_codes: np.ndarray,
+        cell_px: int,
+        grid_counts: np.ndarray,
+        raster_shape: Tuple[int, int],
+        raster_transform: Tuple[float, ...],
+        municipality_codes: Optional[np.ndarray] = None,
+        municipality_counts: Optional[np.ndarray] = None
+    ):
+        self.class_codes = class_codes
+        self.cell_px = int(cell_px)
+        self.grid_counts = grid_counts
+        self.raster_shape = tuple(int(v) for v in raster_shape)
+        self.raster_transform = tuple(float(v) for v in raster_transform)
+
+        codes = municipality_codes if municipality_codes is not None else np.array([], dtype=str)
+        self.municipality_codes = codes
+        self.municipality_counts = (
+            municipality_counts if municipality_counts is not None
+            else np.zeros((0, len(class_codes)), dtype=np.uint32)
+        )
+        self._municipality_rows = {str(code): i for i, code in enumerate(codes)}
+
+    @classmethod
+    def load(cls, path: Path) -> "ZonalHistogramIndex":
+        """Load an index written by save()"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                class_codes=data["class_codes"],
+                cell_px=int(data["cell_px"]),
+                grid_counts=data["grid_counts"],
+                raster_shape=tuple(data["raster_shape"]),
+                raster_transform=tuple(data["raster_transform"]),
+                municipality_codes=data["municipality_codes"],
+                municipality_counts=data["municipality_counts"]
+            )
+
+    def save(self, path: Path):
+        """Write the index as a compressed .npz"""
+        np.savez_compressed(
+            path,
+            class_codes=self.class_codes,
+            cell_px=np.array(self.cell_px),
+            grid_counts=self.grid_counts,
+            raster_shape=np.array(self.raster_shape),
+            raster_transform=np.array(self.raster_transform),
+            municipality_codes=self.municipality_codes,
+            municipality_counts=self.municipality_counts
+        )
+
+    def matches(self, src) -> bool:
+        """Whether the index was built from a raster with this grid"""
+        return (
+            self.raster_shape == (src.height, src.width) and
+            np.allclose(self.raster_transform, tuple(src.transform)[:6])
+        )
+
+    def _to_counts(self, counts: np.ndarray) -> Dict[int, int]:
+        return {
+            int(code): int(count)
+            for code, count in zip(self.class_codes, counts) if count > 0
+        }
+
+    def municipality_pixel_counts(self, ibge_code: str) -> Optional[Dict[int, int]]:
+        """Class pixel counts for a municipality, or None if not indexed"""
+        row = self._municipality_rows.get(str(ibge_code))
+        if row is None:
+            return None
+        return self._to_counts(self.municipality_counts[row])
+
+    def buffer_pixel_counts(self, src, geometry) -> Dict[int, int]:
+        """
+        Class pixel counts for pixels whose centers fall inside a convex polygon
+
+        Each raster row crosses a convex polygon along a single interval, so
+        the covered pixels of every row are a column range. Grid cells whose
+        rows are all fully covered are summed from the index; the remaining
+        covered pixels (the rim) are read from the raster, one window per band
+        of grid rows on each side of the interior.
+
+        Args:
+            src: Open full-resolution rasterio dataset the index was built from
+            geometry: Convex shapely polygon in the raster CRS (e.g. analysis buffer)
+
+        Returns:
+            Dict of class code -> pixel count (nodata included)
+        """
+        height, width = self.raster_shape
+        cell = self.cell_px
+        a, _, c, _, e, f = tuple(src.transform)[:6]
+
+        # Raster rows spanned by the geometry
+        minx, miny, maxx, maxy = geometry.bounds
+        row_first = max(0, int(math.floor((maxy - f) / e)))
+        row_last = min(height - 1, int(math.floor((miny - f) / e)))
+        if row_first > row_last:
+            return {}
+
+        # Covered column range [col_lo, col_hi] of every row (empty: lo > hi)
+        rows = np.arange(row_first, row_last + 1)
+        center_y = f + (rows + 0.5) * e
+        x_left, x_right = _convex_row_spans(geometry, center_y)
+        with np.errstate(invalid="ignore"):
+            col_lo = np.floor((x_left - c) / a - 0.5) + 1
+            col_hi = np.ceil((x_right - c) / a - 0.5) - 1
+        empty = np.isnan(col_lo)
+        col_lo = np.where(empty, width, np.clip(col_lo, 0, width)).astype(np.int64)
+        col_hi = np.where(empty, -1, np.clip(col_hi, -1, width - 1)).astype(np.int64)
+
+        counts = np.zeros(len(self.class_codes), dtype=np.int64)
+        rim_values = np.zeros(VALUE_RANGE, dtype=np.int64)
+
+        # Per row: interior (cell-aligned) column span [inner_lo, inner_hi)
+        inner_lo = np.full(len(rows), width, dtype=np.int64)
+        inner_hi = np.full(len(rows), width, dtype=np.int64)
+
+        for grid_row in range(row_first // cell, row_last // cell + 1):
+            cell_row_start = grid_row * cell
+            cell_row_stop = min(cell_row_start + cell, height)
+            fully_spanned = cell_row_start >= row_first and cell_row_stop - 1 <= row_last
+            if not fully_spanned:
+                continue
+
+            sl = slice(cell_row_start - row_first, cell_row_stop - row_first)
+            lo, hi = col_lo[sl].max(), col_hi[sl].min()
+            gc_start = -(-lo // cell)
+            gc_stop = self.grid_counts.shape[1] if hi + 1 >= width else (hi + 1) // cell
+            if gc_start >= gc_stop:
+                continue
+
+            counts += self.grid_counts[grid_row, gc_start:gc_stop].sum(axis=0, dtype=np.int64)
+            inner_lo[sl] = gc_start * cell
+            inner_hi[sl] = min(gc_stop * cell, width)
+
+        # Rim pixels: left of the interior [col_lo, inner_lo), right (inner_hi, col_hi]
+        left_lo, left_hi = col_lo, np.minimum(inner_lo, col_hi + 1)
+        right_lo, right_hi = np.maximum(inner_hi, col_lo), col_hi + 1
+
+        band = cell * RIM_BAND_ROWS
+        for b0 in range(0, len(rows), band):
+            b1 = min(b0 + band, len(rows))
+            for lo, hi in ((left_lo[b0:b1], left_hi[b0:b1]), (right_lo[b0:b1], right_hi[b0:b1])):
+                has_pixels = hi > lo
+                if not has_pixels.any():
+                    continue
+
+                col_start = int(lo[has_pixels].min())
+                col_stop = int(hi[has_pixels].max())
+                window = Window(col_start, rows[b0], col_stop - col_start, b1 - b0)
+                data = src.read(1, window=window)
+
+                cols = np.arange(col_start, col_stop)
+                within = (cols[None, :] >= lo[:, None]) & (cols[None, :] < hi[:, None])
+                rim_values += np.bincount(
+                    data[within].astype(np.int64), minlength=VALUE_RANGE
+                )[:VALUE_RANGE]
+
+        if rim_values.sum() != rim_values[self.class_codes].sum():
+            logger.warning("Raster values missing from MapBiomas zonal index - rebuild it")
+        counts += rim_values[self.class_codes]
+
+        return self._to_counts(counts)
+
+
+def build_zonal_index(
+    raster_path: Path,
+    cell_px: int,
+    municipalities: Optional[List[Tuple[str, object]]] = None
+) -> ZonalHistogramIndex:
+    """
+    Compute grid-cell and municipality class histograms for a raster
+
+    Reads the raster one grid row (cell_px raster rows) at a time.
+
+    Args:
+        raster_path: MapBiomas GeoTIFF (uint8 class codes)
+        cell_px: Grid cell size in raster pixels
+        municipalities: Optional list of (ibge_code, geometry in raster CRS)
+
+    Returns:
+        ZonalHistogramIndex
+    """
+    municipalities = municipalities or []
+
+    with rasterio.open(raster_path) as src:
+        height, width = src.height, src.width
+        grid_rows = math.ceil(height / cell_px)
+        grid_cols = math.ceil(width / cell_px)
+
+        grid_full = np.zeros((grid_rows, grid_cols, VALUE_RANGE), dtype=np.uint32)
+        muni_full = np.zeros((len(municipalities), VALUE_RANGE), dtype=np.uint64)
+        shapes = [(geom, i + 1) for i, (_, geom) in enumerate(municipalities)]
+        cell_col = np.arange(width) // cell_px
+
+        for grid_row in range(grid_rows):
+            row_start = grid_row * cell_px
+            row_count = min(cell_px, height - row_start)
+            window = Window(0, row_start, width, row_count)
+            data = src.read(1, window=window).astype(np.int64)
+
+            keys = cell_col[None, :] * VALUE_RANGE + data
+            grid_full[grid_row] = np.bincount(
+                keys.ravel(), minlength=grid_cols * VALUE_RANGE
+            ).reshape(grid_cols, VALUE_RANGE)
+
+            if shapes:
+                labels = rasterize(
+                    shapes, out_shape=data.shape,
+                    transform=src.window_transform(window), fill=0, dtype="uint16"
+                ).astype(np.int64)
+                labelled = labels > 0
+                muni_full += np.bincount(
+                    ((labels[labelled] - 1) * VALUE_RANGE + data[labelled]),
+                    minlength=len(municipalities) * VALUE_RANGE
+                ).reshape(len(municipalities), VALUE_RANGE).astype(np.uint64)
+
+        raster_transform = tuple(src.transform)[:6]
+
+    # Keep only values present in the raster
+    class_codes = np.flatnonzero(grid_full.sum(axis=(0, 1))).astype(np.uint8)
+
+    return ZonalHistogramIndex(
+        class_codes=class_codes,
+        cell_px=cell_px,
+        grid_counts=grid_full[:, :, class_codes],
+        raster_shape=(height, width),
+        raster_transform=raster_transform,
+        municipality_codes=np.array([str(code) for code, _ in municipalities]),
+        municipality_counts=muni_full[:, class_codes].astype(np.uint32)
+    )
+
+
+# Global index (thread-safe lazy singleton, reloaded when the file changes)
+_zonal_index: Optional[ZonalHistogramIndex] = None
+_zonal_index_key: Optional[Tuple[str, float]] = None
+_zonal_index_lock = threading.Lock()
+
+
+def get_zonal_index(path: Path) -> Optional[ZonalHistogramIndex]:
+    """
+    Get the process-wide zonal index, or None if it has not been built
+
+    Args:
+        path: Path of the .npz written by the offline job
+    """
+    global _zonal_index, _zonal_index_key
+
+    try:
+        key = (str(path), Path(path).stat().st_mtime)
+    except FileNotFoundError:
+        return None
+
+    if _zonal_index_key != key:
+        with _zonal_index_lock:
+            if _zonal_index_key != key:
+                try:
+                    _zonal_index = ZonalHistogramIndex.load(path)
+                    _zonal_index_key = key
+                    logger.info(f"Loaded MapBiomas zonal index from {path}")
+                except Exception as e:
+                    logger.error(f"Could not load MapBiomas zonal index: {e}")
+                    return None
+
+    return _zonal_index
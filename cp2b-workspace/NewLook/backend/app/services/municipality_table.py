@@ -0,0 +1,272 @@
+"""
+CP2B Maps V3 - Municipality Table
+Process-wide columnar copy of the municipalities table
+
+The table has ~645 rows and is read by most dashboard endpoints and by
+every proximity analysis. It is loaded once with a single query into NumPy
+columns, so rankings, sums, group-bys and histograms are vectorized
+in-process instead of a database/REST round trip plus Python loops.
+
+The copy is reloaded when the table changes: the maintenance task
+compares Postgres' insert/update/delete counters for the table (and
+DATASET_VERSION) with the loaded version.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.executors import get_thread_pool
+from app.services.cache_service import municipality_flight
+from app.utils.analytics import top_k
+
+logger = logging.getLogger(__name__)
+
+# Biogas/energy columns kept as float arrays (NULL -> 0)
+BIOGAS_SUM_COLUMNS = [
+    # Totals
+    "total_biogas_m3_year",
+    "energy_potential_mwh_year",
+    "co2_reduction_tons_year",
+    # By category
+    "urban_biogas_m3_year",
+    "agricultural_biogas_m3_year",
+    "livestock_biogas_m3_year",
+    # Urban detail
+    "rsu_biogas_m3_year",
+    "rpo_biogas_m3_year",
+    # Agricultural residues
+    "sugarcane_biogas_m3_year",
+    "soybean_biogas_m3_year",
+    "corn_biogas_m3_year",
+    "coffee_biogas_m3_year",
+    "citrus_biogas_m3_year",
+    # Livestock residues
+    "cattle_biogas_m3_year",
+    "swine_biogas_m3_year",
+    "poultry_biogas_m3_year",
+    "aquaculture_biogas_m3_year"
+]
+
+# Label used for municipalities without an administrative region
+NO_REGION = "Não definido"
+
+
+def _float_column(rows: List[Dict[str, Any]], name: str, missing: float) -> np.ndarray:
+    return np.array(
+        [float(row[name]) if row.get(name) is not None else missing for row in rows],
+        dtype=float
+    )
+
+
+class MunicipalityTable:
+    """
+    Immutable columnar municipalities table
+
+    Columns are aligned NumPy arrays (position = row). Biogas columns hold
+    0 for NULL; population and area_km2 hold NaN.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], version: str = ""):
+        self.version = version
+        self.loaded_at = time.time()
+
+        self.ids = np.array([row.get("id") or 0 for row in rows], dtype=np.int64)
+        self.names = np.array([row.get("municipality_name") or "" for row in rows], dtype=object)
+        self.ibge_codes = np.array([str(row.get("ibge_code") or "").strip() for row in rows], dtype=object)
+        self.regions = np.array([row.get("administrative_region") or NO_REGION for row in rows], dtype=object)
+        self.population = _float_column(rows, "population", np.nan)
+        self.area_km2 = _float_column(rows, "area_km2", np.nan)
+        self.columns: Dict[str, np.ndarray] = {
+            column: _float_column(rows, column, 0.0) for column in BIOGAS_SUM_COLUMNS
+        }
+
+        self.index_by_ibge: Dict[str, int] = {
+            code: i for i, code in enumerate(self.ibge_codes) if code
+        }
+        self.ibge_by_name: Dict[str, str] = {
+            str(name).strip().upper(): code
+            for name, code in zip(self.names, self.ibge_codes) if code
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, name: str) -> np.ndarray:
+        """Biogas column by name (KeyError if unknown)"""
+        return self.columns[name]
+
+    def sum_columns(self, names: Iterable[str]) -> np.ndarray:
+        """Row-wise sum of several biogas columns"""
+        names = list(names)
+        if not names:
+            return np.zeros(len(self))
+        return np.sum([self.columns[name] for name in names], axis=0)
+
+    def positions(self, ibge_codes: Iterable[str]) -> np.ndarray:
+        """Row positions for IBGE codes (unknown codes are skipped)"""
+        return np.array(
+            [self.index_by_ibge[code] for code in ibge_codes if code in self.index_by_ibge],
+            dtype=np.int64
+        )
+
+    def weighted_totals(
+        self, positions: np.ndarray, weights: np.ndarray, names: Iterable[str] = BIOGAS_SUM_COLUMNS
+    ) -> Dict[str, float]:
+        """Sum of each column over rows, each row scaled by its weight"""
+        names = list(names)
+        matrix = np.column_stack([self.columns[name][positions] for name in names])
+        totals = np.asarray(weights, dtype=float) @ matrix
+        return {name: float(total) for name, total in zip(names, totals)}
+
+    def top(self, values: np.ndarray, limit: int, min_value: Optional[float] = None) -> np.ndarray:
+        """
+        Positions of the largest values, descending (ties keep table order)
+
+        Args:
+            values: Column aligned with the table
+            limit: Maximum positions returned
+            min_value: Keep only values >= min_value (None keeps all)
+        """
+        return top_k(values, limit, min_value=min_value)
+
+    def group_sum(self, values: np.ndarray) -> Dict[str, float]:
+        """Sum of values by administrative region"""
+        regions, inverse = np.unique(self.regions.astype(str), return_inverse=True)
+        totals = np.bincount(inverse, weights=values, minlength=len(regions))
+        return {str(region): float(total) for region, total in zip(regions, totals)}
+
+
+class MunicipalityTableStore:
+    """Holds the current MunicipalityTable and reloads it when the table changes"""
+
+    def __init__(self):
+        self._table: Optional[MunicipalityTable] = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self) -> MunicipalityTable:
+        """
+        Current table, loading it on first use
+
+        Concurrent first calls share one database load.
+
+        Raises:
+            Exception: If the table cannot be loaded from the database
+        """
+        table = self._table
+        if table is None:
+            table, _ = municipality_flight.do("municipality_table", self._load)
+        return table
+
+    def _load(self) -> MunicipalityTable:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            try:
+                version = self._probe_version(cursor)
+                cursor.execute(f"""
+                    SELECT
+                        id,
+                        municipality_name,
+                        ibge_code,
+                        administrative_region,
+                        population,
+                        area_km2,
+                        {", ".join(BIOGAS_SUM_COLUMNS)}
+                    FROM municipalities
+                """)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        table = MunicipalityTable(rows, version)
+        with self._lock:
+            self._table = table
+            self.loads += 1
+        logger.info(f"Municipality table loaded: {len(table)} rows (version {version})")
+        return table
+
+    def _probe_version(self, cursor) -> str:
+        """Version of the municipalities table: DATASET_VERSION + Postgres write counters"""
+        cursor.execute("""
+            SELECT n_tup_ins, n_tup_upd, n_tup_del
+            FROM pg_stat_user_tables
+            WHERE relname = 'municipalities'
+        """)
+        row = cursor.fetchone()
+        counters = f"{row['n_tup_ins']}:{row['n_tup_upd']}:{row['n_tup_del']}" if row else "unknown"
+        return f"{settings.DATASET_VERSION}:{counters}"
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Reload the table if its version changed (periodic maintenance)
+
+        Returns:
+            True if the table was reloaded
+        """
+        if self._table is None:
+            return False
+
+        with get_db() as conn:
+            cursor = conn.cursor()
+            try:
+                version = self._probe_version(cursor)
+            finally:
+                cursor.close()
+
+        if version == self._table.version:
+            return False
+
+        logger.info(f"Municipality table changed ({self._table.version} -> {version}), reloading")
+        municipality_flight.do("municipality_table", self._load)
+        return True
+
+    def set(self, table: Optional[MunicipalityTable]):
+        """Replace the current table (None forces a reload on next use)"""
+        with self._lock:
+            self._table = table
+
+    def get_stats(self) -> dict:
+        table = self._table
+        return {
+            "loaded": table is not None,
+            "rows": len(table) if table is not None else 0,
+            "version": table.version if table is not None else None,
+            "loaded_at": table.loaded_at if table is not None else None,
+            "loads": self.loads
+        }
+
+
+# Global store (process-wide)
+_store: Optional[MunicipalityTableStore] = None
+_store_lock = threading.Lock()
+
+
+def get_municipality_table_store() -> MunicipalityTableStore:
+    """Get or create the process-wide municipality table store"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            # Double-check locking pattern
+            if _store is None:
+                _store = MunicipalityTableStore()
+
+    return _store
+
+
+def get_municipality_table() -> MunicipalityTable:
+    """Current municipality table (loads it on first use)"""
+    return get_municipality_table_store().get()
+
+
+async def load_municipality_table() -> MunicipalityTable:
+    """get_municipality_table() for async endpoints (a first load runs in the thread pool)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), get_municipality_table)
@@ -4,15 +4,27 @@ PostGIS-based spatial analysis for biogas potential assessment
 """
 
 import logging
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import json
 import geopandas as gpd
+import numpy as np
+import shapely
 from shapely.geometry import Point
 from shapely.ops import transform
 import pyproj
-from pathlib import Path
 
 from app.core.database import get_db
+from app.services.municipality_table import (
+    BIOGAS_SUM_COLUMNS,
+    MunicipalityTable,
+    get_municipality_table
+)
+from app.services.geometry_store import (
+    get_geometry_store,
+    SHAPEFILE_DIR,
+    WGS84,
+    UTM_23S
+)
 
 logger = logging.getLogger(__name__)
 
@@ -70,25 +82,48 @@ MAPBIOMAS_RESIDUOS_MAPPING = {
     }
 }
 
-# Coordinate Reference Systems
-WGS84 = "EPSG:4326"  # Input/output
-UTM_23S = "EPSG:31983"  # SIRGAS 2000 / UTM zone 23S - for accurate buffer in meters
 
-# Shapefile directory paths - check Railway deployment first, then local development
-# Railway downloads to: backend/data/shapefiles/
-# Local development uses: project_map/data/shapefile/
-_RAILWAY_SHAPEFILE_DIR = Path(__file__).parent.parent.parent / "data" / "shapefiles"
-_LOCAL_SHAPEFILE_DIR = Path(__file__).parent.parent.parent.parent.parent / "project_map" / "data" / "shapefile"
-
-# Use Railway path if it exists, otherwise fall back to local
-SHAPEFILE_DIR = _RAILWAY_SHAPEFILE_DIR if _RAILWAY_SHAPEFILE_DIR.exists() else _LOCAL_SHAPEFILE_DIR
+# Infrastructure configurations for nearest-feature lookups
+INFRASTRUCTURE_CONFIGS = [
+    {
+        "type": "gas_pipeline",
+        "name": "Gasoduto",
+        "files": ["Gasodutos_Distribuicao_SP", "Gasodutos_Transporte_SP"],
+        "max_distance_km": 100
+    },
+    {
+        "type": "substation",
+        "name": "Subestação",
+        "files": ["Subestacoes_Energia"],
+        "max_distance_km": 50
+    },
+    {
+        "type": "railway",
+        "name": "Rodovia/Ferrovia",
+        "files": ["Rodovias_Estaduais_SP"],
+        "max_distance_km": 50
+    },
+    {
+        "type": "transmission_line",
+        "name": "Linha de Transmissão",
+        "files": ["Linhas_De_Transmissao_Energia"],
+        "max_distance_km": 50
+    },
+    {
+        "type": "ete",
+        "name": "ETE",
+        "files": ["ETEs_2019_SP"],
+        "max_distance_km": 30
+    }
+]
 
 
 class ProximityService:
     """Service for proximity analysis using PostGIS"""
 
     def __init__(self):
-        """Initialize coordinate transformers"""
+        """Initialize coordinate transformers and geometry store"""
+        self.geometry_store = get_geometry_store()
         self.wgs84_to_utm = pyproj.Transformer.from_crs(
             WGS84, UTM_23S, always_xy=True
         ).transform
@@ -131,7 +166,9 @@ class ProximityService:
         """
         Find all municipalities within a radius of a point.
 
-        Uses shapefile for geometry and database for biogas data.
+        Uses the resident shapefile layer for geometry and the in-process
+        municipality table for biogas data. The returned set is
+        meant to be computed once per analysis and passed to aggregation.
 
         Args:
             lat: Latitude of analysis point
@@ -143,79 +180,71 @@ class ProximityService:
         """
         buffer_geojson = self.create_buffer_geojson(lat, lng, radius_km)
 
-        # Create buffer polygon for intersection test
+        # Create buffer polygon in UTM for intersection test
         point = Point(lng, lat)
         point_utm = transform(self.wgs84_to_utm, point)
         buffer_utm = point_utm.buffer(radius_km * 1000)
-        buffer_wgs84 = transform(self.utm_to_wgs84, buffer_utm)
 
         municipalities = []
 
         try:
-            # Load municipalities shapefile
-            shapefile_path = SHAPEFILE_DIR / "SP_Municipios_2024.shp"
-            if not shapefile_path.exists():
-                logger.warning(f"Municipalities shapefile not found: {shapefile_path}")
+            # Get resident municipalities layer
+            layer = self.geometry_store.get_layer("SP_Municipios_2024")
+            if layer is None:
+                logger.warning(f"Municipalities shapefile not found in {SHAPEFILE_DIR}")
                 return buffer_geojson, municipalities
 
-            gdf = gpd.read_file(shapefile_path)
-
-            # Ensure WGS84
-            if gdf.crs != WGS84:
-                gdf = gdf.to_crs(WGS84)
-
-            # Get biogas data from database
-            biogas_data = {}
-            try:
-                with get_db() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT
-                            municipality_name,
-                            ibge_code,
-                            population,
-                            area_km2,
-                            total_biogas_m3_year
-                        FROM municipalities
-                    """)
-                    for row in cursor.fetchall():
-                        # Use municipality name as key
-                        biogas_data[row["municipality_name"]] = row
-                    cursor.close()
-            except Exception as e:
-                logger.warning(f"Could not load biogas data from database: {e}")
-
-            # Find intersecting municipalities
-            muni_id = 0
-            for idx, row in gdf.iterrows():
-                geom = row.geometry
-                if geom is None:
-                    continue
-
-                # Check if municipality intersects buffer
-                if geom.intersects(buffer_wgs84):
-                    # Calculate distance from point to municipality centroid
-                    centroid = geom.centroid
-                    centroid_utm = transform(self.wgs84_to_utm, centroid)
-                    distance_km = point_utm.distance(centroid_utm) / 1000
-
-                    # Get municipality name from shapefile
-                    muni_name = row.get("NM_MUN", row.get("nome", f"Municipality_{idx}"))
-
-                    # Get biogas data if available
-                    muni_biogas = biogas_data.get(muni_name, {})
-
-                    muni_id += 1
-                    municipalities.append({
-                        "id": muni_id,
-                        "name": muni_name,
-                        "ibge_code": muni_biogas.get("ibge_code") or row.get("CD_MUN"),
-                        "distance_km": round(distance_km, 2),
-                        "intersection_percent": 100,  # Simplified for now
-                        "population": muni_biogas.get("population"),
-                        "area_km2": muni_biogas.get("area_km2") or row.get("AREA_KM2"),
-                        "biogas_m3_year": muni_biogas.get("total_biogas_m3_year") or 0
-                    })
+            gdf = layer.gdf_wgs84
+
+            # Columnar municipality table (in-process; None if the database is down)
+            table = self._municipality_table()
+            index_by_ibge = table.index_by_ibge if table is not None else {}
+            ibge_by_name = table.ibge_by_name if table is not None else {}
+
+            # Find intersecting municipalities via the layer's spatial index
+            candidates = layer.query_intersecting(buffer_utm)
+            distances_km = shapely.distance(point_utm, layer.centroids_utm[candidates]) / 1000
+
+            # Share of each municipality's area inside the buffer
+            fractions = layer.intersection_fractions(buffer_utm, candidates)
+
+            for muni_id, (idx, distance_km, fraction) in enumerate(
+                zip(candidates, distances_km, fractions), start=1
+            ):
+                row = gdf.iloc[idx]
+
+                # Get municipality name and IBGE code from shapefile
+                muni_name = row.get("NM_MUN", row.get("nome", f"Municipality_{idx}"))
+                ibge_code = str(row.get("CD_MUN") or "").strip()
+                if ibge_code not in index_by_ibge:
+                    ibge_code = ibge_by_name.get(str(muni_name).strip().upper(), ibge_code)
+
+                # Get biogas data if available
+                position = index_by_ibge.get(ibge_code)
+                fraction = float(fraction)
+
+                # Population and biogas are pro-rated by intersected area
+                population = None
+                area_km2 = None
+                biogas = 0.0
+                if position is not None:
+                    if not np.isnan(table.population[position]):
+                        population = int(round(table.population[position] * fraction))
+                    if not np.isnan(table.area_km2[position]):
+                        area_km2 = float(table.area_km2[position])
+                    biogas = float(table.column("total_biogas_m3_year")[position])
+
+                municipalities.append({
+                    "id": muni_id,
+                    "name": muni_name,
+                    "ibge_code": ibge_code or None,
+                    "distance_km": round(float(distance_km), 2),
+                    "intersection_percent": round(fraction * 100, 2),
+                    "intersection_fraction": fraction,
+                    "population": population,
+                    "area_km2": area_km2 or row.get("AREA_KM2"),
+                    "biogas_m3_year": biogas * fraction
+                })
 
             # Sort by distance
             municipalities.sort(key=lambda x: x["distance_km"])
@@ -228,111 +257,111 @@ class ProximityService:
 
         return buffer_geojson, municipalities
 
+    def get_top_municipality_centroids(self, top_n: int) -> List[Dict[str, Any]]:
+        """
+        Centroids of the municipalities with the highest biogas potential.
+
+        Used to prewarm the proximity cache with the most requested areas.
+
+        Args:
+            top_n: Number of municipalities to return
+
+        Returns:
+            List of {name, ibge_code, latitude, longitude}, highest potential first
+        """
+        layer = self.geometry_store.get_layer("SP_Municipios_2024")
+        if layer is None or top_n <= 0:
+            return []
+
+        table = self._municipality_table()
+        ibge_codes = layer.gdf_wgs84.get("CD_MUN")
+        if ibge_codes is None or table is None:
+            return []
+
+        layer_index = {code: idx for idx, code in enumerate(ibge_codes.astype(str).str.strip())}
+        in_layer = np.array([code in layer_index for code in table.ibge_codes], dtype=bool)
+        values = np.where(in_layer, table.column("total_biogas_m3_year"), -np.inf)
+
+        centroids = []
+        for position in table.top(values, top_n, min_value=0):
+            code = table.ibge_codes[position]
+            centroid = transform(self.utm_to_wgs84, layer.centroids_utm[layer_index[code]])
+            centroids.append({
+                "name": table.names[position],
+                "ibge_code": code,
+                "latitude": centroid.y,
+                "longitude": centroid.x
+            })
+        return centroids
+
+    def _municipality_table(self) -> Optional[MunicipalityTable]:
+        """In-process municipality table, or None if it cannot be loaded"""
+        try:
+            return get_municipality_table()
+        except Exception as e:
+            logger.warning(f"Could not load biogas data from database: {e}")
+            return None
+
     def aggregate_biogas_potential(
-        self, lat: float, lng: float, radius_km: float
+        self, municipalities: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """
-        Aggregate biogas potential for all municipalities in radius.
+        Aggregate biogas potential for municipalities found in radius.
 
-        First finds municipalities via shapefile, then aggregates their biogas data.
+        Sums the in-process municipality table (one weighted matrix
+        product), keyed by the IBGE codes from get_municipalities_in_radius.
+        Each municipality contributes in proportion to its area inside the
+        buffer.
 
         Args:
-            lat: Latitude of analysis point
-            lng: Longitude of analysis point
-            radius_km: Search radius in kilometers
+            municipalities: Municipality set returned by get_municipalities_in_radius
 
         Returns:
             Dictionary with aggregated biogas potential data
         """
-        # First get the municipality names in radius
-        _, municipalities = self.get_municipalities_in_radius(lat, lng, radius_km)
-
         if not municipalities:
             return self._empty_biogas_result()
 
-        # Get the municipality names
-        muni_names = [m["name"] for m in municipalities]
-
-        if not muni_names:
+        table = self._municipality_table()
+        if table is None:
             return self._empty_biogas_result()
 
-        # Query biogas data for these municipalities
-        placeholders = ", ".join(["%s"] * len(muni_names))
-        query = f"""
-        SELECT
-            -- Totals
-            COALESCE(SUM(m.total_biogas_m3_year), 0) as total_biogas,
-            COALESCE(SUM(m.energy_potential_mwh_year), 0) as total_energy_mwh,
-            COALESCE(SUM(m.co2_reduction_tons_year), 0) as total_co2_reduction,
-
-            -- By category
-            COALESCE(SUM(m.urban_biogas_m3_year), 0) as urban_biogas,
-            COALESCE(SUM(m.agricultural_biogas_m3_year), 0) as agricultural_biogas,
-            COALESCE(SUM(m.livestock_biogas_m3_year), 0) as livestock_biogas,
-
-            -- Urban detail
-            COALESCE(SUM(m.rsu_biogas_m3_year), 0) as rsu_biogas,
-            COALESCE(SUM(m.rpo_biogas_m3_year), 0) as rpo_biogas,
-
-            -- Agricultural residues
-            COALESCE(SUM(m.sugarcane_biogas_m3_year), 0) as sugarcane_biogas,
-            COALESCE(SUM(m.soybean_biogas_m3_year), 0) as soybean_biogas,
-            COALESCE(SUM(m.corn_biogas_m3_year), 0) as corn_biogas,
-            COALESCE(SUM(m.coffee_biogas_m3_year), 0) as coffee_biogas,
-            COALESCE(SUM(m.citrus_biogas_m3_year), 0) as citrus_biogas,
-
-            -- Livestock residues
-            COALESCE(SUM(m.cattle_biogas_m3_year), 0) as cattle_biogas,
-            COALESCE(SUM(m.swine_biogas_m3_year), 0) as swine_biogas,
-            COALESCE(SUM(m.poultry_biogas_m3_year), 0) as poultry_biogas,
-            COALESCE(SUM(m.aquaculture_biogas_m3_year), 0) as aquaculture_biogas
-
-        FROM municipalities m
-        WHERE m.municipality_name IN ({placeholders})
-        """
-
-        try:
-            with get_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, tuple(muni_names))
-                row = cursor.fetchone()
-                cursor.close()
+        matched = [m for m in municipalities if m.get("ibge_code") in table.index_by_ibge]
+        if not matched:
+            return self._empty_biogas_result()
 
-                if not row:
-                    return self._empty_biogas_result()
+        positions = table.positions(m["ibge_code"] for m in matched)
+        fractions = np.array([m.get("intersection_fraction", 1.0) for m in matched], dtype=float)
+        totals = table.weighted_totals(positions, fractions, BIOGAS_SUM_COLUMNS)
 
-                # Calculate homes powered (average Brazilian home uses ~150 kWh/month)
-                total_energy = float(row["total_energy_mwh"]) if row["total_energy_mwh"] else 0
-                homes_powered = int(total_energy * 1000 / (150 * 12)) if total_energy > 0 else 0
+        # Calculate homes powered (average Brazilian home uses ~150 kWh/month)
+        total_energy = totals["energy_potential_mwh_year"]
+        homes_powered = int(total_energy * 1000 / (150 * 12)) if total_energy > 0 else 0
 
-                return {
-                    "total_m3_year": float(row["total_biogas"]) if row["total_biogas"] else 0,
-                    "by_category": {
-                        "Urbano": float(row["urban_biogas"]) if row["urban_biogas"] else 0,
-                        "Agrícola": float(row["agricultural_biogas"]) if row["agricultural_biogas"] else 0,
-                        "Pecuário": float(row["livestock_biogas"]) if row["livestock_biogas"] else 0
-                    },
-                    "by_residue": {
-                        "RSU (Resíduos Sólidos Urbanos)": float(row["rsu_biogas"]) if row["rsu_biogas"] else 0,
-                        "RPO (Resíduos Orgânicos)": float(row["rpo_biogas"]) if row["rpo_biogas"] else 0,
-                        "Cana-de-açúcar": float(row["sugarcane_biogas"]) if row["sugarcane_biogas"] else 0,
-                        "Soja": float(row["soybean_biogas"]) if row["soybean_biogas"] else 0,
-                        "Milho": float(row["corn_biogas"]) if row["corn_biogas"] else 0,
-                        "Café": float(row["coffee_biogas"]) if row["coffee_biogas"] else 0,
-                        "Citros": float(row["citrus_biogas"]) if row["citrus_biogas"] else 0,
-                        "Bovinos": float(row["cattle_biogas"]) if row["cattle_biogas"] else 0,
-                        "Suínos": float(row["swine_biogas"]) if row["swine_biogas"] else 0,
-                        "Aves": float(row["poultry_biogas"]) if row["poultry_biogas"] else 0,
-                        "Aquicultura": float(row["aquaculture_biogas"]) if row["aquaculture_biogas"] else 0
-                    },
-                    "energy_potential_mwh_year": total_energy,
-                    "co2_reduction_tons_year": float(row["total_co2_reduction"]) if row["total_co2_reduction"] else 0,
-                    "homes_powered_equivalent": homes_powered
-                }
-
-        except Exception as e:
-            logger.error(f"Error aggregating biogas potential: {e}")
-            return self._empty_biogas_result()
+        return {
+            "total_m3_year": totals["total_biogas_m3_year"],
+            "by_category": {
+                "Urbano": totals["urban_biogas_m3_year"],
+                "Agrícola": totals["agricultural_biogas_m3_year"],
+                "Pecuário": totals["livestock_biogas_m3_year"]
+            },
+            "by_residue": {
+                "RSU (Resíduos Sólidos Urbanos)": totals["rsu_biogas_m3_year"],
+                "RPO (Resíduos Orgânicos)": totals["rpo_biogas_m3_year"],
+                "Cana-de-açúcar": totals["sugarcane_biogas_m3_year"],
+                "Soja": totals["soybean_biogas_m3_year"],
+                "Milho": totals["corn_biogas_m3_year"],
+                "Café": totals["coffee_biogas_m3_year"],
+                "Citros": totals["citrus_biogas_m3_year"],
+                "Bovinos": totals["cattle_biogas_m3_year"],
+                "Suínos": totals["swine_biogas_m3_year"],
+                "Aves": totals["poultry_biogas_m3_year"],
+                "Aquicultura": totals["aquaculture_biogas_m3_year"]
+            },
+            "energy_potential_mwh_year": total_energy,
+            "co2_reduction_tons_year": totals["co2_reduction_tons_year"],
+            "homes_powered_equivalent": homes_powered
+        }
 
     def _empty_biogas_result(self) -> Dict[str, Any]:
         """Return empty biogas result structure"""
@@ -349,24 +378,19 @@ class ProximityService:
             "homes_powered_equivalent": 0
         }
 
-    def get_residuos_for_municipalities(
-        self, municipality_names: List[str]
-    ) -> Dict[str, Any]:
+    def get_residuos_for_municipalities(self) -> Dict[str, Any]:
         """
         Get detailed residuos data for municipalities.
 
         Retrieves residue types with their chemical parameters (BMP, TS, VS)
-        for biogas calculation refinement.
-
-        Args:
-            municipality_names: List of municipality names to query
+        for biogas calculation refinement. The residuos table has no
+        municipality dimension, so the result is the same for any non-empty
+        municipality set; per-municipality potential comes from
+        aggregate_biogas_potential.
 
         Returns:
             Dictionary with residuos organized by sector and subsector
         """
-        if not municipality_names:
-            return self._empty_residuos_result()
-
         try:
             with get_db() as conn:
                 cursor = conn.cursor()
@@ -592,54 +616,32 @@ class ProximityService:
         Returns:
             List of nearest infrastructure items
         """
-        analysis_point = Point(lng, lat)
-        results = []
-
-        # Infrastructure configurations
-        infrastructure_configs = [
-            {
-                "type": "gas_pipeline",
-                "name": "Gasoduto",
-                "files": ["Gasodutos_Distribuicao_SP", "Gasodutos_Transporte_SP"],
-                "max_distance_km": 100
-            },
-            {
-                "type": "substation",
-                "name": "Subestação",
-                "files": ["Subestacoes_Energia"],
-                "max_distance_km": 50
-            },
-            {
-                "type": "railway",
-                "name": "Rodovia/Ferrovia",
-                "files": ["Rodovias_Estaduais_SP"],
-                "max_distance_km": 50
-            },
-            {
-                "type": "transmission_line",
-                "name": "Linha de Transmissão",
-                "files": ["Linhas_De_Transmissao_Energia"],
-                "max_distance_km": 50
-            },
-            {
-                "type": "ete",
-                "name": "ETE",
-                "files": ["ETEs_2019_SP"],
-                "max_distance_km": 30
-            }
+        return [
+            self.find_nearest_infrastructure_of_type(lat, lng, config)
+            for config in INFRASTRUCTURE_CONFIGS
         ]
 
-        for config in infrastructure_configs:
-            result = self._find_nearest_from_shapefiles(
-                analysis_point,
-                config["files"],
-                config["type"],
-                config["name"],
-                config["max_distance_km"]
-            )
-            results.append(result)
+    def find_nearest_infrastructure_of_type(
+        self, lat: float, lng: float, config: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Find nearest infrastructure for a single configuration.
 
-        return results
+        Args:
+            lat: Latitude of analysis point
+            lng: Longitude of analysis point
+            config: Entry from INFRASTRUCTURE_CONFIGS
+
+        Returns:
+            Nearest infrastructure item
+        """
+        return self._find_nearest_from_shapefiles(
+            Point(lng, lat),
+            config["files"],
+            config["type"],
+            config["name"],
+            config["max_distance_km"]
+        )
 
     def _find_nearest_from_shapefiles(
         self,
@@ -665,45 +667,35 @@ class ProximityService:
         nearest_distance = float('inf')
         nearest_feature = None
 
+        # Transform point to UTM for accurate distance
+        point_utm = transform(self.wgs84_to_utm, point)
+
         for shapefile_name in shapefile_names:
-            shapefile_path = SHAPEFILE_DIR / f"{shapefile_name}.shp"
+            try:
+                layer = self.geometry_store.get_layer(shapefile_name)
 
-            if not shapefile_path.exists():
-                logger.warning(f"Shapefile not found: {shapefile_path}")
-                continue
+                if layer is None:
+                    logger.warning(f"Shapefile not found: {SHAPEFILE_DIR / shapefile_name}.shp")
+                    continue
 
-            try:
-                gdf = gpd.read_file(shapefile_path)
-
-                # Ensure WGS84
-                if gdf.crs != WGS84:
-                    gdf = gdf.to_crs(WGS84)
-
-                # Transform point to UTM for accurate distance
-                point_utm = transform(self.wgs84_to_utm, point)
-
-                # Calculate distance for each feature
-                for idx, row in gdf.iterrows():
-                    geom = row.geometry
-                    if geom is None:
-                        continue
-
-                    # Transform geometry to UTM
-                    geom_utm = transform(self.wgs84_to_utm, geom)
-
-                    # Calculate distance in km
-                    distance_km = point_utm.distance(geom_utm) / 1000
-
-                    if distance_km < nearest_distance:
-                        nearest_distance = distance_km
-                        nearest_feature = {
-                            "name": row.get("nome", row.get("NOME", row.get("name", shapefile_name))),
-                            "properties": {
-                                k: str(v) if v is not None else None
-                                for k, v in row.items()
-                                if k != "geometry" and not str(k).startswith("_")
-                            }
+                # Nearest feature via the layer's spatial index (distance in meters)
+                idx, distance_m = layer.nearest(point_utm)
+                if idx is None:
+                    continue
+
+                distance_km = distance_m / 1000
+
+                if distance_km < nearest_distance:
+                    row = layer.gdf_wgs84.iloc[idx]
+                    nearest_distance = distance_km
+                    nearest_feature = {
+                        "name": row.get("nome", row.get("NOME", row.get("name", shapefile_name))),
+                        "properties": {
+                            k: str(v) if v is not None else None
+                            for k, v in row.items()
+                            if k != "geometry" and not str(k).startswith("_")
                         }
+                    }
 
             except Exception as e:
                 logger.error(f"Error reading shapefile {shapefile_name}: {e}")
@@ -0,0 +1,223 @@
+"""
+CP2B Maps V3 - Vector Tile Service
+Mapbox Vector Tiles cut from the resident shapefile layers
+
+Each tile is built from the geometry store: features are found with the
+layer's WGS84 bounding-box index, taken at the simplification level for the
+tile zoom, projected to tile coordinates, clipped to the tile (plus a small
+buffer so strokes do not show seams) and encoded with app.utils.mvt.
+Encoded tiles are kept in the in-process tile cache with their ETag.
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from app.services.cache_service import tile_cache
+from app.services.geometry_store import GeometryLayer, GeometryStore, get_geometry_store, simplify_level
+from app.services.mapbiomas_tiles import tile_etag, tile_to_bbox
+from app.utils.mvt import DEFAULT_EXTENT, encode_layer, encode_tile
+
+logger = logging.getLogger(__name__)
+
+# Tile layer name -> shapefiles (same layers as the GeoJSON endpoints)
+VECTOR_TILE_LAYERS: Dict[str, List[str]] = {
+    "municipalities": ["SP_Municipios_2024"],
+    "railways": ["Rodovias_Estaduais_SP"],
+    "pipelines": ["Gasodutos_Distribuicao_SP", "Gasodutos_Transporte_SP"],
+    "substations": ["Subestacoes_Energia"],
+    "biogas-plants": ["Plantas_Biogas_SP"],
+    "transmission-lines": ["Linhas_De_Transmissao_Energia"],
+    "etes": ["ETEs_2019_SP"],
+    "administrative-regions": ["Regiao_Adm_SP"],
+    "intermediate-regions": ["SP_RG_Intermediarias_2024"],
+    "immediate-regions": ["SP_RG_Imediatas_2024"],
+    "sp-boundary": ["Limite_SP"],
+}
+
+# Supported zoom range
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+
+# Tile coordinate space and clip buffer (in tile units)
+TILE_EXTENT = DEFAULT_EXTENT
+TILE_BUFFER = 64
+
+# Web Mercator latitude limit
+MAX_LATITUDE = 85.0511287798
+
+
+def _tile_transform(z: int, x: int, y: int, extent: int = TILE_EXTENT):
+    """Vectorized lon/lat -> tile coordinate transform for shapely.transform"""
+    n = 2.0 ** z
+
+    def transform(coords: np.ndarray) -> np.ndarray:
+        lng = coords[:, 0]
+        lat_rad = np.radians(np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+        px = ((lng + 180.0) / 360.0 * n - x) * extent
+        py = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n - y) * extent
+        return np.column_stack([px, py])
+
+    return transform
+
+
+class VectorTileService:
+    """
+    Builds and caches MVT tiles for the layers in VECTOR_TILE_LAYERS
+
+    Thread-safe; tile building is blocking and should run off the event loop.
+    """
+
+    def __init__(self, store: Optional[GeometryStore] = None):
+        self._store = store
+
+        # Statistics
+        self.renders = 0
+
+    @property
+    def store(self) -> GeometryStore:
+        return self._store or get_geometry_store()
+
+    def _layers(self, name: str) -> List[GeometryLayer]:
+        """Loaded shapefile layers behind a tile layer (missing shapefiles skipped)"""
+        if name not in VECTOR_TILE_LAYERS:
+            raise KeyError(name)
+        layers = [self.store.get_layer(shapefile) for shapefile in VECTOR_TILE_LAYERS[name]]
+        return [layer for layer in layers if layer is not None]
+
+    def available_properties(self, name: str) -> List[str]:
+        """
+        Attribute columns a tile layer can include
+
+        Raises:
+            KeyError: If the tile layer is unknown
+        """
+        columns: List[str] = []
+        for layer in self._layers(name):
+            for column in layer.gdf_wgs84.columns:
+                if column != layer.gdf_wgs84.geometry.name and column not in columns:
+                    columns.append(column)
+        return columns
+
+    def describe_layer(self, name: str) -> dict:
+        """Availability and selectable properties of a tile layer"""
+        return {
+            "available": bool(self._layers(name)),
+            "properties": self.available_properties(name)
+        }
+
+    def get_tile(
+        self, name: str, z: int, x: int, y: int, properties: Optional[Sequence[str]] = None
+    ) -> Tuple[bytes, str]:
+        """
+        Get an encoded tile and its ETag
+
+        Args:
+            name: Tile layer name (key of VECTOR_TILE_LAYERS)
+            z: Zoom level
+            x: Tile X coordinate
+            y: Tile Y coordinate
+            properties: Attribute columns to include (None = all)
+
+        Returns:
+            Tuple of (mvt_bytes, etag); tiles without features are empty
+
+        Raises:
+            KeyError: If the tile layer is unknown
+            LookupError: If none of the layer's shapefiles are available
+            ValueError: If a requested property does not exist
+        """
+        layers = self._layers(name)
+        if not layers:
+            raise LookupError(f"No shapefile available for layer {name}")
+
+        available = self.available_properties(name)
+        if properties is None:
+            properties = available
+        else:
+            unknown = [p for p in properties if p not in available]
+            if unknown:
+                raise ValueError(f"Unknown properties for layer {name}: {', '.join(unknown)}")
+            # Canonical order so equivalent selections share a cache entry
+            properties = [p for p in available if p in properties]
+
+        # Layer files and mtimes in the key: a reloaded shapefile gets new tiles
+        version = ":".join(f"{layer.path}@{layer.mtime}" for layer in layers)
+        key = f"mvt:{name}:{version}:{z}/{x}/{y}:{','.join(properties)}"
+        cached = tile_cache.get(key)
+        if cached is not None:
+            return cached
+
+        data = self.render(layers, name, z, x, y, properties)
+        self.renders += 1
+
+        entry = (data, tile_etag(data))
+        tile_cache.set(key, entry)
+        return entry
+
+    def render(
+        self, layers: List[GeometryLayer], name: str, z: int, x: int, y: int, properties: Sequence[str]
+    ) -> bytes:
+        """Encode the features of layers that fall in a tile"""
+        west, south, east, north = tile_to_bbox(z, x, y)
+        pad_x = (east - west) * TILE_BUFFER / TILE_EXTENT
+        pad_y = (north - south) * TILE_BUFFER / TILE_EXTENT
+        transform = _tile_transform(z, x, y)
+        level = simplify_level(zoom=z)
+
+        features = []
+        for layer in layers:
+            indices = layer.query_bbox(west - pad_x, south - pad_y, east + pad_x, north + pad_y)
+            if not len(indices):
+                continue
+
+            geometries = shapely.transform(layer.simplified(level)[indices], transform)
+            geometries = shapely.clip_by_rect(
+                geometries, -TILE_BUFFER, -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER, TILE_EXTENT + TILE_BUFFER
+            )
+            # Snap to the integer tile grid (repairs rings collapsed by rounding)
+            geometries = shapely.set_precision(geometries, 1.0)
+
+            columns = [c for c in properties if c in layer.gdf_wgs84.columns]
+            if columns:
+                records = layer.gdf_wgs84.iloc[indices][columns].to_dict("records")
+            else:
+                records = [{}] * len(indices)  # to_dict() of a column-less frame is []
+
+            for geometry, record in zip(geometries, records):
+                if geometry is None or geometry.is_empty:
+                    continue
+                features.append((
+                    geometry,
+                    {key: None if pd.isna(value) else value for key, value in record.items()},
+                    None
+                ))
+
+        if not features:
+            return b""
+        return encode_tile([encode_layer(name, features, extent=TILE_EXTENT)])
+
+    def get_stats(self) -> dict:
+        """Get vector tile statistics"""
+        return {"renders": self.renders}
+
+
+# Global vector tile service (thread-safe lazy singleton)
+_vector_tile_service: Optional[VectorTileService] = None
+_vector_tile_service_lock = threading.Lock()
+
+
+def get_vector_tile_service() -> VectorTileService:
+    """Get the process-wide vector tile service"""
+    global _vector_tile_service
+
+    if _vector_tile_service is None:
+        with _vector_tile_service_lock:
+            if _vector_tile_service is None:
+                _vector_tile_service = VectorTileService()
+
+    return _vector_tile_service
@@ -0,0 +1,120 @@
+"""
+Vectorized analytics helpers for dashboard endpoints
+Top-k, histograms and summary statistics over NumPy columns
+
+Used with the columnar municipality table (app/services/municipality_table.py)
+so the dashboard endpoints run in O(n) NumPy calls instead of Python loops.
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# Bin scales accepted by histogram()
+HISTOGRAM_SCALES = ("linear", "log")
+
+# Percentiles reported by summary_statistics()
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def top_k(values: np.ndarray, k: int, min_value: Optional[float] = None) -> np.ndarray:
+    """
+    Positions of the k largest values, descending
+
+    Uses argpartition (O(n)) and only sorts the selected k. Ties keep
+    position order, so results match a stable full sort.
+
+    Args:
+        values: 1-D array
+        k: Maximum positions returned
+        min_value: Keep only values >= min_value (None keeps all)
+
+    Returns:
+        Int array of positions into values
+    """
+    values = np.asarray(values, dtype=float)
+    candidates = np.arange(len(values))
+    if min_value is not None:
+        candidates = candidates[values >= min_value]
+    if k <= 0 or not candidates.size:
+        return candidates[:0]
+
+    subset = values[candidates]
+    if k < subset.size:
+        # Everything above the k-th largest value, then ties in position order
+        kth = subset[np.argpartition(-subset, k - 1)[k - 1]]
+        above = np.flatnonzero(subset > kth)
+        ties = np.flatnonzero(subset == kth)[:k - above.size]
+        chosen = np.concatenate([above, ties])
+    else:
+        chosen = np.arange(subset.size)
+
+    order = np.argsort(-subset[chosen], kind="stable")
+    return candidates[chosen[order]]
+
+
+def histogram(values: np.ndarray, bins: int, scale: str = "linear") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Histogram over [min, max] of values
+
+    Bins are half-open except the last one, which includes the maximum.
+
+    Args:
+        values: 1-D array (must be > 0 for scale="log")
+        bins: Number of bins
+        scale: "linear" (equal width) or "log" (equal ratio, for skewed data)
+
+    Returns:
+        (counts, edges) with len(edges) == bins + 1
+
+    Raises:
+        ValueError: If scale is unknown, or "log" with non-positive values
+    """
+    if scale not in HISTOGRAM_SCALES:
+        raise ValueError(f"Unknown histogram scale: {scale}")
+
+    values = np.asarray(values, dtype=float)
+    min_val = float(values.min())
+    max_val = float(values.max())
+
+    if scale == "log" and max_val > min_val:
+        if min_val <= 0:
+            raise ValueError("Log-scale bins require positive values")
+        edges = np.geomspace(min_val, max_val, bins + 1)
+        return np.histogram(values, bins=edges)
+
+    return np.histogram(values, bins=bins, range=(min_val, max_val))
+
+
+def summary_statistics(
+    values: np.ndarray, percentiles: Iterable[float] = DEFAULT_PERCENTILES
+) -> Dict[str, object]:
+    """
+    Count, min, max, mean, median, population std and percentiles
+
+    The median is the upper middle value (values[n // 2] once sorted), as
+    reported by the dashboard before; percentiles are linearly interpolated.
+
+    Args:
+        values: Non-empty 1-D array
+        percentiles: Percentiles to report (0-100)
+
+    Returns:
+        Dict of statistics rounded to 2 decimals; percentiles keyed "p<q>"
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.size
+    percentiles = list(percentiles)
+    quantiles = np.percentile(values, percentiles) if percentiles else []
+
+    return {
+        "count": int(n),
+        "min": round(float(values.min()), 2),
+        "max": round(float(values.max()), 2),
+        "mean": round(float(values.mean()), 2),
+        "median": round(float(np.partition(values, n // 2)[n // 2]), 2),
+        "std": round(float(values.std()), 2),
+        "percentiles": {
+            f"p{q:g}": round(float(value), 2) for q, value in zip(percentiles, quantiles)
+        }
+    }
@@ -0,0 +1,91 @@
+"""
+Geohash encoding for snapping analysis points to a grid
+
+A geohash cell at precision 6 is about 1.2 km x 0.6 km; nearby clicks
+falling in the same cell snap to its center and share cached analyses.
+"""
+
+from typing import Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: i for i, char in enumerate(_BASE32)}
+
+
+def encode(lat: float, lng: float, precision: int = 6) -> str:
+    """
+    Encode a WGS84 point as a geohash
+
+    Args:
+        lat: Latitude in degrees
+        lng: Longitude in degrees
+        precision: Number of base32 characters (1-12)
+
+    Returns:
+        Geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # bits alternate lng, lat, starting with lng
+
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+
+    return "".join(chars)
+
+
+def decode_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    Decode a geohash to its cell bounds
+
+    Returns:
+        Tuple of (min_lat, min_lng, max_lat, max_lng)
+
+    Raises:
+        ValueError: If the geohash contains invalid characters
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        if char not in _DECODE:
+            raise ValueError(f"Invalid geohash character: {char!r}")
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def snap(lat: float, lng: float, precision: int = 6) -> Tuple[float, float, str]:
+    """
+    Snap a point to the center of its geohash cell
+
+    Returns:
+        Tuple of (center_lat, center_lng, geohash)
+    """
+    geohash = encode(lat, lng, precision)
+    min_lat, min_lng, max_lat, max_lng = decode_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2, geohash
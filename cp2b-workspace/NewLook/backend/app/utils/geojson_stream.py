@@ -0,0 +1,227 @@
+"""
+CP2B Maps V3 - GeoJSON Streaming Utility
+Stream GeoJSON features to the client without parsing them
+
+Database queries select one text column per row holding a complete Feature
+(jsonb_build_object(...)::text). Rows are read through a server-side cursor
+in batches and written into the FeatureCollection envelope as bytes, so the
+payload never becomes Python dicts or goes through Pydantic validation.
+
+Shapefile layers are serialized the same way: geometry arrays go straight
+to GeoJSON text (shapely.to_geojson, coordinates rounded) and attribute
+rows to JSON objects, giving one bytes string per Feature that callers can
+cache and stream in chunks.
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import threading
+import uuid
+from contextlib import ExitStack
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+import shapely
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.executors import get_thread_pool
+
+logger = logging.getLogger(__name__)
+
+GEOJSON_MEDIA_TYPE = "application/geo+json"
+
+# Feature rows fetched from the server-side cursor per round trip
+FETCH_SIZE = 500
+
+FEATURE_COLLECTION_HEAD = b'{"type": "FeatureCollection", "features": ['
+FEATURE_COLLECTION_TAIL = b"]}"
+
+# Decimal places kept in serialized WGS84 coordinates (6 = ~0.1 m)
+COORDINATE_PRECISION = settings.GEOJSON_COORDINATE_PRECISION
+
+
+async def stream_feature_collection(
+    query: str,
+    params: Optional[Sequence] = None,
+    fetch_size: int = FETCH_SIZE
+) -> StreamingResponse:
+    """
+    Run a feature query and stream the rows as a GeoJSON FeatureCollection
+
+    The query is executed and the first batch fetched in the shared thread
+    pool before returning, so the event loop is not blocked and database
+    errors in that step still raise psycopg2.Error in the endpoint. Later
+    batches are fetched in the pool as the body is sent. An error while
+    streaming cannot reach the endpoint's error handling (the status and
+    headers are already sent): it is logged and the client gets a
+    truncated body.
+
+    The pooled connection is released when the body finishes, or by the
+    response's background task, which also runs when the client
+    disconnects before the body starts.
+
+    Args:
+        query: SQL selecting a single text column with one Feature per row
+        params: Query parameters
+        fetch_size: Rows per fetch from the server-side cursor
+
+    Returns:
+        StreamingResponse with media type application/geo+json
+    """
+    stack = ExitStack()
+    release_lock = threading.Lock()
+
+    def release():
+        # Idempotent: the body's finally and the background task both call it
+        with release_lock:
+            stack.close()
+
+    def open_cursor():
+        try:
+            conn = stack.enter_context(get_db())
+            # Named cursor = server-side; plain cursor returns the text unparsed
+            cursor = stack.enter_context(conn.cursor(
+                name=f"geojson_{uuid.uuid4().hex}",
+                cursor_factory=psycopg2.extensions.cursor
+            ))
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            return cursor, cursor.fetchmany(fetch_size)
+        except BaseException:
+            # Let get_db() roll back and return the connection to the pool
+            if not stack.__exit__(*sys.exc_info()):
+                raise
+
+    opening = get_thread_pool().submit(open_cursor)
+    try:
+        cursor, first_batch = await asyncio.wrap_future(opening)
+    except asyncio.CancelledError:
+        # Request cancelled during the query: release once the worker is done with it
+        opening.add_done_callback(lambda _: release())
+        raise
+
+    async def body() -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        try:
+            chunk = FEATURE_COLLECTION_HEAD
+            batch = first_batch
+            separator = b""
+            while batch:
+                yield chunk + separator + ",".join(row[0] for row in batch).encode()
+                chunk, separator = b"", b","
+                batch = await loop.run_in_executor(get_thread_pool(), cursor.fetchmany, fetch_size)
+            yield chunk + FEATURE_COLLECTION_TAIL
+        except psycopg2.Error as e:
+            # Headers are already sent; the client sees a truncated body
+            logger.error(f"Database error while streaming GeoJSON: {e}")
+            raise
+        finally:
+            await loop.run_in_executor(get_thread_pool(), release)
+
+    return StreamingResponse(
+        body(),
+        media_type=GEOJSON_MEDIA_TYPE,
+        background=BackgroundTask(release)
+    )
+
+
+def _json_default(value: Any) -> Any:
+    """json.dumps fallback: numpy scalars and Decimals as numbers, anything else (dates) as text"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def geometries_to_json(geometries: np.ndarray, precision: Optional[int] = COORDINATE_PRECISION) -> List[str]:
+    """
+    GeoJSON geometry objects (text) for a geometry array
+
+    Args:
+        geometries: Shapely geometry array
+        precision: Decimal places to round coordinates to (None = full precision)
+
+    Returns:
+        One JSON string per geometry ("null" for missing geometries)
+    """
+    if precision is not None:
+        geometries = shapely.transform(geometries, lambda coords: np.round(coords, precision))
+    return [text or "null" for text in shapely.to_geojson(geometries)]
+
+
+def properties_to_json(frame: pd.DataFrame) -> List[str]:
+    """
+    JSON objects (text) for the rows of an attribute frame
+
+    Missing values become null; datetime columns become text ("" for NaT),
+    as the map clients expect.
+    """
+    columns: Dict[str, list] = {}
+    for name in frame.columns:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            column = column.astype(str).where(column.notna(), "")
+        columns[str(name)] = column.astype(object).where(column.notna(), None).tolist()
+
+    names = list(columns)
+    return [
+        json.dumps(dict(zip(names, values)), ensure_ascii=False, default=_json_default)
+        for values in zip(*columns.values())
+    ] if names else ["{}"] * len(frame)
+
+
+def features_to_bytes(ids: Sequence[Any], geometries: Sequence[str], properties: Sequence[str]) -> List[bytes]:
+    """Assemble serialized Feature objects from ids, geometry JSON and properties JSON"""
+    return [
+        ('{"id": %s, "type": "Feature", "properties": %s, "geometry": %s}' % (
+            json.dumps(feature_id, default=_json_default), props, geometry
+        )).encode()
+        for feature_id, geometry, props in zip(ids, geometries, properties)
+    ]
+
+
+def feature_to_bytes(feature_id: Any, geometry: str, properties: Dict[str, Any]) -> bytes:
+    """Serialize one Feature from its id, geometry JSON (text) and properties dict"""
+    return features_to_bytes(
+        [feature_id], [geometry], [json.dumps(properties, ensure_ascii=False, default=_json_default)]
+    )[0]
+
+
+def stream_features(
+    features: Sequence[bytes],
+    metadata: Optional[Dict[str, Any]] = None,
+    chunk_size: int = FETCH_SIZE,
+    headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """
+    Stream serialized Features as a GeoJSON FeatureCollection
+
+    Args:
+        features: One serialized Feature per entry (see features_to_bytes)
+        metadata: Written as the collection's "metadata" member
+        chunk_size: Features per body chunk
+        headers: Extra response headers
+
+    Returns:
+        StreamingResponse with media type application/geo+json
+    """
+    def body() -> Iterator[bytes]:
+        yield FEATURE_COLLECTION_HEAD
+        for start in range(0, len(features), chunk_size):
+            yield (b"," if start else b"") + b",".join(features[start:start + chunk_size])
+        if metadata is None:
+            yield FEATURE_COLLECTION_TAIL
+        else:
+            yield b'], "metadata": ' + json.dumps(metadata, default=_json_default).encode() + b"}"
+
+    return StreamingResponse(body(), media_type=GEOJSON_MEDIA_TYPE, headers=headers)
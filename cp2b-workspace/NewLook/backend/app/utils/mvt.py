@@ -0,0 +1,293 @@
+"""
+CP2B Maps V3 - Mapbox Vector Tile Encoder
+Encode tile-space shapely geometries as Mapbox Vector Tiles (spec v2.1)
+
+Dependency-free: the protobuf messages of vector_tile.proto (Tile, Layer,
+Feature, Value) are written directly. Geometries must already be in tile
+coordinates (integers in [0, extent], y pointing down), clipped to the tile
+and its buffer - see app/services/vector_tiles.py.
+"""
+
+import math
+import struct
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+DEFAULT_EXTENT = 4096
+
+# Feature.GeomType
+GEOM_POINT = 1
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+
+# Geometry commands
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+# Protobuf wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH = 2
+
+
+def _varint(value: int) -> bytes:
+    value &= (1 << 64) - 1  # Negative int64 -> two's complement (10 bytes)
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, wire_type: int) -> bytes:
+    return _varint((number << 3) | wire_type)
+
+
+def _length_delimited(number: int, payload: bytes) -> bytes:
+    return _field(number, _LENGTH) + _varint(len(payload)) + payload
+
+
+def _packed(number: int, values: Iterable[int]) -> bytes:
+    return _length_delimited(number, b"".join(_varint(v) for v in values))
+
+
+def _command(command: int, count: int) -> int:
+    return (command & 0x7) | (count << 3)
+
+
+def _encode_value(value: Any) -> bytes:
+    """Encode a Value message (string, bool, int or double)"""
+    if isinstance(value, (bool, np.bool_)):
+        return _field(7, _VARINT) + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        value = int(value)
+        if value >= 0:
+            return _field(5, _VARINT) + _varint(value)  # uint_value
+        return _field(6, _VARINT) + _varint(_zigzag(value))  # sint_value
+    if isinstance(value, (float, np.floating)):
+        return _field(3, _FIXED64) + struct.pack("<d", float(value))  # double_value
+    return _length_delimited(1, str(value).encode("utf-8"))  # string_value
+
+
+def _value_key(value: Any) -> Tuple[str, Any]:
+    """Deduplication key (keeps 1, 1.0 and True distinct)"""
+    if isinstance(value, (bool, np.bool_)):
+        return ("bool", bool(value))
+    if isinstance(value, (int, np.integer)):
+        return ("int", int(value))
+    if isinstance(value, (float, np.floating)):
+        return ("float", float(value))
+    return ("str", str(value))
+
+
+def _dedupe(coords: np.ndarray) -> np.ndarray:
+    """Drop consecutive repeated vertices (zero-length moves are not allowed)"""
+    if len(coords) < 2:
+        return coords
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+    return coords[keep]
+
+
+def _signed_area(ring: np.ndarray) -> float:
+    """Surveyor's formula in tile coordinates (positive = exterior in MVT)"""
+    x, y = ring[:, 0], ring[:, 1]
+    return float(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]))
+
+
+class _Cursor:
+    """Geometry command writer tracking the pen position"""
+
+    def __init__(self):
+        self.commands: List[int] = []
+        self.x = 0
+        self.y = 0
+
+    def _params(self, coords: np.ndarray):
+        for x, y in coords:
+            self.commands.append(_zigzag(int(x) - self.x))
+            self.commands.append(_zigzag(int(y) - self.y))
+            self.x, self.y = int(x), int(y)
+
+    def move_to(self, coords: np.ndarray):
+        self.commands.append(_command(CMD_MOVE_TO, len(coords)))
+        self._params(coords)
+
+    def line_to(self, coords: np.ndarray):
+        self.commands.append(_command(CMD_LINE_TO, len(coords)))
+        self._params(coords)
+
+    def close_path(self):
+        self.commands.append(_command(CMD_CLOSE_PATH, 1))
+
+
+def _coords(geometry) -> np.ndarray:
+    return np.rint(np.asarray(geometry.coords, dtype=float)[:, :2]).astype(np.int64)
+
+
+def _encode_points(points: Sequence) -> List[int]:
+    coords = np.array([_coords(p)[0] for p in points], dtype=np.int64)
+    cursor = _Cursor()
+    cursor.move_to(coords)
+    return cursor.commands
+
+
+def _encode_lines(lines: Sequence) -> List[int]:
+    cursor = _Cursor()
+    for line in lines:
+        coords = _dedupe(_coords(line))
+        if len(coords) < 2:
+            continue
+        cursor.move_to(coords[:1])
+        cursor.line_to(coords[1:])
+    return cursor.commands
+
+
+def _encode_ring(cursor: _Cursor, ring, exterior: bool) -> bool:
+    coords = _dedupe(_coords(ring))
+    if len(coords) > 1 and np.array_equal(coords[0], coords[-1]):
+        coords = coords[:-1]
+    if len(coords) < 3:
+        return False
+
+    closed = np.vstack([coords, coords[:1]])
+    area = _signed_area(closed)
+    if area == 0:
+        return False
+    if (area > 0) != exterior:
+        coords = coords[::-1]
+
+    cursor.move_to(coords[:1])
+    cursor.line_to(coords[1:])
+    cursor.close_path()
+    return True
+
+
+def _encode_polygons(polygons: Sequence) -> List[int]:
+    cursor = _Cursor()
+    for polygon in polygons:
+        # Holes are only written after a surviving exterior ring
+        if not _encode_ring(cursor, polygon.exterior, exterior=True):
+            continue
+        for interior in polygon.interiors:
+            _encode_ring(cursor, interior, exterior=False)
+    return cursor.commands
+
+
+def _typed_parts(geometry: BaseGeometry) -> Iterator[Tuple[int, List[int]]]:
+    """(GeomType, commands) for a geometry; collections yield one entry per type"""
+    if geometry is None or geometry.is_empty:
+        return
+    kind = geometry.geom_type
+    if kind == "Point":
+        yield GEOM_POINT, _encode_points([geometry])
+    elif kind == "MultiPoint":
+        yield GEOM_POINT, _encode_points(list(geometry.geoms))
+    elif kind in ("LineString", "LinearRing"):
+        yield GEOM_LINESTRING, _encode_lines([geometry])
+    elif kind == "MultiLineString":
+        yield GEOM_LINESTRING, _encode_lines(list(geometry.geoms))
+    elif kind == "Polygon":
+        yield GEOM_POLYGON, _encode_polygons([geometry])
+    elif kind == "MultiPolygon":
+        yield GEOM_POLYGON, _encode_polygons(list(geometry.geoms))
+    elif kind == "GeometryCollection":
+        groups: Dict[str, list] = {"point": [], "line": [], "polygon": []}
+        for part in geometry.geoms:
+            for sub in getattr(part, "geoms", [part]):
+                if sub.is_empty:
+                    continue
+                if sub.geom_type == "Point":
+                    groups["point"].append(sub)
+                elif sub.geom_type in ("LineString", "LinearRing"):
+                    groups["line"].append(sub)
+                elif sub.geom_type == "Polygon":
+                    groups["polygon"].append(sub)
+        if groups["point"]:
+            yield GEOM_POINT, _encode_points(groups["point"])
+        if groups["line"]:
+            yield GEOM_LINESTRING, _encode_lines(groups["line"])
+        if groups["polygon"]:
+            yield GEOM_POLYGON, _encode_polygons(groups["polygon"])
+
+
+def _is_missing(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, (float, np.floating)) and math.isnan(value):
+        return True
+    return False
+
+
+def encode_layer(
+    name: str,
+    features: Iterable[Tuple[BaseGeometry, Dict[str, Any], Optional[int]]],
+    extent: int = DEFAULT_EXTENT
+) -> bytes:
+    """
+    Encode one Layer message
+
+    Args:
+        name: Layer name
+        features: (tile-space geometry, properties, id or None) tuples;
+            None/NaN property values are omitted
+        extent: Tile extent the coordinates are expressed in
+
+    Returns:
+        Serialized Layer message (without the Tile field header)
+    """
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[str, Any], int] = {}
+    encoded_values: List[bytes] = []
+    body = bytearray()
+
+    for geometry, properties, feature_id in features:
+        tags: List[int] = []
+        for key, value in properties.items():
+            if _is_missing(value):
+                continue
+            key_index = keys.setdefault(key, len(keys))
+            value_key = _value_key(value)
+            value_index = values.get(value_key)
+            if value_index is None:
+                value_index = values[value_key] = len(encoded_values)
+                encoded_values.append(_encode_value(value))
+            tags.extend((key_index, value_index))
+
+        for geom_type, commands in _typed_parts(geometry):
+            if not commands:
+                continue
+            feature = bytearray()
+            if feature_id is not None:
+                feature += _field(1, _VARINT) + _varint(int(feature_id))
+            if tags:
+                feature += _packed(2, tags)
+            feature += _field(3, _VARINT) + _varint(geom_type)
+            feature += _packed(4, commands)
+            body += _length_delimited(2, bytes(feature))
+
+    layer = bytearray()
+    layer += _field(15, _VARINT) + _varint(2)  # version
+    layer += _length_delimited(1, name.encode("utf-8"))
+    layer += body
+    for key in keys:
+        layer += _length_delimited(3, key.encode("utf-8"))
+    for value in encoded_values:
+        layer += _length_delimited(4, value)
+    layer += _field(5, _VARINT) + _varint(extent)
+    return bytes(layer)
+
+
+def encode_tile(layers: Iterable[bytes]) -> bytes:
+    """Wrap encoded layers (from encode_layer) into a Tile message"""
+    return b"".join(_length_delimited(3, layer) for layer in layers)
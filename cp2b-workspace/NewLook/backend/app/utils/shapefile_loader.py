@@ -1,110 +1,293 @@
 """
 CP2B Maps V3 - Shapefile Loader Utility
-Loads and converts shapefiles to GeoJSON format
+Streams resident shapefile layers as GeoJSON
+
+Layers come from the geometry store (read once, kept in memory) and
+simplified geometries from its precomputed simplification levels.
+Requests can be narrowed to a map viewport (?bbox=) and paged
+(?limit=/?cursor=) using the layers' spatial index.
+
+Each layer is serialized once per simplification level into one bytes
+string per Feature (kept in geometry_cache); responses stream the selected
+features from there without building dicts or a whole-layer JSON string.
 """
 
-import geopandas as gpd
-import pandas as pd
-from pathlib import Path
-from typing import Dict, Any, Optional
+import numpy as np
+from fastapi import HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, List, Optional, Tuple
 import logging
-import json
+
+from app.services.cache_service import geometry_cache
+from app.services.geometry_store import SHAPEFILE_DIR, GeometryLayer, get_geometry_store, simplify_level
+from app.utils.geojson_stream import (
+    COORDINATE_PRECISION,
+    features_to_bytes,
+    geometries_to_json,
+    properties_to_json,
+    stream_features,
+)
 
 logger = logging.getLogger(__name__)
 
-# Path to shapefile data directory
-SHAPEFILE_DIR = Path(__file__).parent.parent.parent / "data" / "shapefiles"
+
+def map_simplify_level(
+    zoom: Optional[float] = Query(None, ge=0, le=22, description="Map zoom level (selects the geometry detail)"),
+    tolerance: Optional[float] = Query(None, gt=0, description="Simplification tolerance in degrees (overrides zoom)")
+) -> float:
+    """
+    FastAPI dependency: simplification level for a GeoJSON layer request
+
+    Without zoom or tolerance the default level (0.001 degrees) is served.
+    """
+    return simplify_level(zoom=zoom, tolerance=tolerance)
+
+
+# Largest page a client can request with ?limit=
+MAX_PAGE_SIZE = 10000
+
+
+class Viewport:
+    """Bounding box filter and page of a GeoJSON layer request"""
+
+    def __init__(
+        self,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ):
+        self.bbox = bbox
+        self.limit = limit
+        self.offset = offset
+
+    def select(self, indices: np.ndarray) -> np.ndarray:
+        """Page of already bbox-filtered feature indices"""
+        end = None if self.limit is None else self.offset + self.limit
+        return indices[self.offset:end]
+
+    def next_cursor(self, matched: int) -> Optional[str]:
+        """Cursor of the page after this one (None on the last page)"""
+        if self.limit is None or self.offset + self.limit >= matched:
+            return None
+        return str(self.offset + self.limit)
+
+    def select_layers(self, layers: List[GeometryLayer]) -> Tuple[List[np.ndarray], int]:
+        """
+        Feature indices of this page in each layer
+
+        Layers are numbered one after the other, so a page can span them.
+
+        Returns:
+            Tuple of (positional indices per layer, features matching the bbox)
+        """
+        if self.bbox is not None:
+            matches = [layer.query_bbox(*self.bbox) for layer in layers]
+        else:
+            matches = [np.arange(len(layer)) for layer in layers]
+        matched = sum(len(indices) for indices in matches)
+
+        page = self.select(np.arange(matched))
+        first, last = (int(page[0]), int(page[-1]) + 1) if len(page) else (0, 0)
+
+        selected, start = [], 0
+        for indices in matches:
+            selected.append(indices[max(first - start, 0):max(last - start, 0)])
+            start += len(indices)
+        return selected, matched
+
+    def metadata(self, matched: int) -> Dict[str, Any]:
+        """Viewport fields for the response metadata"""
+        return {
+            "bbox": list(self.bbox) if self.bbox else None,
+            "matched_features": matched,
+            "limit": self.limit,
+            "next_cursor": self.next_cursor(matched)
+        }
+
+
+def map_viewport(
+    bbox: Optional[str] = Query(
+        None, description="Viewport as minx,miny,maxx,maxy in WGS84 degrees (features intersecting it)"
+    ),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum features per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+) -> Viewport:
+    """
+    FastAPI dependency: viewport filter and page of a GeoJSON layer request
+
+    Without parameters the whole layer is returned, as before.
+    """
+    box = None
+    if bbox is not None:
+        try:
+            box = tuple(float(v) for v in bbox.split(","))
+        except ValueError:
+            box = ()
+        if len(box) != 4 or not all(np.isfinite(box)) or box[0] > box[2] or box[1] > box[3]:
+            raise HTTPException(
+                status_code=400,
+                detail="bbox must be minx,miny,maxx,maxy with minx <= maxx and miny <= maxy"
+            )
+
+    offset = 0
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        offset = int(cursor)
+
+    return Viewport(bbox=box, limit=limit, offset=offset)
 
 
 class ShapefileLoader:
-    """Utility class to load shapefiles and convert to GeoJSON"""
+    """Utility class to stream shapefile layers as GeoJSON"""
 
     @staticmethod
-    def load_shapefile_as_geojson(filename: str, simplify_tolerance: Optional[float] = None) -> Dict[str, Any]:
+    def layer_features(
+        layer: GeometryLayer,
+        level: Optional[float] = None,
+        precision: Optional[int] = COORDINATE_PRECISION
+    ) -> List[bytes]:
         """
-        Load a shapefile and convert to GeoJSON format
+        Serialized Features of a layer (one bytes string per row)
+
+        Attribute JSON is built once per layer file and geometry JSON once per
+        simplification level; both are kept in geometry_cache.
+
+        Args:
+            layer: Resident shapefile layer
+            level: Simplification level (None = original geometry)
+            precision: Coordinate decimal places
+
+        Returns:
+            Serialized Features aligned with layer.gdf_wgs84
+        """
+        version = f"{layer.path}@{layer.mtime}"
+        key = f"geojson_features:{version}:{level}:{precision}"
+        features = geometry_cache.get(key)
+        if features is not None:
+            return features
+
+        properties_key = f"geojson_properties:{version}"
+        properties = geometry_cache.get(properties_key)
+        if properties is None:
+            gdf = layer.gdf_wgs84
+            properties = properties_to_json(gdf.drop(columns=gdf.geometry.name))
+            geometry_cache.set(properties_key, properties)
+
+        geometries = layer.simplified(level) if level is not None else layer.geometries_wgs84
+        features = features_to_bytes(
+            [str(label) for label in layer.gdf_wgs84.index],
+            geometries_to_json(geometries, precision),
+            properties
+        )
+        geometry_cache.set(key, features)
+        return features
+
+    @staticmethod
+    def stream_shapefile(
+        filename: str,
+        simplify_tolerance: Optional[float] = None,
+        viewport: Optional[Viewport] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> StreamingResponse:
+        """
+        Stream a shapefile as a GeoJSON FeatureCollection
 
         Args:
             filename: Shapefile name (without .shp extension)
+            simplify_tolerance: Tolerance for geometry simplification (degrees),
+                snapped to the nearest stored level not coarser than it
+            viewport: Optional bbox filter and page (see map_viewport)
+            metadata: Extra metadata fields (e.g. layer_type)
+
+        Returns:
+            StreamingResponse with the FeatureCollection
+        """
+        return ShapefileLoader.stream_shapefiles([filename], simplify_tolerance, viewport, metadata)
+
+    @staticmethod
+    def stream_shapefiles(
+        filenames: List[str],
+        simplify_tolerance: Optional[float] = None,
+        viewport: Optional[Viewport] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> StreamingResponse:
+        """
+        Stream shapefiles as one GeoJSON FeatureCollection
+
+        Features keep the file order; a viewport page spans the files as if
+        they were one layer. Missing shapefiles are skipped; if none can be
+        served an empty FeatureCollection explains why.
+
+        Args:
+            filenames: Shapefile names (without .shp extension)
             simplify_tolerance: Tolerance for geometry simplification (degrees)
+            viewport: Optional bbox filter and page (see map_viewport)
+            metadata: Extra metadata fields (e.g. layer_type)
 
         Returns:
-            GeoJSON dict with FeatureCollection
+            StreamingResponse with the FeatureCollection
         """
+        source = " + ".join(f"{filename}.shp" for filename in filenames)
+        viewport = viewport or Viewport()
+        extra = metadata or {}
+
         try:
-            shapefile_path = SHAPEFILE_DIR / f"{filename}.shp"
+            layers = []
+            for filename in filenames:
+                layer = get_geometry_store().get_layer(filename)
+                if layer is None:
+                    logger.warning(f"Shapefile not found: {SHAPEFILE_DIR / filename}.shp")
+                else:
+                    layers.append(layer)
 
-            if not shapefile_path.exists():
-                logger.warning(f"Shapefile not found: {shapefile_path}")
+            if not layers:
                 # Return empty FeatureCollection instead of raising error
-                return {
-                    "type": "FeatureCollection",
-                    "features": [],
-                    "metadata": {
-                        "source": f"{filename}.shp",
-                        "total_features": 0,
-                        "crs": "EPSG:4326",
-                        "note": f"Shapefile {filename} não encontrado no servidor",
-                        "error": "File not found - shapefiles must be uploaded to Railway"
-                    }
-                }
-
-            # Read shapefile
-            logger.info(f"Loading shapefile: {filename}")
-            gdf = gpd.read_file(shapefile_path)
-
-            # Ensure WGS84 (EPSG:4326) for web mapping
-            if gdf.crs != "EPSG:4326":
-                logger.info(f"Reprojecting {filename} to EPSG:4326")
-                gdf = gdf.to_crs("EPSG:4326")
-
-            # Simplify geometry if requested (reduces file size)
-            if simplify_tolerance:
-                logger.info(f"Simplifying {filename} with tolerance {simplify_tolerance}")
-                gdf['geometry'] = gdf['geometry'].simplify(tolerance=simplify_tolerance, preserve_topology=True)
-
-            # Convert datetime/Timestamp columns to strings to avoid JSON serialization errors
-            for col in gdf.columns:
-                if col == 'geometry':
-                    continue
-                # Check for datetime64 types
-                if pd.api.types.is_datetime64_any_dtype(gdf[col]):
-                    gdf[col] = gdf[col].astype(str).replace('NaT', '')
-                # Check for object columns that might contain Timestamps
-                elif gdf[col].dtype == 'object' and len(gdf) > 0:
-                    sample = gdf[col].dropna().iloc[0] if len(gdf[col].dropna()) > 0 else None
-                    if sample is not None and hasattr(sample, 'timestamp'):
-                        gdf[col] = gdf[col].apply(lambda x: str(x) if pd.notna(x) else '')
-
-            # Convert to GeoJSON
-            geojson_str = gdf.to_json()
-            geojson_dict = json.loads(geojson_str)
-
-            # Add metadata
-            geojson_dict["metadata"] = {
-                "source": f"{filename}.shp",
-                "total_features": len(gdf),
+                return stream_features([], {
+                    "source": source,
+                    "total_features": 0,
+                    "crs": "EPSG:4326",
+                    "note": f"Shapefile {', '.join(filenames)} não encontrado no servidor",
+                    "error": "File not found - shapefiles must be uploaded to Railway",
+                    **extra
+                })
+
+            # Resident WGS84 layer; simplified geometry comes from the stored levels
+            level = simplify_level(tolerance=simplify_tolerance) if simplify_tolerance else None
+
+            selected, matched = viewport.select_layers(layers)
+            features: List[bytes] = []
+            for layer, indices in zip(layers, selected):
+                if len(indices):
+                    layer_features = ShapefileLoader.layer_features(layer, level)
+                    features.extend(layer_features[i] for i in indices)
+
+            response_metadata = {
+                "source": source,
+                "total_features": len(features),
                 "crs": "EPSG:4326",
-                "note": f"Dados do shapefile {filename}"
+                "simplify_tolerance": level,
+                "coordinate_precision": COORDINATE_PRECISION,
+                "note": f"Dados do shapefile {', '.join(filenames)}"
             }
+            if viewport.bbox is not None or viewport.limit is not None:
+                response_metadata.update(viewport.metadata(matched))
+            response_metadata.update(extra)
 
-            logger.info(f"Successfully converted {filename} ({len(gdf)} features)")
-            return geojson_dict
+            logger.info(f"Streaming {source} ({len(features)} features)")
+            return stream_features(features, response_metadata)
 
         except Exception as e:
-            logger.error(f"Error loading shapefile {filename}: {str(e)}")
+            logger.error(f"Error loading shapefile {source}: {str(e)}")
             # Return empty FeatureCollection on any error
-            return {
-                "type": "FeatureCollection",
-                "features": [],
-                "metadata": {
-                    "source": f"{filename}.shp",
-                    "total_features": 0,
-                    "crs": "EPSG:4326",
-                    "note": f"Erro ao carregar {filename}",
-                    "error": str(e)
-                }
-            }
+            return stream_features([], {
+                "source": source,
+                "total_features": 0,
+                "crs": "EPSG:4326",
+                "note": f"Erro ao carregar {', '.join(filenames)}",
+                "error": str(e),
+                **extra
+            })
 
 
 # Singleton instance
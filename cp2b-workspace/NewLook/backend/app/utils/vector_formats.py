@@ -0,0 +1,158 @@
+"""
+CP2B Maps V3 - Vector Layer Formats
+Read shapefile layers from faster columnar/indexed copies when available
+
+scripts/convert_shapefiles.py writes, next to each <name>.shp:
+- <name>.parquet: GeoParquet, for full loads (needs pyarrow)
+- <name>.fgb: FlatGeobuf with a packed Hilbert R-tree, for bbox reads
+
+Loaders call layer_source() to pick the preferred readable copy that is not
+older than the shapefile, and read_layer() to read it; the shapefile stays
+the fallback. FlatGeobuf stores features in index (Hilbert) order, so the
+converter keeps the original row number in ROW_COLUMN and read_layer()
+restores shapefile order - feature ids (shapefile row numbers) stay the
+same whatever the format, also for bbox reads.
+"""
+
+import logging
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import geopandas as gpd
+
+# Optional GeoParquet support (geopandas.read_parquet/to_parquet need pyarrow)
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+SHAPEFILE_SUFFIX = ".shp"
+GEOPARQUET_SUFFIX = ".parquet"
+FLATGEOBUF_SUFFIX = ".fgb"
+
+# Original row number stored in FlatGeobuf copies (dropped on read)
+ROW_COLUMN = "_source_row"
+
+# Conversion formats, in load preference order
+FORMATS = ("parquet", "fgb")
+_SUFFIXES = {"parquet": GEOPARQUET_SUFFIX, "fgb": FLATGEOBUF_SUFFIX}
+
+
+def available_formats() -> List[str]:
+    """Formats this environment can read and write"""
+    return [fmt for fmt in FORMATS if fmt != "parquet" or pyarrow is not None]
+
+
+def layer_source(directory: Path, name: str) -> Optional[Path]:
+    """
+    Preferred file to read a layer from
+
+    GeoParquet, then FlatGeobuf, then the shapefile. A converted copy older
+    than the shapefile is ignored (the shapefile was replaced since).
+
+    Args:
+        directory: Layer directory
+        name: Layer name (shapefile name without extension)
+
+    Returns:
+        Path to read, or None if the layer does not exist in any format
+    """
+    shapefile = directory / f"{name}{SHAPEFILE_SUFFIX}"
+    try:
+        shapefile_mtime = shapefile.stat().st_mtime
+    except FileNotFoundError:
+        shapefile_mtime = None
+
+    for fmt in available_formats():
+        path = directory / f"{name}{_SUFFIXES[fmt]}"
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if shapefile_mtime is None or mtime >= shapefile_mtime:
+            return path
+        logger.warning(f"Ignoring {path.name}: older than {shapefile.name} (re-run convert_shapefiles.py)")
+
+    return shapefile if shapefile_mtime is not None else None
+
+
+def layer_names(directory: Path) -> List[str]:
+    """Layer names present in a directory in any readable format"""
+    if not directory.exists():
+        return []
+    suffixes = {SHAPEFILE_SUFFIX, *(_SUFFIXES[fmt] for fmt in available_formats())}
+    return sorted({p.stem for p in directory.iterdir() if p.suffix in suffixes})
+
+
+def read_layer(path: Path, bbox: Optional[Tuple[float, float, float, float]] = None) -> gpd.GeoDataFrame:
+    """
+    Read a layer file (GeoParquet, FlatGeobuf or shapefile)
+
+    Args:
+        path: File from layer_source()
+        bbox: Optional (minx, miny, maxx, maxy) in the layer CRS; FlatGeobuf
+            uses its spatial index, GeoParquet and shapefiles filter after
+            reading (OGR would renumber a shapefile's filtered rows from 0)
+
+    Returns:
+        GeoDataFrame in shapefile row order
+    """
+    if path.suffix == FLATGEOBUF_SUFFIX:
+        gdf = gpd.read_file(path, bbox=bbox)
+        if ROW_COLUMN in gdf.columns:
+            gdf = gdf.sort_values(ROW_COLUMN).set_index(ROW_COLUMN)
+            gdf.index.name = None
+        return gdf
+
+    gdf = gpd.read_parquet(path) if path.suffix == GEOPARQUET_SUFFIX else gpd.read_file(path)
+    if bbox is not None:
+        gdf = gdf.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+    return gdf
+
+
+def convert_layer(
+    shapefile: Path,
+    formats: Sequence[str] = FORMATS,
+    force: bool = False
+) -> List[Path]:
+    """
+    Write GeoParquet/FlatGeobuf copies of a shapefile next to it
+
+    Args:
+        shapefile: Source .shp path
+        formats: Formats to write (subset of FORMATS)
+        force: Rewrite copies that are already up to date
+
+    Returns:
+        Paths written (up-to-date copies are skipped)
+
+    Raises:
+        RuntimeError: If GeoParquet is requested without pyarrow
+    """
+    if "parquet" in formats and pyarrow is None:
+        raise RuntimeError("GeoParquet output needs pyarrow (pip install pyarrow)")
+
+    source_mtime = shapefile.stat().st_mtime
+    targets = [
+        (fmt, shapefile.with_suffix(_SUFFIXES[fmt])) for fmt in formats
+    ]
+    targets = [
+        (fmt, path) for fmt, path in targets
+        if force or not path.exists() or path.stat().st_mtime < source_mtime
+    ]
+    if not targets:
+        return []
+
+    gdf = gpd.read_file(shapefile)
+    written = []
+    for fmt, path in targets:
+        if fmt == "parquet":
+            gdf.to_parquet(path, index=False)
+        else:
+            # SPATIAL_INDEX=YES: packed Hilbert R-tree (features are reordered)
+            gdf.assign(**{ROW_COLUMN: range(len(gdf))}).to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+        written.append(path)
+
+    return written
@@ -0,0 +1,129 @@
+"""
+CP2B Maps V3 - Dashboard Analytics Benchmark
+Compare the previous Python-loop implementations of /analysis/by-residue and
+/analysis/distribution with the vectorized ones over the municipality table
+
+Runs on synthetic rows, so no database is needed. Timings exclude the
+database/REST fetch that the previous implementation also paid per request.
+
+Usage:
+    python scripts/benchmark_analytics.py
+    python scripts/benchmark_analytics.py --rows 5000 --bins 50 --repeat 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from the backend directory without installing the app
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.municipality_table import BIOGAS_SUM_COLUMNS, MunicipalityTable  # noqa: E402
+from app.utils.analytics import histogram, summary_statistics  # noqa: E402
+
+RESIDUE_COLUMNS = ["sugarcane_biogas_m3_year", "soybean_biogas_m3_year", "corn_biogas_m3_year"]
+
+
+def synthetic_rows(n: int) -> list:
+    """Rows shaped like the municipalities table, with skewed potentials"""
+    rng = np.random.default_rng(42)
+    rows = []
+    for i in range(n):
+        row = {column: float(rng.lognormal(13, 2)) if rng.random() > 0.1 else None for column in BIOGAS_SUM_COLUMNS}
+        row.update(
+            id=i + 1,
+            municipality_name=f"Municipality {i}",
+            ibge_code=str(3500000 + i),
+            administrative_region=f"Region {i % 16}",
+            population=int(rng.integers(800, 1_000_000)),
+            area_km2=float(rng.uniform(10, 2000))
+        )
+        rows.append(row)
+    return rows
+
+
+def legacy_by_residue(rows, columns, limit, min_value):
+    """Previous /by-residue: sum, filter and sort row dicts in Python"""
+    results = []
+    for row in rows:
+        total_biogas = 0
+        for col in columns:
+            if col and row.get(col):
+                total_biogas += float(row.get(col, 0))
+        if total_biogas >= min_value:
+            results.append({"municipality_name": row.get("municipality_name"), "biogas_m3_year": round(total_biogas, 2)})
+    results.sort(key=lambda x: x["biogas_m3_year"], reverse=True)
+    return results[:limit]
+
+
+def legacy_distribution(rows, column, bins):
+    """Previous /distribution: one list comprehension per bin, O(n^2) std"""
+    values = [float(row.get(column, 0) or 0) for row in rows if float(row.get(column, 0) or 0) > 0]
+    min_val, max_val = min(values), max(values)
+    bin_width = (max_val - min_val) / bins
+    counts = []
+    for i in range(bins):
+        bin_start = min_val + (i * bin_width)
+        bin_end = min_val + ((i + 1) * bin_width)
+        if i == bins - 1:
+            counts.append(len([v for v in values if bin_start <= v <= bin_end]))
+        else:
+            counts.append(len([v for v in values if bin_start <= v < bin_end]))
+    n = len(values)
+    std = (sum((v - sum(values) / n) ** 2 for v in values) / n) ** 0.5
+    return counts, std
+
+
+def vectorized_by_residue(table, columns, limit, min_value):
+    totals = table.sum_columns(columns)
+    return table.top(totals, limit, min_value=min_value)
+
+
+def vectorized_distribution(table, column, bins):
+    values = table.column(column)
+    values = values[values > 0]
+    counts, _ = histogram(values, bins)
+    return counts, summary_statistics(values)["std"]
+
+
+def run(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<28} {elapsed * 1000:>10.3f} ms")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard analytics")
+    parser.add_argument("--rows", type=int, default=645, help="Municipalities (São Paulo has 645)")
+    parser.add_argument("--bins", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows)
+    table = MunicipalityTable(rows, "benchmark")
+
+    # Same counts as before (float rounding aside)
+    legacy_counts, _ = legacy_distribution(rows, "total_biogas_m3_year", args.bins)
+    counts, _ = vectorized_distribution(table, "total_biogas_m3_year", args.bins)
+    assert sum(legacy_counts) == int(counts.sum())
+
+    print(f"{args.rows} rows, {args.bins} bins, top {args.limit}, {args.repeat} repeats\n")
+    before = run("by-residue (before)", lambda: legacy_by_residue(rows, RESIDUE_COLUMNS, args.limit, 0), args.repeat)
+    after = run("by-residue (after)", lambda: vectorized_by_residue(table, RESIDUE_COLUMNS, args.limit, 0), args.repeat)
+    print(f"{'speedup':<28} {before / after:>10.1f}x\n")
+
+    before = run("distribution (before)", lambda: legacy_distribution(rows, "total_biogas_m3_year", args.bins), args.repeat)
+    after = run("distribution (after)", lambda: vectorized_distribution(table, "total_biogas_m3_year", args.bins), args.repeat)
+    print(f"{'speedup':<28} {before / after:>10.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+CP2B Maps V3 - Proximity Overlay Benchmark
+Compare the municipality selection loop with and without area-weighted intersection fractions
+
+Usage:
+    python scripts/benchmark_proximity.py
+    python scripts/benchmark_proximity.py --layer SP_RG_Intermediarias_2024 --radius 50 --runs 200
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import pyproj
+import shapely
+from shapely.geometry import Point
+from shapely.ops import transform
+
+# Allow running from the backend directory without installing the app
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.geometry_store import get_geometry_store, WGS84, UTM_23S  # noqa: E402
+
+# Analysis points spread across the state (lat, lng)
+SAMPLE_POINTS = [
+    (-21.7946, -48.1756),  # Araraquara
+    (-22.9099, -47.0626),  # Campinas
+    (-23.5505, -46.6333),  # São Paulo
+    (-21.1775, -47.8103),  # Ribeirão Preto
+    (-22.1207, -51.3882),  # Presidente Prudente
+]
+
+
+def select_flat(layer, point_utm, buffer_utm):
+    """Selection as before: every touched municipality counts at 100%"""
+    candidates = layer.query_intersecting(buffer_utm)
+    distances = shapely.distance(point_utm, layer.centroids_utm[candidates])
+    return [(int(idx), float(d), 1.0) for idx, d in zip(candidates, distances)]
+
+
+def select_weighted(layer, point_utm, buffer_utm):
+    """Selection with area-weighted intersection fractions"""
+    candidates = layer.query_intersecting(buffer_utm)
+    distances = shapely.distance(point_utm, layer.centroids_utm[candidates])
+    fractions = layer.intersection_fractions(buffer_utm, candidates)
+    return [
+        (int(idx), float(d), float(f))
+        for idx, d, f in zip(candidates, distances, fractions)
+    ]
+
+
+def time_ms(func, runs, *args):
+    """Median and p95 wall time of func(*args) in milliseconds"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark proximity intersection fractions")
+    parser.add_argument("--layer", default="SP_Municipios_2024", help="Shapefile layer name")
+    parser.add_argument("--radius", type=float, nargs="+", default=[10, 30, 50, 100],
+                        help="Radii in km")
+    parser.add_argument("--runs", type=int, default=100, help="Runs per point and radius")
+    args = parser.parse_args()
+
+    layer = get_geometry_store().get_layer(args.layer)
+    if layer is None:
+        print(f"Layer {args.layer} not found")
+        return 1
+
+    to_utm = pyproj.Transformer.from_crs(WGS84, UTM_23S, always_xy=True).transform
+    print(f"Layer {args.layer}: {len(layer)} features, {args.runs} runs per point\n")
+    print(f"{'radius_km':>9} {'features':>8} {'flat_ms':>8} {'weighted_ms':>11} {'delta_ms':>8} {'p95_delta':>9}")
+
+    for radius_km in args.radius:
+        flat, weighted, deltas_p95, counts = [], [], [], []
+        for lat, lng in SAMPLE_POINTS:
+            point_utm = transform(to_utm, Point(lng, lat))
+            buffer_utm = point_utm.buffer(radius_km * 1000)
+
+            flat_median, flat_p95 = time_ms(select_flat, args.runs, layer, point_utm, buffer_utm)
+            weighted_median, weighted_p95 = time_ms(select_weighted, args.runs, layer, point_utm, buffer_utm)
+
+            flat.append(flat_median)
+            weighted.append(weighted_median)
+            deltas_p95.append(weighted_p95 - flat_p95)
+            counts.append(len(layer.query_intersecting(buffer_utm)))
+
+        flat_ms = statistics.mean(flat)
+        weighted_ms = statistics.mean(weighted)
+        print(
+            f"{radius_km:>9.0f} {statistics.mean(counts):>8.1f} {flat_ms:>8.2f} "
+            f"{weighted_ms:>11.2f} {weighted_ms - flat_ms:>8.2f} {max(deltas_p95):>9.2f}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+CP2B Maps V3 - MapBiomas Tile Rendering Benchmark
+Compare the previous per-tile pipeline (open raster, one mask per class, RGBA
+PNG with optimize=True) with the current one (shared raster handle, paletted PNG)
+
+Usage:
+    python scripts/benchmark_tiles.py
+    python scripts/benchmark_tiles.py --raster /path/to/mapbiomas.tif --zoom 11 --tiles 200
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from the backend directory without installing the app
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.mapbiomas_tiles import (  # noqa: E402
+    HAS_RASTER_DEPS,
+    MAPBIOMAS_COLORS,
+    RASTER_PATH,
+    TILE_SIZE,
+    MapBiomasTileService,
+    create_transparent_tile,
+    lnglat_to_tile,
+    read_tile_data,
+    Image,
+    rasterio,
+)
+
+
+def legacy_tile_image(data: np.ndarray) -> bytes:
+    """Colorization and encoding as done before paletted PNGs"""
+    height, width = data.shape
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    for class_code, rgb in MAPBIOMAS_COLORS.items():
+        mask = data == class_code
+        rgba[mask, 0] = rgb[0]
+        rgba[mask, 1] = rgb[1]
+        rgba[mask, 2] = rgb[2]
+        rgba[mask, 3] = 200
+    img = Image.fromarray(rgba, 'RGBA')
+    if img.size != (TILE_SIZE, TILE_SIZE):
+        img = img.resize((TILE_SIZE, TILE_SIZE), Image.Resampling.NEAREST)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def legacy_render(raster_path: Path, z: int, x: int, y: int) -> bytes:
+    """Previous pipeline: open the raster for every tile"""
+    with rasterio.open(raster_path) as src:
+        data = read_tile_data(src, z, x, y)
+    if data is None:
+        return create_transparent_tile()
+    return legacy_tile_image(data)
+
+
+def synthetic_raster(path: Path) -> Path:
+    """Write a 4000x4000 raster with patchy MapBiomas classes around Campinas"""
+    rng = np.random.default_rng(42)
+    classes = np.array(list(MAPBIOMAS_COLORS) + [0, 0, 0], dtype=np.uint8)
+    # Coarse patches upsampled to look like fields rather than noise
+    coarse = rng.choice(classes, size=(200, 200))
+    data = np.kron(coarse, np.ones((20, 20), dtype=np.uint8))
+
+    transform = rasterio.transform.from_bounds(-48.0, -23.5, -46.0, -21.5, 4000, 4000)
+    with rasterio.open(
+        path, "w", driver="GTiff", width=4000, height=4000, count=1, dtype="uint8",
+        crs="EPSG:4326", transform=transform, nodata=0
+    ) as dst:
+        dst.write(data, 1)
+    return path
+
+
+def run(label, render, tiles):
+    sizes = []
+    start = time.perf_counter()
+    for z, x, y in tiles:
+        sizes.append(len(render(z, x, y)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {len(tiles) / elapsed:>10.1f} {elapsed / len(tiles) * 1000:>8.2f} {np.mean(sizes) / 1024:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MapBiomas tile rendering")
+    parser.add_argument("--raster", default=None, help="GeoTIFF (default: app raster or synthetic)")
+    parser.add_argument("--zoom", type=int, default=11)
+    parser.add_argument("--tiles", type=int, default=100)
+    args = parser.parse_args()
+
+    if not HAS_RASTER_DEPS:
+        print("Raster dependencies not available (rasterio, PIL, numpy)")
+        return 1
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    if args.raster:
+        raster_path = Path(args.raster)
+    elif RASTER_PATH.exists():
+        raster_path = RASTER_PATH
+    else:
+        raster_path = synthetic_raster(Path(tmp_dir.name) / "synthetic.tif")
+
+    with rasterio.open(raster_path) as src:
+        bounds = src.bounds
+
+    x_min, y_min = lnglat_to_tile(bounds.left, bounds.top, args.zoom)
+    x_max, y_max = lnglat_to_tile(bounds.right, bounds.bottom, args.zoom)
+    random.seed(0)
+    tiles = [
+        (args.zoom, random.randint(x_min, x_max), random.randint(y_min, y_max))
+        for _ in range(args.tiles)
+    ]
+
+    service = MapBiomasTileService(raster_path, Path(tmp_dir.name) / "unused.mbtiles")
+
+    print(f"Raster {raster_path}, {len(tiles)} tiles at zoom {args.zoom}\n")
+    print(f"{'pipeline':<10} {'tiles/s':>10} {'ms/tile':>8} {'avg_kb':>8}")
+    run("before", lambda z, x, y: legacy_render(raster_path, z, x, y), tiles)
+    run("after", service.render, tiles)
+
+    service.close()
+    tmp_dir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
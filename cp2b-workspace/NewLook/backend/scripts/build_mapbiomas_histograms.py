@@ -0,0 +1,97 @@
+"""
+CP2B Maps V3 - MapBiomas Zonal Histogram Job
+Precompute MapBiomas class pixel counts per ~1 km grid cell and per municipality
+
+The output (.npz) lets MapBiomasService.analyze_buffer sum precomputed cells
+inside the buffer and only mask raster pixels along the buffer rim.
+Re-run whenever the raster changes.
+
+Usage:
+    python scripts/build_mapbiomas_histograms.py
+    python scripts/build_mapbiomas_histograms.py --cell-km 1 --no-municipalities
+"""
+
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+# Allow running from the backend directory without installing the app
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.geometry_store import get_geometry_store  # noqa: E402
+from app.services.mapbiomas_service import (  # noqa: E402
+    RASTERIO_AVAILABLE,
+    RASTER_PATH,
+    ZONAL_INDEX_PATH,
+    rasterio,
+)
+from app.services.mapbiomas_zonal import build_zonal_index  # noqa: E402
+
+MUNICIPALITIES_LAYER = "SP_Municipios_2024"
+
+
+def cell_size_px(src, cell_km: float) -> int:
+    """Raster pixels per grid cell side for a cell size in km"""
+    res_x, res_y = src.res
+    pixel_m = math.sqrt(abs(res_x * res_y))
+    if src.crs is None or src.crs.is_geographic:
+        # Degrees at São Paulo's mid-latitude (~22°S)
+        pixel_m *= 111_000 * math.cos(math.radians(22))
+    return max(1, round(cell_km * 1000 / pixel_m))
+
+
+def load_municipalities(raster_crs):
+    """(ibge_code, geometry) pairs in the raster CRS from the geometry store"""
+    layer = get_geometry_store().get_layer(MUNICIPALITIES_LAYER)
+    if layer is None:
+        print(f"Layer {MUNICIPALITIES_LAYER} not found - skipping municipality histograms")
+        return []
+
+    gdf = layer.gdf_wgs84.to_crs(raster_crs)
+    return [
+        (str(row["CD_MUN"]).strip(), row.geometry)
+        for _, row in gdf.iterrows()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build MapBiomas zonal histograms")
+    parser.add_argument("--raster", default=str(RASTER_PATH), help="MapBiomas GeoTIFF")
+    parser.add_argument("--output", default=str(ZONAL_INDEX_PATH), help="Output .npz")
+    parser.add_argument("--cell-km", type=float, default=1.0, help="Grid cell size in km")
+    parser.add_argument("--no-municipalities", action="store_true",
+                        help="Only build the grid histograms")
+    args = parser.parse_args()
+
+    if not RASTERIO_AVAILABLE:
+        print("Rasterio not available")
+        return 1
+
+    raster_path = Path(args.raster)
+    if not raster_path.exists():
+        print(f"Raster not found: {raster_path}")
+        return 1
+
+    with rasterio.open(raster_path) as src:
+        cell_px = cell_size_px(src, args.cell_km)
+        raster_crs = src.crs
+
+    municipalities = [] if args.no_municipalities else load_municipalities(raster_crs)
+
+    start = time.time()
+    index = build_zonal_index(raster_path, cell_px, municipalities)
+    index.save(Path(args.output))
+
+    grid_rows, grid_cols, n_classes = index.grid_counts.shape
+    print(
+        f"Wrote {args.output}: {grid_rows}x{grid_cols} cells of {cell_px}px, "
+        f"{n_classes} classes, {len(municipalities)} municipalities "
+        f"in {time.time() - start:.1f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
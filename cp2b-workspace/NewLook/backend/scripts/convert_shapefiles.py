@@ -0,0 +1,83 @@
+"""
+CP2B Maps V3 - Shapefile Conversion
+Write GeoParquet and FlatGeobuf copies of every shapefile in the layer directory
+
+GeoParquet (needs pyarrow) serves full layer loads; FlatGeobuf, with a packed
+Hilbert R-tree, serves bbox reads. The geometry store (backend) and the
+project_map ShapefileLoader prefer these copies and fall back to the
+shapefile when a copy is missing or older than it. Copies that are already
+up to date are skipped, so this is safe to run on every deploy.
+
+Usage:
+    python scripts/convert_shapefiles.py
+    python scripts/convert_shapefiles.py --dir ../../project_map/data/shapefile --formats fgb
+    python scripts/convert_shapefiles.py --layer SP_Municipios_2024 --force
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Allow running from the backend directory without installing the app
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.geometry_store import SHAPEFILE_DIR  # noqa: E402
+from app.utils.vector_formats import FORMATS, available_formats, convert_layer, read_layer  # noqa: E402
+
+
+def timed_read(path: Path) -> float:
+    start = time.perf_counter()
+    read_layer(path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert shapefiles to GeoParquet/FlatGeobuf")
+    parser.add_argument("--dir", type=Path, default=SHAPEFILE_DIR, help=f"Layer directory (default: {SHAPEFILE_DIR})")
+    parser.add_argument(
+        "--formats", default=",".join(available_formats()),
+        help=f"Comma-separated formats among {', '.join(FORMATS)} (default: those available here)"
+    )
+    parser.add_argument("--layer", action="append", help="Only convert this layer (repeatable)")
+    parser.add_argument("--force", action="store_true", help="Rewrite up-to-date copies")
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        parser.error(f"Unknown formats: {', '.join(unknown)}")
+    if "parquet" not in available_formats():
+        print("pyarrow not installed: GeoParquet copies are not written or read")
+        formats = [f for f in formats if f != "parquet"]
+
+    shapefiles = sorted(args.dir.glob("*.shp"))
+    if args.layer:
+        shapefiles = [p for p in shapefiles if p.stem in args.layer]
+    if not shapefiles:
+        print(f"No shapefiles found in {args.dir}")
+        return 1
+
+    failures = 0
+    for shapefile in shapefiles:
+        try:
+            written = convert_layer(shapefile, formats, force=args.force)
+        except Exception as e:
+            failures += 1
+            print(f"{shapefile.stem:<40} FAILED: {e}")
+            continue
+
+        if not written:
+            print(f"{shapefile.stem:<40} up to date")
+            continue
+
+        timings = [f"shp {timed_read(shapefile) * 1000:.0f} ms"]
+        timings += [f"{path.suffix[1:]} {timed_read(path) * 1000:.0f} ms" for path in written]
+        sizes = ", ".join(f"{path.suffix[1:]} {path.stat().st_size / 1024:.0f} KB" for path in written)
+        print(f"{shapefile.stem:<40} {sizes} | read {', '.join(timings)}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,6 +29,10 @@ done
 # Copy rasters
 cp -r /tmp/project_map-main/data/rasters/* data/rasters/
 
+# GeoParquet/FlatGeobuf copies for faster layer loads (shapefiles stay as fallback)
+echo "⚙️  Converting shapefiles..."
+python3 scripts/convert_shapefiles.py --dir data/shapefiles || echo "⚠️  Conversion failed - layers will load from shapefiles"
+
 # Cleanup
 rm -rf /tmp/project_map.zip /tmp/project_map-main
 
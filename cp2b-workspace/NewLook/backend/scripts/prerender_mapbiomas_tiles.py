@@ -0,0 +1,127 @@
+"""
+CP2B Maps V3 - MapBiomas Tile Pre-rendering
+Render the MapBiomas tile pyramid into the MBTiles store served by /mapbiomas/tiles
+
+Zooms deeper than the pre-rendered range are rendered on demand by the API
+and written back to the same store.
+
+Usage:
+    python scripts/prerender_mapbiomas_tiles.py
+    python scripts/prerender_mapbiomas_tiles.py --min-zoom 5 --max-zoom 12 --workers 4
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Allow running from the backend directory without installing the app
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.mapbiomas_tiles import (  # noqa: E402
+    HAS_RASTER_DEPS,
+    PRERENDER_MAX_ZOOM,
+    PRERENDER_MIN_ZOOM,
+    RASTER_PATH,
+    TILES_PATH,
+    RASTER_VERSION_KEY,
+    MBTilesStore,
+    MapBiomasTileService,
+    lnglat_to_tile,
+    raster_version,
+    rasterio,
+)
+
+# Tiles written per SQLite transaction
+BATCH_SIZE = 500
+
+# Per-worker tile service (keeps raster handles per overview level open)
+_worker_service = None
+
+
+def _init_worker(raster_path: str, output: str):
+    global _worker_service
+    _worker_service = MapBiomasTileService(Path(raster_path), Path(output))
+
+
+def _render_row(args):
+    """Render one row of tiles (z, y, x_min, x_max) in a worker"""
+    z, y, x_min, x_max = args
+    return [(z, x, y, _worker_service.render(z, x, y)) for x in range(x_min, x_max + 1)]
+
+
+def tile_rows(bounds, min_zoom: int, max_zoom: int):
+    """Yield (z, y, x_min, x_max) rows covering the raster bounds"""
+    for z in range(min_zoom, max_zoom + 1):
+        x_min, y_min = lnglat_to_tile(bounds.left, bounds.top, z)
+        x_max, y_max = lnglat_to_tile(bounds.right, bounds.bottom, z)
+        for y in range(y_min, y_max + 1):
+            yield z, y, x_min, x_max
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render MapBiomas tiles into MBTiles")
+    parser.add_argument("--raster", default=str(RASTER_PATH), help="MapBiomas GeoTIFF")
+    parser.add_argument("--output", default=str(TILES_PATH), help="MBTiles output path")
+    parser.add_argument("--min-zoom", type=int, default=PRERENDER_MIN_ZOOM)
+    parser.add_argument("--max-zoom", type=int, default=PRERENDER_MAX_ZOOM)
+    parser.add_argument("--workers", type=int, default=1, help="Render processes")
+    args = parser.parse_args()
+
+    if not HAS_RASTER_DEPS:
+        print("Raster dependencies not available (rasterio, PIL, numpy)")
+        return 1
+
+    raster_path = Path(args.raster)
+    if not raster_path.exists():
+        print(f"Raster not found: {raster_path}")
+        return 1
+
+    with rasterio.open(raster_path) as src:
+        bounds = src.bounds
+
+    rows = list(tile_rows(bounds, args.min_zoom, args.max_zoom))
+    total_tiles = sum(x_max - x_min + 1 for _, _, x_min, x_max in rows)
+    print(f"Rendering {total_tiles} tiles (zoom {args.min_zoom}-{args.max_zoom}) into {args.output}")
+
+    store = MBTilesStore(Path(args.output))
+    store.set_metadata({
+        "name": "MapBiomas Agropecuária SP",
+        "format": "png",
+        "type": "overlay",
+        "version": "1.3",
+        "minzoom": args.min_zoom,
+        "maxzoom": args.max_zoom,
+        "bounds": f"{bounds.left},{bounds.bottom},{bounds.right},{bounds.top}",
+        RASTER_VERSION_KEY: raster_version(raster_path)
+    })
+
+    start = time.time()
+    rendered = 0
+    batch = []
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(str(raster_path), args.output)
+    ) as pool:
+        for row_tiles in pool.map(_render_row, rows, chunksize=4):
+            batch.extend(row_tiles)
+            if len(batch) >= BATCH_SIZE:
+                store.put_many(batch)
+                rendered += len(batch)
+                batch = []
+                print(f"  {rendered}/{total_tiles} tiles ({time.time() - start:.0f}s)")
+
+    if batch:
+        store.put_many(batch)
+        rendered += len(batch)
+
+    store.close()
+    print(f"Done: {rendered} tiles in {time.time() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,45 @@
 """
-Setup script to copy MapBiomas raster and create metadata
+Setup script to copy MapBiomas raster, convert it to a Cloud-Optimized GeoTIFF
+and create metadata
 """
 import os
 import shutil
 import json
 
+import rasterio
+import rasterio.shutil
+
 # Paths
 source_raster = r"C:\Users\Lucas\Documents\CP2B\CP2B_Maps_V2\data\rasters\mapbiomas_agropecuaria_sp_2024.tif"
 dest_dir = r"C:\Users\Lucas\Documents\CP2B\CP2B_Maps_V3\cp2b-workspace\NewLook\backend\data\mapbiomas"
 dest_raster = os.path.join(dest_dir, "mapbiomas_agropecuaria_sp_2024.tif")
 metadata_path = os.path.join(dest_dir, "mapbiomas_metadata.json")
 
+# COG layout: 512px internal tiles and 6 overview levels (1/2 .. 1/64 resolution).
+# Overviews use mode resampling so each coarse pixel keeps the majority class.
+COG_BLOCK_SIZE = 512
+COG_OVERVIEW_COUNT = 6
+
+
+def is_cog_ready(path):
+    """Whether the raster is already internally tiled with overviews"""
+    with rasterio.open(path) as src:
+        return src.profile.get("tiled", False) and len(src.overviews(1)) > 0
+
+
+def convert_to_cog(path):
+    """Rewrite the raster in place as a DEFLATE-compressed COG with mode overviews"""
+    cog_path = path + ".cog.tif"
+    rasterio.shutil.copy(
+        path, cog_path, driver="COG",
+        blocksize=COG_BLOCK_SIZE,
+        compress="DEFLATE",
+        overview_resampling="MODE",
+        overview_count=COG_OVERVIEW_COUNT
+    )
+    os.replace(cog_path, path)
+
+
 # Create directory
 os.makedirs(dest_dir, exist_ok=True)
 print(f"Created directory: {dest_dir}")
@@ -22,6 +51,14 @@ if not os.path.exists(dest_raster):
 else:
     print(f"Raster already exists: {dest_raster}")
 
+# Convert to Cloud-Optimized GeoTIFF (tiles and services read overviews at low zoom)
+if not is_cog_ready(dest_raster):
+    convert_to_cog(dest_raster)
+    with rasterio.open(dest_raster) as src:
+        print(f"Converted raster to COG with overviews {src.overviews(1)}")
+else:
+    print("Raster already tiled with overviews")
+
 # Create metadata JSON with MapBiomas class definitions
 metadata = {
     "year": 2024,
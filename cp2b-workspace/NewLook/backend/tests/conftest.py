@@ -1,6 +1,8 @@
 """
 Pytest configuration and fixtures for CP2B Maps V3 Backend
 """
+import time
+
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import Mock, MagicMock
@@ -21,6 +23,14 @@ def mock_db_connection(monkeypatch):
     monkeypatch.setattr("app.core.database.get_db", mock_get_db)
     return mock_conn, mock_cursor
 
+@pytest.fixture(autouse=True)
+def isolate_cache_warm_start(monkeypatch, tmp_path):
+    """Keep app startup/shutdown from prewarming or writing a real cache snapshot"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "CACHE_SNAPSHOT_PATH", tmp_path / "cache_snapshot.bin")
+    monkeypatch.setattr(settings, "CACHE_PREWARM_TOP_N", 0)
+
 @pytest.fixture
 def client() -> Generator:
     """
@@ -114,3 +124,58 @@ def db_transaction(db_connection):
     yield cursor
     db_connection.rollback()
     cursor.close()
+
+# Proximity pipeline fixtures
+SLOW_STAGE_SECONDS = 0.2
+
+class SlowProximityService:
+    """Stand-in for ProximityService whose stages block like GEOS/psycopg2 calls"""
+
+    def get_municipalities_in_radius(self, lat, lng, radius_km):
+        time.sleep(SLOW_STAGE_SECONDS)
+        return {"type": "Polygon", "coordinates": []}, [
+            {"id": 1, "name": "Piracicaba", "ibge_code": "3538709", "distance_km": 3.0,
+             "population": 1000, "intersection_fraction": 0.5}
+        ]
+
+    def aggregate_biogas_potential(self, municipalities):
+        time.sleep(SLOW_STAGE_SECONDS)
+        return {"total_m3_year": 10.0, "energy_potential_mwh_year": 20.0}
+
+    def get_residuos_for_municipalities(self):
+        time.sleep(SLOW_STAGE_SECONDS)
+        return {"total_residuos": 3}
+
+    def correlate_mapbiomas_residuos(self, land_use_data):
+        time.sleep(SLOW_STAGE_SECONDS)
+        return {"correlations": [], "total_potential_sources": 0}
+
+    def find_nearest_infrastructure_of_type(self, lat, lng, config):
+        time.sleep(SLOW_STAGE_SECONDS)
+        return {"type": config["type"], "distance_km": 1.5, "found": True}
+
+def slow_buffer_analysis(lat, lng, radius_km):
+    time.sleep(SLOW_STAGE_SECONDS)
+    return {"total_area_km2": 1256.6, "by_class": {"15": {"area_km2": 600.0}},
+            "dominant_class": "Pastagem", "agricultural_percent": 80.0}
+
+@pytest.fixture
+def slow_services(monkeypatch):
+    """
+    Blocking service stubs in place of the shapefile, database and raster work
+
+    Returns the stub service class (subclass it and monkeypatch
+    proximity.ProximityService to instrument a stage)
+    """
+    from app.api.v1.endpoints import proximity
+    from app.core.config import settings
+    from app.services.cache_service import mapbiomas_cache, proximity_cache
+
+    monkeypatch.setattr(proximity, "ProximityService", SlowProximityService)
+    monkeypatch.setattr(proximity, "run_buffer_analysis", slow_buffer_analysis)
+    monkeypatch.setattr(settings, "MAPBIOMAS_USE_PROCESS_POOL", False)
+    proximity_cache.clear()
+    mapbiomas_cache.clear()
+    yield SlowProximityService
+    proximity_cache.clear()
+    mapbiomas_cache.clear()
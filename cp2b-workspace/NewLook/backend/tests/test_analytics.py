@@ -0,0 +1,59 @@
+"""
+Tests for the vectorized analytics helpers
+"""
+import numpy as np
+import pytest
+
+from app.utils.analytics import histogram, summary_statistics, top_k
+
+
+class TestTopK:
+    """Tests for argpartition-based top-k"""
+
+    def test_matches_stable_sort_with_ties(self):
+        """Test that results equal a full stable sort, including ties at the cut"""
+        rng = np.random.default_rng(0)
+        values = rng.integers(0, 20, size=500).astype(float)
+
+        for k in (1, 5, 37, 500, 600):
+            expected = np.argsort(-values, kind="stable")[:k]
+            assert list(top_k(values, k)) == list(expected)
+
+    def test_min_value_filter(self):
+        """Test that positions refer to the original array after filtering"""
+        values = np.array([5.0, 1.0, 9.0, 3.0, 7.0])
+        assert list(top_k(values, 2, min_value=4)) == [2, 4]
+        assert list(top_k(values, 10, min_value=100)) == []
+
+
+class TestHistogram:
+    """Tests for linear and log-scale bins"""
+
+    def test_last_bin_includes_max(self):
+        """Test half-open bins with an inclusive last bin"""
+        counts, edges = histogram(np.array([1.0, 2.0, 3.0, 4.0]), 3)
+        assert list(counts) == [1, 1, 2]
+        assert edges[0] == 1.0 and edges[-1] == 4.0
+
+    def test_log_scale_spreads_skewed_values(self):
+        """Test that log bins are equal-ratio"""
+        values = np.array([1.0, 10.0, 100.0, 1000.0])
+        counts, edges = histogram(values, 3, scale="log")
+        assert list(counts) == [1, 1, 2]
+        assert edges == pytest.approx([1.0, 10.0, 100.0, 1000.0])
+
+    def test_log_scale_rejects_non_positive(self):
+        """Test that log bins need positive values"""
+        with pytest.raises(ValueError):
+            histogram(np.array([0.0, 10.0]), 3, scale="log")
+
+
+class TestSummaryStatistics:
+    """Tests for summary statistics"""
+
+    def test_statistics(self):
+        """Test median (upper middle value), population std and percentiles"""
+        stats = summary_statistics(np.array([1.0, 2.0, 3.0, 4.0]), percentiles=(25, 50))
+        assert stats["median"] == 3.0
+        assert stats["std"] == pytest.approx(1.12, abs=0.01)
+        assert stats["percentiles"] == {"p25": 1.75, "p50": 2.5}
@@ -0,0 +1,222 @@
+"""
+Tests for two-tier caching with shared L2 backends
+"""
+import fnmatch
+import threading
+import time
+
+import pytest
+
+from app.services.cache_backends import (
+    CacheBackend,
+    MemoryBackend,
+    RedisBackend,
+    SQLiteBackend,
+    decode_entry,
+    encode_entry,
+)
+from app.services.cache_service import LRUCache
+
+
+class FakeRedis:
+    """Dict-backed stand-in for the redis-py client methods RedisBackend uses"""
+
+    def __init__(self):
+        self.data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None or item[1] <= time.time():
+            return None
+        return item[0]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, time.time() + ex)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match="*", count=None):
+        return [key for key in list(self.data) if fnmatch.fnmatchcase(key, match)]
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        # Serialized, so a WATCHed transaction never needs a retry
+        with self._lock:
+            return func(FakePipeline(self))
+
+
+class FakePipeline:
+    """Pipeline handed to transaction callbacks (commands apply immediately)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def multi(self):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.client.set(key, value, ex=ex)
+
+
+class BrokenBackend(MemoryBackend):
+    """Backend whose server is unreachable"""
+
+    def get(self, key):
+        raise ConnectionError("connection refused")
+
+    def set(self, key, payload, ttl):
+        raise ConnectionError("connection refused")
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    """Each shared backend implementation"""
+    if request.param == "memory":
+        yield MemoryBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteBackend(tmp_path / "cache.sqlite3")
+        yield backend
+        backend.close()
+    else:
+        yield RedisBackend(client=FakeRedis())
+
+
+class TestEntryEncoding:
+    """Tests for the pickle-free payload format"""
+
+    def test_json_and_bytes_round_trip(self):
+        """Test that JSON values and raw bytes survive encoding"""
+        value = {"municipalities": [{"ibge_code": "3509502", "biogas": 1.5}], "from_cache": False}
+
+        assert decode_entry(encode_entry(value, 123.0)) == (value, 123.0)
+        assert decode_entry(encode_entry(b"\x89PNG", 5.0)) == (b"\x89PNG", 5.0)
+
+    def test_rejects_arbitrary_objects(self):
+        """Test that non-JSON objects are refused rather than pickled"""
+        with pytest.raises(TypeError):
+            encode_entry(object(), 1.0)
+
+
+class TestBackendInterface:
+    """Tests for the CacheBackend base class"""
+
+    def test_incomplete_backend_fails_on_construction(self):
+        """Test that a backend missing a method cannot be created"""
+        class NoClear(CacheBackend):
+            def get(self, key):
+                return None
+
+            def set(self, key, payload, ttl):
+                pass
+
+            def delete(self, key):
+                pass
+
+        with pytest.raises(TypeError, match="clear"):
+            NoClear()
+
+    @pytest.mark.parametrize("backend_class", [MemoryBackend, SQLiteBackend, RedisBackend])
+    def test_backends_implement_interface(self, backend_class):
+        """Test that the shipped backends leave no abstract method unimplemented"""
+        assert not backend_class.__abstractmethods__
+
+
+class TestTwoTierCache:
+    """Tests for LRUCache with a shared L2 backend"""
+
+    def test_workers_share_results(self, backend):
+        """Test that a value set by one worker is an L2 hit for another"""
+        worker_a = LRUCache(name="proximity", backend=backend)
+        worker_b = LRUCache(name="proximity", backend=backend)
+
+        worker_a.set("proximity:abc", {"total": 42}, ttl=60)
+
+        assert worker_b.get("proximity:abc") == {"total": 42}
+        assert worker_b.get("proximity:abc") == {"total": 42}  # now an L1 hit
+
+        stats = worker_b.get_stats()
+        assert stats["hits"] == 2
+        assert stats["l2_hits"] == 1
+        assert stats["l2_backend"] == backend.name
+
+    def test_namespaces_and_clear(self, backend):
+        """Test that clear() only removes the cache's own shared entries"""
+        proximity = LRUCache(name="proximity", backend=backend)
+        municipality = LRUCache(name="municipality", backend=backend)
+        proximity.set("k", 1)
+        municipality.set("k", 2)
+
+        proximity.clear()
+
+        assert LRUCache(name="proximity", backend=backend).get("k") is None
+        assert LRUCache(name="municipality", backend=backend).get("k") == 2
+
+    def test_expired_l2_entry_is_miss(self, backend):
+        """Test that L2 entries honour the expiry they were written with"""
+        # Store still holds the entry, but its payload has already expired
+        backend.set("cp2b:mapbiomas:k", encode_entry("v", time.time() - 1), 60)
+
+        reader = LRUCache(name="mapbiomas", backend=backend)
+        assert reader.get("k") is None
+        assert reader.get_stats()["misses"] == 1
+
+    def test_concurrent_updates_across_workers(self, backend):
+        """Test that read-modify-writes from two workers do not lose each other's changes"""
+        workers = [LRUCache(name="proximity", backend=backend) for _ in range(2)]
+
+        def add(item):
+            def apply(items):
+                time.sleep(0.005)  # widen the read-to-write window
+                return sorted((items or []) + [item])
+            return apply
+
+        threads = [
+            threading.Thread(target=workers[i % 2].update, args=("radii", add(i)))
+            for i in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert LRUCache(name="proximity", backend=backend).get("radii") == list(range(10))
+
+    def test_backend_failure_falls_back_to_local(self):
+        """Test that an unreachable L2 never breaks the local cache"""
+        cache = LRUCache(name="proximity", backend=BrokenBackend())
+
+        cache.set("k", {"a": 1})
+
+        assert cache.get("k") == {"a": 1}
+        assert cache.get("missing") is None
+        assert cache.get_stats()["l2_errors"] == 1  # backed off after the first failure
+
+        assert cache.update("k", lambda value: {"a": value["a"] + 1}) == {"a": 2}
+        assert cache.get("k") == {"a": 2}
+
+
+class TestSQLiteBackend:
+    """Tests specific to the tmpfs SQLite store"""
+
+    def test_separate_connections_share_file(self, tmp_path):
+        """Test that two workers' connections see each other's writes"""
+        path = tmp_path / "cache.sqlite3"
+        first, second = SQLiteBackend(path), SQLiteBackend(path)
+
+        first.set("cp2b:x", b"payload", 60)
+
+        assert second.get("cp2b:x") == b"payload"
+
+    def test_trim_to_max_entries(self, tmp_path):
+        """Test that the periodic purge bounds the store"""
+        backend = SQLiteBackend(tmp_path / "cache.sqlite3", max_entries=10)
+        for i in range(SQLiteBackend.PURGE_EVERY):
+            backend.set(f"cp2b:{i}", b"x", 60 + i)
+
+        assert backend.get_stats()["size"] == 10
+        assert backend.get(f"cp2b:{SQLiteBackend.PURGE_EVERY - 1}") == b"x"
@@ -0,0 +1,121 @@
+"""
+Tests for background cache maintenance (expiry sweep, stale-while-revalidate)
+"""
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.cache_maintenance import CacheMaintenance
+from app.services.cache_service import LRUCache
+
+
+@pytest.fixture
+def stale_immediately(monkeypatch):
+    """Soft TTL of zero: every entry with a refresher is due at once"""
+    monkeypatch.setattr(settings, "CACHE_SOFT_TTL_FRACTION", 0.0)
+
+
+def _hit(cache, key, times):
+    for _ in range(times):
+        assert cache.get(key) is not None
+
+
+class TestClaimRefreshes:
+    """Tests for selecting entries due for background refresh"""
+
+    def test_only_hot_stale_entries_with_refresher(self, stale_immediately):
+        """Test that cold entries and entries without a refresher are skipped"""
+        cache = LRUCache(max_size=100)
+        cache.set("hot", 1, ttl=60, refresh=lambda: None)
+        cache.set("cold", 2, ttl=60, refresh=lambda: None)
+        cache.set("plain", 3, ttl=60)
+        _hit(cache, "hot", 3)
+        _hit(cache, "cold", 1)
+        _hit(cache, "plain", 5)
+
+        claimed = cache.claim_refreshes(min_hits=2)
+
+        assert [key for key, _ in claimed] == ["hot"]
+        assert cache.claim_refreshes(min_hits=2) == []  # already being refreshed
+
+    def test_fresh_entries_are_not_due(self):
+        """Test that entries before their soft TTL are left alone"""
+        cache = LRUCache(max_size=100)
+        cache.set("k", 1, ttl=300, refresh=lambda: None)
+        _hit(cache, "k", 5)
+
+        assert cache.claim_refreshes(min_hits=1) == []
+
+
+class TestCacheMaintenance:
+    """Tests for a maintenance run"""
+
+    def test_sweeps_expired_entries(self):
+        """Test that expired entries are removed without being requested"""
+        cache = LRUCache(max_size=100)
+        cache.set("old", "x", ttl=-1)
+        cache.set("new", "y", ttl=60)
+        maintenance = CacheMaintenance([cache])
+
+        result = asyncio.run(maintenance.run_once())
+
+        assert result["expired_removed"] == 1
+        assert cache.get_stats()["size"] == 1
+        assert cache.get_stats()["expired_removed"] == 1
+
+    def test_refreshes_hot_entries(self, stale_immediately):
+        """Test that async and blocking refreshers both recompute their entry"""
+        cache = LRUCache(max_size=100)
+
+        async def refresh_async():
+            cache.set("async", "fresh", ttl=60)
+
+        def refresh_blocking():
+            cache.set("blocking", "fresh", ttl=60)
+
+        def refresh_broken():
+            raise RuntimeError("database unavailable")
+
+        cache.set("async", "stale", ttl=60, refresh=refresh_async)
+        cache.set("blocking", "stale", ttl=60, refresh=refresh_blocking)
+        cache.set("broken", "stale", ttl=60, refresh=refresh_broken)
+        for key in ("async", "blocking", "broken"):
+            _hit(cache, key, 2)
+        maintenance = CacheMaintenance([cache], min_hits=2)
+
+        result = asyncio.run(maintenance.run_once())
+
+        assert result == {"expired_removed": 0, "refreshed": 2, "failed": 1}
+        assert cache.get("async") == "fresh"
+        assert cache.get("blocking") == "fresh"
+        assert cache.get("broken") == "stale"  # still served until the hard TTL
+        stats = cache.get_stats()
+        assert (stats["refreshes"], stats["refresh_failures"]) == (2, 1)
+        assert maintenance.get_stats()["refreshes"] == 2
+
+    def test_refreshes_per_run_are_capped(self, stale_immediately):
+        """Test that one run refreshes at most max_refreshes_per_run entries"""
+        cache = LRUCache(max_size=100)
+        for i in range(5):
+            cache.set(f"k{i}", i, ttl=60, refresh=lambda: None)
+            _hit(cache, f"k{i}", 1)
+        maintenance = CacheMaintenance([cache], min_hits=1, max_refreshes_per_run=3)
+
+        assert asyncio.run(maintenance.run_once())["refreshed"] == 3
+        assert asyncio.run(maintenance.run_once())["refreshed"] == 2
+
+    def test_start_and_stop(self):
+        """Test that the periodic task runs on the event loop and stops cleanly"""
+        maintenance = CacheMaintenance([LRUCache(max_size=10)], interval_seconds=0)
+
+        async def run():
+            maintenance.start()
+            await asyncio.sleep(0.05)
+            running = maintenance.get_stats()["running"]
+            await maintenance.stop()
+            return running
+
+        assert asyncio.run(run()) is True
+        assert maintenance.get_stats()["running"] is False
+        assert maintenance.runs > 0
@@ -0,0 +1,101 @@
+"""
+Tests for LRUCache memory budgets, lock striping and compression
+"""
+import threading
+
+from app.services.cache_service import LRUCache, estimate_size, get_all_cache_stats
+
+# A proximity-like response (~100 KB of Python objects, very compressible)
+RESPONSE = {
+    "municipalities": [
+        {"ibge_code": f"35{i:05d}", "name": "Município", "biogas_m3_year": i * 1.5, "population": 1000 + i}
+        for i in range(400)
+    ],
+    "from_cache": False,
+}
+
+
+class TestMemoryBudget:
+    """Tests for size-aware eviction"""
+
+    def test_evicts_by_bytes(self):
+        """Test that large entries are evicted once the byte budget is used up"""
+        entry_size = estimate_size(RESPONSE)
+        cache = LRUCache(max_size=100, max_bytes=entry_size * 3, shards=1)
+
+        for i in range(10):
+            cache.set(f"k{i}", RESPONSE)
+
+        stats = cache.get_stats()
+        assert stats["size"] == 3
+        assert stats["memory_bytes"] <= stats["max_bytes"]
+        assert cache.get("k9") == RESPONSE
+        assert cache.get("k0") is None
+
+    def test_oversized_entry_not_cached(self):
+        """Test that one entry larger than the budget does not flush the cache"""
+        cache = LRUCache(max_size=100, max_bytes=10_000, shards=1)
+        cache.set("small", {"a": 1})
+        cache.set("big", RESPONSE)
+
+        assert cache.get("big") is None
+        assert cache.get("small") == {"a": 1}
+
+    def test_stats_report_memory(self):
+        """Test that /stats/cache reports per-cache and total memory"""
+        stats = get_all_cache_stats()
+
+        assert "memory_bytes" in stats["proximity"]
+        assert stats["total_memory_bytes"] == sum(
+            stats[name]["memory_bytes"]
+            for name in ("proximity", "mapbiomas", "municipality", "tiles", "compressed_responses", "geometry")
+        )
+
+
+class TestCompressedEntries:
+    """Tests for compressed storage"""
+
+    def test_compressed_round_trip(self):
+        """Test that compressed entries are smaller and decode to equal values"""
+        plain = LRUCache(max_size=10)
+        compressed = LRUCache(max_size=10, compress=True)
+        plain.set("k", RESPONSE)
+        compressed.set("k", RESPONSE)
+
+        assert compressed.get("k") == RESPONSE
+        assert compressed.get_stats()["compressed_entries"] == 1
+        assert compressed.get_stats()["memory_bytes"] < plain.get_stats()["memory_bytes"] / 10
+
+    def test_small_and_unserializable_values_kept_raw(self):
+        """Test that tiny or non-JSON values skip compression"""
+        cache = LRUCache(max_size=10, compress=True)
+        marker = object()
+        cache.set("small", {"a": 1})
+        cache.set("object", marker)
+
+        assert cache.get("object") is marker
+        assert cache.get_stats()["compressed_entries"] == 0
+
+
+class TestLockStriping:
+    """Tests for sharded locking"""
+
+    def test_shards_respect_max_size(self):
+        """Test that striping never holds more than max_size entries"""
+        cache = LRUCache(max_size=100, shards=8)
+
+        def fill(start):
+            for i in range(start, start + 200):
+                cache.set(f"key{i}", i)
+                cache.get(f"key{i}")
+
+        threads = [threading.Thread(target=fill, args=(n * 200,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = cache.get_stats()
+        assert stats["shards"] == 6  # 100 // MIN_SHARD_SIZE
+        assert stats["size"] <= 100
+        assert stats["hits"] + stats["misses"] == 800
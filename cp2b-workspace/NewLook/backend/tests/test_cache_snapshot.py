@@ -0,0 +1,127 @@
+"""
+Tests for cache snapshots (warm start across restarts) and startup prewarm
+"""
+import asyncio
+
+import pytest
+
+from app.api.v1.endpoints import proximity
+from app.core.config import settings
+from app.services import cache_maintenance
+from app.services.cache_service import (
+    LRUCache,
+    load_cache_snapshot,
+    mapbiomas_cache,
+    municipality_cache,
+    proximity_cache,
+    save_cache_snapshot,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    for cache in (proximity_cache, mapbiomas_cache, municipality_cache):
+        cache.clear()
+    yield
+    for cache in (proximity_cache, mapbiomas_cache, municipality_cache):
+        cache.clear()
+
+
+class TestExportImport:
+    """Tests for LRUCache.export_entries / import_entries"""
+
+    def test_hottest_entries_first(self):
+        """Test that exports are ranked by hit count and limited"""
+        cache = LRUCache(max_size=100)
+        for key, hits in (("cold", 0), ("warm", 1), ("hot", 5)):
+            cache.set(key, {"key": key}, ttl=60)
+            for _ in range(hits):
+                cache.get(key)
+
+        exported = cache.export_entries(limit=2)
+
+        assert [item["key"] for item in exported] == ["hot", "warm"]
+        assert exported[0]["hits"] == 5
+
+    def test_round_trip_keeps_value_and_expiry(self):
+        """Test that compressed values come back decompressed with their TTL"""
+        source = LRUCache(max_size=100, compress=True)
+        value = {"municipalities": [{"name": "Piracicaba", "biogas": i} for i in range(100)]}
+        source.set("k", value, ttl=60)
+        exported = source.export_entries(limit=10)
+
+        target = LRUCache(max_size=100)
+        assert target.import_entries(exported) == 1
+        assert target.get("k") == value
+        assert target.export_entries(1)[0]["expires_at"] == pytest.approx(exported[0]["expires_at"], abs=1)
+
+
+class TestSnapshotFile:
+    """Tests for save_cache_snapshot / load_cache_snapshot"""
+
+    def test_restart_restores_hot_entries(self, tmp_path):
+        """Test that entries survive a simulated restart"""
+        path = tmp_path / "snapshot.bin"
+        proximity_cache.set("proximity:abc", {"total": 42}, ttl=300)
+        mapbiomas_cache.set("mapbiomas:abc", {"dominant_class": "Pastagem"}, ttl=600)
+
+        assert save_cache_snapshot(path, "v1") == 2
+        proximity_cache.clear()
+        mapbiomas_cache.clear()
+
+        assert load_cache_snapshot(path, "v1") == 2
+        assert proximity_cache.get("proximity:abc") == {"total": 42}
+        assert mapbiomas_cache.get("mapbiomas:abc") == {"dominant_class": "Pastagem"}
+
+    def test_other_dataset_version_is_discarded(self, tmp_path):
+        """Test that results computed from older data are not reloaded"""
+        path = tmp_path / "snapshot.bin"
+        proximity_cache.set("proximity:abc", {"total": 42})
+        save_cache_snapshot(path, "v1")
+        proximity_cache.clear()
+
+        assert load_cache_snapshot(path, "v2") == 0
+        assert proximity_cache.get("proximity:abc") is None
+
+    def test_missing_or_corrupt_file(self, tmp_path):
+        """Test that startup never fails on a bad snapshot"""
+        path = tmp_path / "snapshot.bin"
+        assert load_cache_snapshot(path, "v1") == 0
+
+        path.write_bytes(b"not a snapshot")
+        assert load_cache_snapshot(path, "v1") == 0
+
+    def test_dataset_version_follows_setting(self, monkeypatch):
+        """Test that bumping DATASET_VERSION changes the stamp"""
+        before = cache_maintenance.get_dataset_version()
+        monkeypatch.setattr(settings, "DATASET_VERSION", "reloaded")
+
+        assert cache_maintenance.get_dataset_version() != before
+
+
+class TestPrewarm:
+    """Tests for the startup prewarm of top municipalities"""
+
+    def test_prewarm_computes_missing_analyses_largest_radius_first(self, monkeypatch):
+        """Test that each point is warmed at every radius once"""
+        computed = []
+
+        class FakeService:
+            def get_top_municipality_centroids(self, top_n):
+                return [
+                    {"name": "Piracicaba", "ibge_code": "3538709", "latitude": -22.72, "longitude": -47.65},
+                    {"name": "Campinas", "ibge_code": "3509502", "latitude": -22.90, "longitude": -47.06},
+                ][:top_n]
+
+        async def fake_pipeline(request, analysis_id, start_time, cache_key, snapped_to=None):
+            computed.append((request.latitude, request.radius_km))
+            proximity_cache.set(cache_key, {"radius": request.radius_km})
+
+        monkeypatch.setattr(proximity, "ProximityService", FakeService)
+        monkeypatch.setattr(proximity, "_run_proximity_analysis", fake_pipeline)
+
+        assert asyncio.run(proximity.prewarm_proximity_cache(2, [10, 20, 30, 50], concurrency=1)) == 8
+        assert [radius for lat, radius in computed if lat == -22.72] == [50, 30, 20, 10]
+
+        # Already cached: nothing to recompute
+        assert asyncio.run(proximity.prewarm_proximity_cache(2, [10, 20, 30, 50])) == 0
@@ -0,0 +1,222 @@
+"""
+Tests for streaming PostGIS-built and shapefile GeoJSON
+"""
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import pytest
+from shapely.geometry import LineString
+
+from app.utils import geojson_stream
+from app.utils.geojson_stream import (
+    GEOJSON_MEDIA_TYPE,
+    feature_to_bytes,
+    features_to_bytes,
+    geometries_to_json,
+    properties_to_json,
+    stream_feature_collection,
+    stream_features,
+)
+
+FEATURES = [
+    {"type": "Feature", "id": i, "geometry": {"type": "Point", "coordinates": [-47.0, -22.5]},
+     "properties": {"name": f"Município {i}"}}
+    for i in range(5)
+]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Pooled connection double handing out a server-side cursor"""
+    conn = MagicMock()
+    cursor = MagicMock()
+    cursor.__enter__.return_value = cursor
+    conn.cursor.return_value = cursor
+    released = []
+
+    @contextmanager
+    def fake_get_db():
+        try:
+            yield conn
+        finally:
+            released.append(conn)
+
+    monkeypatch.setattr(geojson_stream, "get_db", fake_get_db)
+    return conn, cursor, released
+
+
+def read_body(response) -> bytes:
+    async def collect():
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+
+def stream_and_read(*args, chunks=None, **kwargs):
+    """Create the streaming response and read its body on one event loop"""
+    chunks = [] if chunks is None else chunks
+
+    async def run():
+        response = await stream_feature_collection(*args, **kwargs)
+        async for chunk in response.body_iterator:
+            chunks.append(chunk)
+        return response
+
+    return asyncio.run(run()), b"".join(chunks)
+
+
+class TestStreamFeatureCollection:
+    """Tests for stream_feature_collection"""
+
+    def test_rows_become_feature_collection(self, db):
+        """Test that feature rows are joined in batches without parsing"""
+        conn, cursor, released = db
+        rows = [(json.dumps(f),) for f in FEATURES]
+        cursor.fetchmany.side_effect = [rows[:2], rows[2:4], rows[4:], []]
+
+        async def run():
+            response = await stream_feature_collection("SELECT feature", [1], fetch_size=2)
+            assert released == []  # Connection held until the stream is consumed
+            return response, b"".join([chunk async for chunk in response.body_iterator])
+
+        response, body = asyncio.run(run())
+
+        assert response.media_type == GEOJSON_MEDIA_TYPE
+        assert conn.cursor.call_args.kwargs["name"].startswith("geojson_")
+        assert json.loads(body) == {"type": "FeatureCollection", "features": FEATURES}
+        assert released == [conn]
+
+    def test_query_runs_off_event_loop(self, db):
+        """Test that execute and the fetches run in the shared thread pool"""
+        _, cursor, _ = db
+        threads = []
+        cursor.execute.side_effect = lambda *args: threads.append(threading.current_thread().name)
+        cursor.fetchmany.side_effect = lambda size: threads.append(threading.current_thread().name) or []
+
+        stream_and_read("SELECT feature")
+
+        assert len(threads) == 2
+        assert all(name.startswith("analysis") for name in threads)
+
+    def test_empty_result(self, db):
+        """Test that no rows give an empty FeatureCollection"""
+        _, cursor, _ = db
+        cursor.fetchmany.return_value = []
+
+        _, body = stream_and_read("SELECT feature")
+
+        assert json.loads(body) == {"type": "FeatureCollection", "features": []}
+
+    def test_query_error_raised_before_streaming(self, db):
+        """Test that database errors surface in the endpoint and release the connection"""
+        conn, cursor, released = db
+        cursor.execute.side_effect = psycopg2.Error("boom")
+
+        with pytest.raises(psycopg2.Error):
+            asyncio.run(stream_feature_collection("SELECT feature"))
+
+        assert released == [conn]
+
+    def test_error_mid_stream_truncates_body(self, db):
+        """Test that a failure after the first batch ends the body early and releases the connection"""
+        conn, cursor, released = db
+        rows = [(json.dumps(f),) for f in FEATURES]
+        cursor.fetchmany.side_effect = [rows[:2], psycopg2.OperationalError("server closed the connection")]
+
+        chunks = []
+        with pytest.raises(psycopg2.OperationalError):
+            stream_and_read("SELECT feature", fetch_size=2, chunks=chunks)
+
+        body = b"".join(chunks)
+        assert body.startswith(geojson_stream.FEATURE_COLLECTION_HEAD)
+        assert not body.endswith(geojson_stream.FEATURE_COLLECTION_TAIL)
+        with pytest.raises(ValueError):
+            json.loads(body)
+        assert released == [conn]
+
+    def test_released_when_cancelled_during_query(self, db):
+        """Test that a request cancelled while the query runs still returns the connection"""
+        conn, cursor, released = db
+        cursor.fetchmany.side_effect = lambda size: time.sleep(0.2) or []
+
+        async def run():
+            task = asyncio.create_task(stream_feature_collection("SELECT feature"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert released == []  # The query is still running in the pool
+            await asyncio.sleep(0.3)
+
+        asyncio.run(run())
+
+        assert released == [conn]
+
+    def test_released_when_client_disconnects_before_body(self, db):
+        """Test that the background task returns the connection if the body is never read"""
+        conn, cursor, released = db
+        cursor.fetchmany.return_value = [(json.dumps(FEATURES[0]),)]
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            await asyncio.sleep(0.1)  # Slow client: disconnect wins
+
+        async def run():
+            response = await stream_feature_collection("SELECT feature")
+            await response({"type": "http", "method": "GET"}, receive, send)
+
+        asyncio.run(run())
+
+        assert released == [conn]
+
+
+class TestFeatureSerialization:
+    """Tests for serializing geometry arrays and attribute frames"""
+
+    def test_geometry_precision(self):
+        """Test coordinate rounding and missing geometries"""
+        geometries = np.array([LineString([(-47.123456789, -22.987654321), (-46.1, -22.3)]), None], dtype=object)
+
+        rounded, missing = geometries_to_json(geometries, precision=4)
+
+        assert json.loads(rounded)["coordinates"] == [[-47.1235, -22.9877], [-46.1, -22.3]]
+        assert missing == "null"
+        assert json.loads(geometries_to_json(geometries[:1], precision=None)[0])["coordinates"][0][0] == -47.123456789
+
+    def test_properties(self):
+        """Test nulls, numpy scalars, datetimes and non-ASCII text"""
+        frame = pd.DataFrame({
+            "nome": ["ETE Piracicaba", None],
+            "vazao": [12.5, np.nan],
+            "lotes": np.array([3, 4], dtype=np.int64),
+            "inicio": pd.to_datetime(["2019-05-01", None]),
+        })
+
+        first, second = [json.loads(p) for p in properties_to_json(frame)]
+
+        assert first == {"nome": "ETE Piracicaba", "vazao": 12.5, "lotes": 3, "inicio": "2019-05-01"}
+        assert second == {"nome": None, "vazao": None, "lotes": 4, "inicio": ""}
+        assert properties_to_json(frame[[]]) == ["{}", "{}"]
+
+    def test_stream_features(self):
+        """Test streamed collection with chunks and metadata"""
+        features = features_to_bytes(["0", "1"], ['{"type": "Point", "coordinates": [1, 2]}'] * 2, ["{}", '{"a": 1}'])
+        features.append(feature_to_bytes("3509502", "null", {"nome": "São Paulo", "total": Decimal("1.5")}))
+
+        response = stream_features(features, {"total_features": 3}, chunk_size=2)
+        body = json.loads(read_body(response))
+
+        assert response.media_type == GEOJSON_MEDIA_TYPE
+        assert [f["id"] for f in body["features"]] == ["0", "1", "3509502"]
+        assert body["features"][2]["properties"] == {"nome": "São Paulo", "total": 1.5}
+        assert body["metadata"] == {"total_features": 3}
+        assert json.loads(read_body(stream_features([]))) == {"type": "FeatureCollection", "features": []}
@@ -0,0 +1,171 @@
+"""
+Tests for the resident geometry store
+"""
+import os
+import numpy as np
+import pytest
+import geopandas as gpd
+import shapely
+from shapely.geometry import LineString, Point, box
+
+from app.services import geometry_store
+from app.services.geometry_store import GeometryStore, SIMPLIFY_LEVELS_DEG, UTM_23S, simplify_level
+
+
+@pytest.fixture
+def shapefile_dir(tmp_path):
+    """Directory with a small point shapefile in SIRGAS 2000"""
+    gdf = gpd.GeoDataFrame(
+        {"nome": ["A", "B", "C"]},
+        geometry=[Point(-47.0, -22.0), Point(-47.1, -22.1), Point(-46.5, -23.5)],
+        crs="EPSG:4674"
+    )
+    gdf.to_file(tmp_path / "Pontos.shp")
+
+    # Two adjacent 10 km squares in UTM 23S
+    squares = gpd.GeoDataFrame(
+        {"nome": ["Oeste", "Leste"]},
+        geometry=[box(300000, 7500000, 310000, 7510000), box(310000, 7500000, 320000, 7510000)],
+        crs=UTM_23S
+    )
+    squares.to_file(tmp_path / "Quadrados.shp")
+    return tmp_path
+
+
+class TestGeometryStore:
+    """Tests for GeometryStore loading and reloading"""
+
+    def test_layer_loaded_in_both_crs(self, shapefile_dir):
+        """Test that layers are kept in WGS84 and UTM 23S"""
+        store = GeometryStore(shapefile_dir)
+        layer = store.get_layer("Pontos")
+
+        assert len(layer) == 3
+        assert layer.gdf_wgs84.crs == "EPSG:4326"
+        assert layer.gdf_utm.crs == UTM_23S
+
+    def test_layer_loaded_once(self, shapefile_dir):
+        """Test that repeated lookups reuse the resident layer"""
+        store = GeometryStore(shapefile_dir)
+
+        first = store.get_layer("Pontos")
+        second = store.get_layer("Pontos")
+
+        assert first is second
+        assert store.get_stats()["loads"] == 1
+
+    def test_layer_reloaded_on_mtime_change(self, shapefile_dir):
+        """Test that a changed shapefile is reloaded"""
+        store = GeometryStore(shapefile_dir)
+        first = store.get_layer("Pontos")
+
+        path = shapefile_dir / "Pontos.shp"
+        stat = path.stat()
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+        second = store.get_layer("Pontos")
+
+        assert second is not first
+        assert store.get_stats()["reloads"] == 1
+
+    def test_missing_layer_returns_none(self, shapefile_dir):
+        """Test that unknown layers return None"""
+        store = GeometryStore(shapefile_dir)
+        assert store.get_layer("Inexistente") is None
+
+    def test_preload_loads_all_layers(self, shapefile_dir):
+        """Test that preload loads every shapefile in the directory"""
+        store = GeometryStore(shapefile_dir)
+        assert store.preload() == 2
+        assert "Pontos" in store.get_stats()["layers"]
+
+
+class TestGeometryLayerIndex:
+    """Tests for the per-layer STRtree queries"""
+
+    def test_query_intersecting_matches_brute_force(self, shapefile_dir):
+        """Test that index probes return the same features as a full scan"""
+        layer = GeometryStore(shapefile_dir).get_layer("Pontos")
+        buffer_utm = layer.geometries_utm[0].buffer(20000)
+
+        expected = [
+            i for i, geom in enumerate(layer.geometries_utm)
+            if geom.intersects(buffer_utm)
+        ]
+
+        assert list(layer.query_intersecting(buffer_utm)) == expected == [0, 1]
+
+    def test_nearest_returns_index_and_distance(self, shapefile_dir):
+        """Test nearest-feature lookup in meters"""
+        layer = GeometryStore(shapefile_dir).get_layer("Pontos")
+        target = layer.geometries_utm[2]
+
+        idx, distance_m = layer.nearest(target.buffer(1).centroid)
+
+        assert idx == 2
+        assert distance_m < 1
+
+    def test_intersection_fractions(self, shapefile_dir):
+        """Test area fractions for contained and partially covered features"""
+        layer = GeometryStore(shapefile_dir).get_layer("Quadrados")
+        # Covers all of Oeste and the western half of Leste
+        query = box(299000, 7499000, 315000, 7511000)
+        indices = layer.query_intersecting(query)
+
+        fractions = layer.intersection_fractions(query, indices)
+
+        assert list(indices) == [0, 1]
+        assert fractions[0] == 1.0
+        assert fractions[1] == pytest.approx(0.5, rel=1e-3)
+
+
+@pytest.fixture
+def line_dir(tmp_path):
+    """Directory with a finely sampled wavy transmission line in WGS84"""
+    x = np.linspace(-48.0, -46.0, 2000)
+    y = -22.5 + 0.002 * np.sin(x * 400) + 0.2 * np.sin(x * 3)
+    gdf = gpd.GeoDataFrame(
+        {"nome": ["Linha"]},
+        geometry=[LineString(np.column_stack([x, y]))],
+        crs="EPSG:4326"
+    )
+    gdf.to_file(tmp_path / "Linhas_De_Transmissao_Energia.shp")
+    return tmp_path
+
+
+class TestSimplificationLevels:
+    """Tests for precomputed map simplification levels"""
+
+    def test_simplify_level_from_zoom_and_tolerance(self):
+        """Test that requests snap to the coarsest level within the target"""
+        assert simplify_level() == 0.001
+        assert simplify_level(zoom=4) == SIMPLIFY_LEVELS_DEG[0]
+        assert simplify_level(zoom=9) == 0.001
+        assert simplify_level(zoom=18) == SIMPLIFY_LEVELS_DEG[-1]
+        assert simplify_level(zoom=4, tolerance=0.002) == 0.001
+
+    def test_levels_computed_once(self, line_dir):
+        """Test that each level is cached and coarser levels have fewer vertices"""
+        layer = GeometryStore(line_dir).get_layer("Linhas_De_Transmissao_Energia")
+
+        coarse = layer.simplified(0.01)
+        fine = layer.simplified(0.0003)
+
+        assert layer.simplified(0.01) is coarse
+        assert shapely.get_num_coordinates(coarse[0]) < shapely.get_num_coordinates(fine[0])
+        assert shapely.get_num_coordinates(fine[0]) < shapely.get_num_coordinates(layer.geometries_wgs84[0])
+
+    def test_endpoint_serves_level_for_zoom(self, line_dir, monkeypatch, client):
+        """Test that ?zoom= selects a coarser geometry than the default"""
+        monkeypatch.setattr(geometry_store, "_geometry_store", GeometryStore(line_dir))
+        url = "/api/v1/infrastructure/transmission-lines/geojson"
+
+        statewide = client.get(url, params={"zoom": 6}).json()
+        default = client.get(url).json()
+
+        assert statewide["metadata"]["simplify_tolerance"] == 0.01
+        assert default["metadata"]["simplify_tolerance"] == 0.001
+        assert (
+            len(statewide["features"][0]["geometry"]["coordinates"])
+            < len(default["features"][0]["geometry"]["coordinates"])
+        )
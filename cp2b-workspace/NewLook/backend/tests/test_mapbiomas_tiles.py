@@ -0,0 +1,282 @@
+"""
+Tests for MapBiomas tile rendering and caching
+"""
+import io
+import os
+import threading
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip("rasterio")
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+
+from app.services import mapbiomas_service
+from app.services.cache_service import tile_cache
+from app.services.mapbiomas_service import MapBiomasService, run_buffer_analysis, select_overview_level
+from app.services import mapbiomas_tiles
+from app.services.mapbiomas_tiles import (
+    RASTER_VERSION_KEY,
+    MBTilesStore,
+    MapBiomasTileService,
+    create_tile_image,
+    lnglat_to_tile,
+    raster_version,
+    tile_etag,
+    Image,
+)
+
+
+def write_raster(path, right_class=15):
+    """Write a MapBiomas-like raster around Campinas (sugarcane and another class)"""
+    data = np.full((200, 200), 20, dtype=np.uint8)
+    data[:, 100:] = right_class
+
+    with rasterio.open(
+        path, "w", driver="GTiff", width=200, height=200, count=1, dtype="uint8",
+        crs="EPSG:4326", transform=from_bounds(-47.5, -23.0, -46.5, -22.0, 200, 200),
+        nodata=0
+    ) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def raster_path(tmp_path):
+    """Small MapBiomas-like raster around Campinas (sugarcane and pasture)"""
+    path = tmp_path / "mapbiomas.tif"
+    write_raster(path)
+    return path
+
+
+@pytest.fixture
+def tile_service(raster_path, tmp_path):
+    """Tile service with an empty MBTiles store and a clean hot-tile cache"""
+    tile_cache.clear()
+    yield MapBiomasTileService(raster_path, tmp_path / "tiles.mbtiles")
+    tile_cache.clear()
+
+
+class TestTileImage:
+    """Tests for paletted tile encoding"""
+
+    def test_palette_colors_and_transparency(self):
+        """Test that class codes map to their colors and nodata is transparent"""
+        data = np.zeros((256, 256), dtype=np.uint8)
+        data[:128] = 47  # Citros
+
+        img = Image.open(io.BytesIO(create_tile_image(data)))
+        rgba = np.asarray(img.convert("RGBA"))
+
+        assert img.mode == "P"
+        assert tuple(rgba[0, 0]) == (255, 167, 38, 200)
+        assert rgba[255, 255, 3] == 0
+
+    def test_non_uint8_input(self):
+        """Test that wider dtypes and out-of-range codes are handled"""
+        data = np.full((256, 256), 1000, dtype=np.int32)
+        data[0, 0] = 15
+
+        rgba = np.asarray(Image.open(io.BytesIO(create_tile_image(data))).convert("RGBA"))
+
+        assert tuple(rgba[0, 0]) == (255, 217, 102, 200)
+        assert rgba[1, 1, 3] == 0
+
+
+class TestMBTilesStore:
+    """Tests for the SQLite tile store"""
+
+    def test_put_and_get(self, tmp_path):
+        """Test round trip and TMS row storage"""
+        store = MBTilesStore(tmp_path / "store.mbtiles")
+        store.put(10, 380, 580, b"png")
+
+        assert store.get(10, 380, 580) == b"png"
+        assert store.get(10, 380, 581) is None
+        assert store.count() == 1
+
+    def test_missing_store_is_created_on_write(self, tmp_path):
+        """Test that the store file only appears once written"""
+        store = MBTilesStore(tmp_path / "sub" / "store.mbtiles")
+        assert not store.exists()
+
+        store.put_many([(5, 11, 17, b"a"), (5, 12, 17, b"b")])
+
+        assert store.exists()
+        assert store.count() == 2
+
+    def test_write_back_is_batched(self, tmp_path, monkeypatch):
+        """Test that single-tile writes are buffered and committed together"""
+        monkeypatch.setattr(MBTilesStore, "WRITE_BATCH", 3)
+        store = MBTilesStore(tmp_path / "store.mbtiles")
+        other = MBTilesStore(tmp_path / "store.mbtiles")  # e.g. another worker
+
+        store.put(10, 1, 1, b"a")
+        store.put(10, 2, 1, b"b")
+        assert store.get(10, 2, 1) == b"b"  # Buffered tiles are readable
+        assert other.get(10, 2, 1) is None  # but not committed yet
+
+        store.put(10, 3, 1, b"c")
+        assert [other.get(10, x, 1) for x in (1, 2, 3)] == [b"a", b"b", b"c"]
+
+        store.put(10, 4, 1, b"d")
+        store.close()
+        assert other.get(10, 4, 1) == b"d"
+        other.close()
+
+    def test_thread_connections(self, tmp_path):
+        """Test that each thread reads through its own connection"""
+        store = MBTilesStore(tmp_path / "store.mbtiles")
+        store.put_many([(8, x, 10, bytes([x])) for x in range(8)])
+        results = {}
+
+        def read(x):
+            results[x] = store.get(8, x, 10)
+
+        threads = [threading.Thread(target=read, args=(x,)) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == {x: bytes([x]) for x in range(8)}
+        assert len(store._connections) == 9
+        store.close()
+        assert store._connections == []
+
+
+class TestMapBiomasTileService:
+    """Tests for tiered tile lookup"""
+
+    def test_render_then_write_back(self, tile_service):
+        """Test that a missing tile is rendered once and stored"""
+        x, y = lnglat_to_tile(-47.0, -22.5, 10)
+
+        data, etag = tile_service.get_tile(10, x, y)
+
+        assert data.startswith(b"\x89PNG")
+        assert etag == tile_etag(data, raster_version(tile_service.raster_path))
+        assert tile_service.renders == 1
+        assert tile_service.store.get(10, x, y) == data
+
+    def test_hot_tile_served_from_cache(self, tile_service):
+        """Test that repeated requests skip store and renderer"""
+        x, y = lnglat_to_tile(-47.0, -22.5, 10)
+
+        first = tile_service.get_tile(10, x, y)
+        second = tile_service.get_tile(10, x, y)
+
+        assert first == second
+        assert tile_service.renders == 1
+        assert tile_service.store_hits == 0
+
+    def test_raster_handle_reused(self, tile_service):
+        """Test that renders on one thread share a single open dataset"""
+        tile_service.render(10, *lnglat_to_tile(-47.0, -22.5, 10))
+        tile_service.render(10, *lnglat_to_tile(-47.2, -22.7, 10))
+
+        assert tile_service.get_stats()["open_raster_handles"] == 1
+
+        tile_service.close()
+        assert tile_service.get_stats()["open_raster_handles"] == 0
+
+    def test_stored_tile_served_without_render(self, tile_service):
+        """Test that pre-rendered tiles are read from the store"""
+        x, y = lnglat_to_tile(-47.0, -22.5, 8)
+        tile_service.store.put(8, x, y, b"prerendered")
+
+        data, _ = tile_service.get_tile(8, x, y)
+
+        assert data == b"prerendered"
+        assert tile_service.store_hits == 1
+        assert tile_service.renders == 0
+
+    def test_replaced_raster_invalidates_tiles(self, tile_service):
+        """Test that a new GeoTIFF is not served tiles or ETags rendered from the old one"""
+        x, y = lnglat_to_tile(-46.8, -22.5, 10)
+        old_data, old_etag = tile_service.get_tile(10, x, y)
+        tile_service.store.flush()
+
+        write_raster(tile_service.raster_path, right_class=47)  # Pasture became citrus
+        mtime = tile_service.raster_path.stat().st_mtime + 10
+        os.utime(tile_service.raster_path, (mtime, mtime))
+
+        new_data, new_etag = tile_service.get_tile(10, x, y)
+
+        assert new_data != old_data and new_etag != old_etag
+        assert tile_service.renders == 2
+        assert tile_service.store.get(10, x, y) == new_data
+        assert tile_service.store.get_metadata(RASTER_VERSION_KEY) == raster_version(tile_service.raster_path)
+
+    def test_store_without_raster(self, tile_service):
+        """Test serving a pre-rendered store when the GeoTIFF is absent"""
+        x, y = lnglat_to_tile(-47.0, -22.5, 8)
+        tile_service.store.put(8, x, y, b"prerendered")
+        tile_service.raster_path.unlink()
+
+        assert tile_service.get_tile(8, x, y)[0] == b"prerendered"
+        with pytest.raises(FileNotFoundError):
+            tile_service.get_tile(8, x + 1, y)
+
+    def test_endpoint_missing_tile_is_404(self, tile_service, monkeypatch, client):
+        """Test that a tile neither stored nor renderable is a 404, not a 500"""
+        x, y = lnglat_to_tile(-47.0, -22.5, 8)
+        tile_service.store.put(8, x, y, b"prerendered")
+        tile_service.store.flush()
+        tile_service.raster_path.unlink()
+        monkeypatch.setattr(mapbiomas_tiles, "_tile_service", tile_service)
+
+        assert client.get(f"/api/v1/mapbiomas/tiles/8/{x}/{y}.png").content == b"prerendered"
+        assert client.get(f"/api/v1/mapbiomas/tiles/8/{x + 1}/{y}.png").status_code == 404
+
+
+class TestOverviewSelection:
+    """Tests for reading raster overviews at low zoom"""
+
+    def test_select_overview_level(self):
+        """Test picking the coarsest overview not coarser than needed"""
+        factors = [2, 4, 8, 16]
+
+        assert select_overview_level(factors, 1.0) is None
+        assert select_overview_level(factors, 3.0) == 0
+        assert select_overview_level(factors, 16.0) == 3
+        assert select_overview_level([], 50.0) is None
+
+    def test_low_zoom_reads_overview(self, raster_path, tmp_path):
+        """Test that low zooms open an overview and high zooms full resolution"""
+        with rasterio.open(raster_path, "r+") as dst:
+            dst.build_overviews([2, 4], Resampling.mode)
+
+        service = MapBiomasTileService(raster_path, tmp_path / "tiles.mbtiles")
+
+        assert service.dataset_for_zoom(5).width == 50
+        assert service.dataset_for_zoom(9).width == 200
+        service.close()
+
+    def test_buffer_analyses_share_raster_info(self, raster_path, tmp_path, monkeypatch):
+        """Test that overview selection reads raster metadata once per raster version"""
+        with rasterio.open(raster_path, "r+") as dst:
+            dst.build_overviews([2, 4], Resampling.mode)
+
+        service = MapBiomasService()
+        service.raster_path = raster_path
+        service.zonal_index_path = tmp_path / "missing.npz"
+        service._rasterio_available = True
+        monkeypatch.setattr(mapbiomas_service, "_mapbiomas_service", service)
+
+        opened = []
+        real_open = rasterio.open
+        monkeypatch.setattr(rasterio, "open", lambda *args, **kwargs: opened.append(kwargs) or real_open(*args, **kwargs))
+
+        first = run_buffer_analysis(-22.5, -47.0, 30)
+        second = run_buffer_analysis(-22.5, -47.2, 30)
+
+        assert first["total_pixels"] > 0 and second["total_pixels"] > 0
+        assert mapbiomas_service.get_mapbiomas_service() is service
+        # Metadata once, then one masked read per analysis
+        assert len(opened) == 3
+
+        mtime = raster_path.stat().st_mtime + 10
+        os.utime(raster_path, (mtime, mtime))
+        run_buffer_analysis(-22.5, -47.0, 30)
+        assert len(opened) == 5
@@ -0,0 +1,105 @@
+"""
+Tests for precomputed MapBiomas zonal histograms
+"""
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip("rasterio")
+from rasterio.transform import from_bounds
+from shapely.geometry import box
+
+from app.services.mapbiomas_service import MapBiomasService
+from app.services.mapbiomas_zonal import ZonalHistogramIndex, build_zonal_index
+
+# Two municipalities splitting the raster at -47.0
+MUNICIPALITIES = [
+    ("3500001", box(-47.5, -23.0, -47.0, -22.0)),
+    ("3500002", box(-47.0, -23.0, -46.5, -22.0)),
+]
+
+
+@pytest.fixture
+def raster_path(tmp_path):
+    """Noisy MapBiomas-like raster (~100 m pixels) around Campinas"""
+    rng = np.random.default_rng(7)
+    data = rng.choice(np.array([0, 15, 20, 39, 46], dtype=np.uint8), size=(1000, 1000))
+    path = tmp_path / "mapbiomas.tif"
+
+    with rasterio.open(
+        path, "w", driver="GTiff", width=1000, height=1000, count=1, dtype="uint8",
+        crs="EPSG:4326", transform=from_bounds(-47.5, -23.0, -46.5, -22.0, 1000, 1000),
+        nodata=0
+    ) as dst:
+        dst.write(data, 1)
+
+    return path
+
+
+@pytest.fixture
+def index_path(raster_path, tmp_path):
+    """Zonal index with 10 px cells written next to the raster"""
+    path = tmp_path / "zonal.npz"
+    build_zonal_index(raster_path, 10, MUNICIPALITIES).save(path)
+    return path
+
+
+def make_service(raster_path, index_path):
+    service = MapBiomasService()
+    service.raster_path = raster_path
+    service.zonal_index_path = index_path
+    service._rasterio_available = True
+    return service
+
+
+class TestZonalIndexBuild:
+    """Tests for the offline histogram job"""
+
+    def test_grid_counts_cover_raster(self, raster_path, index_path):
+        """Test that grid cells add up to the raster histogram"""
+        index = ZonalHistogramIndex.load(index_path)
+        with rasterio.open(raster_path) as src:
+            data = src.read(1)
+
+        expected = {int(v): int(c) for v, c in zip(*np.unique(data, return_counts=True))}
+        totals = index.grid_counts.sum(axis=(0, 1))
+
+        assert index.grid_counts.shape[:2] == (100, 100)
+        assert dict(zip(index.class_codes.tolist(), totals.tolist())) == expected
+
+    def test_municipality_counts(self, raster_path, index_path):
+        """Test per-municipality counts against the raster halves"""
+        index = ZonalHistogramIndex.load(index_path)
+        with rasterio.open(raster_path) as src:
+            west_half = src.read(1)[:, :500]
+
+        expected = {int(v): int(c) for v, c in zip(*np.unique(west_half, return_counts=True))}
+
+        assert index.municipality_pixel_counts("3500001") == expected
+        assert index.municipality_pixel_counts("9999999") is None
+
+
+class TestZonalBufferAnalysis:
+    """Tests for answering buffer analyses from the index"""
+
+    @pytest.mark.parametrize("lat,lng,radius_km", [
+        (-22.5, -47.0, 5),
+        (-22.5, -47.0, 30),
+        (-22.1, -47.4, 20),  # Buffer crosses the raster edge
+    ])
+    def test_matches_raster_mask(self, raster_path, index_path, tmp_path, lat, lng, radius_km):
+        """Test that index + rim masking gives the same result as masking the raster"""
+        with_index = make_service(raster_path, index_path)
+        without_index = make_service(raster_path, tmp_path / "missing.npz")
+
+        fast = with_index.analyze_buffer(lat, lng, radius_km)
+        full = without_index.analyze_buffer(lat, lng, radius_km)
+
+        assert fast["total_pixels"] > 0
+        assert fast == full
+
+    def test_municipality_analysis(self, raster_path, index_path):
+        """Test whole-municipality land use from the index"""
+        result = make_service(raster_path, index_path).analyze_municipality("3500002")
+
+        assert result["total_pixels"] > 0
+        assert set(result["by_class"]) == {"15", "20", "39", "46"}
@@ -0,0 +1,208 @@
+"""
+Tests for the split municipality map payloads (geometry + columnar attributes)
+"""
+import threading
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+from app.api.v1.endpoints import geospatial
+from app.services import geometry_store
+from app.services.cache_maintenance import get_dataset_version
+from app.services.cache_service import geometry_cache, municipality_cache
+from app.services.geometry_store import GeometryStore
+from app.services.municipality_table import MunicipalityTable, get_municipality_table_store
+from tests.test_municipality_table import ROWS
+
+
+@pytest.fixture
+def municipality_store(tmp_path, monkeypatch):
+    """Geometry store with two municipality polygons"""
+    gdf = gpd.GeoDataFrame(
+        {"CD_MUN": ["3509502", "3538709"], "NM_MUN": ["Campinas", "Piracicaba"], "AREA_KM2": [795.7, 1378.1]},
+        geometry=[box(-47.2, -23.0, -46.9, -22.7), box(-47.9, -22.9, -47.5, -22.5)],
+        crs="EPSG:4326"
+    )
+    gdf.to_file(tmp_path / "SP_Municipios_2024.shp")
+
+    monkeypatch.setattr(geometry_store, "_geometry_store", GeometryStore(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def table():
+    table = MunicipalityTable(ROWS, "test")
+    get_municipality_table_store().set(table)
+    municipality_cache.clear()
+    yield table
+    get_municipality_table_store().set(None)
+    municipality_cache.clear()
+
+
+class TestMunicipalityGeometry:
+    """Tests for /api/v1/geospatial/municipalities/geometry"""
+
+    url = "/api/v1/geospatial/municipalities/geometry"
+
+    def test_geometry_only_features(self, municipality_store, client):
+        """Test that features carry only the IBGE code and name"""
+        response = client.get(self.url)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/geo+json"
+        features = response.json()["features"]
+        assert [f["id"] for f in features] == ["3509502", "3538709"]
+        assert features[0]["properties"] == {"ibge_code": "3509502", "name": "Campinas"}
+        assert features[0]["geometry"]["type"] == "Polygon"
+
+    def test_versioned_caching(self, municipality_store, client):
+        """Test immutable caching for the current version and conditional requests"""
+        unversioned = client.get(self.url)
+        version = unversioned.headers["x-dataset-version"]
+        assert version == get_dataset_version()
+        assert "immutable" not in unversioned.headers["cache-control"]
+
+        versioned = client.get(self.url, params={"v": version})
+        assert versioned.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert versioned.headers["etag"] == unversioned.headers["etag"]
+
+        again = client.get(self.url, headers={"If-None-Match": versioned.headers["etag"]})
+        assert again.status_code == 304
+
+    def test_missing_layer(self, tmp_path, monkeypatch, client):
+        """Test 404 when the municipality shapefile is not available"""
+        monkeypatch.setattr(geometry_store, "_geometry_store", GeometryStore(tmp_path))
+        assert client.get(self.url).status_code == 404
+
+
+class TestMunicipalityPolygons:
+    """Tests for /api/v1/geospatial/municipalities/polygons"""
+
+    url = "/api/v1/geospatial/municipalities/polygons"
+
+    def test_joins_table_columns(self, municipality_store, table, client):
+        """Test that polygons carry the municipality table's biogas columns"""
+        data = client.get(self.url).json()
+
+        campinas, piracicaba = data["features"]
+        assert campinas["id"] == "3509502"
+        assert campinas["properties"]["total_biogas_m3_year"] == 500.0
+        assert campinas["properties"]["urban_biogas"] == 400.0
+        assert campinas["properties"]["energy_mwh_year"] == 50.0
+        assert campinas["properties"]["population"] == 1000
+        assert campinas["properties"]["population_density"] == 10.0
+        assert piracicaba["properties"]["region"] == "Piracicaba"
+        assert data["metadata"]["matched_with_biogas"] == 2
+
+    def test_built_off_loop_once_per_level(self, municipality_store, table, client, monkeypatch):
+        """Test that features are serialized in the thread pool and reused across requests"""
+        geometry_cache.clear()
+        threads = []
+        serialize = geospatial.geometries_to_json
+
+        def spy(geometries, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return serialize(geometries, *args, **kwargs)
+
+        monkeypatch.setattr(geospatial, "geometries_to_json", spy)
+
+        first = client.get(self.url, params={"zoom": 8}).json()
+        page = client.get(self.url, params={"zoom": 8, "bbox": "-47.3,-23.1,-47.0,-22.8"}).json()
+
+        assert len(threads) == 1 and threads[0].startswith("analysis")
+        assert page["features"] == first["features"][:1]
+        assert page["metadata"]["matched_with_biogas"] == 1
+
+        client.get(self.url, params={"zoom": 4})
+        assert len(threads) == 2
+
+    def test_unmatched_municipality(self, municipality_store, client):
+        """Test defaults for polygons without a table row"""
+        get_municipality_table_store().set(MunicipalityTable(ROWS[:1], "partial"))
+        try:
+            data = client.get(self.url).json()
+        finally:
+            get_municipality_table_store().set(None)
+
+        campinas, piracicaba = data["features"]
+        assert campinas["properties"]["total_biogas"] == 0
+        assert piracicaba["properties"]["total_biogas"] == 300.0
+        assert data["metadata"]["matched_with_biogas"] == 1
+
+
+class TestMunicipalityAttributes:
+    """Tests for /api/v1/geospatial/municipalities/attributes"""
+
+    url = "/api/v1/geospatial/municipalities/attributes"
+
+    def test_default_fields(self, table, client):
+        """Test columnar arrays aligned with ibge_codes"""
+        response = client.get(self.url)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["ibge_codes"] == ["3538709", "3509502", "3526902", "3507209"]
+        assert data["fields"]["total_biogas_m3_year"] == [300.0, 500.0, 200.0, 0.0]
+        assert "municipality_name" not in data["fields"]
+        assert data["table_version"] == "test"
+        assert data["dataset_version"] == get_dataset_version()
+
+    def test_sparse_fieldset(self, table, client):
+        """Test that only the requested fields are returned"""
+        data = client.get(self.url, params={"fields": "municipality_name,population"}).json()
+
+        assert set(data["fields"]) == {"municipality_name", "population"}
+        assert data["fields"]["population"] == [1000, 1000, None, 1000]
+
+        assert client.get(self.url, params={"fields": "secret"}).status_code == 400
+
+    def test_residue_selection(self, table, client):
+        """Test the computed biogas_m3_year array for a category"""
+        data = client.get(self.url, params={"category": "urban"}).json()
+
+        assert data["fields"] == {"biogas_m3_year": [100.0, 400.0, 0.0, 0.0]}
+        assert data["residue_columns"] == ["urban_biogas_m3_year"]
+
+        bad = client.get(self.url, params={"category": "agricultural", "residue_types": ["nope"]})
+        assert bad.status_code == 400
+
+    def test_conditional_request(self, table, client):
+        """Test ETag / If-None-Match on attributes"""
+        response = client.get(self.url)
+        assert response.headers["cache-control"] == "public, max-age=300"
+
+        again = client.get(self.url, headers={"If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304
+
+    def test_dataset_swap_changes_result(self, table, client, monkeypatch):
+        """Test that a new dataset version is reported at once, not after the cache TTL"""
+        before = client.get(self.url)
+
+        monkeypatch.setattr(geospatial, "get_dataset_version", lambda: "swapped")
+        after = client.get(self.url)
+
+        assert after.json()["dataset_version"] == "swapped"
+        assert after.headers["etag"] != before.headers["etag"]
+        assert client.get(self.url, headers={"If-None-Match": before.headers["etag"]}).status_code == 200
+
+    def test_first_table_load_off_loop(self, client, monkeypatch):
+        """Test that loading the table on first use runs in the thread pool"""
+        store = get_municipality_table_store()
+        threads = []
+
+        def load():
+            threads.append(threading.current_thread().name)
+            return MunicipalityTable(ROWS, "loaded")
+
+        monkeypatch.setattr(store, "_load", load)
+        store.set(None)
+        municipality_cache.clear()
+        try:
+            data = client.get(self.url).json()
+        finally:
+            store.set(None)
+            municipality_cache.clear()
+
+        assert data["table_version"] == "loaded"
+        assert len(threads) == 1 and threads[0].startswith("analysis")
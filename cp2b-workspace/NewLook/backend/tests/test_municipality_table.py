@@ -0,0 +1,159 @@
+"""
+Tests for the in-process columnar municipality table and the endpoints using it
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.api.v1.endpoints import analysis, geospatial
+from app.services.cache_service import municipality_cache
+from app.services.municipality_table import (
+    BIOGAS_SUM_COLUMNS,
+    NO_REGION,
+    MunicipalityTable,
+    get_municipality_table_store,
+)
+from app.services.proximity_service import ProximityService
+
+
+def make_row(id, name, ibge, region, total, urban=0.0, population=1000, **extra):
+    row = {column: 0.0 for column in BIOGAS_SUM_COLUMNS}
+    row.update(
+        id=id,
+        municipality_name=name,
+        ibge_code=ibge,
+        administrative_region=region,
+        population=population,
+        area_km2=100.0,
+        total_biogas_m3_year=total,
+        urban_biogas_m3_year=urban,
+        energy_potential_mwh_year=total / 10,
+    )
+    row.update(extra)
+    return row
+
+
+ROWS = [
+    make_row(1, "Piracicaba", "3538709", "Piracicaba", 300.0, urban=100.0),
+    make_row(2, "Campinas", "3509502", "Campinas", 500.0, urban=400.0),
+    make_row(3, "Limeira", "3526902", "Piracicaba", 200.0, population=None),
+    make_row(4, "Borá", "3507209", None, 0.0),
+]
+
+
+@pytest.fixture
+def table():
+    table = MunicipalityTable(ROWS, "test")
+    get_municipality_table_store().set(table)
+    municipality_cache.clear()
+    yield table
+    get_municipality_table_store().set(None)
+    municipality_cache.clear()
+
+
+class TestMunicipalityTable:
+    """Tests for the vectorized table helpers"""
+
+    def test_nulls(self, table):
+        """Test that NULL biogas is 0, NULL population NaN, NULL region labelled"""
+        assert np.isnan(table.population[2])
+        assert table.regions[3] == NO_REGION
+        assert table.column("livestock_biogas_m3_year").sum() == 0
+
+    def test_top_descending_with_min_value(self, table):
+        """Test ranking and the minimum-value filter"""
+        values = table.column("total_biogas_m3_year")
+        assert list(table.names[table.top(values, 3)]) == ["Campinas", "Piracicaba", "Limeira"]
+        assert list(table.names[table.top(values, 10, min_value=250)]) == ["Campinas", "Piracicaba"]
+
+    def test_weighted_totals(self, table):
+        """Test that rows are scaled by their weight before summing"""
+        positions = table.positions(["3538709", "3509502", "9999999"])
+        totals = table.weighted_totals(positions, np.array([0.5, 1.0]), ["total_biogas_m3_year"])
+        assert totals == {"total_biogas_m3_year": 650.0}
+
+    def test_group_sum(self, table):
+        """Test per-region sums"""
+        assert table.group_sum(table.column("total_biogas_m3_year")) == {
+            "Campinas": 500.0,
+            "Piracicaba": 500.0,
+            NO_REGION: 0.0,
+        }
+
+
+class TestEndpoints:
+    """Tests for the endpoints served from the table"""
+
+    def test_rankings_skip_zero(self, table):
+        """Test that rankings are descending and exclude zero potential"""
+        result = asyncio.run(geospatial.get_rankings(criteria="total", limit=10))
+        assert [r["municipality"] for r in result["rankings"]] == ["Campinas", "Piracicaba", "Limeira"]
+        assert result["rankings"][0]["energy_mwh_year"] == 50.0
+
+    def test_summary(self, table):
+        """Test platform totals"""
+        result = asyncio.run(geospatial.get_summary_statistics())
+        assert result["total_municipalities"] == 4
+        assert result["total_biogas_m3_year"] == 1000.0
+        assert result["total_population"] == 3000
+        assert result["top_municipality"]["name"] == "Campinas"
+
+    def test_by_residue(self, table):
+        """Test top municipalities by residue columns with a minimum value"""
+        result = asyncio.run(analysis.get_analysis_by_residue(
+            category=analysis.ResidueCategory.urban, residue_types=None, limit=10, min_value=50
+        ))
+        assert [r["municipality_name"] for r in result["data"]] == ["Campinas", "Piracicaba"]
+        assert result["data"][0]["population"] == 1000
+
+    def test_by_region_percentages(self, table):
+        """Test regional shares"""
+        result = asyncio.run(analysis.get_statistics_by_region(category=None))
+        shares = {r["region"]: r["percentage"] for r in result["regions"]}
+        assert shares == {"Campinas": 50.0, "Piracicaba": 50.0, NO_REGION: 0.0}
+
+    def test_distribution(self, table):
+        """Test histogram counts and statistics over non-zero values"""
+        result = asyncio.run(analysis.get_distribution(category=None, bins=3, scale="linear"))
+        assert [b["count"] for b in result["histogram"]] == [1, 1, 1]
+        assert result["statistics"]["count"] == 3
+        assert result["statistics"]["median"] == 300.0
+
+    def test_results_cached_per_table_version(self, table):
+        """Test that a reloaded table is not served stale cached results"""
+        first = asyncio.run(analysis.get_distribution(category=None, bins=5, scale="log"))
+        assert first["scale"] == "log"
+        assert "p90" in first["statistics"]["percentiles"]
+
+        get_municipality_table_store().set(MunicipalityTable(ROWS[:2], "reloaded"))
+        second = asyncio.run(analysis.get_distribution(category=None, bins=5, scale="log"))
+        assert second["statistics"]["count"] == 2
+
+
+class TestProximityAggregation:
+    """Tests for ProximityService.aggregate_biogas_potential on the table"""
+
+    def test_weighted_by_intersection_fraction(self, table):
+        """Test that totals are per-municipality values times their share inside the buffer"""
+        fractions = {"3538709": 0.25, "3509502": 1.0, "3526902": 0.5}
+        municipalities = [
+            {"name": row["municipality_name"], "ibge_code": row["ibge_code"], "intersection_fraction": fractions[row["ibge_code"]]}
+            for row in ROWS if row["ibge_code"] in fractions
+        ]
+        municipalities.append({"name": "Fora da tabela", "ibge_code": "9999999", "intersection_fraction": 1.0})
+
+        result = ProximityService().aggregate_biogas_potential(municipalities)
+
+        def expected(column):
+            return sum(row[column] * fractions[row["ibge_code"]] for row in ROWS if row["ibge_code"] in fractions)
+
+        assert result["total_m3_year"] == pytest.approx(expected("total_biogas_m3_year"))  # 75 + 500 + 100
+        assert result["by_category"]["Urbano"] == pytest.approx(expected("urban_biogas_m3_year"))
+        assert result["energy_potential_mwh_year"] == pytest.approx(expected("energy_potential_mwh_year"))
+
+    def test_no_known_municipalities(self, table):
+        """Test the empty result when no municipality is in the table"""
+        service = ProximityService()
+        assert service.aggregate_biogas_potential([]) == service._empty_biogas_result()
+        assert service.aggregate_biogas_potential([{"ibge_code": "9999999"}])["total_m3_year"] == 0
@@ -0,0 +1,98 @@
+"""
+Tests for the concurrent proximity analysis pipeline (stages off the event loop)
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.api.v1.endpoints import proximity
+from app.services.cache_service import mapbiomas_cache
+from app.services.proximity_service import INFRASTRUCTURE_CONFIGS
+
+STAGE_SECONDS = 0.2
+
+
+def analyze(request):
+    """Run the real pipeline for a request, as the endpoint does on a cache miss"""
+    return asyncio.run(proximity._run_proximity_analysis(
+        request, "analysis-1", time.time(), proximity._cache_key(request)
+    ))
+
+
+class TestRunStage:
+    """Tests for _run_stage"""
+
+    def test_blocking_stages_overlap(self):
+        """Test that two blocking stages take about max(t), not sum(t)"""
+        timings = {}
+        ticks = []
+
+        async def heartbeat():
+            for _ in range(5):
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(STAGE_SECONDS / 5)
+
+        async def run():
+            start = time.perf_counter()
+            await asyncio.gather(
+                proximity._run_stage("first", timings, time.sleep, STAGE_SECONDS),
+                proximity._run_stage("second", timings, time.sleep, STAGE_SECONDS * 1.5),
+                heartbeat()
+            )
+            return time.perf_counter() - start
+
+        elapsed = asyncio.run(run())
+
+        assert elapsed < STAGE_SECONDS * 2.5 * 0.8
+        assert set(timings) == {"first", "second"}
+        assert timings["second"] >= STAGE_SECONDS * 1.5 * 1000 * 0.9
+        # The event loop kept running while both stages blocked
+        assert len(ticks) == 5
+
+    def test_timing_recorded_on_failure(self):
+        """Test that a failing stage still reports its duration and re-raises"""
+        timings = {}
+
+        def fail():
+            raise ValueError("raster unavailable")
+
+        with pytest.raises(ValueError):
+            asyncio.run(proximity._run_stage("mapbiomas", timings, fail))
+        assert "mapbiomas" in timings
+
+
+class TestAnalysisPipeline:
+    """Tests for _run_proximity_analysis with stubbed services"""
+
+    def test_stage_timings(self, slow_services):
+        """Test that every stage is timed and independent branches overlap"""
+        response = analyze(proximity.ProximityAnalysisRequest(latitude=-22.5, longitude=-47.3, radius_km=20))
+
+        timings = response.metadata.stage_timings_ms
+        infrastructure_stages = {f"infrastructure.{config['type']}" for config in INFRASTRUCTURE_CONFIGS}
+        assert set(timings) == {
+            "setup", "municipalities", "biogas_potential", "residuos_data",
+            "mapbiomas", "residuos_correlation", "infrastructure"
+        } | infrastructure_stages
+
+        # Sequentially the blocking stages would take the sum of their timings
+        blocking = sum(timings[name] for name in timings if name not in ("setup", "infrastructure"))
+        assert response.metadata.processing_time_ms < blocking / 2
+        assert response.results["land_use"]["dominant_class"] == "Pastagem"
+        assert len(response.results["infrastructure"]) == len(INFRASTRUCTURE_CONFIGS)
+
+    def test_failed_land_use_stage_degrades(self, slow_services, monkeypatch):
+        """Test that a MapBiomas failure yields the error result, not a failed analysis"""
+        def broken_raster(lat, lng, radius_km):
+            raise OSError("mapbiomas raster not found")
+
+        monkeypatch.setattr(proximity, "run_buffer_analysis", broken_raster)
+        response = analyze(proximity.ProximityAnalysisRequest(latitude=-22.5, longitude=-47.3, radius_km=20))
+
+        assert response.results["land_use"] == proximity._land_use_error(OSError("mapbiomas raster not found"))
+        assert "mapbiomas" in response.metadata.stage_timings_ms
+        assert response.results["biogas_potential"]["total_m3_year"] == 10.0
+        assert len(response.results["infrastructure"]) == len(INFRASTRUCTURE_CONFIGS)
+        # Failures are not cached as land use results
+        assert mapbiomas_cache.get_stats()["size"] == 0
@@ -0,0 +1,152 @@
+"""
+Tests for snapped proximity cache keys and multi-radius reuse
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.api.v1.endpoints import proximity
+from app.core.config import settings
+from app.services.cache_service import (
+    find_covering_proximity_result,
+    get_proximity_cache_key,
+    proximity_cache,
+    record_proximity_radius,
+)
+from app.utils import geohash
+
+
+class FakeProximityService:
+    """Stand-in for ProximityService that counts calls per stage"""
+
+    calls = []
+
+    def __init__(self):
+        pass
+
+    def get_municipalities_in_radius(self, lat, lng, radius_km):
+        self.calls.append("municipalities")
+        return {"type": "Polygon", "coordinates": []}, [
+            {"id": 1, "name": "Piracicaba", "distance_km": 3.0, "population": 1000}
+        ]
+
+    def aggregate_biogas_potential(self, municipalities):
+        self.calls.append("biogas_potential")
+        return {"total_m3_year": 10.0, "energy_potential_mwh_year": 20.0}
+
+    def get_residuos_for_municipalities(self):
+        self.calls.append("residuos_data")
+        return {"total_residuos": 3}
+
+    def find_nearest_infrastructure_of_type(self, lat, lng, config):
+        self.calls.append("infrastructure")
+        return {"type": config["type"], "distance_km": 1.5, "found": True}
+
+
+def _request(lat=-22.5, lng=-47.3, radius_km=20.0, **options):
+    options.setdefault("include_mapbiomas", False)
+    return proximity.ProximityAnalysisRequest(
+        latitude=lat, longitude=lng, radius_km=radius_km, options=options
+    )
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    proximity_cache.clear()
+    yield
+    proximity_cache.clear()
+
+
+class TestGeohash:
+    """Tests for geohash encoding and snapping"""
+
+    def test_encode_known_value(self):
+        """Test encoding against a published geohash"""
+        assert geohash.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+    def test_snap_returns_cell_center(self):
+        """Test that snapped points are the center of the point's cell"""
+        lat, lng, cell = geohash.snap(-22.5, -47.3, 6)
+        min_lat, min_lng, max_lat, max_lng = geohash.decode_bounds(cell)
+
+        assert min_lat <= -22.5 <= max_lat and min_lng <= -47.3 <= max_lng
+        assert (lat, lng) == ((min_lat + max_lat) / 2, (min_lng + max_lng) / 2)
+        assert geohash.encode(lat, lng, 6) == cell
+
+
+class TestSnapRequest:
+    """Tests for request snapping"""
+
+    def test_nearby_points_share_cache_key(self):
+        """Test that clicks ~100 m apart snap to one analysis"""
+        first, _ = proximity._snap_request(_request(-22.4975, -47.3016, 19.2, snap_to_grid=True))
+        second, info = proximity._snap_request(_request(-22.4968, -47.3008, 21.4, snap_to_grid=True))
+
+        assert get_proximity_cache_key(first.latitude, first.longitude, first.radius_km) == \
+            get_proximity_cache_key(second.latitude, second.longitude, second.radius_km)
+        assert info["radius_km"] == 20
+        assert info["geohash"] == geohash.encode(-22.4968, -47.3008, settings.PROXIMITY_SNAP_GEOHASH_PRECISION)
+
+    def test_snapping_is_opt_in(self):
+        """Test that requests are analyzed as given unless snapping is enabled"""
+        request = _request(-22.5008, -47.2995, 21.4)
+
+        assert proximity._snap_request(request) == (request, None)
+
+
+class TestRadiusReuse:
+    """Tests for reusing a larger cached radius at the same center"""
+
+    def test_find_smallest_covering_radius(self):
+        """Test lookup of the smallest cached radius above the requested one"""
+        for radius in (10, 30, 50):
+            proximity_cache.set(get_proximity_cache_key(-22.5, -47.3, radius), {"radius": radius})
+            record_proximity_radius(-22.5, -47.3, radius)
+
+        assert find_covering_proximity_result(-22.5, -47.3, 20) == (30, {"radius": 30})
+        assert find_covering_proximity_result(-22.5, -47.3, 50) is None
+        assert find_covering_proximity_result(-22.6, -47.3, 5) is None
+
+    def test_concurrent_radii_at_one_center(self, monkeypatch):
+        """Test that two radii recorded at once for one center are both indexed"""
+        read = proximity_cache.get
+
+        def slow_get(key):
+            value = read(key)
+            time.sleep(0.05)  # both recorders would read the index before either writes it
+            return value
+
+        monkeypatch.setattr(proximity_cache, "get", slow_get)
+        for radius in (10, 30):
+            proximity_cache.set(get_proximity_cache_key(-22.5, -47.3, radius), {"radius": radius})
+        threads = [threading.Thread(target=record_proximity_radius, args=(-22.5, -47.3, radius)) for radius in (10, 30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        monkeypatch.undo()
+        assert find_covering_proximity_result(-22.5, -47.3, 5) == (10, {"radius": 10})
+        assert find_covering_proximity_result(-22.5, -47.3, 20) == (30, {"radius": 30})
+
+    def test_smaller_radius_reuses_radius_independent_stages(self, monkeypatch):
+        """Test that a smaller radius skips infrastructure and residuos lookups"""
+        FakeProximityService.calls = []
+        monkeypatch.setattr(proximity, "ProximityService", FakeProximityService)
+
+        def analyze(radius_km):
+            request = _request(radius_km=radius_km)
+            return asyncio.run(proximity._run_proximity_analysis(
+                request, f"analysis-{radius_km}", time.time(), proximity._cache_key(request)
+            ))
+
+        analyze(30)
+        FakeProximityService.calls = []
+        response = analyze(10)
+
+        assert FakeProximityService.calls == ["municipalities", "biogas_potential"]
+        assert response.metadata.derived_from_radius_km == 30
+        assert response.results["infrastructure"][0]["distance_km"] == 1.5
+        assert response.results["residuos_data"] == {"total_residuos": 3}
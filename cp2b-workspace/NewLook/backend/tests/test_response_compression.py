@@ -0,0 +1,166 @@
+"""
+Tests for the response compression middleware
+"""
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.middleware.response_compression import (
+    CompressionMiddleware,
+    encoded_etag,
+    identity_etags,
+    parse_accept_encoding,
+    select_encoding,
+)
+from app.services.cache_service import compressed_response_cache
+
+FEATURES = {"type": "FeatureCollection", "features": [{"id": i, "name": f"Município {i}"} for i in range(500)]}
+PAYLOAD = json.dumps(FEATURES).encode()
+
+
+@pytest.fixture
+def client():
+    """Small app behind the middleware with plain, streamed, ETag and PNG routes"""
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, offload_size=4096)
+
+    @app.get("/json")
+    def plain():
+        return FEATURES
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    def stream():
+        chunks = (PAYLOAD[i:i + 1000] for i in range(0, len(PAYLOAD), 1000))
+        return StreamingResponse(chunks, media_type="application/geo+json")
+
+    @app.get("/etag")
+    def etagged():
+        return JSONResponse(FEATURES, headers={"ETag": '"v1"'})
+
+    @app.get("/other-etag")
+    def same_etag_other_body():
+        return JSONResponse({"other": list(range(500))}, headers={"ETag": '"v1"'})
+
+    @app.get("/conditional")
+    def conditional(if_none_match: str = Header(None)):
+        # Compares against its own (identity) ETag, like the geospatial endpoints
+        if if_none_match and '"v1"' in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": '"v1"'})
+        return JSONResponse(FEATURES, headers={"ETag": '"v1"'})
+
+    @app.get("/tile.png")
+    def tile():
+        return Response(b"\x89PNG" + bytes(4000), media_type="image/png")
+
+    compressed_response_cache.clear()
+    yield TestClient(app)
+    compressed_response_cache.clear()
+
+
+class TestEncodingNegotiation:
+    """Tests for Accept-Encoding parsing"""
+
+    def test_parse_q_values(self):
+        """Test q-values, defaults and malformed weights"""
+        weights = parse_accept_encoding("gzip;q=0.5, br, zstd;q=abc, *;q=0.1")
+
+        assert weights == {"gzip": 0.5, "br": 1.0, "zstd": 0.0, "*": 0.1}
+
+    def test_select_highest_q(self):
+        """Test that the highest-weighted available codec wins"""
+        available = ["zstd", "br", "gzip"]
+
+        assert select_encoding("gzip;q=1.0, br;q=0.8", available) == "gzip"
+        assert select_encoding("gzip, br, zstd", available) == "zstd"
+        assert select_encoding("gzip, br", ["gzip"]) == "gzip"
+
+    def test_refused_and_wildcard(self):
+        """Test q=0 refusals and wildcard handling"""
+        available = ["zstd", "br", "gzip"]
+
+        assert select_encoding("identity", available) is None
+        assert select_encoding("gzip;q=0", available) is None
+        assert select_encoding("*;q=0.5, zstd;q=0", available) == "br"
+        assert select_encoding("", available) is None
+
+
+class TestCompressionMiddleware:
+    """Tests for compressing responses end to end"""
+
+    def test_gzip_json(self, client):
+        """Test that a large JSON body is gzipped with the right headers"""
+        response = client.get("/json", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.json() == FEATURES
+
+    def test_brotli_preferred(self, client):
+        """Test that brotli is chosen when the client prefers it"""
+        pytest.importorskip("brotli")
+        response = client.get("/json", headers={"Accept-Encoding": "gzip;q=0.5, br"})
+
+        assert response.headers["content-encoding"] == "br"
+        assert response.json() == FEATURES
+
+    def test_zstd_stream(self, client):
+        """Test that streamed bodies are compressed incrementally"""
+        zstandard = pytest.importorskip("zstandard")
+        with client.stream("GET", "/stream", headers={"Accept-Encoding": "zstd"}) as response:
+            raw = b"".join(response.iter_raw())
+
+        assert response.headers["content-encoding"] == "zstd"
+        assert "content-length" not in response.headers
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(raw) == PAYLOAD
+
+    def test_skips_small_png_and_identity(self, client):
+        """Test pass-through for small bodies, PNG tiles and identity clients"""
+        assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+        assert "content-encoding" not in client.get("/tile.png", headers={"Accept-Encoding": "gzip"}).headers
+        assert "content-encoding" not in client.get("/json", headers={"Accept-Encoding": "identity"}).headers
+
+    def test_etag_body_cached(self, client):
+        """Test that ETag-tagged bodies are compressed once and reused"""
+        first = client.get("/etag", headers={"Accept-Encoding": "gzip"})
+        cached = compressed_response_cache.get('gzip:/etag:"v1"')
+        second = client.get("/etag", headers={"Accept-Encoding": "gzip"})
+
+        assert cached is not None
+        assert json.loads(gzip.decompress(cached)) == FEATURES
+        assert first.json() == second.json() == FEATURES
+        assert compressed_response_cache.get_stats()["hits"] == 2
+
+    def test_etag_differs_per_coding(self, client):
+        """Test that compressed bodies carry a coding-specific strong ETag"""
+        assert client.get("/etag", headers={"Accept-Encoding": "gzip"}).headers["etag"] == '"v1-gzip"'
+        assert client.get("/etag", headers={"Accept-Encoding": "identity"}).headers["etag"] == '"v1"'
+        assert encoded_etag('W/"v1"', "br") == 'W/"v1-br"'
+
+    def test_conditional_request_with_encoded_etag(self, client):
+        """Test that both ETag forms revalidate against the endpoint's own ETag"""
+        etag = client.get("/conditional", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+
+        revalidated = client.get("/conditional", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["etag"] == '"v1-gzip"'
+
+        plain = client.get("/conditional", headers={"Accept-Encoding": "identity", "If-None-Match": '"v1"'})
+        assert plain.status_code == 304
+        assert plain.headers["etag"] == '"v1"'
+        assert identity_etags('"a-zstd", W/"b-br", "c"') == '"a-zstd", W/"b-br", "c", "a", W/"b"'
+
+    def test_cache_scoped_by_path(self, client):
+        """Test that endpoints sharing an ETag string do not share compressed bodies"""
+        first = client.get("/etag", headers={"Accept-Encoding": "gzip"})
+        other = client.get("/other-etag", headers={"Accept-Encoding": "gzip"})
+
+        assert first.json() == FEATURES
+        assert other.json() == {"other": list(range(500))}
@@ -0,0 +1,226 @@
+"""
+Tests for single-flight coalescing of identical analyses
+"""
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.api.v1.endpoints import proximity
+from app.services.cache_service import SingleFlight, get_proximity_cache_key, proximity_cache
+
+CONCURRENT_REQUESTS = 50
+
+
+class TestSingleFlight:
+    """Tests for SingleFlight.do / do_async"""
+
+    def test_threads_share_one_computation(self):
+        """Test that N threads asking for the same key run fn once"""
+        flight = SingleFlight("test")
+        calls = []
+        results = []
+        barrier = threading.Barrier(CONCURRENT_REQUESTS)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"total": 42}
+
+        def worker():
+            barrier.wait()
+            results.append(flight.do("proximity:abc", compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(CONCURRENT_REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert all(value == {"total": 42} for value, _ in results)
+        assert sum(coalesced for _, coalesced in results) == CONCURRENT_REQUESTS - 1
+        assert flight.get_stats() == {"in_flight": 0, "leaders": 1, "coalesced": CONCURRENT_REQUESTS - 1}
+
+    def test_async_callers_share_one_computation(self):
+        """Test that concurrent coroutines await the first computation"""
+        flight = SingleFlight("test")
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value
+
+        async def run():
+            return await asyncio.gather(*[
+                flight.do_async("key", compute, 7) for _ in range(CONCURRENT_REQUESTS)
+            ])
+
+        results = asyncio.run(run())
+
+        assert calls == [7]
+        assert [value for value, _ in results] == [7] * CONCURRENT_REQUESTS
+
+    def test_errors_reach_every_caller(self):
+        """Test that a failing computation fails all waiting callers, then clears"""
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.05)
+            raise ValueError("raster unavailable")
+
+        async def run():
+            return await asyncio.gather(*[flight.do_async("key", fail) for _ in range(5)], return_exceptions=True)
+
+        errors = asyncio.run(run())
+
+        assert all(isinstance(e, ValueError) for e in errors)
+        assert flight.get_stats()["in_flight"] == 0
+
+    def test_cancelled_waiter_leaves_others_unaffected(self):
+        """Test that cancelling one of N waiters does not fail the leader or the rest"""
+        flight = SingleFlight("test")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def run():
+            leader = asyncio.create_task(flight.do_async("key", compute))
+            await asyncio.sleep(0)
+            waiters = [asyncio.create_task(flight.do_async("key", compute)) for _ in range(4)]
+            await asyncio.sleep(0.01)
+            waiters[0].cancel()  # e.g. that client disconnected
+            return await asyncio.gather(leader, *waiters, return_exceptions=True)
+
+        leader, cancelled, *others = asyncio.run(run())
+
+        assert leader == ("done", False)
+        assert isinstance(cancelled, asyncio.CancelledError)
+        assert others == [("done", True)] * 3
+        assert len(calls) == 1
+        assert flight.get_stats()["in_flight"] == 0
+
+    def test_cancelled_leader_hands_over(self):
+        """Test that a waiting caller recomputes when the leader is cancelled"""
+        flight = SingleFlight("test")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def run():
+            leader = asyncio.create_task(flight.do_async("key", compute))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(flight.do_async("key", compute))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        assert asyncio.run(run()) == ("done", False)
+        assert len(calls) == 2
+
+
+def post_all(payloads):
+    """POST analyses from one client each, all at once"""
+    from app.main import app
+
+    async def post_as(user: int, payload):
+        # A distinct client address per request keeps the per-IP rate limiter out of the way
+        transport = httpx.ASGITransport(app=app, client=(f"10.0.0.{user}", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/v1/proximity/analyze", json=payload)
+
+    async def burst():
+        return await asyncio.gather(*[post_as(user, payload) for user, payload in enumerate(payloads)])
+
+    return asyncio.run(burst())
+
+
+def post_burst(payload, count=CONCURRENT_REQUESTS):
+    """POST the same analysis from count clients at once"""
+    return post_all([payload] * count)
+
+
+class TestProximityCoalescing:
+    """Load test: concurrent identical /proximity/analyze requests"""
+
+    @pytest.fixture
+    def counted_pipeline(self, monkeypatch):
+        """Replace the analysis pipeline with a slow stand-in that counts runs"""
+        runs = []
+
+        async def fake_pipeline(request, analysis_id, start_time, cache_key, snapped_to=None):
+            runs.append(analysis_id)
+            await asyncio.sleep(0.2)
+            return proximity.ProximityAnalysisResponse(
+                analysis_id=analysis_id,
+                request=request,
+                results={"municipalities": []},
+                summary=proximity.AnalysisSummary(
+                    total_area_km2=1256.64, total_municipalities=0, total_population=0,
+                    total_biogas_m3_year=0, energy_potential_mwh_year=0, radius_recommendation="optimal"
+                ),
+                metadata=proximity.AnalysisMetadata(analysis_timestamp="2024-01-01T00:00:00Z", processing_time_ms=200)
+            )
+
+        monkeypatch.setattr(proximity, "_run_proximity_analysis", fake_pipeline)
+        proximity_cache.clear()
+        yield runs
+        proximity_cache.clear()
+
+    def test_concurrent_identical_requests_run_once(self, counted_pipeline):
+        """Test that N concurrent identical requests cost one computation"""
+        responses = post_burst({"latitude": -22.5, "longitude": -47.3, "radius_km": 20})
+
+        assert [r.status_code for r in responses] == [200] * CONCURRENT_REQUESTS
+        assert len(counted_pipeline) == 1
+        # Every request still gets its own analysis id
+        assert len({r.json()["analysis_id"] for r in responses}) == CONCURRENT_REQUESTS
+
+
+class TestProximityPipelineCaching:
+    """Coalesced requests through the real pipeline (stubbed services)"""
+
+    def test_result_lands_in_cache(self, slow_services, monkeypatch):
+        """Test that the leader's analysis is computed once and cached under the request key"""
+        runs = []
+
+        class CountingService(slow_services):
+            def get_municipalities_in_radius(self, lat, lng, radius_km):
+                runs.append((lat, lng, radius_km))
+                return super().get_municipalities_in_radius(lat, lng, radius_km)
+
+        monkeypatch.setattr(proximity, "ProximityService", CountingService)
+
+        responses = post_burst({"latitude": -22.5, "longitude": -47.3, "radius_km": 20}, count=10)
+
+        assert [r.status_code for r in responses] == [200] * 10
+        assert len(runs) == 1
+        cached = proximity_cache.get(get_proximity_cache_key(-22.5, -47.3, 20))
+        assert cached is not None and cached["from_cache"] is False
+        assert cached["summary"]["total_biogas_m3_year"] == 10.0
+        assert all(r.json()["summary"] == cached["summary"] for r in responses)
+
+    def test_different_options_not_coalesced(self, slow_services):
+        """Test that concurrent requests with different include_* options each get their own parts"""
+        point = {"latitude": -22.5, "longitude": -47.3, "radius_km": 20}
+        full, no_land_use, no_infrastructure = post_all([
+            point,
+            {**point, "options": {"include_mapbiomas": False}},
+            {**point, "options": {"include_infrastructure": False}},
+        ])
+
+        assert set(full.json()["results"]) >= {"land_use", "infrastructure", "biogas_potential"}
+        assert "land_use" not in no_land_use.json()["results"]
+        assert "infrastructure" in no_land_use.json()["results"]
+        assert "infrastructure" not in no_infrastructure.json()["results"]
+        assert "land_use" in no_infrastructure.json()["results"]
+        assert proximity.proximity_flight.get_stats()["in_flight"] == 0
@@ -0,0 +1,140 @@
+"""
+Tests for GeoParquet/FlatGeobuf layer copies and their use by the geometry store
+"""
+import os
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point
+
+from app.services.geometry_store import GeometryStore
+from app.utils import vector_formats
+from app.utils.vector_formats import (
+    ROW_COLUMN,
+    available_formats,
+    convert_layer,
+    layer_names,
+    layer_source,
+    read_layer,
+)
+
+
+@pytest.fixture
+def shapefile(tmp_path):
+    """Points spread so the FlatGeobuf Hilbert index reorders them"""
+    gdf = gpd.GeoDataFrame(
+        {"nome": [f"ETE {i}" for i in range(8)], "vazao": [float(i) for i in range(8)]},
+        geometry=[Point(-53.0 + (i * 5) % 8, -25.0 + (i * 3) % 5) for i in range(8)],
+        crs="EPSG:4326"
+    )
+    path = tmp_path / "ETEs_2019_SP.shp"
+    gdf.to_file(path)
+    return path
+
+
+def age(path, seconds):
+    """Make a file older than now by some seconds"""
+    mtime = path.stat().st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+class TestFlatGeobuf:
+    """Tests for FlatGeobuf copies"""
+
+    def test_round_trip_keeps_row_order(self, shapefile):
+        """Test that the spatial index order is undone on read"""
+        (fgb,) = convert_layer(shapefile, ["fgb"])
+
+        original = gpd.read_file(shapefile)
+        copy = read_layer(fgb)
+
+        assert list(gpd.read_file(fgb)[ROW_COLUMN]) != list(range(8))  # stored in index order
+        assert list(copy.columns) == list(original.columns)
+        assert list(copy.index) == list(original.index)
+        assert copy["nome"].tolist() == original["nome"].tolist()
+        assert copy.geometry.geom_equals(original.geometry).all()
+
+    def test_bbox_read(self, shapefile):
+        """Test reading only the features in a bounding box"""
+        (fgb,) = convert_layer(shapefile, ["fgb"])
+        subset = read_layer(fgb, bbox=(-53.5, -25.5, -50.5, -22.5))
+
+        original = gpd.read_file(shapefile)
+        expected = original.cx[-53.5:-50.5, -25.5:-22.5]
+        assert subset["nome"].tolist() == expected["nome"].tolist()
+        assert list(subset.index) == list(expected.index)
+
+    def test_bbox_read_keeps_row_ids_in_every_format(self, shapefile):
+        """Test that bbox reads return shapefile row numbers whatever the source file"""
+        sources = [shapefile, *convert_layer(shapefile, available_formats())]
+        bbox = (-50.5, -25.5, -46.5, -21.5)
+
+        expected = gpd.read_file(shapefile).cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+        assert list(expected.index) != list(range(len(expected)))  # rows not at the start
+        for path in sources:
+            subset = read_layer(path, bbox=bbox)
+            assert list(subset.index) == list(expected.index), path.suffix
+            assert subset["nome"].tolist() == expected["nome"].tolist(), path.suffix
+
+
+class TestLayerSource:
+    """Tests for choosing between the shapefile and its copies"""
+
+    def test_prefers_fresh_copy(self, shapefile, monkeypatch):
+        """Test the preference order and that stale copies are ignored"""
+        monkeypatch.setattr(vector_formats, "pyarrow", None)
+        directory = shapefile.parent
+        assert layer_source(directory, "ETEs_2019_SP") == shapefile
+
+        (fgb,) = convert_layer(shapefile, ["fgb"])
+        assert layer_source(directory, "ETEs_2019_SP") == fgb
+        assert convert_layer(shapefile, ["fgb"]) == []  # Up to date
+
+        age(fgb, 60)
+        assert layer_source(directory, "ETEs_2019_SP") == shapefile
+        assert convert_layer(shapefile, ["fgb"]) == [fgb]
+
+    def test_copy_without_shapefile(self, shapefile):
+        """Test that a deployment can ship only the converted copies"""
+        (fgb,) = convert_layer(shapefile, ["fgb"])
+        for path in shapefile.parent.glob("ETEs_2019_SP.*"):
+            if path != fgb:
+                path.unlink()
+
+        assert layer_source(shapefile.parent, "ETEs_2019_SP") == fgb
+        assert layer_names(shapefile.parent) == ["ETEs_2019_SP"]
+        assert layer_source(shapefile.parent, "missing") is None
+
+    def test_parquet_preferred(self, shapefile):
+        """Test GeoParquet copies (when pyarrow is installed)"""
+        pytest.importorskip("pyarrow")
+        parquet, fgb = convert_layer(shapefile)
+
+        assert layer_source(shapefile.parent, "ETEs_2019_SP") == parquet
+        copy = read_layer(parquet)
+        assert copy["nome"].tolist() == gpd.read_file(shapefile)["nome"].tolist()
+        assert copy.crs == "EPSG:4326"
+
+    def test_parquet_requires_pyarrow(self, shapefile, monkeypatch):
+        """Test the error when GeoParquet is requested without pyarrow"""
+        monkeypatch.setattr(vector_formats, "pyarrow", None)
+        with pytest.raises(RuntimeError):
+            convert_layer(shapefile, ["parquet"])
+
+
+class TestGeometryStoreSources:
+    """Tests for the geometry store reading converted copies"""
+
+    def test_loads_and_switches_source(self, shapefile):
+        """Test that the store reads the copy and reloads when the source changes"""
+        store = GeometryStore(shapefile.parent)
+        first = store.get_layer("ETEs_2019_SP")
+        assert first.path == shapefile
+
+        convert_layer(shapefile, ["fgb"])
+        second = store.get_layer("ETEs_2019_SP")
+
+        assert second is not first
+        assert second.path.suffix == ".fgb"
+        assert second.gdf_wgs84["nome"].tolist() == first.gdf_wgs84["nome"].tolist()
+        assert store.get_stats()["sources"]["ETEs_2019_SP"] == second.path.suffix
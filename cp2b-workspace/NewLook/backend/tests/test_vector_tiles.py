@@ -0,0 +1,189 @@
+"""
+Tests for the MVT encoder and the vector tile endpoints
+"""
+import struct
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import LineString, Point, Polygon, box
+
+from app.services import geometry_store
+from app.services.geometry_store import GeometryStore
+from app.services.mapbiomas_tiles import lnglat_to_tile
+from app.utils.mvt import GEOM_LINESTRING, GEOM_POINT, GEOM_POLYGON, encode_layer, encode_tile
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_message(data):
+    """Minimal protobuf reader: {field_number: [values]} (bytes for length-delimited)"""
+    fields, pos = {}, 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = struct.unpack("<d", data[pos:pos + 8])[0], pos + 8
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def read_packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_tile(data):
+    """Decode a tile into {layer: [(geom_type, rings/parts, properties)]}"""
+    layers = {}
+    for layer_bytes in read_message(data).get(3, []):
+        layer = read_message(layer_bytes)
+        keys = [k.decode() for k in layer.get(3, [])]
+        values = []
+        for value_bytes in layer.get(4, []):
+            (number, value), = read_message(value_bytes).items()
+            if number == 1:
+                values.append(value[0].decode())
+            elif number == 6:
+                values.append(unzigzag(value[0]))
+            else:
+                values.append(value[0])
+
+        features = []
+        for feature_bytes in layer.get(2, []):
+            feature = read_message(feature_bytes)
+            tags = read_packed(feature[2][0]) if 2 in feature else []
+            properties = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+
+            commands = read_packed(feature[4][0])
+            parts, x, y, i = [], 0, 0, 0
+            while i < len(commands):
+                command, count = commands[i] & 7, commands[i] >> 3
+                i += 1
+                if command == 7:
+                    continue
+                if command == 1:
+                    parts.append([])
+                for _ in range(count):
+                    x += unzigzag(commands[i])
+                    y += unzigzag(commands[i + 1])
+                    i += 2
+                    parts[-1].append((x, y))
+            features.append((feature[3][0], parts, properties))
+        layers[layer[1][0].decode()] = {"extent": layer[5][0], "version": layer[15][0], "features": features}
+    return layers
+
+
+def signed_area(ring):
+    closed = ring + ring[:1]
+    return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(closed, closed[1:]))
+
+
+class TestEncoder:
+    """Tests for app.utils.mvt"""
+
+    def test_round_trip(self):
+        """Test geometry commands, properties and polygon winding"""
+        polygon = Polygon(
+            [(0, 0), (100, 0), (100, 100), (0, 100)],
+            holes=[[(20, 20), (20, 40), (40, 40), (40, 20)]]
+        )
+        tile = encode_tile([encode_layer("demo", [
+            (Point(10, 20), {"name": "ETE", "capacity": 2.5, "active": True}, 7),
+            (LineString([(0, 0), (10, 0), (10, 0), (10, 10)]), {"kv": -138}, None),
+            (polygon, {"name": "ETE", "missing": None}, None),
+        ])])
+
+        layer = decode_tile(tile)["demo"]
+        (point, line, poly) = layer["features"]
+
+        assert layer["extent"] == 4096 and layer["version"] == 2
+        assert point == (GEOM_POINT, [[(10, 20)]], {"name": "ETE", "capacity": 2.5, "active": 1})
+        assert line == (GEOM_LINESTRING, [[(0, 0), (10, 0), (10, 10)]], {"kv": -138})
+        assert poly[0] == GEOM_POLYGON and poly[2] == {"name": "ETE"}
+        exterior, hole = poly[1]
+        assert signed_area(exterior) > 0 > signed_area(hole)
+
+
+@pytest.fixture
+def tile_store(tmp_path, monkeypatch):
+    """Geometry store with a transmission line and a state boundary around Campinas"""
+    lines = gpd.GeoDataFrame(
+        {"Nome": ["LT Campinas"], "Tensao": [440]},
+        geometry=[LineString([(-47.5, -22.9), (-46.5, -22.9)])],
+        crs="EPSG:4326"
+    )
+    lines.to_file(tmp_path / "Linhas_De_Transmissao_Energia.shp")
+    boundary = gpd.GeoDataFrame({"NM_UF": ["São Paulo"]}, geometry=[box(-48.0, -23.5, -46.0, -22.0)], crs="EPSG:4326")
+    boundary.to_file(tmp_path / "Limite_SP.shp")
+
+    monkeypatch.setattr(geometry_store, "_geometry_store", GeometryStore(tmp_path))
+    return tmp_path
+
+
+class TestVectorTileEndpoint:
+    """Tests for /api/v1/tiles/{layer}/{z}/{x}/{y}.mvt"""
+
+    def url(self, layer, z, lng=-47.06, lat=-22.9):
+        x, y = lnglat_to_tile(lng, lat, z)
+        return f"/api/v1/tiles/{layer}/{z}/{x}/{y}.mvt"
+
+    def test_tile_with_cache_headers(self, tile_store, client):
+        """Test MVT body, MapBiomas-style cache headers and conditional requests"""
+        response = client.get(self.url("transmission-lines", 10))
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+        assert response.headers["cache-control"] == "public, max-age=86400"
+        features = decode_tile(response.content)["transmission-lines"]["features"]
+        assert features[0][2] == {"Nome": "LT Campinas", "Tensao": 440}
+
+        again = client.get(self.url("transmission-lines", 10), headers={"If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304
+
+    def test_property_selection(self, tile_store, client):
+        """Test that only the requested properties are encoded"""
+        response = client.get(self.url("transmission-lines", 10), params={"properties": "Tensao"})
+        features = decode_tile(response.content)["transmission-lines"]["features"]
+        assert features[0][2] == {"Tensao": 440}
+
+        assert client.get(self.url("transmission-lines", 10), params={"properties": "nope"}).status_code == 400
+
+    def test_polygon_clipped_to_tile(self, tile_store, client):
+        """Test that a polygon larger than the tile is clipped to the tile buffer"""
+        response = client.get(self.url("sp-boundary", 12))
+        (geom_type, rings, _), = decode_tile(response.content)["sp-boundary"]["features"]
+
+        assert geom_type == GEOM_POLYGON
+        coords = [c for ring in rings for c in ring]
+        assert min(c for xy in coords for c in xy) >= -64
+        assert max(c for xy in coords for c in xy) <= 4096 + 64
+
+    def test_empty_and_invalid_tiles(self, tile_store, client):
+        """Test empty tiles, unknown layers, missing data and bad coordinates"""
+        empty = client.get(self.url("transmission-lines", 10, lng=-51.0, lat=-20.5))
+        assert empty.status_code == 200 and empty.content == b""
+
+        assert client.get(self.url("unknown", 10)).status_code == 404
+        assert client.get(self.url("etes", 10)).status_code == 404
+        assert client.get("/api/v1/tiles/sp-boundary/3/9/1.mvt").status_code == 400
@@ -0,0 +1,178 @@
+"""
+Tests for viewport (bbox) filtering and paging of the GeoJSON layer endpoints
+"""
+import threading
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import LineString, Point, box
+
+from app.services import geometry_store
+from app.services.cache_service import geometry_cache, tile_cache
+from app.services.geometry_store import GeometryStore, get_geometry_store
+from app.utils.shapefile_loader import ShapefileLoader
+
+
+@pytest.fixture
+def layer_store(tmp_path, monkeypatch):
+    """ETEs along a parallel, two pipeline files and two municipalities"""
+    etes = gpd.GeoDataFrame(
+        {"nome": [f"ETE {i}" for i in range(6)]},
+        geometry=[Point(-50.0 + i, -22.5) for i in range(6)],
+        crs="EPSG:4326"
+    )
+    etes.to_file(tmp_path / "ETEs_2019_SP.shp")
+
+    for name, lng in (("Gasodutos_Distribuicao_SP", -47.0), ("Gasodutos_Transporte_SP", -46.0)):
+        pipes = gpd.GeoDataFrame(
+            {"nome": [f"{name} A", f"{name} B"]},
+            geometry=[LineString([(lng, -23.0), (lng + 0.5, -23.0)]), LineString([(lng, -20.0), (lng + 0.5, -20.0)])],
+            crs="EPSG:4326"
+        )
+        pipes.to_file(tmp_path / f"{name}.shp")
+
+    municipalities = gpd.GeoDataFrame(
+        {"CD_MUN": ["3509502", "3538709"], "NM_MUN": ["Campinas", "Piracicaba"]},
+        geometry=[box(-47.2, -23.0, -46.9, -22.7), box(-47.9, -22.9, -47.5, -22.5)],
+        crs="EPSG:4326"
+    )
+    municipalities.to_file(tmp_path / "SP_Municipios_2024.shp")
+
+    monkeypatch.setattr(geometry_store, "_geometry_store", GeometryStore(tmp_path))
+    return tmp_path
+
+
+def names(geojson):
+    return [f["properties"]["nome"] for f in geojson["features"]]
+
+
+class TestLayerViewport:
+    """Tests for ?bbox= and ?limit=/?cursor= on /api/v1/infrastructure/*/geojson"""
+
+    url = "/api/v1/infrastructure/etes/geojson"
+
+    def test_unfiltered_layer_unchanged(self, layer_store, client):
+        """Test that requests without viewport parameters return the whole layer"""
+        data = client.get(self.url).json()
+
+        assert len(data["features"]) == 6
+        assert "next_cursor" not in data["metadata"]
+
+    def test_bbox_filter(self, layer_store, client):
+        """Test that only features in the viewport are returned"""
+        data = client.get(self.url, params={"bbox": "-48.5,-23,-46.5,-22"}).json()
+
+        assert names(data) == ["ETE 2", "ETE 3"]
+        assert data["metadata"]["matched_features"] == 2
+        assert data["metadata"]["bbox"] == [-48.5, -23.0, -46.5, -22.0]
+        assert data["metadata"]["next_cursor"] is None
+
+    def test_cursor_paging(self, layer_store, client):
+        """Test walking a bbox result page by page"""
+        params = {"bbox": "-51,-23,-45.5,-22", "limit": 4}
+        first = client.get(self.url, params=params).json()
+        assert names(first) == ["ETE 0", "ETE 1", "ETE 2", "ETE 3"]
+        assert first["metadata"]["matched_features"] == 5
+
+        second = client.get(self.url, params={**params, "cursor": first["metadata"]["next_cursor"]}).json()
+        assert names(second) == ["ETE 4"]
+        assert second["metadata"]["next_cursor"] is None
+
+    def test_paging_across_files(self, layer_store, client):
+        """Test that combined layers page as one layer"""
+        url = "/api/v1/infrastructure/pipelines/geojson"
+        first = client.get(url, params={"limit": 3}).json()
+        second = client.get(url, params={"limit": 3, "cursor": first["metadata"]["next_cursor"]}).json()
+
+        assert len(first["features"]) == 3 and len(second["features"]) == 1
+        assert names(second) == ["Gasodutos_Transporte_SP B"]
+
+        south = client.get(url, params={"bbox": "-48,-24,-45,-22"}).json()
+        assert names(south) == ["Gasodutos_Distribuicao_SP A", "Gasodutos_Transporte_SP A"]
+
+    def test_invalid_parameters(self, layer_store, client):
+        """Test malformed bbox, cursor and limit"""
+        assert client.get(self.url, params={"bbox": "1,2,3"}).status_code == 400
+        assert client.get(self.url, params={"bbox": "a,b,c,d"}).status_code == 400
+        assert client.get(self.url, params={"bbox": "-46,-23,-47,-22"}).status_code == 400
+        assert client.get(self.url, params={"cursor": "-1"}).status_code == 400
+        assert client.get(self.url, params={"limit": 0}).status_code == 422
+
+
+class TestMunicipalityGeometryViewport:
+    """Tests for the viewport on /api/v1/geospatial/municipalities/geometry"""
+
+    def test_bbox_filter(self, layer_store, client):
+        """Test that the geometry payload honours the viewport"""
+        url = "/api/v1/geospatial/municipalities/geometry"
+        data = client.get(url, params={"bbox": "-47.3,-23.1,-47.0,-22.8"}).json()
+
+        assert [f["id"] for f in data["features"]] == ["3509502"]
+        assert data["metadata"]["matched_features"] == 1
+        assert len(client.get(url).json()["features"]) == 2
+
+
+class TestLayerFeatureCache:
+    """Tests for the pre-serialized feature cache behind the layer endpoints"""
+
+    def test_serialized_once_per_level(self, layer_store, client):
+        """Test that features are reused across requests and keyed by level"""
+        layer = get_geometry_store().get_layer("ETEs_2019_SP")
+
+        assert ShapefileLoader.layer_features(layer) is ShapefileLoader.layer_features(layer)
+        assert ShapefileLoader.layer_features(layer, 0.01) is not ShapefileLoader.layer_features(layer)
+
+        data = client.get("/api/v1/infrastructure/etes/geojson").json()
+        assert data["features"][0] == {
+            "id": "0",
+            "type": "Feature",
+            "properties": {"nome": "ETE 0"},
+            "geometry": {"type": "Point", "coordinates": [-50.0, -22.5]}
+        }
+        assert data["metadata"]["coordinate_precision"] == 6
+
+    def test_features_survive_tile_traffic(self, layer_store):
+        """Test that serialized layers are kept apart from the tile cache"""
+        layer = get_geometry_store().get_layer("ETEs_2019_SP")
+        features = ShapefileLoader.layer_features(layer)
+
+        try:
+            for i in range(tile_cache.max_size):
+                tile_cache.set(f"mapbiomas_tile:{i}", b"\x89PNG" + bytes(64))
+        finally:
+            tile_cache.clear()
+
+        assert ShapefileLoader.layer_features(layer) is features
+
+    def test_layer_larger_than_tile_shard_is_cached(self):
+        """Test that a multi-MB layer payload fits the geometry cache"""
+        shard_budget = tile_cache.max_bytes // len(tile_cache._shards)
+        features = [bytes(64 * 1024)] * (shard_budget // (64 * 1024) + 1)
+
+        geometry_cache.set("geojson_features:large", features)
+        try:
+            assert geometry_cache.get("geojson_features:large") is features
+        finally:
+            geometry_cache.delete("geojson_features:large")
+
+
+class TestLayerDispatch:
+    """Tests for building layer responses off the event loop"""
+
+    def test_features_built_in_thread_pool(self, layer_store, client, monkeypatch):
+        """Test that feature selection and serialization run on analysis threads"""
+        threads = []
+        layer_features = ShapefileLoader.layer_features
+
+        def spy(layer, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return layer_features(layer, *args, **kwargs)
+
+        monkeypatch.setattr(ShapefileLoader, "layer_features", staticmethod(spy))
+
+        data = client.get("/api/v1/infrastructure/pipelines/geojson", params={"zoom": 8}).json()
+
+        assert len(data["features"]) == 4
+        assert data["metadata"]["layer_type"] == "pipelines"
+        assert len(threads) == 2
+        assert all(name.startswith("analysis") for name in threads)
@@ -1,12 +1,16 @@
 """
 CP2B Maps - Professional Shapefile Loader
 High-performance geospatial data loading with smart caching and optimization
+
+Layers are read from GeoParquet (<name>.parquet) or FlatGeobuf (<name>.fgb)
+copies when present and not older than the shapefile - see the backend's
+scripts/convert_shapefiles.py - and from the shapefile otherwise.
 """
 
 import os
 import hashlib
 from pathlib import Path
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, Tuple, Union
 import geopandas as gpd
 import pandas as pd
 from functools import lru_cache
@@ -17,6 +21,16 @@ from src.utils.logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# GeoParquet copies need pyarrow
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Original row number stored in FlatGeobuf copies (written by convert_shapefiles.py)
+ROW_COLUMN = "_source_row"
+
 
 class ShapefileLoader:
     """
@@ -38,11 +52,70 @@ class ShapefileLoader:
             self.logger.warning(f"Shapefile directory not found: {self.data_dir}")
             self.data_dir.mkdir(parents=True, exist_ok=True)
 
+    def _resolve_source(self,
+                        filename: str,
+                        bbox: Optional[Tuple[float, float, float, float]] = None) -> Optional[Path]:
+        """
+        Pick the file to read a layer from
+
+        GeoParquet (with pyarrow), then FlatGeobuf, then the shapefile; with
+        a bbox FlatGeobuf comes first (its spatial index reads only the
+        matching features). Copies older than the shapefile are ignored.
+
+        Args:
+            filename: Shapefile name (without extension)
+            bbox: The (minx, miny, maxx, maxy) the layer will be read with, if any
+
+        Returns:
+            Path to read, or None if the layer is missing in every format
+        """
+        shapefile_path = self.data_dir / f"{filename}.shp"
+        shapefile_mtime = shapefile_path.stat().st_mtime if shapefile_path.exists() else None
+
+        suffixes = [".parquet", ".fgb"] if HAS_PYARROW else [".fgb"]
+        if bbox is not None:
+            suffixes.reverse()
+        for suffix in suffixes:
+            path = self.data_dir / f"{filename}{suffix}"
+            if path.exists() and (shapefile_mtime is None or path.stat().st_mtime >= shapefile_mtime):
+                return path
+
+        return shapefile_path if shapefile_mtime is not None else None
+
+    def _read_source(self,
+                     path: Path,
+                     bbox: Optional[Tuple[float, float, float, float]] = None) -> gpd.GeoDataFrame:
+        """
+        Read a GeoParquet, FlatGeobuf or shapefile layer in shapefile row order
+
+        Args:
+            path: File from _resolve_source
+            bbox: Optional (minx, miny, maxx, maxy) in the layer CRS
+
+        Returns:
+            GeoDataFrame
+        """
+        if path.suffix == ".fgb":
+            # FlatGeobuf uses its spatial index for bbox reads
+            gdf = gpd.read_file(path, bbox=bbox)
+            if ROW_COLUMN in gdf.columns:
+                # FlatGeobuf stores features in spatial index order
+                gdf = gdf.sort_values(ROW_COLUMN).set_index(ROW_COLUMN)
+                gdf.index.name = None
+            return gdf
+
+        # Filtered after reading: OGR would renumber a shapefile's bbox rows from 0
+        gdf = gpd.read_parquet(path) if path.suffix == ".parquet" else gpd.read_file(path)
+        if bbox is not None:
+            gdf = gdf.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+        return gdf
+
     @st.cache_data(ttl=settings.CACHE_TTL)
     def load_shapefile(_self,
                       filename: str,
                       simplify_tolerance: float = 0.001,
-                      target_crs: str = "EPSG:4326") -> Optional[gpd.GeoDataFrame]:
+                      target_crs: str = "EPSG:4326",
+                      bbox: Optional[Tuple[float, float, float, float]] = None) -> Optional[gpd.GeoDataFrame]:
         """
         Load shapefile with caching and optimization
 
@@ -50,21 +123,23 @@ class ShapefileLoader:
             filename: Shapefile name (without extension)
             simplify_tolerance: Geometry simplification tolerance (0 = no simplification)
             target_crs: Target coordinate reference system
+            bbox: Only load features intersecting (minx, miny, maxx, maxy),
+                given in the layer CRS (fast with FlatGeobuf copies)
 
         Returns:
             GeoDataFrame or None if loading fails
         """
         try:
-            shapefile_path = _self.data_dir / f"{filename}.shp"
+            source_path = _self._resolve_source(filename, bbox)
 
-            if not shapefile_path.exists():
-                _self.logger.error(f"Shapefile not found: {shapefile_path}")
+            if source_path is None:
+                _self.logger.error(f"Shapefile not found: {_self.data_dir / filename}.shp")
                 return None
 
-            _self.logger.info(f"Loading shapefile: {filename}")
+            _self.logger.info(f"Loading shapefile: {filename} ({source_path.suffix[1:]})")
 
-            # Load shapefile
-            gdf = gpd.read_file(shapefile_path)
+            # Load layer (GeoParquet/FlatGeobuf copy or shapefile)
+            gdf = _self._read_source(source_path, bbox)
 
             # CRS conversion
             if gdf.crs and str(gdf.crs) != target_crs: